@@ -22,6 +22,9 @@ import cufflinks as cf
 import copy as cp
 import random as rd
 import ast
+import json
+import gzip
+import http.server
 
 # get the cwd were all the scripts are 
 CWD = "/".join(__file__.split("/")[0:-1]); sys.path.insert(0, CWD)
@@ -700,21 +703,8 @@ def add_SV_CNV_to_fig(fig, SV_CNV, chrom_to_Xoffset, vcf_fields_onHover, sampleI
     SV_CNV = cp.deepcopy(SV_CNV)
     SV_CNV.index = list(range(0, len(SV_CNV)))
 
-    # define all fields
-    all_vcf_fields = set(SV_CNV.keys())
-
     # define the interesting vcf_fields_onHover
-    if vcf_fields_onHover=="all": 
-
-        # define uninteresting fields
-        uninteresting_vcf_fields = {f for f in all_vcf_fields if len(get_unique_values_series(SV_CNV[f]))==1 or all(pd.isna(SV_CNV[f]))}
-        uninteresting_vcf_fields.update({"INFO", "sampleID", "REF", "IDset"})
-
-        # keep the others
-        vcf_fields_onHover = all_vcf_fields.difference(uninteresting_vcf_fields)
-
-    # sort
-    vcf_fields_onHover = sorted(vcf_fields_onHover.intersection(all_vcf_fields))
+    vcf_fields_onHover = get_vcf_fields_onHover_df(SV_CNV, vcf_fields_onHover)
 
     # get the plotting data
     df_plot = SV_CNV.apply(lambda r: get_plot_data_SV_CNV_r(r, vcf_fields_onHover, chrom_to_Xoffset), axis=1)
@@ -842,21 +832,8 @@ def add_smallVars_to_fig(fig, small_vars, small_vars_annot, chrom_to_Xoffset, sa
     # get the annot
     small_vars_annot = cp.deepcopy(small_vars_annot).set_index("#Uploaded_variation", drop=False)
 
-    # define all vars
-    all_vcf_fields = set(small_vars.keys())
-
     # define the interesting vcf_fields_onHover
-    if vcf_fields_onHover=="all": 
-
-        # define uninteresting fields
-        uninteresting_vcf_fields = {f for f in all_vcf_fields if len(get_unique_values_series(small_vars[f]))==1 or all(pd.isna(small_vars[f]))}
-        uninteresting_vcf_fields.update({"INFO", "sampleID", "REF", "IDset"})
-
-        # keep the others
-        vcf_fields_onHover = all_vcf_fields.difference(uninteresting_vcf_fields)
-
-    # sort fields
-    vcf_fields_onHover = sorted(vcf_fields_onHover.intersection(all_vcf_fields))
+    vcf_fields_onHover = get_vcf_fields_onHover_df(small_vars, vcf_fields_onHover)
 
     # add the var_annotation_str
     small_vars_annot["var_annotation_str"] = small_vars_annot.Gene.apply(str) + ": " + small_vars_annot.string_rep_variant + ": " +  small_vars_annot.Feature_productDescription
@@ -1000,7 +977,7 @@ def get_df_windows_draw_coverage(SV_CNV, chrom_to_Xoffset, reference_genome, thr
         for region in ["5", "3"]: 
 
             # get a df with the regions
-            df_region = df_windows_SVs.apply(lambda r: fun.get_target_region_row(r, region, chrom_to_bpPositions[r["chromosome"]], chrom_to_maxPos[r["chromosome"]], max_relative_len_neighbors=1), axis=1)
+            df_region = fun.get_df_target_regions(df_windows_SVs, region, chrom_to_bpPositions, chrom_to_maxPos, max_relative_len_neighbors=1)
 
             final_df_windows_SVs = final_df_windows_SVs.append(df_region[windows_fields])
 
@@ -1271,11 +1248,7 @@ def get_genome_variation_browser(df_data, samples_colors_df, target_regions, tar
     all_chromosomes = sorted(set(chrom_to_len))
 
     # define chromosome offset, which is necessary to keep the xaxis organised
-    chrom_to_Xoffset = {}
-    current_offset = 0
-    for chrom in all_chromosomes:
-        chrom_to_Xoffset[chrom] = current_offset
-        current_offset += chrom_to_len[chrom] + 15000
+    chrom_to_Xoffset = get_chrom_to_Xoffset(chrom_to_len)
 
     # map each chromosome to a color
     chrom_to_color, palette_chromosome = fun.get_value_to_color(all_chromosomes, palette="tab10", type_color="hex")
@@ -1415,6 +1388,670 @@ def get_genome_variation_browser(df_data, samples_colors_df, target_regions, tar
 
     
 
+# the html of the tiled genome browser (see get_genome_variation_browser_tiled). __TITLE__ and __MANIFEST__ are replaced
+g_tiled_browser_html = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<script src="plotly.min.js"></script>
+</head>
+<body>
+<div id="browser" style="width:100%;height:95vh;"></div>
+<script id="manifest" type="application/json">__MANIFEST__</script>
+<script>
+
+// load the manifest, with the chromosomes, zoom levels, tiles and styles of the traces
+var manifest = JSON.parse(document.getElementById("manifest").textContent);
+
+// map each tile key (<Ichrom>_<tile_bin>) to its tiles, which are that of the variants and features and one with the coverage of each sample
+manifest.levels.forEach(function(level){
+    level.key_to_tiles = new Map();
+    level.tiles.forEach(function(tile){
+        var key = tile.split("_").slice(0, 2).join("_");
+        if (!level.key_to_tiles.has(key)) level.key_to_tiles.set(key, []);
+        level.key_to_tiles.get(key).push(tile);
+    });
+});
+
+var browser_div = document.getElementById("browser");
+var tile_cache = new Map();
+var last_request_ID = 0;
+
+// get the (cached) data of one tile, which is a gzipped json
+function get_tile(level, key) {
+
+    var url = "tiles/" + level.name + "/" + key + ".json.gz";
+    if (!tile_cache.has(url)) {
+
+        tile_cache.set(url, fetch(url).then(function(response){ return response.arrayBuffer(); }).then(function(buffer){
+
+            // the server may have already decompressed it
+            var bytes = new Uint8Array(buffer);
+            if (bytes[0]!==0x1f || bytes[1]!==0x8b) return JSON.parse(new TextDecoder().decode(bytes));
+            return new Response(new Blob([buffer]).stream().pipeThrough(new DecompressionStream("gzip"))).json();
+        }));
+    }
+
+    return tile_cache.get(url);
+}
+
+// the finest level where the span has at most nbins_view bins (or the detail level)
+function get_level(span) {
+
+    if (span<=manifest.detail_max_span) return manifest.levels[manifest.levels.length-1];
+
+    var level = manifest.levels[0];
+    manifest.levels.forEach(function(l){ if (l.bin_size!==null && span/l.bin_size<=manifest.nbins_view) level = l; });
+    return level;
+}
+
+// the tiles overlapping x0-x1
+function get_tile_keys(level, x0, x1) {
+
+    var keys = [];
+    manifest.chromosomes.forEach(function(c, Ichrom){
+
+        var start = Math.max(x0-c.offset, 0);
+        var end = Math.min(x1-c.offset, c.length);
+        if (start>end) return;
+
+        for (var I=Math.floor(start/level.tile_span); I<=Math.floor(end/level.tile_span); I++) {
+            var key = Ichrom + "_" + I;
+            if (level.key_to_tiles.has(key)) keys = keys.concat(level.key_to_tiles.get(key));
+        }
+    });
+
+    return keys;
+}
+
+// draw the data of x0-x1
+function update_browser(x0, x1) {
+
+    var level = get_level(x1-x0);
+    var request_ID = ++last_request_ID;
+
+    Promise.all(get_tile_keys(level, x0, x1).map(function(key){ return get_tile(level, key); })).then(function(tiles){
+
+        // skip if there was a later zoom
+        if (request_ID!==last_request_ID) return;
+
+        // merge the traces of all tiles
+        var name_to_data = {};
+        tiles.forEach(function(tile){
+            Object.keys(tile).forEach(function(name){
+
+                var d = tile[name];
+                if (!(name in name_to_data)) name_to_data[name] = {x:[], y:[], text:[], size:[], mode:d.mode};
+                var t = name_to_data[name];
+                if (t.x.length>0) { t.x.push(null); t.y.push(null); t.text.push(null); t.size.push(0); }
+
+                t.x = t.x.concat(d.x); t.y = t.y.concat(d.y); t.text = t.text.concat(d.text); t.size = t.size.concat(d.size);
+            });
+        });
+
+        // keep the visibility set in the legend
+        var name_to_visible = {};
+        (browser_div.data || []).forEach(function(trace){ name_to_visible[trace.name] = trace.visible; });
+
+        // get the traces, always all of them, so that the legend is stable
+        var traces = Object.keys(manifest.trace_styles).map(function(name){
+
+            var s = manifest.trace_styles[name];
+            var d = name_to_data[name] || {x:[], y:[], text:[], size:[], mode:s.mode};
+
+            return {type:"scattergl", x:d.x, y:d.y, text:d.text, hoverinfo:"text", name:name, mode:d.mode || s.mode, xaxis:"x", yaxis:s.yaxis, line:{color:s.color, width:s.width}, marker:{color:s.color, symbol:s.symbol, size:d.size}, opacity:s.opacity, visible:(name in name_to_visible) ? name_to_visible[name] : s.visible};
+        });
+
+        // keep the ranges of the zoom
+        var layout = JSON.parse(JSON.stringify(manifest.layout));
+        layout.xaxis.range = [x0, x1];
+        layout.xaxis.autorange = false;
+        if (browser_div.layout) {
+            layout.yaxis.range = browser_div.layout.yaxis.range; layout.yaxis.autorange = false;
+            layout.yaxis2.range = browser_div.layout.yaxis2.range; layout.yaxis2.autorange = false;
+        }
+        layout.title = manifest.title + " (" + (level.bin_size===null ? "all variants" : "bins of " + level.bin_size + " bp") + ")";
+
+        Plotly.react(browser_div, traces, layout, {editable:false});
+    });
+}
+
+// redraw on zoom, once it stops
+var relayout_timeout = null;
+function on_relayout(event) {
+
+    var x0 = event["xaxis.range[0]"];
+    var x1 = event["xaxis.range[1]"];
+    if (event["xaxis.range"]!==undefined) { x0 = event["xaxis.range"][0]; x1 = event["xaxis.range"][1]; }
+    if (event["xaxis.autorange"]===true) { x0 = 0; x1 = manifest.genome_span; }
+    if (x0===undefined || x1===undefined) return;
+
+    clearTimeout(relayout_timeout);
+    relayout_timeout = setTimeout(function(){ update_browser(x0, x1); }, 200);
+}
+
+Plotly.newPlot(browser_div, [], manifest.layout, {editable:false}).then(function(){
+    browser_div.on("plotly_relayout", on_relayout);
+    update_browser(0, manifest.genome_span);
+});
+
+</script>
+</body>
+</html>
+"""
+
+def get_chrom_to_Xoffset(chrom_to_len):
+
+    """Maps each chromosome (sorted) to its offset in the x axis of the browser, which is necessary to keep the xaxis organised"""
+
+    chrom_to_Xoffset = {}
+    current_offset = 0
+    for chrom in sorted(set(chrom_to_len)):
+        chrom_to_Xoffset[chrom] = current_offset
+        current_offset += chrom_to_len[chrom] + 15000
+
+    return chrom_to_Xoffset
+
+def get_vcf_fields_onHover_df(df, vcf_fields_onHover):
+
+    """Takes a vcf df and the vcf_fields_onHover (a set or 'all'). It returns the sorted fields of df to show on hover. If 'all', it takes all the fields that are informative"""
+
+    # define all fields
+    all_vcf_fields = set(df.keys())
+
+    # define the interesting vcf_fields_onHover
+    if vcf_fields_onHover=="all": 
+
+        # define uninteresting fields
+        uninteresting_vcf_fields = {f for f in all_vcf_fields if len(get_unique_values_series(df[f]))==1 or all(pd.isna(df[f]))}
+        uninteresting_vcf_fields.update({"INFO", "sampleID", "REF", "IDset"})
+
+        # keep the others
+        vcf_fields_onHover = all_vcf_fields.difference(uninteresting_vcf_fields)
+
+    return sorted(vcf_fields_onHover.intersection(all_vcf_fields))
+
+def get_hover_texts_vcf_df(df, vcf_fields_onHover):
+
+    """Returns a list with the hover text of each row of the vcf df, with the (sorted) vcf_fields_onHover, as in get_plot_data_small_vars_r"""
+
+    non_INFO_fields = [f for f in vcf_fields_onHover if not f.startswith("INFO_")]
+    INFO_fields = [f for f in vcf_fields_onHover if f.startswith("INFO_")]
+
+    hover_texts = []
+    for non_INFO_values, INFO_values in zip(df[non_INFO_fields].values, df[INFO_fields].values):
+
+        hover_text = "<br>".join(["%s: %s"%(f, v) for f, v in zip(non_INFO_fields, non_INFO_values)])
+        hover_text += "<br><br>INFO:<br>"
+        hover_text += "<br>".join(["%s: %s"%(f.split("INFO_")[1], v) for f, v in zip(INFO_fields, INFO_values) if not pd.isna(v)])
+        hover_texts.append(hover_text)
+
+    return hover_texts
+
+def get_zoom_levels_tiled_browser(genome_span, min_bin_size, nbins_view, zoom_factor):
+
+    """Returns the bin sizes of the zoom levels of the tiled browser, from the coarsest (where the whole genome fits in nbins_view bins) to min_bin_size. Each level has bins zoom_factor times smaller than the previous"""
+
+    bin_sizes = [min_bin_size]
+    while bin_sizes[-1]*nbins_view < genome_span: bin_sizes.append(bin_sizes[-1]*zoom_factor)
+
+    return list(reversed(bin_sizes))
+
+def get_list_for_json(values, ndecimals=None):
+
+    """Takes an array of numbers and returns it as a list that can be written as json, with NaNs as None"""
+
+    if ndecimals is not None: values = np.round(np.array(values, dtype=float), ndecimals)
+    if ndecimals==0: return [None if pd.isna(v) else int(v) for v in np.array(values).tolist()]
+    return [None if pd.isna(v) else v for v in np.array(values).tolist()]
+
+def get_tile_trace_tiled_browser(x, y, text, size, mode, groups=None):
+
+    """Returns the dict of one trace in a tile of the tiled browser. If groups is provided, a gap (None) is added between consecutive points of different groups, so that the lines are not joined"""
+
+    x = get_list_for_json(x, 0)
+    y = get_list_for_json(y, 3)
+    text = list(text)
+    size = get_list_for_json(size, 1)
+
+    if groups is not None and len(x)>0:
+
+        groups = list(groups)
+        Igaps = [I for I in range(1, len(groups)) if groups[I]!=groups[I-1]]
+        for I in reversed(Igaps): 
+            for l in [x, y, text]: l.insert(I, None)
+            size.insert(I, 0)
+
+    return {"x":x, "y":y, "text":text, "size":size, "mode":mode}
+
+def write_tile_tiled_browser(tile, tile_file):
+
+    """Writes the tile (a dict mapping each trace name to get_tile_trace_tiled_browser dicts) as a gzipped json"""
+
+    tile_file_tmp = "%s.tmp"%tile_file
+    with gzip.open(tile_file_tmp, "wt") as fd: json.dump(tile, fd, separators=(",", ":"))
+    os.rename(tile_file_tmp, tile_file)
+
+def get_items_small_vars_tiled_browser(small_vars, small_vars_annot, chrom_to_Xoffset, sampleID_to_ylevel, small_vars_offset, vcf_fields_onHover):
+
+    """Returns a df with one row for each small variant to draw in the tiled browser (see get_items_tiled_browser). The colors and names are as in get_plot_data_small_vars_r"""
+
+    small_vars = small_vars.reset_index(drop=True)
+    vcf_fields_onHover = get_vcf_fields_onHover_df(small_vars, vcf_fields_onHover)
+
+    # collapse the annotations of each variant
+    small_vars_annot = cp.deepcopy(small_vars_annot)
+    small_vars_annot["var_annotation_str"] = small_vars_annot.Gene.apply(str) + ": " + small_vars_annot.string_rep_variant + ": " +  small_vars_annot.Feature_productDescription
+    annot_df = small_vars_annot.groupby("#Uploaded_variation").agg({"is_protein_altering":any, "overlaps_repeats":any, "var_annotation_str":"<br>".join})
+
+    is_protein_altering = small_vars.ID.map(annot_df.is_protein_altering).fillna(False).astype(bool)
+    overlaps_repeats = small_vars.ID.map(annot_df.overlaps_repeats).fillna(False).astype(bool)
+    var_annotation_str = small_vars.ID.map(annot_df.var_annotation_str).fillna("")
+
+    # get the items
+    items = pd.DataFrame({"chromosome":small_vars["#CHROM"], "start":small_vars.POS.apply(int), "sampleID":small_vars.sampleID})
+    items["end"] = items.start
+    items["name"] = np.select([is_protein_altering & overlaps_repeats, is_protein_altering & ~overlaps_repeats, ~is_protein_altering & overlaps_repeats], ["smallVars - protein altering - overlapping repeats", "smallVars - protein altering", "smallVars - non protein altering - overlapping repeats"], default="smallVars - non protein altering")
+    items["x"] = (items.chromosome.map(chrom_to_Xoffset) + items.start).apply(lambda x: [x])
+    items["y"] = items.sampleID.map(sampleID_to_ylevel) + np.mean(small_vars_offset)
+    items["y_agg"] = items.y
+    items["text"] = [h + "<br>variant effects:<br>%s"%a for h, a in zip(get_hover_texts_vcf_df(small_vars, vcf_fields_onHover), var_annotation_str)]
+
+    name_to_color = {"smallVars - protein altering - overlapping repeats":"teal", "smallVars - protein altering":"dodgerblue", "smallVars - non protein altering - overlapping repeats":"gray", "smallVars - non protein altering":"black"}
+    trace_styles = {name : {"color":name_to_color[name], "symbol":"square", "mode":"markers", "yaxis":"y", "width":2, "opacity":1.0, "visible":True} for name in set(items["name"])}
+
+    return items, trace_styles
+
+def get_items_SV_CNV_tiled_browser(SV_CNV, chrom_to_Xoffset, sampleID_to_ylevel, SV_offset, vcf_fields_onHover, nlanes=4):
+
+    """Returns a df with one row for each SV or CNV to draw in the tiled browser (see get_items_tiled_browser). The overlapping variants of each sample are not clustered as in the static browser, but spread into nlanes along the y"""
+
+    SV_CNV = SV_CNV.reset_index(drop=True)
+    vcf_fields_onHover = get_vcf_fields_onHover_df(SV_CNV, vcf_fields_onHover)
+
+    # get the plotting data
+    df_plot = SV_CNV.apply(lambda r: get_plot_data_SV_CNV_r(r, vcf_fields_onHover, chrom_to_Xoffset), axis=1)
+
+    # get the items
+    offsets = df_plot.chromosome.map(chrom_to_Xoffset)
+    items = pd.DataFrame({"chromosome":df_plot.chromosome, "sampleID":df_plot.sampleID, "name":df_plot.type_sv, "x":df_plot.x, "text":df_plot.hover_text})
+    items["start"] = df_plot.x.apply(min) - offsets
+    items["end"] = df_plot.x.apply(max) - offsets
+
+    lane = items.groupby("sampleID").cumcount() % nlanes
+    items["y"] = items.sampleID.map(sampleID_to_ylevel) + SV_offset[0] + (lane+0.5)*((SV_offset[1]-SV_offset[0])/nlanes)
+    items["y_agg"] = items.sampleID.map(sampleID_to_ylevel) + np.mean(SV_offset)
+
+    trace_styles = {name : {"color":color, "symbol":symbol, "mode":"lines+markers", "yaxis":"y", "width":2, "opacity":1.0, "visible":True} for name, color, symbol in df_plot[["type_sv", "color", "marker_symbol"]].drop_duplicates(subset=["type_sv"]).values}
+
+    return items, trace_styles
+
+def get_items_gff_tiled_browser(gff_df, chrom_to_Xoffset, gff_annotation_fields, interesting_features="all", initial_ylevel=1):
+
+    """Returns a df with one row for each gff feature to draw in the gene browser of the tiled browser (see get_items_tiled_browser). The features are placed in non-overlapping ylevels and have the hover of add_gff_traces_as_scatters. In the binned zoom levels each feature is counted in a ylevel"""
+
+    if interesting_features=="all": interesting_features = set(gff_df.feature)
+    genes_df = gff_df[gff_df.feature.isin(interesting_features)].sort_values(by=["start", "end", "strand"])
+    genes_df = genes_df.assign(genome_start=genes_df.chromosome.map(chrom_to_Xoffset) + genes_df.start, genome_end=genes_df.chromosome.map(chrom_to_Xoffset) + genes_df.end).sort_values(by=["genome_start", "genome_end"])
+
+    # map features to colors
+    feature_to_color = {'gene': 'black', 'exon': 'darkblue', 'repeat_region': 'silver', 'mRNA': 'crimson', 'pseudogene': 'gray', 'centromere': 'silver', 'chromosome': 'silver', 'rRNA': 'coral', 'CDS': 'green', 'tRNA': 'red', 'ncRNA': 'orange', 'long_terminal_repeat': 'silver'}
+    possible_colors = ["black", "maroon", "darkgreen", "darkslategray", "darkblue", "indigo", "crimson"]
+    for I, feat in enumerate(sorted(set(genes_df.feature).difference(set(feature_to_color)))): feature_to_color[feat] = possible_colors[I % len(possible_colors)]
+
+    # get the ylevel of each feature, the first where it does not overlap any previous feature
+    level_ends = []
+    good_levels_list = []
+    for start, end in genes_df[["genome_start", "genome_end"]].values:
+
+        Ilevel = next((I for I, l_end in enumerate(level_ends) if start>l_end), len(level_ends))
+        if Ilevel==len(level_ends): level_ends.append(end)
+        else: level_ends[Ilevel] = end
+        good_levels_list.append(initial_ylevel + Ilevel)
+
+    # get the hover texts
+    hover_texts = []
+    for I, r in genes_df.iterrows():
+
+        direction_text = {"+":">", "-":"<", ".":"?"}[r["strand"]]
+        hovertext = "<b>%s%s"%(direction_text, r["ID"])
+
+        if pd.isna(r["userProvided_description"]):
+            for f in gff_annotation_fields: 
+                if f in r.keys() and not pd.isna(r[f]): hovertext += "-%s:%s"%(f, r[f])
+
+        else: hovertext += ":%s"%r["userProvided_description"]
+
+        hover_texts.append("%s%s</b>"%(hovertext, direction_text))
+
+    # get the items
+    all_features = sorted(set(genes_df.feature))
+    items = pd.DataFrame({"chromosome":genes_df.chromosome.values, "start":genes_df.start.values, "end":genes_df.end.values, "name":genes_df.feature.values, "text":hover_texts, "y":good_levels_list, "sampleID":""})
+    items["x"] = [[s, e] for s, e in genes_df[["genome_start", "genome_end"]].values]
+    items["y_agg"] = items["name"].apply(lambda f: initial_ylevel + all_features.index(f))
+
+    trace_styles = {feat : {"color":feature_to_color[feat], "symbol":"circle", "mode":"lines+markers", "yaxis":"y2", "width":2, "opacity":0.8, "visible":True} for feat in all_features}
+
+    return items, trace_styles
+
+def get_coverage_windows_tiled_browser(regions_df, chrom_to_len, min_bin_size):
+
+    """Takes a df with regions (chromosome, start and end, 1-based) and returns a df with the windows of min_bin_size (chromosome, bin, start and end, 0-based) that overlap them, sorted by chromosome and bin. These are the windows where the coverage is drawn in the tiled browser"""
+
+    all_windows = []
+    for chrom, regions_chrom in regions_df[regions_df.chromosome.isin(set(chrom_to_len))].groupby("chromosome"):
+
+        # mark the bins overlapping any region
+        nbins = (chrom_to_len[chrom]-1)//min_bin_size + 1
+        first_bins = np.clip((np.maximum(regions_chrom.start.values.astype(int), 1)-1)//min_bin_size, 0, nbins)
+        last_bins = np.clip((regions_chrom.end.values.astype(int)-1)//min_bin_size, -1, nbins-1)
+        delta_nregions = np.zeros(nbins+1, dtype=int)
+        np.add.at(delta_nregions, first_bins[first_bins<=last_bins], 1)
+        np.add.at(delta_nregions, last_bins[first_bins<=last_bins]+1, -1)
+        bins = np.where(np.cumsum(delta_nregions[:-1])>0)[0]
+
+        all_windows.append(pd.DataFrame({"chromosome":chrom, "bin":bins, "start":bins*min_bin_size, "end":np.minimum((bins+1)*min_bin_size, chrom_to_len[chrom])}))
+
+    if len(all_windows)==0: return pd.DataFrame(columns=["chromosome", "bin", "start", "end"])
+    return pd.concat(all_windows, sort=False)[["chromosome", "bin", "start", "end"]].sort_values(by=["chromosome", "bin"]).reset_index(drop=True)
+
+def write_coverage_tiles_tiled_browser(df_data, df_windows, reference_genome, cache_dir, tiles_dir, bin_sizes, nbins_view, detail_tile_span, chrom_to_Xoffset, chrom_to_Ichrom, sampleID_to_ylevel, coverage_offset, min_cov, max_cov, mitochondrial_chromosome, sampleID_to_backgroundSamples, threads, replace):
+
+    """Writes the tiles with the relative_coverage and relative_coverage_to_bg (as in get_df_coverage_with_coverage_relative_to_bg) of each sample in df_windows (see get_coverage_windows_tiled_browser). The coverage of each window is averaged in the bins of each level (bin_sizes, see get_zoom_levels_tiled_browser), and the detail level has that of the finest bins. The coverage is relative to the median coverage of the sample in the bins of the coarsest level (across the whole genome). The tiles are written (one chromosome at a time) into tiles_dir/<level>/<Ichrom>_<tile_bin>_cov.json.gz, each with the coverage of all samples, so that each view of the browser requests one coverage tile for each tile_bin. It returns a dict that maps each level to the keys of the written tiles."""
+
+    min_bin_size = bin_sizes[-1]
+    sampleIDs = list(df_data.sampleID)
+    level_to_tile_keys = {level_name : [] for level_name in ["level%i"%Ilevel for Ilevel in range(len(bin_sizes))] + ["detail"]}
+    if len(df_windows)==0: return level_to_tile_keys
+
+    # write the windows and those of the coarsest level (to get the median coverage)
+    windows_bed = "%s/tiled_browser_coverage_windows_%ibp.bed"%(cache_dir, min_bin_size)
+    df_windows[["chromosome", "start", "end"]].to_csv(windows_bed, sep="\t", header=True, index=False)
+
+    chrom_to_len = fun.get_chr_to_len(reference_genome)
+    df_windows_coarse = pd.concat([pd.DataFrame({"chromosome":chrom, "start":np.arange(0, length, bin_sizes[0])}) for chrom, length in chrom_to_len.items()], sort=False)
+    df_windows_coarse["end"] = np.minimum(df_windows_coarse.start + bin_sizes[0], df_windows_coarse.chromosome.map(chrom_to_len))
+    windows_coarse_bed = "%s/tiled_browser_coverage_windows_%ibp.bed"%(cache_dir, bin_sizes[0])
+    df_windows_coarse[["chromosome", "start", "end"]].to_csv(windows_coarse_bed, sep="\t", header=True, index=False)
+
+    # save the relative coverage of each sample in df_windows, so that only one chromosome is loaded at a time
+    coverage_dir = "%s/tiled_browser_coverage"%cache_dir
+    fun.delete_folder(coverage_dir); fun.make_folder(coverage_dir)
+    windows_index = pd.MultiIndex.from_arrays([df_windows.chromosome, df_windows.start])
+
+    for Is, (sampleID, r_data) in enumerate(df_data.iterrows()):
+        fun.print_if_verbose("getting coverage of %s"%sampleID)
+
+        df_s = fun.get_coverage_per_window_df_without_repeating(reference_genome, r_data["sorted_bam"], windows_bed, replace=replace, run_in_parallel=True, delete_bams=True, threads=threads)
+        df_s_coarse = fun.get_coverage_per_window_df_without_repeating(reference_genome, r_data["sorted_bam"], windows_coarse_bed, replace=replace, run_in_parallel=True, delete_bams=True, threads=threads)
+
+        relative_coverage = df_s.set_index(["chromosome", "start"]).mediancov_1.reindex(windows_index).values / fun.get_median_coverage(df_s_coarse, mitochondrial_chromosome)
+        np.save("%s/sample%i.npy"%(coverage_dir, Is), relative_coverage.astype(float))
+
+    # define the background samples
+    sampleID_to_Ibg_samples = {}
+    for sampleID in sampleIDs:
+
+        if sampleID in sampleID_to_backgroundSamples: bg_samples = sampleID_to_backgroundSamples[sampleID]
+        else: bg_samples = set(sampleIDs).difference({sampleID})
+        if len(sampleIDs)==1: bg_samples = set(sampleIDs)
+        sampleID_to_Ibg_samples[sampleID] = [I for I, s in enumerate(sampleIDs) if s in bg_samples]
+
+    # go through each chromosome, writing the tiles of all samples
+    chrom_to_first_last_window = {chrom : (min(idx), max(idx)+1) for chrom, idx in df_windows.groupby("chromosome").groups.items()}
+    for chrom, (first_window, last_window) in sorted(chrom_to_first_last_window.items()):
+
+        fun.print_if_verbose("writing the coverage tiles of %s"%chrom)
+        bins = df_windows.bin.values[first_window:last_window]
+        relative_coverage_chrom = np.array([np.load("%s/sample%i.npy"%(coverage_dir, Is), mmap_mode="r")[first_window:last_window] for Is in range(len(sampleIDs))])
+
+        sampleID_to_name_to_values = {}
+        for Is, sampleID in enumerate(sampleIDs):
+
+            relative_coverage_bg = np.median(relative_coverage_chrom[sampleID_to_Ibg_samples[sampleID],:], axis=0)
+            sampleID_to_name_to_values[sampleID] = {"relative_coverage":relative_coverage_chrom[Is,:], "relative_coverage_to_bg":(relative_coverage_chrom[Is,:] + 0.01)/(relative_coverage_bg + 0.01)}
+
+        # aggregate the windows into the bins of each level (and the detail level, with the finest bins), writing one tile with all the samples
+        for level_name, bin_size in [("level%i"%Ilevel, bin_size) for Ilevel, bin_size in enumerate(bin_sizes)] + [("detail", min_bin_size)]:
+
+            all_coverage_dfs = []
+            for sampleID, name_to_values in sampleID_to_name_to_values.items():
+                for name, values in name_to_values.items():
+
+                    valid = np.isfinite(values)
+                    level_bins, Ibin = np.unique((bins[valid]*min_bin_size)//bin_size, return_inverse=True)
+                    all_coverage_dfs.append(pd.DataFrame({"chromosome":chrom, "bin":level_bins, "sampleID":sampleID, "name":name, "sum_value":np.bincount(Ibin, weights=values[valid], minlength=len(level_bins)), "n":np.bincount(Ibin, minlength=len(level_bins))}))
+
+            coverage_df = pd.concat(all_coverage_dfs, sort=False)
+            if level_name=="detail": coverage_df["tile_bin"] = (coverage_df.bin*min_bin_size)//detail_tile_span
+            else: coverage_df["tile_bin"] = coverage_df.bin//nbins_view
+
+            tile_traces_df = get_binned_tile_traces_tiled_browser(pd.DataFrame(), coverage_df, bin_size, chrom_to_Xoffset, sampleID_to_ylevel, coverage_offset, min_cov, max_cov)
+            level_to_tile_keys[level_name] += write_tiles_tiled_browser(tile_traces_df, "%s/%s"%(tiles_dir, level_name), chrom_to_Ichrom, key_suffix="_cov")
+
+    fun.delete_folder(coverage_dir)
+
+    return level_to_tile_keys
+
+def get_binned_tile_traces_tiled_browser(counts_df, coverage_df, bin_size, chrom_to_Xoffset, sampleID_to_ylevel, coverage_offset, min_cov, max_cov):
+
+    """Takes the counts of items (counts_df) and the coverage (coverage_df, with the sum and number of windows) in bins of bin_size, and returns a df with the fields chromosome, tile_bin (the bin of the first position of each point) and trace (the trace dict of the points of one name in these bins, see get_tile_trace_tiled_browser)."""
+
+    all_traces = []
+
+    # add the counts, one point for each bin with the number of items 
+    if len(counts_df)>0:
+
+        counts_df = counts_df.assign(x=counts_df.chromosome.map(chrom_to_Xoffset) + counts_df.bin*bin_size + bin_size/2)
+        counts_df["text"] = counts_df.n.apply(str) + " " + counts_df["name"] + "<br>" + counts_df.chromosome.apply(str) + ":" + (counts_df.bin*bin_size+1).apply(str) + "-" + ((counts_df.bin+1)*bin_size).apply(str)
+        counts_df["size"] = np.clip(4 + 2*np.log2(counts_df.n), 4, 16)
+
+        for (chrom, tile_bin, name), df in counts_df.groupby(["chromosome", "tile_bin", "name"]): all_traces.append((chrom, tile_bin, name, get_tile_trace_tiled_browser(df.x, df.y_agg, df.text, df["size"], "markers")))
+
+    # add the coverage, one line for each sample
+    if len(coverage_df)>0:
+
+        coverage_df = coverage_df.assign(x=coverage_df.chromosome.map(chrom_to_Xoffset) + coverage_df.bin*bin_size + bin_size/2, mean_value=coverage_df.sum_value/coverage_df.n)
+        min_y = coverage_df.sampleID.map(sampleID_to_ylevel) + coverage_offset[0]
+        relative_value = np.minimum(np.abs(coverage_df.mean_value-min_cov)/abs(max_cov-min_cov), 1)
+        coverage_df["y"] = min_y + relative_value*abs(coverage_offset[1]-coverage_offset[0])
+        coverage_df["text"] = coverage_df.mean_value.apply(lambda x: "%.2f"%x)
+        coverage_df = coverage_df.sort_values(by=["name", "sampleID", "bin"])
+
+        for (chrom, tile_bin, name), df in coverage_df.groupby(["chromosome", "tile_bin", "name"]): all_traces.append((chrom, tile_bin, name, get_tile_trace_tiled_browser(df.x, df.y, df.text, [3]*len(df), "lines+markers", groups=df.sampleID)))
+
+    return pd.DataFrame(all_traces, columns=["chromosome", "tile_bin", "name", "trace"])
+
+def get_detail_tile_traces_tiled_browser(items_df, tile_span, trace_styles):
+
+    """Takes the items to draw (see get_items_tiled_browser) and returns a df with the fields chromosome, tile_bin and trace, where the trace has each of the items of one name in each tile of tile_span. The items that span several tiles are in all of them"""
+
+    if len(items_df)==0: return pd.DataFrame(columns=["chromosome", "tile_bin", "name", "trace"])
+
+    # repeat the items for each tile
+    first_tile = (items_df.start.values-1)//tile_span
+    ntiles = (items_df.end.values-1)//tile_span - first_tile + 1
+    items_df = items_df.iloc[np.repeat(np.arange(len(items_df)), ntiles)].copy()
+    items_df["tile_bin"] = np.repeat(first_tile, ntiles) + np.concatenate([np.arange(n) for n in ntiles])
+
+    # get the traces
+    all_traces = []
+    for (chrom, tile_bin, name), df in items_df.groupby(["chromosome", "tile_bin", "name"]):
+
+        mode = trace_styles[name]["mode"]
+        if mode=="markers": 
+            x = [x[0] for x in df.x]
+            trace = get_tile_trace_tiled_browser(x, df.y, df.text, [6]*len(x), mode)
+
+        else: 
+            x = [p for xlist in df.x for p in xlist]
+            groups = [I for I, xlist in enumerate(df.x) for p in xlist]
+            trace = get_tile_trace_tiled_browser(x, np.repeat(df.y.values, df.x.apply(len).values), np.repeat(df.text.values, df.x.apply(len).values), [6]*len(x), mode, groups=groups)
+
+        all_traces.append((chrom, tile_bin, name, trace))
+
+    return pd.DataFrame(all_traces, columns=["chromosome", "tile_bin", "name", "trace"])
+
+def write_tiles_tiled_browser(tile_traces_df, tiles_dir, chrom_to_Ichrom, key_suffix=""):
+
+    """Writes one tile for each chromosome and tile_bin of tile_traces_df (see get_binned_tile_traces_tiled_browser) into tiles_dir. It returns the keys of the tiles (<Ichrom>_<tile_bin><key_suffix>)"""
+
+    fun.make_folder(tiles_dir)
+
+    tile_keys = []
+    for (chrom, tile_bin), df in tile_traces_df.groupby(["chromosome", "tile_bin"]):
+
+        tile_key = "%i_%i%s"%(chrom_to_Ichrom[chrom], tile_bin, key_suffix)
+        write_tile_tiled_browser(dict(zip(df["name"], df.trace)), "%s/%s.json.gz"%(tiles_dir, tile_key))
+        tile_keys.append(tile_key)
+
+    return tile_keys
+
+def get_genome_variation_browser_tiled(df_data, samples_colors_df, target_regions, target_genes, gff_df, browser_dir, cache_dir, reference_genome, threads=4, title="SVbrowser", chrName_to_shortName={}, fraction_y_domain_by_gene_browser=0.5, min_cov=0, max_cov=2, only_affected_genes=False, interesting_features="all", vcf_fields_onHover="all", replace=False, mitochondrial_chromosome="mito_C_glabrata_CBS138", sampleID_to_backgroundSamples={}, gff_annotation_fields=set(), min_bin_size=1000, nbins_view=1000, zoom_factor=4):
+
+    """Like get_genome_variation_browser, but for large datasets. It writes into browser_dir an index.html that loads the data as the user zooms (it has to be served, see serve_tiled_genome_browser). The variants, coverage and gff features are counted (or averaged) in bins of several zoom levels (see get_zoom_levels_tiled_browser), from the coarsest (the whole genome in nbins_view bins) to bins of min_bin_size. Each level is split into tiles of nbins_view bins, which are written as gzipped json files into browser_dir/tiles/<level>. Each variant and feature is drawn (with the hover of the static browser) only in the 'detail' level, when the view spans less than min_bin_size*nbins_view/zoom_factor. The coverage is calculated in the windows of min_bin_size that overlap the target_regions or the drawn gff features, and each of its tiles has all samples (see write_coverage_tiles_tiled_browser). The size of the output depends on the number of bins (and on the number of variants only in the detail level)."""
+
+    # get index integrated
+    df_data = df_data.set_index("sampleID", drop=False)
+
+    # get all the variant dfs, already filtering out
+    small_vars, small_vars_annot, SV_CNV, SV_CNV_annot = get_integrated_vars_df(df_data, cache_dir, target_regions, target_genes, gff_df)
+
+    # define the chromosomes
+    chrom_to_len = fun.get_chr_to_len(reference_genome)
+    all_chromosomes = sorted(set(chrom_to_len))
+    chrom_to_Ichrom = {chrom : Ichrom for Ichrom, chrom in enumerate(all_chromosomes)}
+    chrom_to_Xoffset = get_chrom_to_Xoffset(chrom_to_len)
+    genome_span = chrom_to_Xoffset[all_chromosomes[-1]] + chrom_to_len[all_chromosomes[-1]]
+    chrom_to_color, palette_chromosome = fun.get_value_to_color(all_chromosomes, palette="tab10", type_color="hex")
+    if chrName_to_shortName=={}: chrName_to_shortName = {c:c for c in all_chromosomes}
+
+    # get the gff as in get_genome_variation_browser
+    gff_df = gff_df[gff_df.upmost_parent_feature!="chromosome"]
+    affected_genes = set(SV_CNV_annot.Gene).union(set(small_vars_annot.Gene))
+    if only_affected_genes is True: gff_df = gff_df[(gff_df.upmost_parent.isin(affected_genes))]
+    gff_df = gff_df[gff_df.upmost_parent.isin(target_genes)]
+
+    # map each sample to the ylevel
+    ylevels = [x*2 for x in list(reversed(range(len(samples_colors_df))))]
+    sampleID_to_ylevel = dict(zip(samples_colors_df.index, ylevels))
+
+    # get the y offset of each type of vars
+    plot_small_vars = len(small_vars)>0
+    plot_SV = len(SV_CNV)>0
+    plot_coverage = "sorted_bam" in df_data.keys()
+    small_vars_offset, SV_offset, coverage_offset = get_offset_each_typeData(plot_small_vars, plot_SV, plot_coverage)
+
+    ######## GET THE ITEMS TO DRAW ########
+
+    all_items = []
+    trace_styles = {}
+
+    for plot_data, get_items_fn, args in [(plot_small_vars, get_items_small_vars_tiled_browser, (small_vars, small_vars_annot, chrom_to_Xoffset, sampleID_to_ylevel, small_vars_offset, vcf_fields_onHover)),
+                                          (plot_SV, get_items_SV_CNV_tiled_browser, (SV_CNV, chrom_to_Xoffset, sampleID_to_ylevel, SV_offset, vcf_fields_onHover)),
+                                          (len(gff_df)>0, get_items_gff_tiled_browser, (gff_df, chrom_to_Xoffset, gff_annotation_fields, interesting_features))]:
+
+        if plot_data is False: continue
+        items, item_trace_styles = get_items_fn(*args)
+        all_items.append(items[["chromosome", "start", "end", "sampleID", "name", "x", "y", "y_agg", "text"]])
+        trace_styles.update(item_trace_styles)
+
+    if len(all_items)>0: items_df = pd.concat(all_items, sort=False)
+    else: items_df = pd.DataFrame(columns=["chromosome", "start", "end", "sampleID", "name", "x", "y", "y_agg", "text"])
+    for f in ["start", "end"]: items_df[f] = items_df[f].apply(int)
+    fun.print_if_verbose("There are %i variants and features to draw"%len(items_df))
+
+    # add the styles of the coverage
+    if plot_coverage: 
+        for name, color in [("relative_coverage", "blue"), ("relative_coverage_to_bg", "red")]: trace_styles[name] = {"color":color, "symbol":"circle", "mode":"lines+markers", "yaxis":"y", "width":1, "opacity":1.0, "visible":"legendonly"}
+
+    #######################################
+
+    ######## WRITE THE TILES ########
+
+    # write into a tmp dir
+    browser_dir_tmp = "%s.tmp"%browser_dir
+    fun.delete_folder(browser_dir_tmp); fun.make_folder(browser_dir_tmp)
+
+    # get the levels
+    bin_sizes = get_zoom_levels_tiled_browser(genome_span, min_bin_size, nbins_view, zoom_factor)
+    detail_tile_span = max([1, int(min_bin_size*nbins_view/zoom_factor)])
+    levels = []
+
+    # write the coverage tiles of each sample, in the windows of min_bin_size that overlap the target regions or the drawn features
+    if plot_coverage:
+        df_windows = get_coverage_windows_tiled_browser(pd.concat([target_regions[["chromosome", "start", "end"]], gff_df[["chromosome", "start", "end"]]], sort=False), chrom_to_len, min_bin_size)
+        fun.print_if_verbose("drawing the coverage in %i windows of %i bp"%(len(df_windows), min_bin_size))
+        level_to_coverage_tile_keys = write_coverage_tiles_tiled_browser(df_data, df_windows, reference_genome, cache_dir, "%s/tiles"%browser_dir_tmp, bin_sizes, nbins_view, detail_tile_span, chrom_to_Xoffset, chrom_to_Ichrom, sampleID_to_ylevel, coverage_offset, min_cov, max_cov, mitochondrial_chromosome, sampleID_to_backgroundSamples, threads, replace)
+
+    else: level_to_coverage_tile_keys = {}
+
+    # init the counts in the finest bins
+    counts_df = items_df.assign(bin=(items_df.start-1)//min_bin_size).groupby(["chromosome", "bin", "name", "y_agg"]).size().rename("n").reset_index()
+
+    # go through the levels, from the finest, getting the bins from the previous level
+    for Ilevel in reversed(range(len(bin_sizes))):
+
+        bin_size = bin_sizes[Ilevel]
+        fun.print_if_verbose("writing the tiles of bins of %i bp"%bin_size)
+
+        if bin_size!=min_bin_size: counts_df = counts_df.assign(bin=counts_df.bin//zoom_factor).groupby(["chromosome", "bin", "name", "y_agg"]).n.sum().reset_index()
+        counts_df["tile_bin"] = counts_df.bin//nbins_view
+
+        level_name = "level%i"%Ilevel
+        tile_traces_df = get_binned_tile_traces_tiled_browser(counts_df, pd.DataFrame(), bin_size, chrom_to_Xoffset, sampleID_to_ylevel, coverage_offset, min_cov, max_cov)
+        tile_keys = write_tiles_tiled_browser(tile_traces_df, "%s/tiles/%s"%(browser_dir_tmp, level_name), chrom_to_Ichrom) + level_to_coverage_tile_keys.get(level_name, [])
+        levels.append({"name":level_name, "bin_size":bin_size, "tile_span":bin_size*nbins_view, "tiles":tile_keys})
+
+    # write the detail level, with the items (the coverage is that of the finest bins)
+    fun.print_if_verbose("writing the tiles with all the variants and features")
+    tile_traces_df = get_detail_tile_traces_tiled_browser(items_df, detail_tile_span, trace_styles)
+    tile_keys = write_tiles_tiled_browser(tile_traces_df, "%s/tiles/detail"%browser_dir_tmp, chrom_to_Ichrom) + level_to_coverage_tile_keys.get("detail", [])
+
+    levels = list(reversed(levels)) + [{"name":"detail", "bin_size":None, "tile_span":detail_tile_span, "tiles":tile_keys}]
+
+    #################################
+
+    ######## WRITE THE HTML ########
+
+    # define the shapes of the background of each sample (related by the last column of samples_colors_df) and the chromosomes
+    lastCol = samples_colors_df.columns[-1]
+    shapes = [dict(type="rect", xref="paper", yref="y", x0=0, x1=1, y0=ylevel-1, y1=ylevel+1, fillcolor=samples_colors_df.loc[sampleID, lastCol], opacity=0.15, line=dict(width=0), layer="below") for sampleID, ylevel in sampleID_to_ylevel.items()]
+
+    chromosome_rectanges, chromosome_annotations = get_rectangles_and_annotations_for_chromosomes(chrom_to_Xoffset, chrom_to_len, chrom_to_color, chrName_to_shortName, ylevel=0, width_rect=0.2, xref="x", yref="y2", annotation_offset=0.1)
+    shapes += chromosome_rectanges
+    annotations = [dict(x=a["x"], y=a["y"], text=a["text"], font=a["textfont"], xref="x", yref="y2", showarrow=False) for a in chromosome_annotations]
+
+    # define the layout
+    max_gene_ylevel = float(max([1] + list(items_df[items_df.sampleID==""].y) + list(items_df[items_df.sampleID==""].y_agg)))
+    layout = {"title":title, "hovermode":"closest", "showlegend":True, "font":{"size":12}, "margin":{"l":250, "r":250, "b":50, "t":50}, "shapes":shapes, "annotations":annotations,
+              "xaxis":{"domain":[0, 1], "anchor":"y2", "range":[0, genome_span], "showgrid":True, "zeroline":False},
+              "yaxis":{"domain":[fraction_y_domain_by_gene_browser, 1], "anchor":"x", "tickmode":"array", "tickvals":ylevels, "ticktext":list(samples_colors_df.index), "range":[min(ylevels)-1.2, max(ylevels)+1.2], "showgrid":True, "zeroline":False},
+              "yaxis2":{"domain":[0, fraction_y_domain_by_gene_browser], "anchor":"x", "range":[-1, max_gene_ylevel+1], "showgrid":True, "zeroline":False, "showticklabels":False}}
+
+    # define the manifest
+    manifest = {"title":title, "nbins_view":nbins_view, "detail_max_span":detail_tile_span, "genome_span":genome_span, "chromosomes":[{"name":c, "offset":chrom_to_Xoffset[c], "length":chrom_to_len[c]} for c in all_chromosomes], "levels":levels, "trace_styles":trace_styles, "layout":layout}
+
+    # write the html and plotly.js
+    open("%s/index.html"%browser_dir_tmp, "w").write(g_tiled_browser_html.replace("__TITLE__", title).replace("__MANIFEST__", json.dumps(manifest).replace("</", "<\\/")))
+    open("%s/plotly.min.js"%browser_dir_tmp, "w").write(off_py.get_plotlyjs())
+
+    # replace the previous browser
+    fun.delete_folder(browser_dir)
+    os.rename(browser_dir_tmp, browser_dir)
+
+    print("The tiled genome browser was written into %s. Serve it with serve_tiled_genome_browser (i.e. perSVade_genome_browser.py --serve_port) or any static http server"%browser_dir)
+
+def serve_tiled_genome_browser(browser_dir, port=8000):
+
+    """Serves the browser_dir written by get_genome_variation_browser_tiled at http://localhost:<port>/index.html, until it is interrupted. The tiles can't be loaded if index.html is opened as a file"""
+
+    os.chdir(browser_dir)
+    print("The genome browser is served at http://localhost:%i/index.html. Press Ctrl+C to stop"%port)
+    http.server.HTTPServer(("localhost", port), http.server.SimpleHTTPRequestHandler).serve_forever()
+
+
 #######################################################
 ############### FUNCTIONS PLOTS TESTING ###############
 #######################################################
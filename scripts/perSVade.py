@@ -89,12 +89,14 @@ resources_args = parser.add_argument_group("RESOURCES")
 
 resources_args.add_argument("-thr", "--threads", dest="threads", default=16, type=int, help="Number of threads, Default: 16")
 
-resources_args.add_argument("--fraction_available_mem", dest="fraction_available_mem", default=None, type=float, help="The fraction of RAM that is being allocated to this perSVade run. In several steps, this pipeline needs to calculate the available memory (using psutil.virtual_memory()). This returns all the available memory in the computer. If you are running on a fraction of the computers' resources, this calculation is overestimating the available RAM. In such case you can provide the fraction available through this argument. By default, it will calculate the available ram by filling the memory, which may give errors. It is highly reccommended that you provide this option. If you want to use all the allocated memory you should specify --fraction_available_mem 1.0")
+resources_args.add_argument("--fraction_available_mem", dest="fraction_available_mem", default=None, type=float, help="The fraction of RAM that is being allocated to this perSVade run. In several steps, this pipeline needs to calculate the available memory (using psutil.virtual_memory()). This returns all the available memory in the computer. If you are running on a fraction of the computers' resources, this calculation is overestimating the available RAM. In such case you can provide the fraction available through this argument. By default, it will calculate the available RAM from the memory limits of the cgroup or the job (SLURM or LSF) and /proc/meminfo. If you want to use all the allocated memory you should specify --fraction_available_mem 1.0")
 
 resources_args.add_argument("--fractionRAM_to_dedicate", dest="fractionRAM_to_dedicate", type=float,  default=0.5, help="This is the fraction of the available memory that will be used by several java programs that require a heap size. By default we set this to 0.5 to not overload the system")
 
 resources_args.add_argument("--tmpdir", dest="tmpdir", default=None, help="A full path to a directory where to write intermediate files. This is useful if you are running on a cluster that has some directories that have higher writing speed than others.")
 
+resources_args.add_argument("--streaming_alignment", dest="streaming_alignment", default=False, action="store_true", help="Stream the output of bwa mem through duplicate marking (with samtools fixmate and markdup) and sorting, without writing the intermediate .sam and .bam files to disk. This is useful if you are running on a cluster with slow or limited scratch. The I/O and time saved in each stage are written into <sorted_bam>.streaming_alignment_stats.tab")
+
 resources_args.add_argument("--min_gb_RAM_required", dest="min_gb_RAM_required", default=2, type=int, help="The minimum number of RAM required to run perSVade. This can be related to --fraction_available_mem")
 
 
@@ -140,7 +142,7 @@ SVcalling_args.add_argument("--nsimulations", dest="nsimulations", default=2, ty
 
 SVcalling_args.add_argument("--simulation_ploidies", dest="simulation_ploidies", type=str, default="auto", help='A comma-sepparated string of the ploidies to simulate for parameter optimisation. It can have any of "haploid", "diploid_homo", "diploid_hetero", "ref:2_var:1", "ref:3_var:1", "ref:4_var:1", "ref:5_var:1", "ref:9_var:1", "ref:19_var:1", "ref:99_var:1" . By default it will be inferred from the ploidy. For example, if you are running on ploidy=2, it will optimise for diploid_hetero.')
 
-SVcalling_args.add_argument("--range_filtering_benchmark", dest="range_filtering_benchmark", type=str, default="theoretically_meaningful", help='The range of parameters that should be tested in the SV optimisation pipeline. It can be any of large, medium, small, theoretically_meaningful, theoretically_meaningful_NoFilterRepeats or single. ')
+SVcalling_args.add_argument("--range_filtering_benchmark", dest="range_filtering_benchmark", type=str, default="theoretically_meaningful", help='The range of parameters that should be tested in the SV optimisation pipeline. It can be any of large, medium, small, theoretically_meaningful, theoretically_meaningful_NoFilterRepeats or single. Any of these can end with _treeSearch (i.e. large_treeSearch), which searches the combinations of filters as a tree, pruning the filters that yield no breakpoints. This is faster and yields the same results. ')
 
 SVcalling_args.add_argument("--simulate_SVs_around_repeats", dest="simulate_SVs_around_repeats", action="store_true", default=False, help="Simulate SVs around repeats. This requires that there are some repeats inferred. This option will generate a simulated set of breakpoints around repeats, if possible of the same family, and with random orientations.")
 
@@ -340,7 +342,9 @@ if opt.type_variant_calling is not None:
 
 # start time of processing
 start_time_GeneralProcessing =  time.time()
+start_cpu_time_GeneralProcessing = fun.get_cpu_time_self_and_children()
 start_time_all =  time.time()
+start_cpu_time_all = fun.get_cpu_time_self_and_children()
 
 # if replace is set remove the outdir, and then make it
 if opt.replace is True: fun.delete_folder(opt.outdir)
@@ -462,7 +466,7 @@ fun.printing_verbose_mode = opt.verbose
 
 # defin the fraction of available mem
 fun.fraction_available_mem = opt.fraction_available_mem
-if opt.fraction_available_mem is None: print("WARNING: You did not specify how much RAM should be used through --fraction_available_mem. perSVade will calculate this by filling the memory, which may be dangerous. If you want to use all the allocated memory you should specify --fraction_available_mem 1.0")
+if opt.fraction_available_mem is None: print("WARNING: You did not specify how much RAM should be used through --fraction_available_mem. perSVade will calculate this from the memory limits of the cgroup or the job (SLURM or LSF) and /proc/meminfo. If you want to use all the allocated memory you should specify --fraction_available_mem 1.0")
 
 # define the fraction of RAM to dedicate
 if opt.fractionRAM_to_dedicate>0.95: raise ValueError("You are using >95 pct of the systems RAM, which is dangerous")
@@ -556,6 +560,7 @@ if opt.simulate_SVs_around_HomologousRegions is True:
 
 # end time of processing
 end_time_GeneralProcessing =  time.time()
+fun.record_threads_used_stage(opt.outdir, "GeneralProcessing", opt.threads, start_time_GeneralProcessing, end_time_GeneralProcessing, start_cpu_time=start_cpu_time_GeneralProcessing)
 
 ########################################
 ########################################
@@ -567,6 +572,7 @@ end_time_GeneralProcessing =  time.time()
 #####################################
 
 start_time_alignment =  time.time()
+start_cpu_time_alignment = fun.get_cpu_time_self_and_children()
 
 if not any([x=="skip" for x in {opt.fastq1, opt.fastq2}]):
 
@@ -646,7 +652,7 @@ if not any([x=="skip" for x in {opt.fastq1, opt.fastq2}]):
         else: bwa_mem_MarkDuplicates = True
 
         print("WORKING ON ALIGNMENT")
-        fun.run_bwa_mem(opt.fastq1, opt.fastq2, opt.ref, opt.outdir, bamfile, sorted_bam, index_bam, name_sample, threads=opt.threads, replace=opt.replace, tmpdir_writingFiles=opt.tmpdir, MarkDuplicates=bwa_mem_MarkDuplicates)
+        fun.run_bwa_mem(opt.fastq1, opt.fastq2, opt.ref, opt.outdir, bamfile, sorted_bam, index_bam, name_sample, threads=opt.threads, replace=opt.replace, tmpdir_writingFiles=opt.tmpdir, MarkDuplicates=bwa_mem_MarkDuplicates, streaming_alignment=opt.streaming_alignment)
         fun.clean_sorted_bam_coverage_per_window_files(sorted_bam)
         
     else: print("Warning: No fastq file given, assuming that you provided a bam file")
@@ -655,6 +661,7 @@ if not any([x=="skip" for x in {opt.fastq1, opt.fastq2}]):
     if any([fun.file_is_empty(x) for x in {sorted_bam, index_bam}]): raise ValueError("You need the sorted and indexed bam files in ")
 
 end_time_alignment =  time.time()
+fun.record_threads_used_stage(opt.outdir, "alignment", opt.threads, start_time_alignment, end_time_alignment, start_cpu_time=start_cpu_time_alignment)
 
 #####################################
 #####################################
@@ -691,6 +698,7 @@ if opt.StopAfter_bamFileObtention is True:
 #####################################
 
 start_time_obtentionCloseSVs =  time.time()
+start_cpu_time_obtentionCloseSVs = fun.get_cpu_time_self_and_children()
 
 ##### find a set of 'real_bedpe_breakpoints' that will be used for the simulations #####
 
@@ -749,6 +757,7 @@ if opt.StopAfter_obtentionOFcloseSVs:
     sys.exit(0)
 
 end_time_obtentionCloseSVs =  time.time()
+fun.record_threads_used_stage(opt.outdir, "obtentionCloseSVs", opt.threads, start_time_obtentionCloseSVs, end_time_obtentionCloseSVs, start_cpu_time=start_cpu_time_obtentionCloseSVs)
 
 # test that the real_bedpe_breakpoints are correct
 if real_bedpe_breakpoints is not None and not os.path.isfile(real_bedpe_breakpoints): raise ValueError("The provided real bedpe breakpoints %s are incorrect."%real_bedpe_breakpoints)
@@ -801,6 +810,7 @@ if opt.goldenSet_table is not None:
         sys.exit(0) 
 
 start_time_SVcalling =  time.time()
+start_cpu_time_SVcalling = fun.get_cpu_time_self_and_children()
 
 # run the actual perSVade function optimising parameters
 if opt.skip_SVcalling is False and not any([x=="skip" for x in {opt.fastq1, opt.fastq2}]):
@@ -809,6 +819,7 @@ if opt.skip_SVcalling is False and not any([x=="skip" for x in {opt.fastq1, opt.
     outdir_gridss_final = fun.run_GridssClove_optimising_parameters(sorted_bam, opt.ref, SVdetection_outdir, threads=opt.threads, replace=opt.replace, n_simulated_genomes=opt.nsimulations, mitochondrial_chromosome=opt.mitochondrial_chromosome, simulation_ploidies=simulation_ploidies, range_filtering_benchmark=opt.range_filtering_benchmark, nvars=opt.nvars, fast_SVcalling=opt.fast_SVcalling, real_bedpe_breakpoints=real_bedpe_breakpoints, replace_FromGridssRun_final_perSVade_run=opt.replace_FromGridssRun_final_perSVade_run, tmpdir=opt.tmpdir, simulation_chromosomes=opt.simulation_chromosomes)
 
 end_time_SVcalling =  time.time()
+fun.record_threads_used_stage(opt.outdir, "SVcalling", opt.threads, start_time_SVcalling, end_time_SVcalling, start_cpu_time=start_cpu_time_SVcalling)
 
 print("structural variation analysis with perSVade finished")
 
@@ -845,6 +856,7 @@ else: df_CNV_coverage = pd.DataFrame(columns=minimal_CNV_fields)
 #####################################
 
 start_time_SVandCNVcalling =  time.time()
+start_cpu_time_SVandCNVcalling = fun.get_cpu_time_self_and_children()
 
 run_SV_CNV_calling = (opt.skip_SVcalling is False and not any([x=="skip" for x in {opt.fastq1, opt.fastq2}]) and opt.skip_SV_CNV_calling is False)
 if run_SV_CNV_calling is True:
@@ -886,6 +898,7 @@ if run_SV_CNV_calling is True:
     else: print("WARNING: Skipping SV annotation because -gff was not provided.")
 
 end_time_SVandCNVcalling =  time.time()
+fun.record_threads_used_stage(opt.outdir, "SVandCNVcalling", opt.threads, start_time_SVandCNVcalling, end_time_SVandCNVcalling, start_cpu_time=start_cpu_time_SVandCNVcalling)
 
 #####################################
 #####################################
@@ -898,6 +911,7 @@ end_time_SVandCNVcalling =  time.time()
 #####################################
 
 start_time_smallVarsCNV =  time.time()
+start_cpu_time_smallVarsCNV = fun.get_cpu_time_self_and_children()
 
 if opt.run_smallVarsCNV:
 
@@ -947,6 +961,7 @@ if opt.run_smallVarsCNV:
     if opt.remove_smallVarsCNV_nonEssentialFiles is True: fun.remove_smallVarsCNV_nonEssentialFiles_severalPloidies(outdir_varcall, ploidies_varcall)
 
 end_time_smallVarsCNV =  time.time()
+fun.record_threads_used_stage(opt.outdir, "smallVarsCNV", opt.threads, start_time_smallVarsCNV, end_time_smallVarsCNV, start_cpu_time=start_cpu_time_smallVarsCNV)
 
 if opt.StopAfter_smallVarCall is True:
     print("WARNING: Ending after the running of small variant calling...")
@@ -1001,6 +1016,7 @@ if opt.skip_cleaning_outdir is False: fun.clean_perSVade_outdir(opt.outdir)
 
 # define times
 end_time_all = time.time()
+fun.record_threads_used_stage(opt.outdir, "all", opt.threads, start_time_all, end_time_all, start_cpu_time=start_cpu_time_all)
 
 # generate a file that indicates whether the gridss run is finished
 fun.generate_final_file_report(final_file, start_time_GeneralProcessing, end_time_GeneralProcessing, start_time_alignment, end_time_alignment, start_time_all, end_time_all, start_time_obtentionCloseSVs, end_time_obtentionCloseSVs, start_time_SVcalling, end_time_SVcalling, start_time_SVandCNVcalling, end_time_SVandCNVcalling, start_time_smallVarsCNV, end_time_smallVarsCNV)
@@ -74,6 +74,12 @@ parser.add_argument("--gffID_to_hoverText", dest="gffID_to_hoverText", default=N
 
 parser.add_argument("--coverage_range", dest="coverage_range", default="0,2", type=str, help="A comma-sepparated string of the minimum and max coverage.")
 
+# tiled browser
+parser.add_argument("--browser_mode", dest="browser_mode", default="static", type=str, help="The type of browser. It can be 'static' (one .html with all the data, <outdir>/genome_variation_browser.html) or 'tiled' (for many samples or variants). In 'tiled' the variants, coverage and genes are counted (or averaged) in bins of several zoom levels and written as compressed tiles into <outdir>/genome_variation_browser_tiled, which are loaded as you zoom. Each variant is only drawn when you zoom into regions of less than --min_bin_size * --nbins_view / 4 bp. The tiled browser has to be opened through a local server (see --serve_port).")
+parser.add_argument("--min_bin_size", dest="min_bin_size", default=1000, type=int, help="In --browser_mode tiled, the size (in bp) of the finest bins. The coverage is calculated in the windows of this size that overlap the target regions or the drawn genes.")
+parser.add_argument("--nbins_view", dest="nbins_view", default=1000, type=int, help="In --browser_mode tiled, the maximum number of bins drawn for each sample and type of data at each zoom.")
+parser.add_argument("--serve_port", dest="serve_port", default=None, type=int, help="In --browser_mode tiled, serve the browser at http://localhost:<serve_port>/index.html after writing it (until it is interrupted). By default, it is not served, and you can serve it with any static http server (i.e. 'python -m http.server' from the browser folder).")
+
 opt = parser.parse_args()
 
 ##################
@@ -170,6 +176,10 @@ if opt.target_regions is None and opt.target_genes is None:
 # check that the fields are correct
 target_regions = target_regions[["chromosome", "start", "end"]]
 
+# add the genes overlapping the target regions (the bed starts are 0-based, and the gff coordinates are 1-based with both ends included)
+if opt.target_regions is not None:
+    for r in target_regions.itertuples(): target_genes.update(set(df_gff[(df_gff.chromosome.astype(str)==str(r.chromosome)) & (df_gff.start<=r.end) & (df_gff.end>=(r.start+1))].upmost_parent).intersection(all_genes))
+
 # check that all the genes are in the gff
 missing_genes = target_genes.difference(all_genes)
 if len(missing_genes)>0: raise ValueError("%s are missing genes"%missing_genes)
@@ -197,9 +207,20 @@ else: interesting_features = set(opt.interesting_features.split(","))
 min_cov, max_cov = [float(x) for x in opt.coverage_range.split(",")]
 
 # get the browser
-filename = "%s/genome_variation_browser.html"%opt.outdir
-gfun.get_genome_variation_browser(df, samples_colors_df, target_regions, target_genes, df_gff, filename, data_dir, opt.reference_genome, threads=opt.threads, sample_group_labels=opt.sample_group_labels.split(","), only_affected_genes=opt.only_affected_genes, vcf_fields_onHover=opt.vcf_fields_onHover, replace=opt.replace, mitochondrial_chromosome=opt.mitochondrial_chromosome, gff_annotation_fields=gff_annotation_fields, fraction_y_domain_by_gene_browser=opt.fraction_y_domain_by_gene_browser, interesting_features=interesting_features, min_cov=min_cov, max_cov=max_cov)
-print("genome variation browser was written into %s"%filename)
+if opt.browser_mode=="static":
+
+    filename = "%s/genome_variation_browser.html"%opt.outdir
+    gfun.get_genome_variation_browser(df, samples_colors_df, target_regions, target_genes, df_gff, filename, data_dir, opt.reference_genome, threads=opt.threads, sample_group_labels=opt.sample_group_labels.split(","), only_affected_genes=opt.only_affected_genes, vcf_fields_onHover=opt.vcf_fields_onHover, replace=opt.replace, mitochondrial_chromosome=opt.mitochondrial_chromosome, gff_annotation_fields=gff_annotation_fields, fraction_y_domain_by_gene_browser=opt.fraction_y_domain_by_gene_browser, interesting_features=interesting_features, min_cov=min_cov, max_cov=max_cov)
+    print("genome variation browser was written into %s"%filename)
+
+elif opt.browser_mode=="tiled":
+
+    browser_dir = "%s/genome_variation_browser_tiled"%opt.outdir
+    gfun.get_genome_variation_browser_tiled(df, samples_colors_df, target_regions, target_genes, df_gff, browser_dir, data_dir, opt.reference_genome, threads=opt.threads, only_affected_genes=opt.only_affected_genes, vcf_fields_onHover=opt.vcf_fields_onHover, replace=opt.replace, mitochondrial_chromosome=opt.mitochondrial_chromosome, gff_annotation_fields=gff_annotation_fields, fraction_y_domain_by_gene_browser=opt.fraction_y_domain_by_gene_browser, interesting_features=interesting_features, min_cov=min_cov, max_cov=max_cov, min_bin_size=opt.min_bin_size, nbins_view=opt.nbins_view)
+
+    if opt.serve_port is not None: gfun.serve_tiled_genome_browser(browser_dir, port=opt.serve_port)
+
+else: raise ValueError("%s is not a valid --browser_mode"%opt.browser_mode)
 
 
 
@@ -26,14 +26,18 @@ try:
     from math import ceil
     from Bio.Seq import Seq
     from Bio.SeqRecord import SeqRecord
+    from Bio import bgzf
     import pickle
     import cylowess 
     import itertools
+    import heapq
+    import hashlib
     import ast
     import copy as cp
     import re
     import logging
     import shutil
+    import mmap
     from datetime import date
     import multiprocessing as multiproc
     import scipy.stats
@@ -51,8 +55,10 @@ try:
     import urllib
     from subprocess import STDOUT, check_output
     import subprocess
+    from io import StringIO
     import subprocess, datetime, signal
     import json
+    import resource
     import sklearn
     import matplotlib.colors as mcolors
     import matplotlib.patches as mpatches
@@ -155,6 +161,9 @@ EnvDir = "/".join(sys.executable.split("/")[0:-2])
 CondaDir =  "/".join(sys.executable.split("/")[0:-4])
 EnvName = EnvDir.split("/")[-1]
 
+# define the bash used to run the cmds
+g_bash_executable = shutil.which("bash") or "/bin/bash"
+
 # define the R env name
 EnvName_R = "%s_R_env"%EnvName
 EnvName_gridss = "%s_gridss_env"%EnvName
@@ -253,7 +262,6 @@ perSVade_modules = "%s/perSVade"%CWD
 run_trimmomatic_and_fastqc_py = "%s/run_trimmomatic_and_fastqc.py"%CWD
 get_trimmed_reads_for_srr_py = "%s/get_trimmed_reads_for_srr.py"%CWD
 run_vep = "%s/run_vep.py"%CWD
-calculate_memory_py = "%s/calculate_memory.py"%CWD
 get_interestingTaxIDs_distanceToTarget_taxID_to_sciName_py = "%s/get_interestingTaxIDs_distanceToTarget_taxID_to_sciName.py"%CWD
 libraries_CONY = "%s/CONY_package_debugged.R"%CWD
 run_svim_and_sniffles_py = "%s/run_svim_and_sniffles.py"%CWD
@@ -415,6 +423,28 @@ g_filterName_to_filtersList = {"min_Nfragments":g_min_Nfragments_l, "min_af":g_m
 # map each value of each filter list to a value depending on the position
 g_filterName_to_filterValue_to_Number = {filterName : dict(zip(filtersList, range(len(filtersList)))) for filterName, filtersList in g_filterName_to_filtersList.items()}
 
+# map each of the terms of get_gridssDF_filtered to the filters that define it. This is used by the bitmask engine of the GRIDSS filtering (get_tupleBreakpoints_for_filters_GRIDSS_bitmask)
+g_gridssFilterTerm_to_filterNames = {"min_size":("min_size",),
+                                     "min_QUAL":("min_QUAL",),
+                                     "min_Nfragments":("min_Nfragments",),
+                                     "min_af":("min_af",),
+                                     "min_af_EitherSmallOrLargeEvent":("min_af_EitherSmallOrLargeEvent",),
+                                     "wrong_INFOtags":("wrong_INFOtags",),
+                                     "wrong_FILTERtags":("wrong_FILTERtags",),
+                                     "maximum_strand_bias":("maximum_strand_bias", "max_to_be_considered_small_event"),
+                                     "maximum_microhomology":("maximum_microhomology",),
+                                     "maximum_lenght_inexactHomology":("maximum_lenght_inexactHomology", "max_to_be_considered_small_event"),
+                                     "range_filt_DEL_breakpoints":("range_filt_DEL_breakpoints",),
+                                     "min_length_inversions":("min_length_inversions",),
+                                     "dif_between_insert_and_del":("dif_between_insert_and_del", "max_to_be_considered_small_event"),
+                                     "filter_polyGC":("filter_polyGC",),
+                                     "filter_noSplitReads":("filter_noSplitReads", "max_to_be_considered_small_event"),
+                                     "filter_noReadPairs":("filter_noReadPairs", "max_to_be_considered_small_event"),
+                                     "filter_overlappingRepeats":("filter_overlappingRepeats",)}
+
+# define the order in which the filters are searched in the tree of filter combinations (get_bpointTuple_to_filterDicts_GRIDSS_treeSearch). This is the same order as the brute force search
+g_gridss_sorted_filterNames_treeSearch = ["min_Nfragments", "min_af", "min_af_EitherSmallOrLargeEvent", "wrong_FILTERtags", "filter_polyGC", "filter_noSplitReads", "filter_noReadPairs", "maximum_strand_bias", "maximum_microhomology", "maximum_lenght_inexactHomology", "range_filt_DEL_breakpoints", "min_length_inversions", "dif_between_insert_and_del", "max_to_be_considered_small_event", "min_QUAL", "filter_overlappingRepeats"]
+
 # define the default window_l
 window_l = 10000
 
@@ -433,6 +463,15 @@ fractionRAM_to_dedicate = 0.5
 # define the fraction of memory available
 fraction_available_mem = None
 
+# the memory budget of the run, probed once (see get_memory_budget)
+g_memory_budget = None
+
+# the available threads of the run (see get_available_threads)
+g_available_threads_probe = None
+
+# the disk write throughput of each probed filesystem (see get_disk_write_throughput)
+g_disk_write_throughput_probes = {}
+
 # the minimum size of CNVs to be considered
 min_CNVsize_coverageBased = 300
 
@@ -660,39 +699,63 @@ def run_cmd_simple_noError(cmd):
         print("\nERROR!!! Out status: %i"%(out_stat))
         sys.exit(10)
 
-def run_cmd(cmd, env=EnvName):
+# process-level cache of the variables that each conda environment changes (see get_environ_changes_conda_env)
+g_env_to_environChanges = {}
 
-    """This function runs a cmd with a given env"""
+# variables of the shell that are not taken from the activated environments
+g_shell_specific_environ_vars = {"_", "SHLVL", "PWD", "OLDPWD"}
 
-    # append the command to log_file_all_cmds
-    if log_file_all_cmds is not None: open(log_file_all_cmds, "a").write("environment: %s; cmd: %s\n"%(env, cmd))
+def get_environ_changes_conda_env(env):
 
-    # define the cmds
-    SOURCE_CONDA_CMD = "source %s/etc/profile.d/conda.sh"%CondaDir
-    cmd_prefix = "%s && conda activate %s > /dev/null 2>&1 &&"%(SOURCE_CONDA_CMD, env)
+    """Takes a conda environment and returns a tuple (changed_vars, removed_vars), where changed_vars is a dict with the environment variables (like PATH) that are set when activating it and removed_vars a set with the ones that are unset. The activation is run only once per process and cached in g_env_to_environChanges."""
 
-    # define the cmd
-    cmd_to_run = "%s %s"%(cmd_prefix, cmd)
+    if env not in g_env_to_environChanges:
 
-    # define a tmpdir to write the bash scripts
-    if "PERSVADE_TMPDIR" in os.environ: tmpdir = os.environ["PERSVADE_TMPDIR"]
-    else: tmpdir = "%s/.perSVade_tmp"%(os.environ["HOME"])
-    make_folder(tmpdir)
+        # activate the environment and print all the variables
+        SOURCE_CONDA_CMD = "source %s/etc/profile.d/conda.sh"%CondaDir
+        activation_cmd = "%s && conda activate %s > /dev/null 2>&1 && env -0"%(SOURCE_CONDA_CMD, env)
+
+        try: env_output = subprocess.check_output(activation_cmd, shell=True, executable=g_bash_executable, env=dict(os.environ)).decode()
+        except subprocess.CalledProcessError: raise ValueError("The environment %s could not be activated with '%s'"%(env, activation_cmd))
+
+        activated_environ = dict([x.split("=", 1) for x in env_output.split("\0") if "=" in x])
+        activated_environ = {var : value for var, value in activated_environ.items() if var not in g_shell_specific_environ_vars}
+
+        # keep the changes
+        changed_vars = {var : value for var, value in activated_environ.items() if os.environ.get(var)!=value}
+        removed_vars = {var for var in os.environ if var not in activated_environ and var not in g_shell_specific_environ_vars}
+        g_env_to_environChanges[env] = (changed_vars, removed_vars)
 
-    # define a bash script to print the cmd and run
-    nchars = 15
-    already_existing_ids = {f.split(".sh")[0] for f in os.listdir(tmpdir) if len(f)==(nchars+3) and f.endswith(".sh")} # +3 for the ".sh"
-    bash_script = "%s/%s.sh"%(tmpdir, id_generator(size=nchars, already_existing_ids=already_existing_ids, chars=string.ascii_uppercase))
+    return g_env_to_environChanges[env]
 
-    # write the bash script
-    open(bash_script, "w").write(cmd_to_run+"\n")
+def get_environ_conda_env(env):
+
+    """Returns a dict with the environment variables needed to run cmds in the conda environment env, which are the current ones with the changes of get_environ_changes_conda_env"""
+
+    changed_vars, removed_vars = get_environ_changes_conda_env(env)
+
+    environ = {var : value for var, value in os.environ.items() if var not in removed_vars}
+    environ.update(changed_vars)
+
+    return environ
+
+def run_cmd(cmd, env=EnvName):
+
+    """This function runs a cmd with a given env. The cmd is run by bash through subprocess, with the environment variables of the activated env (resolved once per process). The cmd is written to log_file_all_cmds before running, and the time it took after it finished."""
+
+    # append the command to log_file_all_cmds
+    if log_file_all_cmds is not None: open(log_file_all_cmds, "a").write("environment: %s; cmd: %s\n"%(env, cmd))
+
+    # get the environment variables
+    environ = get_environ_conda_env(env)
 
     # run
-    out_stat = os.system("bash %s"%bash_script) 
-    if out_stat!=0: raise ValueError("\n%s\n did not finish correctly. Out status: %i"%(cmd_to_run, out_stat))
+    start_time = time.time()
+    out_stat = subprocess.call(cmd, shell=True, executable=g_bash_executable, env=environ)
+    if out_stat!=0: raise ValueError("\n%s\n did not finish correctly (environment %s). Out status: %i"%(cmd, env, out_stat))
 
-    # remove the script
-    run_cmd_simple("rm %s"%bash_script)
+    # log the time
+    if log_file_all_cmds is not None: open(log_file_all_cmds, "a").write("# time: %.3f seconds; environment: %s; cmd: %s\n"%(time.time()-start_time, env, cmd))
 
 def get_weigthed_median(df, field, weight_field, type_algorithm="fast"):
 
@@ -825,6 +888,168 @@ def delete_file_or_folder(f):
     if os.path.isdir(f): shutil.rmtree(f)
     if os.path.isfile(f): os.unlink(f)
 
+# process-level cache of the genome stores (see get_genome_store), keyed by (path, mtime) and with the last used at the end
+g_genome_store_cache = OrderedDict()
+g_genome_store_cache_maxsize = 8
+
+def get_fai_records_genome(genome):
+
+    """Takes a fasta and returns a list of tuples (chromosome, length, offset, linebases, linewidth), one for each sequence, as in a samtools .fai index. If <genome>.fai exists and is newer than genome it is loaded. Otherwise the index is built reading the fasta and written (in the same format as samtools faidx) into <genome>.fai, if possible. If the sequence lines of the fasta do not have a regular width (so that it can't be indexed) it returns None."""
+
+    # load a previously generated index
+    fai_file = "%s.fai"%genome
+    if not file_is_empty(fai_file) and os.path.getmtime(fai_file)>=os.path.getmtime(genome):
+
+        fai_records = []
+        for line in open(fai_file, "r"):
+            chrom, length, offset, linebases, linewidth = line.rstrip("\n").split("\t")[0:5]
+            fai_records.append((chrom, int(length), int(offset), int(linebases), int(linewidth)))
+
+        return fai_records
+
+    # build the index from the fasta
+    fai_records = []
+    chrom = None
+    position = 0
+
+    with open(genome, "rb") as f:
+        for line in f:
+
+            # a new sequence
+            if line.startswith(b">"):
+
+                if chrom is not None: fai_records.append((chrom, length, offset, linebases, linewidth))
+
+                header_fields = line[1:].decode().split()
+                if len(header_fields)>0: chrom = header_fields[0]
+                else: chrom = ""
+
+                length = 0
+                offset = position + len(line)
+                linebases = 0
+                linewidth = 0
+                previous_line_is_full = True
+
+            # sequence lines
+            elif chrom is not None:
+
+                nbases = len(line.rstrip(b"\r\n"))
+
+                if nbases>0:
+
+                    # only the last line of each sequence can be shorter
+                    if previous_line_is_full is False: return None
+
+                    # define the line width from the first line
+                    if linebases==0: 
+                        linebases = nbases
+                        linewidth = len(line)
+
+                    if nbases>linebases or len(line)-nbases>linewidth-linebases: return None
+                    previous_line_is_full = (nbases==linebases and len(line)==linewidth)
+
+                    length += nbases
+
+                else: previous_line_is_full = False
+
+            position += len(line)
+
+    if chrom is not None: fai_records.append((chrom, length, offset, linebases, linewidth))
+
+    # write the index (the genome folder may not be writable)
+    fai_file_tmp = "%s.%i.tmp"%(fai_file, os.getpid())
+    try:
+        with open(fai_file_tmp, "w") as fd: fd.write("".join(["%s\t%i\t%i\t%i\t%i\n"%r for r in fai_records]))
+        os.rename(fai_file_tmp, fai_file)
+
+    except OSError: remove_file(fai_file_tmp)
+
+    return fai_records
+
+def get_genome_store(genome):
+
+    """Takes a fasta and returns a dict that allows random access to its sequences (see fetch_genome_store), with the chromosome lengths (chrom_to_len, in the order of the fasta). The fasta is accessed through its .fai index and mmap, so that it is not parsed. Genomes that can't be indexed are loaded into memory. The stores are cached per process (keeping the last g_genome_store_cache_maxsize), and they are regenerated if the genome changes."""
+
+    # get from the cache
+    key = (os.path.realpath(genome), os.path.getmtime(genome))
+    if key in g_genome_store_cache: 
+        g_genome_store_cache.move_to_end(key)
+        return g_genome_store_cache[key]
+
+    # get the index
+    fai_records = get_fai_records_genome(genome)
+
+    # genomes that can't be indexed are kept in memory
+    if fai_records is None:
+
+        print_if_verbose("WARNING: %s has lines of irregular width, so that it can't be indexed. It will be loaded into memory"%genome)
+        chrom_to_seq = {seq.id : str(seq.seq) for seq in SeqIO.parse(genome, "fasta")}
+        genome_store = {"genome":genome, "chrom_to_len":{chrom : len(seq) for chrom, seq in chrom_to_seq.items()}, "chrom_to_seq":chrom_to_seq, "chrom_to_faiRecord":None, "mmap":None}
+
+    else:
+
+        # map the file into memory (empty files can't be mapped)
+        if os.path.getsize(genome)>0:
+            with open(genome, "rb") as f: genome_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        else: genome_mmap = None
+
+        genome_store = {"genome":genome, "chrom_to_len":{r[0] : r[1] for r in fai_records}, "chrom_to_seq":None, "chrom_to_faiRecord":{r[0] : r for r in fai_records}, "mmap":genome_mmap}
+
+    # keep in the cache, removing the least recently used
+    g_genome_store_cache[key] = genome_store
+    while len(g_genome_store_cache)>g_genome_store_cache_maxsize: g_genome_store_cache.popitem(last=False)
+
+    return genome_store
+
+def fetch_genome_store(genome, chrom, start=0, end=None):
+
+    """Returns a string with the sequence of chrom in genome between start and end (0-based, end not included, like slicing the sequence). If end is None it returns until the end of the chromosome."""
+
+    genome_store = get_genome_store(genome)
+
+    # define the region, within the chromosome
+    len_chrom = genome_store["chrom_to_len"][chrom]
+    if end is None or end>len_chrom: end = len_chrom
+    start = max([0, start])
+    if end<=start: return ""
+
+    # from the sequences in memory
+    if genome_store["chrom_to_seq"] is not None: return genome_store["chrom_to_seq"][chrom][start:end]
+
+    # from the mmap, removing the line breaks
+    chrom, length, offset, linebases, linewidth = genome_store["chrom_to_faiRecord"][chrom]
+    start_byte = offset + (start//linebases)*linewidth + start%linebases
+    end_byte = offset + (end//linebases)*linewidth + end%linebases
+
+    return genome_store["mmap"][start_byte:end_byte].replace(b"\n", b"").replace(b"\r", b"").decode()
+
+def get_chrom_to_len_genome_store(genome):
+
+    """Returns a dict that maps each chromosome of genome to its length, in the order of the fasta."""
+
+    return dict(get_genome_store(genome)["chrom_to_len"])
+
+def get_chrom_to_seq_genome_store(genome, chromosomes=None, upper=False):
+
+    """Returns a dict that maps each chromosome (all of them if chromosomes is None) to its sequence as a string, in the order of the fasta. upper indicates whether to convert the sequences to uppercase."""
+
+    chrom_to_seq = {}
+    for chrom in get_genome_store(genome)["chrom_to_len"]:
+        if chromosomes is not None and chrom not in chromosomes: continue
+
+        seq = fetch_genome_store(genome, chrom)
+        if upper is True: seq = seq.upper()
+        chrom_to_seq[chrom] = seq
+
+    return chrom_to_seq
+
+def get_seqRecords_genome_store(genome, chromosomes=None):
+
+    """Returns a list of SeqRecords (with only the IDs) for the chromosomes of genome (all of them if chromosomes is None), in the order of the fasta."""
+
+    return [SeqRecord(Seq(seq), id=chrom, name="", description="") for chrom, seq in get_chrom_to_seq_genome_store(genome, chromosomes=chromosomes).items()]
+
 def get_chr_to_len(genome, replace=False):
 
     chr_to_len_file = "%s.chr_to_len.py"%genome
@@ -835,7 +1060,7 @@ def get_chr_to_len(genome, replace=False):
         remove_file(chr_to_len_file_tmp)
 
         # define chromosome_to_length for a genome
-        chr_to_len = {seq.id: len(seq.seq) for seq in SeqIO.parse(genome, "fasta")}
+        chr_to_len = get_chrom_to_len_genome_store(genome)
 
         # save
         save_object(chr_to_len, chr_to_len_file_tmp)
@@ -903,7 +1128,7 @@ def extract_BEDofGENES_of_gff3(gff, bed, replace=False, reference=""):
     #### get the bed of the regions sorrounding the genes ####
 
     # map each chromosome to it's length
-    chromosome_to_lenght = {chrRec.id : len(str(chrRec.seq)) for chrRec in SeqIO.parse(reference, "fasta")}
+    chromosome_to_lenght = get_chrom_to_len_genome_store(reference)
 
     # define two functions that take the start and the end and return the left and right bounds of the gene +- window
     def get_left_bound_of_gene(start):
@@ -939,72 +1164,154 @@ def extract_BEDofGENES_of_gff3(gff, bed, replace=False, reference=""):
     # return for further usage
     return regions_filename
 
-def get_availableGbRAM(outdir):
+def get_meminfo_Gb():
 
-    """This function returns a float with the available memory in your system. psutil.virtual_memory().available/1e9 would yield the theoretically available memory.
+    """Returns a dict that maps each field of /proc/meminfo (i.e. MemTotal, MemAvailable) to its value in Gb. It is empty in systems without /proc/meminfo."""
 
-    fraction_available_mem is the fraction of the total memory available in the node (computer) that is dedicated to the run of perSVade.
+    meminfo = {}
+    if not os.path.isfile("/proc/meminfo"): return meminfo
 
-    # nord3. This does not work reliably
-    
-    elif "BSC_MACHINE" in os.environ and os.environ["BSC_MACHINE"]=="nord3":
+    for line in open("/proc/meminfo", "r").readlines():
+        fields = line.split()
+        if len(fields)==3 and fields[2]=="kB": meminfo[fields[0].rstrip(":")] = int(fields[1])*1024/1e9
 
-        # define the available threads
-        real_available_threads = get_available_threads(outdir)
+    return meminfo
 
-        # get thr ram considering that 1 node has 16 threads
-        availableGbRAM = available_mem*(int(real_available_threads)/16)
+def get_cgroup_memory_limit_and_usage_files():
 
-    """
+    """Returns a list of (limit_file, usage_file) tuples for the memory cgroups (v2 or v1) that this process belongs to, from the innermost to the root one. Only existing files are kept."""
 
-    # get the memory with psutil
-    available_mem = psutil.virtual_memory().available/1e9
+    if not os.path.isfile("/proc/self/cgroup"): return []
 
-    # define the fraction_total_running 
-    if fraction_available_mem is None:
+    # get the cgroup path of the memory controller (v1) or the unified hierarchy (v2)
+    cgroup_v1_path = None
+    cgroup_v2_path = None
+    for line in open("/proc/self/cgroup", "r").readlines():
+        hierarchy_ID, controllers, path = line.rstrip("\n").split(":", 2)
+        if hierarchy_ID=="0" and controllers=="": cgroup_v2_path = path
+        elif "memory" in controllers.split(","): cgroup_v1_path = path
 
-        # BSC machine
-        if str(subprocess.check_output("uname -a", shell=True)).startswith("b'Linux bscls063 4.12.14-lp150.12.48-default"): 
+    # define the candidate dirs (in containers the cgroup of the process is mounted as the root)
+    if cgroup_v1_path is not None: 
+        mount_dir = "/sys/fs/cgroup/memory"
+        cgroup_path = cgroup_v1_path
+        limit_fname, usage_fname = "memory.limit_in_bytes", "memory.usage_in_bytes"
 
-            availableGbRAM = available_mem
+    elif cgroup_v2_path is not None: 
+        mount_dir = "/sys/fs/cgroup"
+        cgroup_path = cgroup_v2_path
+        limit_fname, usage_fname = "memory.max", "memory.current"
 
+    else: return []
 
-        # MN4
-        #elif "BSC_MACHINE" in os.environ and os.environ["BSC_MACHINE"]=="mn4":
-        #
-        #    #availableGbRAM = available_mem*(int(os.environ["SLURM_CPUS_PER_TASK"])/48) # old way, now available_mem does not do it for the 
-        #    availableGbRAM = available_mem*(int(os.environ["SLURM_CPUS_PER_TASK"])/48)
+    # go from the cgroup of the process to the root
+    cgroup_dirs = []
+    path_fields = [x for x in cgroup_path.split("/") if x!=""]
+    for I in reversed(range(len(path_fields)+1)): cgroup_dirs.append("/".join([mount_dir] + path_fields[0:I]))
 
-        #    print(availableGbRAM)
+    limit_and_usage_files = []
+    for cgroup_dir in cgroup_dirs:
+        limit_file = "%s/%s"%(cgroup_dir, limit_fname)
+        usage_file = "%s/%s"%(cgroup_dir, usage_fname)
+        if os.path.isfile(limit_file) and os.path.isfile(usage_file): limit_and_usage_files.append((limit_file, usage_file))
 
-        #    dahdgahdgjghdag
+    return limit_and_usage_files
 
+def get_job_scheduler_memory_limit_Gb():
 
-        # In the docker container
-        #elif os.path.isfile("/.dockerenv"): 
+    """Returns a tuple (limit_Gb, source) with the memory requested to the job scheduler (SLURM or LSF), read from the environment variables of the job. It returns (None, None) if not running in a job with a memory request."""
 
-        # others. Calculate from filling the memory
-        else:
-            print_if_verbose("WARNING: calculating the available RAM by filling it. This may be dangerous.")
+    # SLURM (in Mb)
+    if "SLURM_MEM_PER_NODE" in os.environ: return (int(os.environ["SLURM_MEM_PER_NODE"])*1e6/1e9, "SLURM_MEM_PER_NODE")
 
-            # define a file where to calculate memory
-            calc_memory_file = "%s/calculating_memory.txt"%outdir
-            remove_file(calc_memory_file)
+    if "SLURM_MEM_PER_CPU" in os.environ:
+        for cpus_var in ["SLURM_CPUS_PER_TASK", "SLURM_CPUS_ON_NODE"]:
+            if cpus_var in os.environ: return (int(os.environ["SLURM_MEM_PER_CPU"])*int(os.environ[cpus_var])*1e6/1e9, "SLURM_MEM_PER_CPU*%s"%cpus_var)
 
-            # run the calculate memory
-            cmd_std = "%s.std"%calc_memory_file
-            try: run_cmd("%s --outfile %s > %s 2>&1"%(calculate_memory_py, calc_memory_file, cmd_std))
-            except: print_if_verbose("memory was calculated")
+        return (int(os.environ["SLURM_MEM_PER_CPU"])*1e6/1e9, "SLURM_MEM_PER_CPU")
 
-            # get from file
-            availableGbRAM = float(open(calc_memory_file, "r").readlines()[-1])
+    # LSF, from the rusage[mem=<n>] of the resource requirement (in the units of LSF_UNIT_FOR_LIMITS, Mb by default)
+    unit_to_Gb = {"KB":1e-6, "MB":1e-3, "GB":1.0, "TB":1e3}
+    for rsrcreq_var in ["LSB_EFFECTIVE_RSRCREQ", "LSB_SUB_RES_REQ"]:
+        if rsrcreq_var not in os.environ: continue
 
-            # at the end remove the file
-            remove_file(calc_memory_file)
-            remove_file(cmd_std)
+        match = re.search(r"rusage\[[^\]]*mem=([0-9\.]+)([KMGT]B)?", os.environ[rsrcreq_var], re.IGNORECASE)
+        if match is None: continue
 
-    else: availableGbRAM = available_mem*float(fraction_available_mem)
+        unit = (match.group(2) or os.environ.get("LSF_UNIT_FOR_LIMITS", "MB")).upper()
+        if unit not in unit_to_Gb: raise ValueError("Invalid LSF memory unit %s"%unit)
+        return (float(match.group(1))*unit_to_Gb[unit], rsrcreq_var)
+
+    return (None, None)
+
+def get_memory_budget():
 
+    """Returns a dict with the memory limit of this perSVade run, which is shared by all the steps that need to know the available RAM (through get_availableGbRAM). The limit is the lowest of the cgroup (v1 or v2), the job scheduler (SLURM or LSF) and the total memory (/proc/meminfo or psutil). It is probed once per process and cached in g_memory_budget."""
+
+    global g_memory_budget
+    if g_memory_budget is not None: return g_memory_budget
+
+    # the total memory
+    meminfo = get_meminfo_Gb()
+    if "MemTotal" in meminfo: source_to_limit_Gb = {"/proc/meminfo":meminfo["MemTotal"]}
+    else: source_to_limit_Gb = {"psutil":psutil.virtual_memory().total/1e9}
+    total_mem = min(source_to_limit_Gb.values())
+
+    # the cgroup limits. Unlimited cgroups have 'max' (v2) or a very high number (v1)
+    cgroup_usage_files = []
+    for limit_file, usage_file in get_cgroup_memory_limit_and_usage_files():
+
+        limit_str = open(limit_file, "r").read().strip()
+        if limit_str=="max": continue
+
+        limit_Gb = int(limit_str)/1e9
+        if limit_Gb>=total_mem: continue
+
+        source_to_limit_Gb[limit_file] = limit_Gb
+        cgroup_usage_files.append((limit_file, usage_file))
+
+    # the job scheduler limits
+    scheduler_limit_Gb, scheduler_source = get_job_scheduler_memory_limit_Gb()
+    if scheduler_limit_Gb is not None: source_to_limit_Gb[scheduler_source] = scheduler_limit_Gb
+
+    # get the budget
+    limit_source = min(source_to_limit_Gb, key=source_to_limit_Gb.get)
+    g_memory_budget = {"limit_Gb":source_to_limit_Gb[limit_source], "limit_source":limit_source, "source_to_limit_Gb":source_to_limit_Gb, "cgroup_usage_files":cgroup_usage_files}
+    print_if_verbose("The memory budget of this run is %.3f Gb (from %s)"%(g_memory_budget["limit_Gb"], limit_source))
+
+    return g_memory_budget
+
+def get_node_availableGbRAM():
+
+    """Returns the memory available in the whole node (MemAvailable of /proc/meminfo or psutil), regardless of the memory budget. This is what fraction_available_mem is applied to in get_availableGbRAM"""
+
+    meminfo = get_meminfo_Gb()
+    if "MemAvailable" in meminfo: return meminfo["MemAvailable"]
+    else: return psutil.virtual_memory().available/1e9
+
+def get_availableGbRAM(outdir):
+
+    """This function returns a float with the available memory in your system. psutil.virtual_memory().available/1e9 (or MemAvailable in /proc/meminfo) would yield the theoretically available memory.
+
+    fraction_available_mem is the fraction of the total memory available in the node (computer) that is dedicated to the run of perSVade.
+
+    If fraction_available_mem is None the available memory is bound by the memory budget (see get_memory_budget), substracting the current usage of the limiting cgroups. It only reads small files, so that it can be called at each step. outdir is kept for compatibility."""
+
+    # get the available memory in the node
+    available_mem = get_node_availableGbRAM()
+
+    # define the fraction_total_running 
+    if fraction_available_mem is None:
+
+        memory_budget = get_memory_budget()
+
+        # bound by the budget and by the memory that is not used in each limiting cgroup
+        availableGbRAM = min([available_mem, memory_budget["limit_Gb"]])
+        for limit_file, usage_file in memory_budget["cgroup_usage_files"]: availableGbRAM = min([availableGbRAM, memory_budget["source_to_limit_Gb"][limit_file] - int(open(usage_file, "r").read().strip())/1e9])
+
+        availableGbRAM = max([availableGbRAM, 0.0])
+
+    else: availableGbRAM = available_mem*float(fraction_available_mem)
 
     return availableGbRAM
 
@@ -1074,9 +1381,66 @@ def get_sorted_bam_test(r1, r2, ref_genome, replace=False):
     return sorted_bam
 
 
+def get_cpu_quota_cgroup():
+
+    """Returns the number of cpus allowed by the cpu quota of the cgroup of this process (cpu.max in cgroup v2 or cpu.cfs_quota_us in v1), rounded up. It returns None if there is no quota."""
+
+    if not os.path.isfile("/proc/self/cgroup"): return None
+
+    # get the quota and period files
+    quota_period_files = []
+    for line in open("/proc/self/cgroup", "r").readlines():
+        hierarchy_ID, controllers, path = line.rstrip("\n").split(":", 2)
+
+        if hierarchy_ID=="0" and controllers=="": 
+            for cgroup_dir in ["/sys/fs/cgroup%s"%path.rstrip("/"), "/sys/fs/cgroup"]: quota_period_files.append(("%s/cpu.max"%cgroup_dir, None))
+
+        elif "cpu" in controllers.split(","):
+            for cgroup_dir in ["/sys/fs/cgroup/%s%s"%(controllers, path.rstrip("/")), "/sys/fs/cgroup/cpu,cpuacct%s"%path.rstrip("/"), "/sys/fs/cgroup/cpu%s"%path.rstrip("/"), "/sys/fs/cgroup/cpu"]: quota_period_files.append(("%s/cpu.cfs_quota_us"%cgroup_dir, "%s/cpu.cfs_period_us"%cgroup_dir))
+
+    # get the quota of the first existing file
+    for quota_file, period_file in quota_period_files:
+        if not os.path.isfile(quota_file): continue
+
+        # v2 has '<quota> <period>' and v1 has the quota and period in different files ('max' or -1 mean no quota)
+        if period_file is None: quota, period = open(quota_file, "r").read().split()
+        elif os.path.isfile(period_file): quota, period = open(quota_file, "r").read().strip(), open(period_file, "r").read().strip()
+        else: continue
+
+        if quota in {"max", "-1"}: return None
+        return max([1, int(ceil(int(quota)/int(period)))])
+
+    return None
+
+def get_available_threads_probe_key():
+
+    """Returns a tuple with the host and job ID of this process, which define whether a probe of the available threads can be reused"""
+
+    return (os.uname()[1], os.environ.get("SLURM_JOB_ID", os.environ.get("LSB_JOBID", None)))
+
+def get_available_threads_probe():
+
+    """Returns a dict with the available threads of this process (available_threads), as the lowest of the cpu affinity (os.sched_getaffinity), the cgroup cpu quota and the threads requested to the job scheduler (SLURM or LSF). It also has the key of the probe (hostname and job ID), to validate cached probes."""
+
+    # the cpus where this process can run
+    if hasattr(os, "sched_getaffinity"): source_to_threads = {"sched_getaffinity":len(os.sched_getaffinity(0))}
+    else: source_to_threads = {"cpu_count":multiproc.cpu_count()}
+
+    # the cgroup quota
+    cgroup_threads = get_cpu_quota_cgroup()
+    if cgroup_threads is not None: source_to_threads["cgroup_cpu_quota"] = cgroup_threads
+
+    # the job scheduler
+    for threads_var in ["SLURM_CPUS_PER_TASK", "LSB_DJOB_NUMPROC"]:
+        if threads_var in os.environ: source_to_threads[threads_var] = int(os.environ[threads_var])
+
+    threads_source = min(source_to_threads, key=source_to_threads.get)
+
+    return {"available_threads":source_to_threads[threads_source], "threads_source":threads_source, "source_to_threads":source_to_threads, "probe_key":get_available_threads_probe_key()}
+
 def get_available_threads(outdir):
 
-    """Returns the avilable number of threads by runnning GATK. It runs gatk on a dummy genome and returns the really available number of threads  
+    """Returns the avilable number of threads. Outside the BSC machines they are calculated with get_available_threads_probe, which is cached in <outdir>/available_threads_probe.py (and for the process), so that it is reused by all modules running in outdir. Cached probes from another host or job are discarded.
 
     # Nord3 non interactive nodes
     elif "BSC_MACHINE" in os.environ and os.environ["BSC_MACHINE"]=="nord3" and "LSB_MCPU_HOSTS" in os.environ:
@@ -1085,6 +1449,8 @@ def get_available_threads(outdir):
 
     """
 
+    global g_available_threads_probe
+
     # MN4, MN5
     if "BSC_MACHINE" in os.environ and os.environ["BSC_MACHINE"] in {"mn4", "mn5"}:
         available_threads = int(os.environ["SLURM_CPUS_PER_TASK"])
@@ -1099,49 +1465,49 @@ def get_available_threads(outdir):
 
         available_threads = 4
 
-    # others. Calculate by running GATK
+    # others. Calculate from the affinity, cgroup and job scheduler
     else:
 
-        # redefnie the outdir under outdir
-        outdir = "%s/getting_available_threads"%(outdir)
-        delete_folder(outdir)
-        make_folder(outdir)
+        # load the cached probe
+        probe_file = "%s/available_threads_probe.py"%outdir
+        if g_available_threads_probe is None and not file_is_empty(probe_file): g_available_threads_probe = load_object(probe_file)
 
-        # define a genome that has one chromosome
-        genome = "%s/genome.fasta"%outdir
-        genome_obj = SeqRecord(Seq("ACTGCGATCGACTCGATCGATGAGAGAGAGGACTCTCAACAG"*10), id="chromosomeX")
-        SeqIO.write([genome_obj], genome, "fasta")
+        # get the probe if it is not valid
+        if g_available_threads_probe is None or g_available_threads_probe["probe_key"]!=get_available_threads_probe_key(): 
+            g_available_threads_probe = get_available_threads_probe()
+            print_if_verbose("there are %i available threads in this run (from %s)"%(g_available_threads_probe["available_threads"], g_available_threads_probe["threads_source"]))
 
-        # get some simulated reads
-        reads1, reads2 = simulate_testing_reads_on_genome(genome, window_l=75, npairs=1000, read_length=50, median_insert_size=15, median_insert_size_sd=5, threads=4, replace=False)
+        # save into outdir (also if the cached probe is from another host or job)
+        if os.path.isdir(outdir) and (file_is_empty(probe_file) or load_object(probe_file)["probe_key"]!=get_available_threads_probe_key()):
+            probe_file_tmp = "%s.tmp"%probe_file
+            save_object(g_available_threads_probe, probe_file_tmp)
+            os.rename(probe_file_tmp, probe_file)
 
-        # get a sorted bam
-        sorted_bam = get_sorted_bam_test(reads1, reads2, genome, replace=False)
+        available_threads = g_available_threads_probe["available_threads"]
 
-        # create the files
-        create_sequence_dict(genome, replace=False)
+    return available_threads
 
-        # run GATK HC 
-        gatk_out = "%s/output_HC.vcf"%outdir
-        gatk_std = "%s.running.std"%gatk_out
+def get_cpu_time_self_and_children():
 
-        gatk_cmd = "%s HaplotypeCaller -R %s -I %s -O %s -ploidy %i --genotyping-mode DISCOVERY --emit-ref-confidence NONE --stand-call-conf 30 --native-pair-hmm-threads %i > %s 2>&1"%(gatk, genome, sorted_bam, gatk_out, 1, 100000000, gatk_std)
+    """Returns the cpu time (user and system, in seconds) spent by this process and its finished children"""
 
-        run_cmd(gatk_cmd)
+    return sum([r.ru_utime + r.ru_stime for r in [resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)]])
 
-        # get the available threads
-        threads_lines = [l for l in open(gatk_std, "r").readlines() if "IntelPairHmm - Using" in l and "available threads, but" in l and "were requested" in l]
-        if len(threads_lines)!=1: raise ValueError("the threads were not properly calculated")
+def record_threads_used_stage(outdir, stage, requested_threads, start_time, end_time, start_cpu_time):
 
-        available_threads = int(threads_lines[0].split("IntelPairHmm - Using ")[1].split("available threads")[0])
+    """Appends to <outdir>/threads_per_stage.tab the threads that were used by a stage (of this process), to tune the threads of each stage. The used_threads are the cpu time (since start_cpu_time, see get_cpu_time_self_and_children) divided by the wall time."""
 
-        # print
-        print_if_verbose("there are %i available threads in this run"%available_threads)
+    threads_file = "%s/threads_per_stage.tab"%outdir
+    fields = ["stage", "requested_threads", "available_threads", "wall_time_s", "cpu_time_s", "used_threads"]
 
-        # remove the outdir
-        delete_folder(outdir)
+    # get the stats
+    wall_time = max([end_time-start_time, 1e-6])
+    cpu_time = get_cpu_time_self_and_children() - start_cpu_time
+    if requested_threads is None: requested_threads = -1
 
-    return available_threads
+    # write
+    if file_is_empty(threads_file): open(threads_file, "w").write("\t".join(fields) + "\n")
+    open(threads_file, "a").write("%s\t%i\t%i\t%.3f\t%.3f\t%.3f\n"%(stage, requested_threads, get_available_threads(outdir), wall_time, cpu_time, cpu_time/wall_time))
 
 def write_coverage_per_gene_mosdepth_and_parallel(sorted_bam, reference_genome, cnv_outdir, bed, gene_to_coverage_file, replace=False, threads=4):
 
@@ -1292,9 +1658,136 @@ def check_sorted_bam_has_correct_insert_sizes(input_sorted_bam, replace, threads
     # clean
     delete_folder(workdir)
 
-def run_bwa_mem(fastq1, fastq2, ref, outdir, bamfile, sorted_bam, index_bam, name_sample, threads=1, replace=False, MarkDuplicates=True, tmpdir_writingFiles=None):
+def get_disk_write_throughput(outdir, probe_size=64*1024*1024):
+
+    """Returns the write throughput (bytes per second) of the disk under outdir, measured by writing (and syncing) a probe file of probe_size bytes. The measure is cached in <outdir>/disk_write_throughput_probe.py (and for the process), and it is only repeated for another host or filesystem (device) of outdir."""
+
+    # get the cached probe
+    probe_key = (os.uname()[1], os.stat(outdir).st_dev)
+    cached_probe_file = "%s/disk_write_throughput_probe.py"%outdir
+    if probe_key in g_disk_write_throughput_probes: return g_disk_write_throughput_probes[probe_key]
+
+    if not file_is_empty(cached_probe_file):
+        cached_probe = load_object(cached_probe_file)
+        if cached_probe["probe_key"]==probe_key: 
+            g_disk_write_throughput_probes[probe_key] = cached_probe["disk_write_throughput"]
+            return cached_probe["disk_write_throughput"]
+
+    # measure
+    probe_file = "%s/disk_throughput_probe.%s.tmp"%(outdir, id_generator())
+    block = b"\0"*(1024*1024)
+
+    start_time = time.time()
+    with open(probe_file, "wb") as fd:
+        for I in range(int(probe_size/len(block))): fd.write(block)
+        fd.flush()
+        os.fsync(fd.fileno())
+
+    elapsed_time = max(time.time()-start_time, 1e-6)
+    remove_file(probe_file)
+
+    # save
+    g_disk_write_throughput_probes[probe_key] = probe_size/elapsed_time
+    cached_probe_file_tmp = "%s.tmp"%cached_probe_file
+    save_object({"probe_key":probe_key, "disk_write_throughput":probe_size/elapsed_time}, cached_probe_file_tmp)
+    os.rename(cached_probe_file_tmp, cached_probe_file)
+
+    return probe_size/elapsed_time
+
+def run_bwa_mem_streaming(fastq1, fastq2, ref, outdir, sorted_bam, name_sample, threads=1, MarkDuplicates=True, tmpdir_writingFiles=None):
+
+    """Generates sorted_bam from the reads streaming the bwa mem output through BAM encoding, duplicate marking and sorting, without writing the intermediate sam and bams to disk. The stages are connected with pipes, and named FIFOs count the bytes streamed out of each stage. Note that duplicate marking is done with samtools fixmate and markdup (which needs a coordinate-sorted input), because MarkDuplicatesSpark and picard MarkDuplicates need to read a file. The final bam is written into sorted_bam.tmp and renamed once it is checked, so that failed runs are restarted from the reads. It writes <sorted_bam>.streaming_alignment_stats.tab with the I/O bytes and the estimated wall time saved in each stage."""
+
+    print_if_verbose("running streaming alignment")
+
+    # define the tmpdir, which has the FIFOs, the stds and the samtools sort temporary files
+    if tmpdir_writingFiles is None: streaming_dir = "%s.streaming_alignment_tmp"%sorted_bam
+    else: streaming_dir = get_new_tmpdir(tmpdir_writingFiles)
+
+    delete_folder("%s.streaming_alignment_tmp"%sorted_bam)
+    delete_folder(streaming_dir)
+    make_folder(streaming_dir)
+
+    # remove the files of previous (failed) runs
+    sorted_bam_tmp = "%s.tmp"%sorted_bam
+    remove_file(sorted_bam_tmp)
+
+    # define the RAM per core
+    allocated_ram = get_availableGbRAM(get_dir(sorted_bam))*fractionRAM_to_dedicate
+    max_MbRAM_per_thread = int((allocated_ram/threads)*1000)
+
+    # define the stages, as (stage, cmd, the intermediate file of the file-based alignment that is not written). Each stage reads from the previous one
+    stages = [("bwa_mem", '%s mem -R "@RG\\tID:%s\\tSM:%s" -t %i %s %s %s'%(bwa, name_sample, name_sample, threads, ref, fastq1, fastq2), "aligned_reads.sam")]
+
+    if MarkDuplicates is True: 
+        stages += [("fixmate", "%s fixmate -m -O bam,level=0 -@ %i - -"%(samtools, threads), "aligned_reads.bam"),
+                   ("sort", "%s sort -l 0 --threads %i -m %iM -T %s/sort_tmp -o - -"%(samtools, threads, max_MbRAM_per_thread, streaming_dir), "aligned_reads.bam.MarkDups.bam"),
+                   ("markdup", "%s markdup -s -@ %i - %s"%(samtools, threads, sorted_bam_tmp), None)]
+
+    else: stages += [("sort", "%s sort --threads %i -m %iM -T %s/sort_tmp -o %s -"%(samtools, threads, max_MbRAM_per_thread, streaming_dir, sorted_bam_tmp), None)]
+
+    # define the cmd. Each stage writes its stderr and the time when it finished, and the stdout of the stages is copied into a FIFO that is counted
+    counting_cmds = []
+    pipeline_cmds = []
+    for stage, cmd, intermediate_file in stages:
+
+        stage_std = "%s/%s.stderr"%(streaming_dir, stage)
+        stage_cmd = "{ %s 2>%s && date +%%s.%%N > %s/%s.end_time; }"%(cmd, stage_std, streaming_dir, stage)
+
+        if intermediate_file is not None:
+
+            fifo = "%s/%s.fifo"%(streaming_dir, stage)
+            os.mkfifo(fifo)
+            counting_cmds.append("wc -c < %s > %s/%s.streamed_bytes &"%(fifo, streaming_dir, stage))
+            stage_cmd += " | tee %s"%fifo
+
+        pipeline_cmds.append(stage_cmd)
+
+    streaming_cmd = "set -o pipefail; %s %s; exit_status=$?; wait; exit $exit_status"%(" ".join(counting_cmds), " | ".join(pipeline_cmds))
+
+    # run
+    print_if_verbose("running streaming alignment through %s. The stds are in %s"%(" | ".join([x[0] for x in stages]), streaming_dir))
+    start_time = time.time()
+    run_cmd(streaming_cmd)
+    pipeline_time = time.time() - start_time
+
+    # check that the sorted bam has correct insert sizes
+    check_sorted_bam_has_correct_insert_sizes(sorted_bam_tmp, False, threads)
+
+    # get the stats of each stage. The time saved is estimated as that of writing and reading back the not written intermediate file
+    disk_write_throughput = get_disk_write_throughput(get_dir(sorted_bam))
+
+    stats_dicts = []
+    for stage, cmd, intermediate_file in stages:
+
+        stage_time = float(open("%s/%s.end_time"%(streaming_dir, stage), "r").readlines()[0].strip()) - start_time
+
+        if intermediate_file is not None: streamed_bytes = int(open("%s/%s.streamed_bytes"%(streaming_dir, stage), "r").readlines()[0].strip())
+        else: streamed_bytes = 0
+
+        saved_IO_bytes = 2*streamed_bytes
+        saved_time = saved_IO_bytes/disk_write_throughput
+        stats_dicts.append({"stage":stage, "not_written_file":intermediate_file, "streamed_bytes":streamed_bytes, "saved_IO_bytes":saved_IO_bytes, "estimated_saved_time":saved_time, "end_time":stage_time})
+
+        if intermediate_file is not None: print_if_verbose("stage %s finished after %.2fs. It streamed %.3fGb instead of writing %s, saving %.3fGb of I/O and ~%.2fs"%(stage, stage_time, streamed_bytes/1e9, intermediate_file, saved_IO_bytes/1e9, saved_time))
+
+    df_stats = pd.DataFrame(stats_dicts)[["stage", "not_written_file", "streamed_bytes", "saved_IO_bytes", "estimated_saved_time", "end_time"]]
+    print_if_verbose("the streaming alignment took %.2fs, saving %.3fGb of I/O and ~%.2fs"%(pipeline_time, sum(df_stats.saved_IO_bytes)/1e9, sum(df_stats.estimated_saved_time)))
+
+    stats_file = "%s.streaming_alignment_stats.tab"%sorted_bam
+    stats_file_tmp = "%s.tmp"%stats_file
+    df_stats.to_csv(stats_file_tmp, sep="\t", index=False, header=True)
+    os.rename(stats_file_tmp, stats_file)
+
+    # clean
+    delete_folder(streaming_dir)
+
+    # keep
+    os.rename(sorted_bam_tmp, sorted_bam)
+
+def run_bwa_mem(fastq1, fastq2, ref, outdir, bamfile, sorted_bam, index_bam, name_sample, threads=1, replace=False, MarkDuplicates=True, tmpdir_writingFiles=None, streaming_alignment=False):
 
-    """Takes a set of files and runs bwa mem getting sorted_bam and index_bam. skip_MarkingDuplicates will not mark duplicates"""
+    """Takes a set of files and runs bwa mem getting sorted_bam and index_bam. skip_MarkingDuplicates will not mark duplicates. If streaming_alignment is True the alignment, duplicate marking and sorting are streamed without intermediate files (see run_bwa_mem_streaming)."""
 
 
     if file_is_empty(sorted_bam) or replace is True:
@@ -1321,69 +1814,75 @@ def run_bwa_mem(fastq1, fastq2, ref, outdir, bamfile, sorted_bam, index_bam, nam
             os.unlink(branch_ref)
             os.unlink(indexFasta_std)
 
-        #BWA MEM --> get .sam
-        samfile = "%s/aligned_reads.sam"%outdir;
-        if (file_is_empty(samfile) and file_is_empty(bamfile)) or replace is True:
+        # streaming alignment, which does not write the intermediate sam and bams
+        if streaming_alignment is True: run_bwa_mem_streaming(fastq1, fastq2, ref, outdir, sorted_bam, name_sample, threads=threads, MarkDuplicates=MarkDuplicates, tmpdir_writingFiles=tmpdir_writingFiles)
 
-            # define the samfile_tmp
-            samfile_tmp = "%s.tmp"%samfile
+        # file-based alignment
+        else:
 
-            bwa_mem_stderr = "%s.tmp.stderr"%samfile
-            print_if_verbose("running bwa mem. The std is in %s"%bwa_mem_stderr)
-            cmd_bwa = '%s mem -R "@RG\\tID:%s\\tSM:%s" -t %i %s %s %s > %s 2>%s'%(bwa, name_sample, name_sample, threads, ref, fastq1, fastq2, samfile_tmp, bwa_mem_stderr); run_cmd(cmd_bwa)
+            #BWA MEM --> get .sam
+            samfile = "%s/aligned_reads.sam"%outdir;
+            if (file_is_empty(samfile) and file_is_empty(bamfile)) or replace is True:
 
-            remove_file(bwa_mem_stderr)
-            os.rename(samfile_tmp , samfile)
+                # define the samfile_tmp
+                samfile_tmp = "%s.tmp"%samfile
 
-        # convert to bam 
-        if file_is_empty(bamfile) or replace is True:
+                bwa_mem_stderr = "%s.tmp.stderr"%samfile
+                print_if_verbose("running bwa mem. The std is in %s"%bwa_mem_stderr)
+                cmd_bwa = '%s mem -R "@RG\\tID:%s\\tSM:%s" -t %i %s %s %s > %s 2>%s'%(bwa, name_sample, name_sample, threads, ref, fastq1, fastq2, samfile_tmp, bwa_mem_stderr); run_cmd(cmd_bwa)
 
-            # define the temporary file
-            bamfile_tmp = "%s.tmp"%bamfile
+                remove_file(bwa_mem_stderr)
+                os.rename(samfile_tmp , samfile)
 
-            bamconversion_stderr = "%s.tmp.stderr"%bamfile
-            print_if_verbose("Converting to bam. The std is in %s"%bamconversion_stderr)
-            cmd_toBAM = "%s view --threads %i -Sbu %s > %s 2>%s"%(samtools, threads, samfile, bamfile_tmp, bamconversion_stderr); run_cmd(cmd_toBAM)
+            # convert to bam 
+            if file_is_empty(bamfile) or replace is True:
 
-            # remove the sam
-            os.unlink(samfile)
-            remove_file(bamconversion_stderr)
-            os.rename(bamfile_tmp , bamfile)
+                # define the temporary file
+                bamfile_tmp = "%s.tmp"%bamfile
 
+                bamconversion_stderr = "%s.tmp.stderr"%bamfile
+                print_if_verbose("Converting to bam. The std is in %s"%bamconversion_stderr)
+                cmd_toBAM = "%s view --threads %i -Sbu %s > %s 2>%s"%(samtools, threads, samfile, bamfile_tmp, bamconversion_stderr); run_cmd(cmd_toBAM)
 
-        if MarkDuplicates is True:
-            bamfile_MarkedDuplicates = get_bam_with_duplicatesMarkedSpark(bamfile, threads=threads, replace=replace, tmpdir_writingFiles=tmpdir_writingFiles)
+                # remove the sam
+                os.unlink(samfile)
+                remove_file(bamconversion_stderr)
+                os.rename(bamfile_tmp , bamfile)
 
-        else: bamfile_MarkedDuplicates = bamfile
 
-        if file_is_empty(sorted_bam) or replace is True:
-            print_if_verbose("Sorting bam")
+            if MarkDuplicates is True:
+                bamfile_MarkedDuplicates = get_bam_with_duplicatesMarkedSpark(bamfile, threads=threads, replace=replace, tmpdir_writingFiles=tmpdir_writingFiles)
 
-            # define the RAM per core
-            allocated_ram = get_availableGbRAM(get_dir(sorted_bam))*fractionRAM_to_dedicate
-            max_MbRAM_per_thread = int((allocated_ram/threads)*1000)
+            else: bamfile_MarkedDuplicates = bamfile
 
-            # remove all temporary files generated previously in samtools sort (they'd make a new sort to be an error)
-            for outdir_file in os.listdir(outdir): 
-                fullfilepath = "%s/%s"%(outdir, outdir_file)
-                if outdir_file.startswith("aligned_reads") and ".tmp." in outdir_file: delete_file_or_folder(fullfilepath)
+            if file_is_empty(sorted_bam) or replace is True:
+                print_if_verbose("Sorting bam")
 
-            # define the temporary file
-            sorted_bam_tmp = "%s.tmp"%sorted_bam
+                # define the RAM per core
+                allocated_ram = get_availableGbRAM(get_dir(sorted_bam))*fractionRAM_to_dedicate
+                max_MbRAM_per_thread = int((allocated_ram/threads)*1000)
 
-            # sort
-            bam_sort_std = "%s.generating.txt"%sorted_bam
-            print_if_verbose("the sorting bam std is in %s. Running on %i threads and %iMb RAM/thread"%(bam_sort_std, threads, max_MbRAM_per_thread))
-            cmd_sort = "%s sort --threads %i -m %iM -o %s %s > %s 2>&1"%(samtools, threads, max_MbRAM_per_thread, sorted_bam_tmp, bamfile_MarkedDuplicates, bam_sort_std); run_cmd(cmd_sort)
+                # remove all temporary files generated previously in samtools sort (they'd make a new sort to be an error)
+                for outdir_file in os.listdir(outdir): 
+                    fullfilepath = "%s/%s"%(outdir, outdir_file)
+                    if outdir_file.startswith("aligned_reads") and ".tmp." in outdir_file: delete_file_or_folder(fullfilepath)
 
-            # check that the sorted bam has correct insert sizes
-            check_sorted_bam_has_correct_insert_sizes(sorted_bam_tmp, replace, threads)
+                # define the temporary file
+                sorted_bam_tmp = "%s.tmp"%sorted_bam
 
-            # remove files
-            for f in [bam_sort_std, bamfile_MarkedDuplicates, bamfile]: remove_file(f)
+                # sort
+                bam_sort_std = "%s.generating.txt"%sorted_bam
+                print_if_verbose("the sorting bam std is in %s. Running on %i threads and %iMb RAM/thread"%(bam_sort_std, threads, max_MbRAM_per_thread))
+                cmd_sort = "%s sort --threads %i -m %iM -o %s %s > %s 2>&1"%(samtools, threads, max_MbRAM_per_thread, sorted_bam_tmp, bamfile_MarkedDuplicates, bam_sort_std); run_cmd(cmd_sort)
 
-            # rename
-            os.rename(sorted_bam_tmp, sorted_bam)
+                # check that the sorted bam has correct insert sizes
+                check_sorted_bam_has_correct_insert_sizes(sorted_bam_tmp, replace, threads)
+
+                # remove files
+                for f in [bam_sort_std, bamfile_MarkedDuplicates, bamfile]: remove_file(f)
+
+                # rename
+                os.rename(sorted_bam_tmp, sorted_bam)
 
     if file_is_empty(index_bam) or replace is True:
 
@@ -1935,7 +2434,7 @@ def rewrite_translocations_uniformizedFormat_simulateSV(translocations_file, ref
     remove_file(copying_translocations_std)
 
     # define chromosome_to_length
-    chr_to_len = {seq.id: len(seq.seq) for seq in SeqIO.parse(reference_genome, "fasta")}
+    chr_to_len = get_chrom_to_len_genome_store(reference_genome)
 
     # load translocations
     df = pd.read_csv(translocations_file, sep="\t")
@@ -2038,11 +2537,11 @@ def transform_cut_and_paste_to_copy_and_paste_insertions(reference_genome, rearr
             if not file_is_empty(rearranged_genome_unmodified_tmp): os.rename(rearranged_genome_unmodified_tmp, rearranged_genome)
 
             # get the rearranged genome seq
-            chr_to_rearrangedSeq = {seq.id: str(seq.seq).upper() for seq in SeqIO.parse(rearranged_genome, "fasta")}
+            chr_to_rearrangedSeq = get_chrom_to_seq_genome_store(rearranged_genome, upper=True)
             all_rearranged_chromosomes_together = "".join(chr_to_rearrangedSeq.values())
 
             # get the seq
-            chr_to_refSeq = {seq.id: str(seq.seq).upper()  for seq in SeqIO.parse(reference_genome, "fasta")}
+            chr_to_refSeq = get_chrom_to_seq_genome_store(reference_genome, upper=True)
 
             # define the length of each chrom
             chr_to_lenSeq = {chrom : len(seq) for chrom, seq in chr_to_refSeq.items()}
@@ -2191,11 +2690,11 @@ def get_svDF_in_coords_of_rearranged_genome(svDF, reference_genome, rearranged_g
     if len(svDF)==0: return svDF
 
     # get the rearranged genome seq
-    chr_to_rearrangedSeq = {seq.id: str(seq.seq).upper() for seq in SeqIO.parse(rearranged_genome, "fasta")}
+    chr_to_rearrangedSeq = get_chrom_to_seq_genome_store(rearranged_genome, upper=True)
     #all_rearranged_chromosomes_together = "".join(chr_to_rearrangedSeq.values())
 
     # get the seq
-    chr_to_refSeq = {seq.id: str(seq.seq).upper() for seq in SeqIO.parse(reference_genome, "fasta")}
+    chr_to_refSeq = get_chrom_to_seq_genome_store(reference_genome, upper=True)
 
     # define the length of each chrom
     chr_to_ref_lenSeq = {chrom : len(seq) for chrom, seq in chr_to_refSeq.items()}
@@ -2885,13 +3384,13 @@ def simulate_SVs_in_genome(reference_genome, mitochondrial_chromosome, outdir, n
     final_svtype_to_svDF = {svtype : pd.DataFrame() for svtype in svtypes}
 
     # define the different types of chromosomes. Note that the mtDNA chromosomes will be simulated appart
-    all_chromosomes = {s.id for s in SeqIO.parse(reference_genome, "fasta")}
+    all_chromosomes = set(get_chrom_to_len_genome_store(reference_genome))
     if mitochondrial_chromosome!="no_mitochondria": mtDNA_chromosomes = set(mitochondrial_chromosome.split(","))
     else: mtDNA_chromosomes = set()
     gDNA_chromosomes = all_chromosomes.difference(mtDNA_chromosomes)
 
     # map the chromosome to the length
-    chrom_to_len = {s.id : len(s.seq) for s in SeqIO.parse(reference_genome, "fasta")}
+    chrom_to_len = get_chrom_to_len_genome_store(reference_genome)
 
     # go through each of the mtDNA and gDNA
     for type_genome, chroms in [("mtDNA", mtDNA_chromosomes), ("gDNA", gDNA_chromosomes)]:
@@ -2909,7 +3408,7 @@ def simulate_SVs_in_genome(reference_genome, mitochondrial_chromosome, outdir, n
 
         # get the genome 
         genome_file = "%s/genome.fasta"%genome_outdir
-        SeqIO.write([c for c in SeqIO.parse(reference_genome, "fasta") if c.id in chroms], genome_file, "fasta")
+        SeqIO.write(get_seqRecords_genome_store(reference_genome, chromosomes=chroms), genome_file, "fasta")
 
         # simulate random SVs into regions without previous SVs 
         random_sim_dir = "%s/random_SVs"%genome_outdir
@@ -3141,7 +3640,7 @@ def generate_coverage_per_window_file_parallel(reference_genome, destination_dir
             remove_file(windows_file_stderr)
 
             # define the chromosomes
-            all_chromosome_IDs = [seq.id for seq in SeqIO.parse(reference_genome, "fasta")]
+            all_chromosome_IDs = list(get_chrom_to_len_genome_store(reference_genome))
 
     # in the case you have provied a window file
     elif not file_is_empty(windows_file):
@@ -3329,135 +3828,288 @@ def run_gridss_and_annotateSimpleType(sorted_bam, reference_genome, outdir, repl
 
     return gridss_VCFoutput_with_simple_event
 
-def load_single_sample_VCF(path):
+def get_df_single_sample_VCF_literalEval(path):
 
-    """Loads a vcf with a single sample into a df."""
+    """Loads a vcf with a single sample into a df, parsing each INFO value with ast.literal_eval. This was the way to load the vcf in load_single_sample_VCF, and it is kept to benchmark get_df_single_sample_VCF_typed (see benchmark_loading_single_sample_VCF)."""
 
-    vcf_df_file = "%s.vcf_df.py"%path
+    # load the df
+    df = pd.read_csv(path, sep="\t", header = len([l for l in open(path, "r") if l.startswith("##")]))
 
-    if file_is_empty(vcf_df_file):
+    # change the name of the last column, which is the actual sample data
+    df = df.rename(columns={df.keys()[-1]: "DATA"})
 
-        print_if_verbose("running load_single_sample_VCF")
+    # get the filter as set and filter
+    df["FILTER_set"] = df.FILTER.apply(lambda x: set(x.split(";")))
+    #df = df[df.FILTER_set.apply(lambda x: len(x.intersection(interesting_filterTAGs))>0)]
 
-        # load the df
-        df = pd.read_csv(path, sep="\t", header = len([l for l in open(path, "r") if l.startswith("##")]))
+    # check that there
 
-        # change the name of the last column, which is the actual sample data
-        df = df.rename(columns={df.keys()[-1]: "DATA"})
+    ### INFO COLUMN ####
 
-        # get the filter as set and filter
-        df["FILTER_set"] = df.FILTER.apply(lambda x: set(x.split(";")))
-        #df = df[df.FILTER_set.apply(lambda x: len(x.intersection(interesting_filterTAGs))>0)]
+    def get_real_value(string):
 
-        # check that there
+        try: return ast.literal_eval(string)
+        except: return string
 
-        ### INFO COLUMN ####
+    def get_dict_fromRow(row):
 
-        def get_real_value(string):
+        # get as a list, considering to put appart whatever has an "="
+        list_row = row.split(";")
+        rows_with_equal = [x.split("=") for x in list_row if "=" in x]
+        rows_without_equal = [x for x in list_row if "=" not in x]
 
-            try: return ast.literal_eval(string)
-            except: return string
+        # add the values with an "=" to the dictionary
+        final_dict = {"INFO_%s"%x[0] : get_real_value(x[1]) for x in rows_with_equal}
 
-        def get_dict_fromRow(row):
+        # add the others collapsed
+        final_dict["INFO_misc"] = ";".join(rows_without_equal)
 
-            # get as a list, considering to put appart whatever has an "="
-            list_row = row.split(";")
-            rows_with_equal = [x.split("=") for x in list_row if "=" in x]
-            rows_without_equal = [x for x in list_row if "=" not in x]
+        return final_dict
 
-            # add the values with an "=" to the dictionary
-            final_dict = {"INFO_%s"%x[0] : get_real_value(x[1]) for x in rows_with_equal}
+    print_if_verbose("getting INFO as dict")
 
-            # add the others collapsed
-            final_dict["INFO_misc"] = ";".join(rows_without_equal)
+    # add a column that has a dictionary with the info fields
+    df["INFO_as_dict"] = df.INFO.apply(get_dict_fromRow)
+    all_INFO_fields = sorted(list(set.union(*df.INFO_as_dict.apply(lambda x: set(x)))))
 
-            return final_dict
+    # add them as sepparated columns
+    def get_from_dict_orNaN(value, dictionary):
 
-        print_if_verbose("getting INFO as dict")
+        if value in dictionary: return dictionary[value]
+        else: return np.nan
 
-        # add a column that has a dictionary with the info fields
-        df["INFO_as_dict"] = df.INFO.apply(get_dict_fromRow)
-        all_INFO_fields = sorted(list(set.union(*df.INFO_as_dict.apply(lambda x: set(x)))))
+    for f in all_INFO_fields: df[f] = df.INFO_as_dict.apply(lambda d: get_from_dict_orNaN(f, d))
+    df.pop("INFO_as_dict")
 
-        # add them as sepparated columns
-        def get_from_dict_orNaN(value, dictionary):
+    #########################
 
-            if value in dictionary: return dictionary[value]
-            else: return np.nan
+    ### FORMAT COLUMN ###
 
-        for f in all_INFO_fields: df[f] = df.INFO_as_dict.apply(lambda d: get_from_dict_orNaN(f, d))
-        df.pop("INFO_as_dict")
+    # check that there is only one format
+    all_formats = set(df.FORMAT)
+    if len(all_formats)!=1: raise ValueError("There should be only one format in the FORMAT file")
 
-        #########################
+    # get as dictionary
+    format_list = next(iter(all_formats)).split(":")
 
-        ### FORMAT COLUMN ###
+    def getINTorFLOATdictionary(data):
 
-        # check that there is only one format
-        all_formats = set(df.FORMAT)
-        if len(all_formats)!=1: raise ValueError("There should be only one format in the FORMAT file")
+        # get dictionary
+        dictionary = dict(zip(format_list, data.split(":")))
 
-        # get as dictionary
-        format_list = next(iter(all_formats)).split(":")
+        # change the type
+        final_dict = {}
+        for k, v in dictionary.items():
 
-        def getINTorFLOATdictionary(data):
+            if v==".": final_dict[k] = "."
+            elif "/" in v or "," in v: final_dict[k] = v
+            elif "." in v: final_dict[k] = float(v)
+            else: final_dict[k] = int(v)
 
-            # get dictionary
-            dictionary = dict(zip(format_list, data.split(":")))
+        return final_dict
 
-            # change the type
-            final_dict = {}
-            for k, v in dictionary.items():
+    df["FORMAT_as_dict"] = df.DATA.apply(getINTorFLOATdictionary)
 
-                if v==".": final_dict[k] = "."
-                elif "/" in v or "," in v: final_dict[k] = v
-                elif "." in v: final_dict[k] = float(v)
-                else: final_dict[k] = int(v)
+    # get as independent fields
+    for f in sorted(format_list): df["DATA_%s"%f] = df.FORMAT_as_dict.apply(lambda d: d[f])
+    df.pop("FORMAT_as_dict")
 
-            return final_dict
+    #########################
 
-        df["FORMAT_as_dict"] = df.DATA.apply(getINTorFLOATdictionary)
+    # calculate allele frequencies (if AD is provided)
+    if "DATA_AD" in df.keys():
 
-        # get as independent fields
-        for f in sorted(format_list): df["DATA_%s"%f] = df.FORMAT_as_dict.apply(lambda d: d[f])
-        df.pop("FORMAT_as_dict")
+        df["allele_freqs"] = df.apply(lambda r: [int(reads_allele)/r["DATA_DP"] for reads_allele in r["DATA_AD"].split(",")], axis=1)
 
-        #########################
+        # assign a boolean whether it is heterozygius
+        df["is_heterozygous_coverage"] = df.allele_freqs.apply(lambda x: any([freq>=0.25 and freq<=0.75 for freq in x]))
+        df["is_heterozygous_GT"] = df.DATA_GT.apply(lambda x: len(set(x.split("/")))>1)
 
-        # calculate allele frequencies (if AD is provided)
-        if "DATA_AD" in df.keys():
+    return df
 
-            df["allele_freqs"] = df.apply(lambda r: [int(reads_allele)/r["DATA_DP"] for reads_allele in r["DATA_AD"].split(",")], axis=1)
+def get_INFO_fields_header_VCF(path):
 
-            # assign a boolean whether it is heterozygius
-            df["is_heterozygous_coverage"] = df.allele_freqs.apply(lambda x: any([freq>=0.25 and freq<=0.75 for freq in x]))
-            df["is_heterozygous_GT"] = df.DATA_GT.apply(lambda x: len(set(x.split("/")))>1)
+    """Takes a vcf and returns a dict that maps each INFO field declared in the header to a tuple (Number, Type)"""
 
-        print_if_verbose("load_single_sample_VCF ran")
+    INFO_field_to_NumberAndType = {}
+    for line in open(path, "r"):
 
-        # save
-        save_object(df, vcf_df_file)
+        if not line.startswith("##"): break
+        if line.startswith("##INFO=<"):
 
-    # load
-    df = load_object(vcf_df_file)
+            ID = re.search("ID=([^,>]+)", line).group(1)
+            Number = re.search("Number=([^,>]+)", line).group(1)
+            Type = re.search("Type=([^,>]+)", line).group(1)
+            INFO_field_to_NumberAndType[ID] = (Number, Type)
 
-    return df
+    return INFO_field_to_NumberAndType
 
-def getNaN_to_0(x):
+def get_real_value_VCF(string):
 
-    if pd.isna(x): return 0.0
-    else: return x
+    """Takes a string of a VCF and returns the python object that it represents, as in ast.literal_eval, or the string if it can't be parsed"""
 
-def add_info_to_gridssDF(df, reference_genome, expected_fields={"allele_frequency", "allele_frequency_SmallEvent", "other_coordinates", "other_chromosome", "other_position", "other_orientation",  "inserted_sequence", "len_inserted_sequence", "length_event", "has_poly16GC", "length_inexactHomology", "length_microHomology", "overlaps_repeats", "eventID_as_clove", "coordinates"}, median_insert_size=500, median_insert_size_sd=50):
+    try: return ast.literal_eval(string)
+    except: return string
 
-    """This function takes a gridss df and returns the same adding expected_fields. This adds if not already done."""
+# regular expressions of the numeric values that ast.literal_eval parses as int or float
+g_int_literal_re = re.compile(r"^[+-]?(0+|[1-9][0-9]*)$")
+g_float_literal_re = re.compile(r"^[+-]?([0-9]+\.[0-9]*|\.[0-9]+|[0-9]+(?=[eE]))([eE][+-]?[0-9]+)?$")
 
-    if len(set(df.keys()).intersection(expected_fields))!=len(expected_fields):
+def get_series_INFO_field_VCF(values, Number, Type, index):
 
-        df = cp.deepcopy(df)
-        print_if_verbose("Adding info to df_gridss")
+    """Takes a list of string values of one INFO field (None if missing) and the Number and Type of the field in the header. It returns a series with the same values that ast.literal_eval would return (NaN if missing). Scalar numeric fields are filled into numpy arrays, and the other ones are parsed once per unique value."""
 
+    # define the present values
+    present_values = [v for v in values if v is not None]
+    all_present = len(present_values)==len(values)
 
-        ####### ADD WHETHER THE VARIANTS OVERLAP REPEATS #######
+    # scalar numeric fields with values that are all numeric literals
+    if Number=="1" and Type in {"Integer", "Float"} and all([g_int_literal_re.match(v) or g_float_literal_re.match(v) for v in present_values]):
+
+        # if all are ints and present it is an int array
+        if all_present and all([g_int_literal_re.match(v) for v in values]): return pd.Series(np.array(values).astype(np.int64), index=index)
+
+        # else it is a float array
+        array = np.full(len(values), np.nan)
+        array[[I for I, v in enumerate(values) if v is not None]] = np.array(present_values).astype(float)
+        return pd.Series(array, index=index)
+
+    # any other field is parsed once for each unique value
+    value_to_real_value = {v : get_real_value_VCF(v) for v in set(present_values)}
+    return pd.Series([v if v is not None else np.nan for v in values], index=index, dtype=object).map(lambda v: value_to_real_value[v] if type(v)==str else np.nan)
+
+def get_series_FORMAT_field_VCF(values, index):
+
+    """Takes a list of string values of one FORMAT field and returns a series with the values as in the getINTorFLOATdictionary function of get_df_single_sample_VCF_literalEval (the '.' and any value with '/' or ',' are kept as strings, values with '.' are floats, and the others are ints)."""
+
+    # if there are no strings, get a numeric array
+    if not any([v=="." or "/" in v or "," in v for v in values]):
+
+        if any(["." in v for v in values]): return pd.Series(np.array(values).astype(float), index=index)
+        else: return pd.Series(np.array(values).astype(np.int64), index=index)
+
+    # else, parse each of the values
+    def get_INTorFLOATorSTR(v):
+
+        if v==".": return "."
+        elif "/" in v or "," in v: return v
+        elif "." in v: return float(v)
+        else: return int(v)
+
+    return pd.Series(values, index=index, dtype=object).map(get_INTorFLOATorSTR)
+
+def get_df_single_sample_VCF_typed(path):
+
+    """Loads a vcf with a single sample into a df, with the same columns and values as get_df_single_sample_VCF_literalEval. The INFO and FORMAT columns are split into columns in one pass, and the numeric INFO fields (according to the Number and Type declared in the header) are directly filled as numpy arrays."""
+
+    # load the df
+    df = pd.read_csv(path, sep="\t", header = len([l for l in open(path, "r") if l.startswith("##")]))
+
+    # change the name of the last column, which is the actual sample data
+    df = df.rename(columns={df.keys()[-1]: "DATA"})
+
+    # get the filter as set
+    df["FILTER_set"] = [set(x.split(";")) for x in df.FILTER]
+
+    ### INFO COLUMN ####
+
+    # get, for each INFO field, the values of each row. Whatever is without a '=' is collapsed into INFO_misc
+    nrows = len(df)
+    INFOfield_to_rowToValue = {}
+    INFO_misc = []
+
+    for I, INFO in enumerate(df.INFO):
+
+        row_misc = []
+        for x in INFO.split(";"):
+
+            if "=" in x: 
+                x_split = x.split("=")
+                INFOfield_to_rowToValue.setdefault(x_split[0], {})[I] = x_split[1]
+
+            else: row_misc.append(x)
+
+        INFO_misc.append(";".join(row_misc))
+
+    # add the fields as typed columns, sorted as in get_df_single_sample_VCF_literalEval
+    INFO_field_to_NumberAndType = get_INFO_fields_header_VCF(path)
+    INFOcolumn_to_series = {"INFO_misc" : pd.Series(INFO_misc, index=df.index, dtype=object)}
+
+    for field, row_to_value in INFOfield_to_rowToValue.items():
+
+        Number, Type = INFO_field_to_NumberAndType.get(field, (".", "String"))
+        INFOcolumn_to_series["INFO_%s"%field] = get_series_INFO_field_VCF([row_to_value.get(I) for I in range(nrows)], Number, Type, df.index)
+
+    for f in sorted(INFOcolumn_to_series): df[f] = INFOcolumn_to_series[f]
+
+    #########################
+
+    ### FORMAT COLUMN ###
+
+    # check that there is only one format
+    all_formats = set(df.FORMAT)
+    if len(all_formats)!=1: raise ValueError("There should be only one format in the FORMAT file")
+
+    # get the values of each FORMAT field
+    format_list = next(iter(all_formats)).split(":")
+    DATA_split = [data.split(":") for data in df.DATA]
+
+    for f in sorted(format_list): 
+        If = format_list.index(f)
+        df["DATA_%s"%f] = get_series_FORMAT_field_VCF([x[If] for x in DATA_split], df.index)
+
+    #########################
+
+    # calculate allele frequencies (if AD is provided)
+    if "DATA_AD" in df.keys():
+
+        df["allele_freqs"] = pd.Series([[int(reads_allele)/DP for reads_allele in AD.split(",")] for AD, DP in zip(df.DATA_AD, df.DATA_DP)], index=df.index, dtype=object)
+
+        # assign a boolean whether it is heterozygius
+        df["is_heterozygous_coverage"] = df.allele_freqs.apply(lambda x: any([freq>=0.25 and freq<=0.75 for freq in x]))
+        df["is_heterozygous_GT"] = df.DATA_GT.apply(lambda x: len(set(x.split("/")))>1)
+
+    return df
+
+def load_single_sample_VCF(path, fields="all", filters=[]):
+
+    """Loads a vcf with a single sample into a df. The df is stored as columnar (see get_df_columnar_file), so that only some fields and rows can be loaded."""
+
+    vcf_df_file = "%s.vcf_df.py"%path
+
+    if columnar_file_is_empty(vcf_df_file):
+
+        print_if_verbose("running load_single_sample_VCF")
+
+        # load the df
+        df = get_df_single_sample_VCF_typed(path)
+
+        print_if_verbose("load_single_sample_VCF ran")
+
+        # save
+        save_df_columnar_file(df, vcf_df_file)
+
+    # load
+    df = get_df_columnar_file(vcf_df_file, fields=fields, filters=filters)
+
+    return df
+
+def getNaN_to_0(x):
+
+    if pd.isna(x): return 0.0
+    else: return x
+
+def add_info_to_gridssDF(df, reference_genome, expected_fields={"allele_frequency", "allele_frequency_SmallEvent", "other_coordinates", "other_chromosome", "other_position", "other_orientation",  "inserted_sequence", "len_inserted_sequence", "length_event", "has_poly16GC", "length_inexactHomology", "length_microHomology", "overlaps_repeats", "eventID_as_clove", "coordinates"}, median_insert_size=500, median_insert_size_sd=50):
+
+    """This function takes a gridss df and returns the same adding expected_fields. This adds if not already done."""
+
+    if len(set(df.keys()).intersection(expected_fields))!=len(expected_fields):
+
+        df = df.copy(deep=False) # the new columns are only added to this copy
+        print_if_verbose("Adding info to df_gridss")
+
+
+        ####### ADD WHETHER THE VARIANTS OVERLAP REPEATS #######
 
         # get the repeats table
         repeats_table = get_repeat_maskerDF(reference_genome, threads=1, replace=False)[1]
@@ -3465,87 +4117,65 @@ def add_info_to_gridssDF(df, reference_genome, expected_fields={"allele_frequenc
 
         ########################################################
 
-        # add the allele frequencies
-        df["allele_frequency"] = df.apply(lambda r: np.divide(r["DATA_VF"] , (r["DATA_VF"] + r["DATA_REF"] + r["DATA_REFPAIR"])), axis=1).apply(getNaN_to_0)
-        df["allele_frequency_SmallEvent"] = df.apply(lambda r: np.divide(r["DATA_VF"] , (r["DATA_VF"] + r["DATA_REF"])), axis=1).apply(getNaN_to_0)
+        # add the allele frequencies. NaNs (from 0/0) are set to 0
+        df["allele_frequency"] = (df.DATA_VF / (df.DATA_VF + df.DATA_REF + df.DATA_REFPAIR)).fillna(0.0)
+        df["allele_frequency_SmallEvent"] = (df.DATA_VF / (df.DATA_VF + df.DATA_REF)).fillna(0.0)
 
         # add data to calculate the other breakpoint
 
         # check that the chromosomes do not start or end with a ".", which would give an error in the calculation of the length of the event
         if any([c.startswith(".") or c.endswith(".")  for c in set(df["#CHROM"])]): raise ValueError("If chromosome names start or end with a '.' the parsing of the gridss output is incorrect.")
 
-        def get_other_position(r):
-            
-            # in case that this is just a bp, without any other chromsomes
-            if r["ALT"].startswith(".") or r["ALT"].endswith("."): return "%s:%i"%(r["#CHROM"], r["POS"])
+        # get the coordinates of the other breakend. If the ALT is just a bp, without any other chromsomes, these are the coordinates of the breakend
+        coordinates = df["#CHROM"] + ":" + df.POS.astype(int).astype(str)
+        ALT_split = df.ALT.str.split(r"\]|\[", expand=True)
+        is_single_breakend = df.ALT.str.startswith(".") | df.ALT.str.endswith(".")
 
-            # in case it is a breakpoint
-            else: return re.split("\]|\[", r["ALT"])[1]
+        if len(ALT_split.columns)>1: df["other_coordinates"] = ALT_split[1].where(~is_single_breakend, coordinates)
+        else: df["other_coordinates"] = coordinates
+        if any(pd.isna(df.other_coordinates)): raise ValueError("The other coordinates could not be parsed from some ALT fields")
 
-        df["other_coordinates"] = df.apply(get_other_position, axis=1)
-        df["other_chromosome"] = df.other_coordinates.apply(lambda x: x.split(":")[0])
-        df["other_position"] = df.other_coordinates.apply(lambda x: int(x.split(":")[1]))
+        other_coordinates_split = df.other_coordinates.str.split(":")
+        df["other_chromosome"] = other_coordinates_split.str[0]
+        df["other_position"] = other_coordinates_split.str[1].astype(int)
 
-        df["coordinates"] = df["#CHROM"] + ":" + df.POS.apply(int).apply(str)
+        df["coordinates"] = coordinates
 
         # add the orientation of the other
-        def get_other_orientation(alt): 
-
-            if "]" in alt: return "]"
-            elif "[" in alt: return "["
-            else: return "unk"
-
-        df["other_orientation"] = df.ALT.apply(get_other_orientation)
-
-        # get the inserted sequence
-        def get_inserted_seq(ALT):
-            
-            if "." in ALT: return ""
-            else: return [x for x in re.split("\]|\[", ALT) if all([base.upper() in {"A", "C", "T", "G", "N"} and len(base)>0 for base in set(x)])][0]
-            
-        df["inserted_sequence"] = df.ALT.apply(get_inserted_seq)
-        df["len_inserted_sequence"] = df.inserted_sequence.apply(len)
+        df["other_orientation"] = np.where(df.ALT.str.contains("]", regex=False), "]", np.where(df.ALT.str.contains("[", regex=False), "[", "unk"))
 
-        def get_length(r):
+        # get the inserted sequence, which is the first part of the ALT (split by the brackets) that only has nucleotides (or is empty). Single breakends have no inserted sequence
+        inserted_sequence = pd.Series(np.nan, index=df.index, dtype=object)
+        for Ipart in reversed(ALT_split.columns): 
+            is_sequence = ALT_split[Ipart].str.match("^[ACGTNacgtn]*$").fillna(False).astype(bool)
+            inserted_sequence = ALT_split[Ipart].where(is_sequence, inserted_sequence)
 
-            
-            # same chromosome
-            if r["#CHROM"]==r["other_chromosome"]: return abs(r["other_position"] - r["POS"])
-            
-            # different chromosomes
-            return 100000000000
+        df["inserted_sequence"] = inserted_sequence.where(~df.ALT.str.contains(".", regex=False), "")
+        if any(pd.isna(df.inserted_sequence)): raise ValueError("The inserted sequence could not be parsed from some ALT fields")
+        df["len_inserted_sequence"] = df.inserted_sequence.str.len()
 
-        df["length_event"] = df[["#CHROM", "other_chromosome", "POS", "other_position"]].apply(get_length, axis=1)
-        
+        # get the length of the event. Breakends in different chromosomes get a very high length
+        df["length_event"] = np.where(df["#CHROM"]==df.other_chromosome, (df.other_position - df.POS).abs(), 100000000000)
     
         # add if the df has a polyG tag
-        df["has_poly16GC"] = df.ALT.apply(lambda x: ("G"*16) in x or ("C"*16) in x)
+        df["has_poly16GC"] = df.ALT.str.contains("G"*16, regex=False) | df.ALT.str.contains("C"*16, regex=False)
 
-        # add the range of inexact homology
-        def add_inexact_homology_length(IHOMPOS):
-            
-            if pd.isna(IHOMPOS): return  0
-            else: return int(IHOMPOS[1]) - int(IHOMPOS[0])
+        # add the range of inexact homology, which is 0 if there is no IHOMPOS
+        IHOMPOS_provided = df.INFO_IHOMPOS.notna()
+        length_inexactHomology = np.zeros(len(df), dtype=int)
+        if any(IHOMPOS_provided): 
+            IHOMPOS = np.array(list(df.INFO_IHOMPOS[IHOMPOS_provided]), dtype=int)
+            length_inexactHomology[IHOMPOS_provided.values] = IHOMPOS[:,1] - IHOMPOS[:,0]
 
-        df["length_inexactHomology"] = df.INFO_IHOMPOS.apply(add_inexact_homology_length)
+        df["length_inexactHomology"] = length_inexactHomology
 
         # add the length of homology
-        def get_homology_length(HOMLEN):
-            
-            if pd.isna(HOMLEN): return 0
-            else: return int(HOMLEN)
-
-        if "INFO_HOMLEN" in df.keys(): df["length_microHomology"] = df.INFO_HOMLEN.apply(get_homology_length)
+        if "INFO_HOMLEN" in df.keys(): df["length_microHomology"] = df.INFO_HOMLEN.fillna(0).astype(int)
         else: df["length_microHomology"] = 0
 
         # add the actual allele_frequency, which depends on the median_insert_size and the median_insert_size_sd. If the breakend is longer than the insert size it is a large event
         maxiumum_insert_size = median_insert_size + median_insert_size_sd
-        def get_allele_freq(r):
-            
-            if r["length_event"]>maxiumum_insert_size: return r["allele_frequency"]
-            else: return r["allele_frequency_SmallEvent"]
-        
-        df["real_AF"] = df.apply(get_allele_freq, axis=1)
+        df["real_AF"] = np.where(df.length_event>maxiumum_insert_size, df.allele_frequency, df.allele_frequency_SmallEvent)
 
         if any(pd.isna(df["real_AF"])): raise ValueError("There are NaNs in the real_AF field")
 
@@ -3813,100 +4443,153 @@ def parallelization_is_possible(threads):
     except AssertionError: return False
 
 
-def get_coverage_per_window_df_without_repeating(reference_genome, sorted_bam, windows_file, replace=False, run_in_parallel=True, delete_bams=False, threads=4, validate_all_coverage_already_calculated=False, average_cov_measure="median"):
+def get_chrom_to_len_bam_header(sorted_bam):
 
-    """This function takes a windows file and a bam, and it runs generate_coverage_per_window_file_parallel but only for regions that are not previously calculated"""
+    """Takes a bam and returns a dict mapping each chromosome of the header to its length"""
 
-    # check if it can be run in parallel
-    if parallelization_is_possible(threads) is False: run_in_parallel = False
-    print_if_verbose("running get_coverage_per_window_df_without_repeating with %i threads"%threads)
+    chrom_to_len = {}
+    for line in subprocess.check_output("%s view -H %s"%(samtools, sorted_bam), shell=True).decode("utf-8").split("\n"):
+        if not line.startswith("@SQ"): continue
 
-    # define the query_windows
-    if open(windows_file).readlines()[0].startswith("chromosome"): query_windows_df = pd.read_csv(windows_file, sep="\t")
-    else: query_windows_df = pd.read_csv(windows_file, sep="\t", header=None, names=["chromosome", "start", "end"])
+        tag_to_val = dict([field.split(":", 1) for field in line.split("\t")[1:] if ":" in field])
+        chrom_to_len[tag_to_val["SN"]] = int(tag_to_val["LN"])
 
-    query_windows_df = query_windows_df.set_index(["chromosome", "start", "end"], drop=False)
-    if len(query_windows_df)==0: return pd.DataFrame()
-    
-    # chek the initial length
-    query_df_len = len(query_windows_df)
+    return chrom_to_len
 
-    # define the file were the coverage will be calculated
-    calculated_coverage_file = "%s.coverage_per_window.tab"%sorted_bam
+def get_bam_info_per_base_coverage_store(sorted_bam):
 
-    ######### define previously measured regions ##########
-    print_if_verbose("getting the previously-calculated regions")
+    """Returns the info of sorted_bam (mtime and size) used to check whether the per-base coverage store is up to date"""
 
-    if not file_is_empty(calculated_coverage_file):
+    return {"mtime":os.path.getmtime(sorted_bam), "size":os.path.getsize(sorted_bam)}
 
-        # get into a df all the previously calculated coverages
-        df_previosuly_calculated_coverages = pd.read_csv(calculated_coverage_file, sep="\t").set_index(["chromosome", "start", "end"], drop=False)
+def per_base_coverage_store_is_up_to_date(sorted_bam):
 
-        # define the windows_to_measure_df as those that are not in df_previosuly_calculated_coverages
-        windows_still_to_measure = set(query_windows_df.index).difference(set(df_previosuly_calculated_coverages.index))
+    """Returns whether the per-base coverage store of sorted_bam (see get_per_base_coverage_store) exists and was generated from the current sorted_bam"""
 
-        if len(windows_still_to_measure)==0: windows_to_measure_df = pd.DataFrame()
-        else: windows_to_measure_df = query_windows_df.loc[list(windows_still_to_measure)]
+    store_info_file = "%s.per_base_coverage_store/store_info.py"%sorted_bam
+    if file_is_empty(store_info_file): return False
 
-    else: 
-        windows_to_measure_df = query_windows_df
-        df_previosuly_calculated_coverages = pd.DataFrame()
+    return load_object(store_info_file)["bam_info"]==get_bam_info_per_base_coverage_store(sorted_bam)
 
-    ###################################
+def get_per_base_coverage_store(sorted_bam, threads=4):
 
-    ######## measure regions, keeping in tmp ######
+    """Takes a sorted bam and returns a dict mapping each chromosome to an int32 array (memory-mapped) with the coverage of each position. The per-base coverage is calculated only once for each bam with mosdepth (in fast mode, as the coverage per windows) and stored in <sorted_bam>.per_base_coverage_store, with one .npy array per chromosome. This store is regenerated if the mtime or the size of the bam change."""
 
-    if len(windows_to_measure_df)>0:
-        print_if_verbose("calculating coverage for uncalculated windows. %i/%i remaining"%(len(windows_to_measure_df), query_df_len))
+    store_dir = "%s.per_base_coverage_store"%sorted_bam
+    store_info_file = "%s/store_info.py"%store_dir
 
-        # if validate_all_coverage_already_calculated, there should be no windows to calculate
-        if validate_all_coverage_already_calculated is True: raise ValueError("There are some windows where coverage is not calculated: %s"%str(windows_to_measure_df))
+    if per_base_coverage_store_is_up_to_date(sorted_bam) is False:
+        print_if_verbose("calculating the per-base coverage of %s"%sorted_bam)
 
-        # remove the already calculated windows
-        remove_file(calculated_coverage_file)
+        # remove the previous store
+        delete_folder(store_dir)
 
-        # write a bed with the regions to measure
-        bed_windows_to_measure = "%s.measuring.bed"%(calculated_coverage_file)
-        windows_to_measure_df[["chromosome", "start", "end"]].to_csv(bed_windows_to_measure, sep="\t", header=False, index=False)
+        # make a tmp store, unique for this process
+        store_dir_tmp = "%s.%s.tmp"%(store_dir, id_generator())
+        delete_folder(store_dir_tmp); make_folder(store_dir_tmp)
+        bam_info = get_bam_info_per_base_coverage_store(sorted_bam)
 
-        # get the coverage df
-        destination_dir = "%s.calculating_windowcoverage"%sorted_bam
-        coverage_df = pd.read_csv(generate_coverage_per_window_file_parallel(reference_genome, destination_dir, sorted_bam, windows_file=bed_windows_to_measure, replace=replace, run_in_parallel=run_in_parallel, delete_bams=delete_bams, threads=threads, average_cov_measure=average_cov_measure), sep="\t").rename(columns={"#chrom":"chromosome"}).set_index(["chromosome", "start", "end"], drop=False)
+        # run mosdepth
+        mosdepth_prefix = "%s/coverage"%store_dir_tmp
+        mosdepth_std = "%s.generating.std"%mosdepth_prefix
+        print_if_verbose("running mosdepth. The std is in %s"%mosdepth_std)
+        run_cmd("%s --threads %i --fast-mode %s %s > %s 2>&1"%(mosdepth, threads, mosdepth_prefix, sorted_bam, mosdepth_std))
+
+        # init the arrays, one for each chromosome
+        chrom_to_len = get_chrom_to_len_bam_header(sorted_bam)
+        chrom_to_file = {chrom : "chromosome_%i.npy"%Ichrom for Ichrom, chrom in enumerate(chrom_to_len)}
+        chrom_to_array = {chrom : np.lib.format.open_memmap("%s/%s"%(store_dir_tmp, chrom_to_file[chrom]), mode="w+", dtype=np.int32, shape=(chrom_to_len[chrom],)) for chrom in chrom_to_len}
+        chrom_to_nbp_filled = {chrom : 0 for chrom in chrom_to_len}
+
+        # fill the arrays from the runs of the per-base bed, in chunks
+        for df_per_base in pd.read_csv("%s.per-base.bed.gz"%mosdepth_prefix, sep="\t", header=None, names=["chromosome", "start", "end", "coverage"], dtype={"chromosome":str, "start":np.int64, "end":np.int64, "coverage":np.int32}, chunksize=5000000):
+            for chrom, df_chrom in df_per_base.groupby("chromosome", sort=False):
+
+                starts = df_chrom.start.values
+                ends = df_chrom.end.values
+                chrom_to_array[chrom][starts[0]:ends[-1]] = np.repeat(df_chrom.coverage.values, ends-starts)
+                chrom_to_nbp_filled[chrom] += sum(ends-starts)
 
-        delete_folder(destination_dir)
-        remove_file(bed_windows_to_measure)
+        # checks
+        for chrom, len_chrom in chrom_to_len.items():
+            if chrom_to_nbp_filled[chrom]!=len_chrom: raise ValueError("The per-base coverage of %s has %i positions, while its length is %i"%(chrom, chrom_to_nbp_filled[chrom], len_chrom))
 
-        delete_folder("%s.coverage_measurement_destination"%bed_windows_to_measure)
-        remove_file("%s.coverage_provided_windows.tab"%bed_windows_to_measure)
+            chrom_to_array[chrom].flush()
 
-        # get the merged dfs
-        df_coverage_all = df_previosuly_calculated_coverages.append(coverage_df, sort=True) # do not keep only the query windows
-        #df_coverage_all = df_previosuly_calculated_coverages.append(coverage_df, sort=True).loc[list(query_windows_df.index)]
+        del chrom_to_array
 
-        # save
-        calculated_coverage_file_tmp = "%s.tmp"%calculated_coverage_file
-        df_coverage_all.to_csv(calculated_coverage_file_tmp, sep="\t", header=True, index=False)
-        os.rename(calculated_coverage_file_tmp, calculated_coverage_file)
+        # clean
+        for f in os.listdir(store_dir_tmp): 
+            if f.startswith("coverage"): remove_file("%s/%s"%(store_dir_tmp, f))
 
-    #############################################
+        # keep. If another process already generated the store, keep that one
+        save_object({"bam_info":bam_info, "chrom_to_file":chrom_to_file}, "%s/store_info.py"%store_dir_tmp)
+        try: os.rename(store_dir_tmp, store_dir)
+        except OSError: delete_folder(store_dir_tmp)
 
-    # load the df
-    df_coverage_all = pd.read_csv(calculated_coverage_file, sep="\t")
+    # load
+    chrom_to_file = load_object(store_info_file)["chrom_to_file"]
+    return {chrom : np.load("%s/%s"%(store_dir, file), mmap_mode="r") for chrom, file in chrom_to_file.items()}
+
+def get_coverage_per_windows_df_from_per_base_coverage(chrom_to_coverage, df_windows, average_cov_measure="median"):
+
+    """Takes the per-base coverage (see get_per_base_coverage_store) and a df_windows with chromosome, start and end (0-based, half-open). It returns a df with the same fields as get_mosdepth_coverage_per_windows_output_likeBamStats, with one row for each row of df_windows (in the same order). As in get_mosdepth_coverage_per_windows_output_likeBamStats (which passed start+1 to mosdepth) the coverage, length and covered bases are those of start+1 to end, so that the thresholds defined on them are unchanged."""
+
+    # init the fields
+    average_cov_field = "%scov_1"%average_cov_measure
+    average_cov_function = {"median":np.median, "mean":np.mean}[average_cov_measure]
+    average_cov = np.zeros(len(df_windows))
+    nbp_more_than_1x = np.zeros(len(df_windows), dtype=int)
+
+    # go through each chromosome
+    chromosomes = df_windows.chromosome.apply(str).values
+    for chrom in set(chromosomes):
+
+        if chrom not in chrom_to_coverage: raise ValueError("%s is not in the bam"%chrom)
+        coverage = chrom_to_coverage[chrom]
+
+        # get the coverage of each window
+        for I, start, end in zip(np.nonzero(chromosomes==chrom)[0], df_windows.start.values[chromosomes==chrom], df_windows.end.values[chromosomes==chrom]):
+
+            window_coverage = coverage[max(start+1, 0):max(end, 0)]
+            if len(window_coverage)==0: continue
+
+            average_cov[I] = average_cov_function(window_coverage)
+            nbp_more_than_1x[I] = np.count_nonzero(window_coverage)
+
+    # get as df. The coverage is rounded as in mosdepth
+    df = pd.DataFrame({"chromosome":df_windows.chromosome.values, "start":df_windows.start.values, "end":df_windows.end.values, average_cov_field:np.round(average_cov, 2), "nbp_more_than_1x":nbp_more_than_1x})
+
+    # add some trivial info
+    df["length"] = df.end - (df.start+1)
+    df["nocoveragebp_1"] = df.length - df.nbp_more_than_1x
+    df["percentcovered_1"] = 100 - ((df.nocoveragebp_1/df.length) * 100).apply(lambda x: 0.0 if pd.isna(x) else float(x))
+
+    return df[["chromosome", "start", "end", average_cov_field, "nbp_more_than_1x", "length", "nocoveragebp_1", "percentcovered_1"]]
+
+def get_coverage_per_window_df_without_repeating(reference_genome, sorted_bam, windows_file, replace=False, run_in_parallel=True, delete_bams=False, threads=4, validate_all_coverage_already_calculated=False, average_cov_measure="median"):
+
+    """This function takes a windows file and a bam, and it returns a df with the coverage of each window. The coverage comes from the per-base coverage of the bam, which is calculated only once (see get_per_base_coverage_store), so that it is not repeated for each set of windows. The store is regenerated when the bam changes (replace does not force it). If validate_all_coverage_already_calculated is True the store should already exist."""
+
+    print_if_verbose("running get_coverage_per_window_df_without_repeating with %i threads"%threads)
+
+    # define the query_windows
+    if open(windows_file).readlines()[0].startswith("chromosome"): query_windows_df = pd.read_csv(windows_file, sep="\t")
+    else: query_windows_df = pd.read_csv(windows_file, sep="\t", header=None, names=["chromosome", "start", "end"])
 
-    # drop duplicates
-    df_coverage_all = df_coverage_all.drop_duplicates(subset=["chromosome", "start", "end"], keep='first')
+    if len(query_windows_df)==0: return pd.DataFrame()
 
-    # set the index to be the chromosome,start,end
-    df_coverage_all = df_coverage_all.set_index(["chromosome", "start", "end"], drop=False)
+    # if validate_all_coverage_already_calculated, there should be no coverage to calculate
+    if validate_all_coverage_already_calculated is True and per_base_coverage_store_is_up_to_date(sorted_bam) is False: raise ValueError("The per-base coverage of %s is not calculated"%sorted_bam)
 
-    # keep as df_coverage_final those that intersect with query_windows_df
-    df_coverage_final = df_coverage_all.loc[query_windows_df.index]
+    # get the coverage
+    df_coverage_final = get_coverage_per_windows_df_from_per_base_coverage(get_per_base_coverage_store(sorted_bam, threads=threads), query_windows_df, average_cov_measure=average_cov_measure)
 
     # get the correct index
     df_coverage_final.index = list(range(len(df_coverage_final)))
 
     # debug
-    if query_df_len!=len(df_coverage_final): raise ValueError("the length has changed in the process")
+    if len(query_windows_df)!=len(df_coverage_final): raise ValueError("the length has changed in the process")
 
     return df_coverage_final
 
@@ -3999,12 +4682,73 @@ def get_target_region_row(r, region, breakpoint_positions, maxPos, max_relative_
     return pd.Series({"chromosome":r["chromosome"], "start":start, "end":end, "region_name":region_name})
 
 
+def get_df_target_regions(df_windows, region, chrom_to_bpPositions, chrom_to_maxPos, max_relative_len_neighbors=2):
+
+    """This function takes a df with windows and returns a df (with the same index) with the 'region' of each window, which can be 5 or 3. It is a batched version of get_target_region_row, where the breakpoints of each chromosome are sorted once and the previous or next breakpoints of all windows are found with np.searchsorted."""
+
+    # define the minimum region length
+    min_region_len = 100
+
+    # init the coordinates of the regions
+    region_starts = np.zeros(len(df_windows), dtype=int)
+    region_ends = np.zeros(len(df_windows), dtype=int)
+
+    # go through each chromosome
+    chromosomes = df_windows.chromosome.values
+    for chrom in set(chromosomes):
+
+        # get the windows
+        idx_chrom = np.nonzero(chromosomes==chrom)[0]
+        starts = df_windows.start.values[idx_chrom].astype(int)
+        ends = df_windows.end.values[idx_chrom].astype(int)
+
+        # get the sorted breakpoint positions and the maximum region lengths
+        breakpoint_positions = np.array(sorted(chrom_to_bpPositions[chrom]), dtype=int)
+        maxPos = chrom_to_maxPos[chrom]
+        max_region_length = (ends-starts)*max_relative_len_neighbors
+
+        # define the 5' region, where the start is the previous breakpoint (or 0)
+        ends_5 = starts - 1
+        Iprevious_bp = np.searchsorted(breakpoint_positions, ends_5-min_region_len, side="left") - 1
+        previous_bp = np.where(Iprevious_bp>=0, breakpoint_positions[np.maximum(Iprevious_bp, 0)] if len(breakpoint_positions)>0 else 0, 0)
+        starts_5 = np.where((ends_5-previous_bp)<=max_region_length, previous_bp, ends_5-max_region_length)
+
+        # define the 3' region, where the end is the next breakpoint (or maxPos)
+        starts_3 = ends + 1
+        Inext_bp = np.searchsorted(breakpoint_positions, starts_3+min_region_len, side="right")
+        next_bp = np.where(Inext_bp<len(breakpoint_positions), breakpoint_positions[np.minimum(Inext_bp, len(breakpoint_positions)-1)] if len(breakpoint_positions)>0 else maxPos, maxPos)
+        ends_3 = np.where((next_bp-starts_3)<=max_region_length, next_bp, starts_3+max_region_length)
+
+        # readjust for regions that are close to the telomere. If the start is 1 the 5' region is the 3' region, and if the 3' region is not large enough it is the 5' region
+        if region=="5": is_region_5 = starts>=min_region_len
+        elif region=="3": is_region_5 = (maxPos-ends)<min_region_len
+        else: raise ValueError("region should be 5 or 3")
+
+        chrom_region_starts = np.where(is_region_5, starts_5, starts_3)
+        chrom_region_ends = np.where(is_region_5, ends_5, ends_3)
+
+        # if the region spans the whole chromosome, just set whole region as the 'region'
+        is_whole_chrom = (starts<=min_region_len) & ((maxPos-ends)<=min_region_len)
+        chrom_region_starts = np.where(is_whole_chrom, starts, chrom_region_starts)
+        chrom_region_ends = np.where(is_whole_chrom, ends, chrom_region_ends)
+
+        # if the start is after the end, exit
+        if any(chrom_region_starts>=chrom_region_ends): 
+            print(df_windows.iloc[idx_chrom[chrom_region_starts>=chrom_region_ends]], region, maxPos)
+            raise ValueError("start after end")
+
+        region_starts[idx_chrom] = chrom_region_starts
+        region_ends[idx_chrom] = chrom_region_ends
+
+    # return a df of all important fields
+    return pd.DataFrame({"chromosome":chromosomes, "start":region_starts, "end":region_ends, "region_name":"%s_region"%region}, index=df_windows.index)[["chromosome", "start", "end", "region_name"]]
+
 def get_chrom_to_bpPositions(df_clove, reference_genome):
 
     """This function takes a df_clove and maps each chromosome to the breakpoint positions"""
 
     # all chroms
-    all_chromosomes = {seq.id for seq in SeqIO.parse(reference_genome, "fasta")}
+    all_chromosomes = set(get_chrom_to_len_genome_store(reference_genome))
 
     # change to ints
     for f in ["POS", "START", "END"]: df_clove[f] = df_clove[f].apply(int)
@@ -4040,7 +4784,7 @@ def get_df_with_coverage_per_windows_relative_to_neighbor_regions(df_windows, be
     df_windows = cp.deepcopy(df_windows)
 
     # get the coverage to len
-    chrom_to_maxPos = {seq.id : len(seq.seq)-1 for seq in SeqIO.parse(reference_genome, "fasta")}
+    chrom_to_maxPos = {chrom : len_chrom-1 for chrom, len_chrom in get_chrom_to_len_genome_store(reference_genome).items()}
 
     # map the chromosome to the positions with breakpoints
     chrom_to_bpPositions = get_chrom_to_bpPositions(df_clove, reference_genome)
@@ -4050,12 +4794,9 @@ def get_df_with_coverage_per_windows_relative_to_neighbor_regions(df_windows, be
 
     # get a df with all windows
     all_df_windows = cp.deepcopy(df_windows)
-    all_df_windows.index = all_df_windows.apply(get_IDwindow_df, axis=1) + "_originalRegion"
+    all_df_windows.index = all_df_windows.chromosome.apply(str) + "_" + all_df_windows.start.apply(int).apply(str) + "_" + all_df_windows.end.apply(int).apply(str) + "_originalRegion"
     all_df_windows["IDwindow"] = all_df_windows.index
 
-    # original_indices
-    all_df_windows_index = list(all_df_windows.index)
-
     # go through each region and get a coverage df
     for region in ["target", "5", "3"]: 
 
@@ -4066,10 +4807,10 @@ def get_df_with_coverage_per_windows_relative_to_neighbor_regions(df_windows, be
         else:
 
             # get a df with the regions
-            df_region = df_windows.apply(lambda r: get_target_region_row(r, region, chrom_to_bpPositions[r["chromosome"]], chrom_to_maxPos[r["chromosome"]]), axis=1)
+            df_region = get_df_target_regions(df_windows, region, chrom_to_bpPositions, chrom_to_maxPos)
 
         # add the index
-        df_region.index = df_region.apply(get_IDwindow_df, axis=1)
+        df_region.index = df_region.chromosome.apply(str) + "_" + df_region.start.apply(int).apply(str) + "_" + df_region.end.apply(int).apply(str)
 
         # get the coverage df
         bed_file = "%s.%s.bed"%(bed_windows_prefix, region)
@@ -4077,28 +4818,24 @@ def get_df_with_coverage_per_windows_relative_to_neighbor_regions(df_windows, be
         if only_generate_regions_coverage is True: continue
 
         coverage_df = get_coverage_per_window_df_without_repeating(reference_genome, sorted_bam, bed_file, replace=replace, run_in_parallel=run_in_parallel, delete_bams=delete_bams, threads=threads, validate_all_coverage_already_calculated=validate_all_coverage_already_calculated).drop_duplicates(subset=["chromosome", "start", "end"])
-        coverage_df.index = coverage_df.apply(get_IDwindow_df, axis=1)
+        coverage_df.index = coverage_df.chromosome.apply(str) + "_" + coverage_df.start.apply(int).apply(str) + "_" + coverage_df.end.apply(int).apply(str)
 
         # make sure that they are unique
         if len(coverage_df)!=len(set(coverage_df.index)): raise ValueError("coverage_df is not unique")
 
-        # add the coverage to the windows df
-        df_region["IDwindow"] = df_region.index
-        df_region["coverage"] = df_region.IDwindow.apply(lambda x: coverage_df.loc[x, "mediancov_1"])
+        # add the coverage to the windows df, which are in the same order as all_df_windows
+        df_region["coverage"] = coverage_df.mediancov_1.reindex(df_region.index).values
         if any(pd.isna(df_region.coverage)): raise ValueError("there should be no NaNs")
 
-        # add the original index
-        df_region.index = all_df_windows_index
-
         # add to all df
-        all_df_windows["%s_coverage"%region] = all_df_windows.IDwindow.apply(lambda x: df_region.loc[x, "coverage"])
+        all_df_windows["%s_coverage"%region] = df_region.coverage.values
 
         # add relative parms
         all_df_windows["relative_coverage_%s"%region] = all_df_windows["%s_coverage"%region]/median_coverage
 
         # add rge coordinates
-        all_df_windows["%s_region_start"%region] = all_df_windows.IDwindow.apply(lambda x: df_region.loc[x, "start"])
-        all_df_windows["%s_region_end"%region] = all_df_windows.IDwindow.apply(lambda x: df_region.loc[x, "end"])
+        all_df_windows["%s_region_start"%region] = df_region.start.values
+        all_df_windows["%s_region_end"%region] = df_region.end.values
 
     if only_generate_regions_coverage is True: return
 
@@ -4356,7 +5093,7 @@ def write_clove_df_into_bedORbedpe_files_like_RSVSim(df_clove, fileprefix, refer
     # GENERAL THINGS #############
 
     # add length chromosome
-    chr_to_len = {seq.id: len(seq.seq) for seq in SeqIO.parse(reference_genome, "fasta")}
+    chr_to_len = get_chrom_to_len_genome_store(reference_genome)
 
     # define the svtypes that are straightforwardly classified
     cloveSVtypes_easy_classification = {"CID", "CIT", "DUP", "TRA", "CIV", "IVD"} # note that DEL and TAN are left out because they may not directly be assignable to DEL and TAN
@@ -4935,129 +5672,224 @@ def get_sorted_bam_one_chromosome(input_sorted_bam, chromosome, threads=4):
 
     return output_sorted_bam
 
-def run_freebayes_parallel_regions(outdir_freebayes, ref, sorted_bam, ploidy, coverage, threads=4, replace=False, pooled_sequencing=False, window_fb=10000, fb_use_best_n_alleles=20):
+def get_freebayes_regions_balanced_by_coverage(ref, sorted_bam, window_fb, threads=4, replace=False):
 
-    """It parallelizes over the provided threads of the system"""
+    """Takes a sorted bam and returns a df with the regions (chromosome, start, end, region, estimated_work) to run freebayes on. The regions are sized so that they have the same expected work, estimated as the number of bp * (read depth + 1), where the read depth comes from the mosdepth coverage per window of sorted_bam (it is generated if not already there). There are as many regions as non-overlapping windows of window_fb, so that deep regions (i.e. repeats) are split into shorter regions and shallow ones are merged."""
 
-    # make the dir if not already done
-    make_folder(outdir_freebayes)
+    # get the coverage per window
+    coverage_file = generate_coverage_per_window_file_parallel(ref, "%s.calculating_windowcoverage"%sorted_bam, sorted_bam, windows_file="none", replace=replace, run_in_parallel=True, delete_bams=True, threads=threads)
+    df_coverage = pd.read_csv(coverage_file, sep="\t")
+    df_coverage["chromosome"] = df_coverage["#chrom"].apply(str)
+    df_coverage["work"] = (df_coverage.end - df_coverage.start) * (df_coverage.mediancov_1.fillna(0) + 1)
 
-    #run freebayes
-    freebayes_output ="%s/output.raw.vcf"%outdir_freebayes; freebayes_output_tmp = "%s.tmp"%freebayes_output
-    if file_is_empty(freebayes_output) or replace is True:
+    # define the chromosomes
+    chrom_to_len = get_chr_to_len(ref)
+    chrom_to_df_coverage = dict(list(df_coverage.groupby("chromosome")))
 
-        print_if_verbose("running freebayes in parallel with %i threads"%(threads))
+    # define the work per region
+    total_work = sum(df_coverage.work) + sum([len_chrom for chrom, len_chrom in chrom_to_len.items() if chrom not in chrom_to_df_coverage])
+    nregions = max(int(np.ceil(sum(chrom_to_len.values())/window_fb)), threads)
+    work_per_region = total_work/nregions
 
-        # define the regions file
-        regions_file = "%s/regions_genome_%ibp.tab"%(outdir_freebayes, window_fb)
-        regions_file_stderr = "%s.generating.stderr"%regions_file
-        print_if_verbose("getting regions for freebayes run in parallel. The stderr is in %s"%regions_file_stderr)
-        run_cmd("%s %s.fai %i > %s 2>%s"%(fasta_generate_regions_py, ref, window_fb, regions_file, regions_file_stderr))
-        remove_file(regions_file_stderr)
-        regions = [l.strip() for l in open(regions_file, "r").readlines()]
-        print_if_verbose("There are %i regions to run freebayes on."%(len(regions)))
+    # split each chromosome where the cumulative work crosses multiples of work_per_region (linearly interpolating inside the coverage windows)
+    all_df_regions = []
+    for chrom, len_chrom in chrom_to_len.items():
 
-        # sort values by numeric position and then chromosome, so that you maximize accessing different chromosomes at different times
-        # regions = sorted(regions, key=(lambda r: (int(r.split(":")[1].split("-")[0]), r.split(":")[0]))) # enable better access
+        # get the cumulative work at the window edges
+        if chrom in chrom_to_df_coverage:
+            df_c = chrom_to_df_coverage[chrom].sort_values(by="start")
+            edges = np.append(df_c.start.values, df_c.end.values[-1]).astype(float)
+            cum_work = np.append(0, np.cumsum(df_c.work.values))
 
-        # define one sorted bam for each chromosome to optimize
-        # print_if_verbose("getting sorted bams for chromosomes...")
-        # chrom_to_sorted_bam = {}
-        # for chrom in sorted(get_chr_to_len(ref).keys()): chrom_to_sorted_bam[chrom] = get_sorted_bam_one_chromosome(sorted_bam, chrom, threads=threads)
+        else:
+            edges = np.array([0, len_chrom], dtype=float)
+            cum_work = np.array([0, len_chrom], dtype=float)
 
-        # remove the previous tmp file
-        remove_file(freebayes_output_tmp)
+        # get the breakpoints
+        nregions_chrom = max(int(np.ceil(cum_work[-1]/work_per_region)), 1)
+        breakpoints = np.interp(cum_work[-1]*(np.arange(1, nregions_chrom)/nregions_chrom), cum_work, edges).round().astype(int)
+        breakpoints = np.unique(np.concatenate([[0], breakpoints[(breakpoints>0) & (breakpoints<len_chrom)], [len_chrom]]))
 
-        # make a dir to store the vcfs
-        regions_vcfs_dir = "%s/regions_vcfs"%outdir_freebayes; make_folder(regions_vcfs_dir)
+        # keep
+        df_regions_chrom = pd.DataFrame({"start":breakpoints[:-1], "end":breakpoints[1:]})
+        df_regions_chrom["chromosome"] = chrom
+        df_regions_chrom["estimated_work"] = np.diff(np.interp(breakpoints, edges, cum_work))
+        all_df_regions.append(df_regions_chrom)
 
-        # init the df that will have all these vcfs and also the header lines
-        all_df = pd.DataFrame()
-        all_header_lines = []
+    df_regions = pd.concat(all_df_regions, sort=True)
+    df_regions["region"] = df_regions.chromosome + ":" + df_regions.start.apply(str) + "-" + df_regions.end.apply(str)
+    print_if_verbose("There are %i regions balanced by coverage. The estimated work per region is %.0f (max %.0f)"%(len(df_regions), work_per_region, max(df_regions.estimated_work)))
 
-        ############ FEED THE ALL_DF #############
+    return df_regions[["chromosome", "start", "end", "region", "estimated_work"]]
 
-        # size_chunk = 100 # this has to be constant, it used to be 100
-        size_chunk = 10000000000000 # skip chunking
-        for Ic, chunk_regions in enumerate(chunks(regions, size_chunk)):
-            print_if_verbose("working on chunk %i/%i"%(Ic, int(len(regions)/size_chunk)))
+def get_records_freebayes_region_vcf(vcf):
 
-            # get the df of this chunk
-            all_df_chunk_file = "%s/regions_chunk%i_all_df_concatenated.tab"%(regions_vcfs_dir, Ic)
-            all_header_lines_chunk_file = "%s/regions_chunk%i_header_lines.py"%(regions_vcfs_dir, Ic)
-            if file_is_empty(all_df_chunk_file) or replace is True:
+    """Takes a vcf of one region and yields (POS, REF, ALT, line) for each record"""
 
-                # restart the folder
-                regions_vcfs_dir_chunk = "%s/regions_chunk%i"%(regions_vcfs_dir, Ic)
-                make_folder(regions_vcfs_dir_chunk)
+    with open(vcf, "r") as fd:
+        for line in fd:
+            if line.startswith("#"): continue
 
-                # define the inputs of the function
-                # inputs_fn = [(region, regions_vcfs_dir_chunk, ref, chrom_to_sorted_bam[region.split(":")[0]], ploidy, coverage, replace, pooled_sequencing, fb_use_best_n_alleles) for region in chunk_regions] # region bam
-                inputs_fn = [(region, regions_vcfs_dir_chunk, ref, sorted_bam, ploidy, coverage, replace, pooled_sequencing, fb_use_best_n_alleles) for region in chunk_regions] # whole bam
+            if not line.endswith("\n"): line += "\n"
+            fields = line.split("\t", 5)
+            yield (int(fields[1]), fields[3], fields[4], line)
 
-                # debug 
-                #inputs_fn = inputs_fn[0:5] # debug
+def write_merged_freebayes_region_vcfs(df_regions, outfile):
 
-                # initialize the pool class with the available CPUs --> this is asyncronous parallelization
-                with multiproc.Pool(threads) as pool:
+    """Takes a df_regions with the chromosome, start and vcf of each region and writes a merged vcf into outfile. The records are streamed with a k-way merge on (CHROM, POS) over the region vcfs, where each vcf is only opened when the merge reaches its start, so that few files are open at the same time. Records with the same POS are sorted by REF and ALT, and duplicated records (i.e. from regions that overlap a variant) are removed, as in a sort + drop_duplicates on #CHROM, POS, REF, ALT. If a record comes after one with a higher POS (i.e. freebayes may report a variant that starts just before the region) the chromosome is rewritten from the sorted records of all its vcfs."""
 
-                    # run in parallel the freebayes generation for all the 
-                    regions_vcfs = pool.starmap(run_freebayes_for_region, inputs_fn, chunksize=1)
+    print_if_verbose("merging the vcfs of %i regions"%len(df_regions))
 
-                    # close the pool
-                    pool.close()
-                    pool.terminate()
+    # check that all the headers are the same
+    all_header_lines = set()
+    chrom_line = None
+    for vcf in df_regions.vcf:
 
-                # go through each of the chromosomal vcfs and append to a whole df
-                print_if_verbose("appending all vcfs of the individual regions together")
-                all_header_lines_chunk = []
-                all_df_chunk = pd.DataFrame()
-                for Iregion, vcf in enumerate(regions_vcfs):
-                    print_if_verbose("Working on region %i/%i"%(Iregion+1, len(regions_vcfs)))
+        header_lines = []
+        with open(vcf, "r") as fd:
+            for line in fd:
+                if line.startswith("##"): header_lines.append(line)
+                elif line.startswith("#CHROM"): 
+                    if chrom_line is None: chrom_line = line
+                    break
 
-                    # load the df keeping the header lines
-                    header_lines = [l for l in open(vcf, "r") if l.startswith("##")]
-                    df = pd.read_csv(vcf, sep="\t", header = len(header_lines))
+                else: break
 
-                    # define the vcf header
-                    vcf_header = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
-                    sample_header = [c for c in df.columns if c not in vcf_header][0]
-                    vcf_header.append(sample_header)
+        # keep header that is unique
+        all_header_lines.add("".join([line for line in header_lines if line.split("=")[0] not in {"##reference", "##commandline", "##fileDate"}]))
 
-                    # keep header that is unique
-                    all_header_lines_chunk.append("".join([line for line in header_lines if line.split("=")[0] not in {"##reference", "##commandline", "##fileDate"}]))
-                    
-                    # append to the previous df
-                    all_df_chunk = all_df_chunk.append(df[vcf_header], sort=True)
+    if len(all_header_lines)!=1: 
+        print_if_verbose("These are the header lines: ", all_header_lines)
+        print_if_verbose("There are %i unique headers"%len(all_header_lines))
+        raise ValueError("Not all headers are the same in the individual chromosomal vcfs. This may indicate a problem with parallelization of freebayes")
 
-                # delete unnecessary files
-                delete_folder(regions_vcfs_dir_chunk)
+    with open(outfile, "w") as fd:
 
-                # save
-                save_object(all_header_lines_chunk, all_header_lines_chunk_file)
-                save_df_as_tab(all_df_chunk, all_df_chunk_file)
+        # write the header
+        fd.write(next(iter(all_header_lines)) + chrom_line)
+
+        # go through each chromosome, sorted as strings
+        for chrom, df_chrom in df_regions.groupby("chromosome"):
+
+            # define the regions, sorted by start
+            pending_regions = [(start, vcf) for start, vcf in df_chrom.sort_values(by="start")[["start", "vcf"]].values]
+            Ipending = 0
+
+            # init the heap, which has (POS, Ivcf, record, records_iterator)
+            heap = []
+            previous_pos = 0
+            records_pos = []
+            records_are_sorted = True
+            chrom_offset = fd.tell()
+
+            while Ipending<len(pending_regions) or len(heap)>0:
+
+                # open the regions that start before the current POS (records are always after the region start)
+                while Ipending<len(pending_regions) and (len(heap)==0 or heap[0][0]>pending_regions[Ipending][0]):
+
+                    records_iterator = get_records_freebayes_region_vcf(pending_regions[Ipending][1])
+                    for record in records_iterator: 
+                        heapq.heappush(heap, (record[0], Ipending, record, records_iterator))
+                        break
+
+                    Ipending += 1
+
+                if len(heap)==0: break
+
+                # get the next record
+                pos, Ivcf, record, records_iterator = heapq.heappop(heap)
+                for next_record in records_iterator: 
+                    heapq.heappush(heap, (next_record[0], Ivcf, next_record, records_iterator))
+                    break
+
+                # write the records of the previous POS, sorted by REF, ALT and without duplicates
+                if pos!=previous_pos:
+                    if pos<previous_pos: 
+                        records_are_sorted = False
+                        break
+
+                    fd.write("".join([r[3] for r in get_unique_records_sorted_by_ref_alt(records_pos)]))
+                    records_pos = []
+                    previous_pos = pos
+
+                records_pos.append(record)
+
+            if records_are_sorted is True: fd.write("".join([r[3] for r in get_unique_records_sorted_by_ref_alt(records_pos)]))
+
+            # rewrite the chromosome from all the records sorted by POS (keeping the order of the regions for the same POS)
+            else:
+                print_if_verbose("The records of %s are not sorted by position. Sorting them"%chrom)
+                fd.seek(chrom_offset); fd.truncate()
+
+                all_records = sorted([record for start, vcf in pending_regions for record in get_records_freebayes_region_vcf(vcf)], key=(lambda r: r[0]))
+                for pos, records_pos in itertools.groupby(all_records, key=(lambda r: r[0])): fd.write("".join([r[3] for r in get_unique_records_sorted_by_ref_alt(list(records_pos))]))
+
+def get_unique_records_sorted_by_ref_alt(records):
+
+    """Takes a list of (POS, REF, ALT, line) records and returns them sorted by REF and ALT, keeping the first of each (REF, ALT)"""
+
+    unique_records = []
+    previous_ref_alt = None
+    for record in sorted(records, key=(lambda r: (r[1], r[2]))):
+        if (record[1], record[2])!=previous_ref_alt: unique_records.append(record)
+        previous_ref_alt = (record[1], record[2])
+
+    return unique_records
+
+def run_freebayes_parallel_regions(outdir_freebayes, ref, sorted_bam, ploidy, coverage, threads=4, replace=False, pooled_sequencing=False, window_fb=10000, fb_use_best_n_alleles=20, balance_regions_by_coverage=True):
+
+    """It parallelizes over the provided threads of the system. If balance_regions_by_coverage is True the regions are sized so that they have similar read depth * length (see get_freebayes_regions_balanced_by_coverage). Otherwise they are windows of window_fb. The regions with more expected work are run first, and the region vcfs are merged with a k-way merge."""
+
+    # make the dir if not already done
+    make_folder(outdir_freebayes)
+
+    #run freebayes
+    freebayes_output ="%s/output.raw.vcf"%outdir_freebayes; freebayes_output_tmp = "%s.tmp"%freebayes_output
+    if file_is_empty(freebayes_output) or replace is True:
+
+        print_if_verbose("running freebayes in parallel with %i threads"%(threads))
+
+        # define the regions, sorted so that the ones with more expected work are run first
+        if balance_regions_by_coverage is True: df_regions = get_freebayes_regions_balanced_by_coverage(ref, sorted_bam, window_fb, threads=threads, replace=replace)
 
-            # load files
-            all_header_lines_chunk = load_object(all_header_lines_chunk_file)
-            all_df_chunk = get_tab_as_df_or_empty_df(all_df_chunk_file)
+        else:
+            regions_file = "%s/regions_genome_%ibp.tab"%(outdir_freebayes, window_fb)
+            regions_file_stderr = "%s.generating.stderr"%regions_file
+            print_if_verbose("getting regions for freebayes run in parallel. The stderr is in %s"%regions_file_stderr)
+            run_cmd("%s %s.fai %i > %s 2>%s"%(fasta_generate_regions_py, ref, window_fb, regions_file, regions_file_stderr))
+            remove_file(regions_file_stderr)
+
+            df_regions = pd.DataFrame({"region" : [l.strip() for l in open(regions_file, "r").readlines()]})
+            df_regions["chromosome"] = df_regions.region.apply(lambda r: r.rsplit(":", 1)[0])
+            df_regions["start"] = df_regions.region.apply(lambda r: int(r.rsplit(":", 1)[1].split("-")[0]))
+            df_regions["end"] = df_regions.region.apply(lambda r: int(r.rsplit(":", 1)[1].split("-")[1]))
+            df_regions["estimated_work"] = df_regions.end - df_regions.start
+
+        df_regions = df_regions.sort_values(by="estimated_work", ascending=False)
+        print_if_verbose("There are %i regions to run freebayes on."%(len(df_regions)))
+
+        # remove the previous tmp file
+        remove_file(freebayes_output_tmp)
+
+        # make a dir to store the vcfs
+        regions_vcfs_dir = "%s/regions_vcfs"%outdir_freebayes; make_folder(regions_vcfs_dir)
 
-            # add to the final dfs
-            all_header_lines += all_header_lines_chunk
-            all_df = all_df.append(all_df_chunk)
+        # define the inputs of the function, longest first. With chunksize=1 each free process takes the next longest region
+        inputs_fn = [(region, regions_vcfs_dir, ref, sorted_bam, ploidy, coverage, replace, pooled_sequencing, fb_use_best_n_alleles) for region in df_regions.region]
 
-        ##########################################
+        # initialize the pool class with the available CPUs --> this is asyncronous parallelization
+        with multiproc.Pool(threads) as pool:
 
-        # check that all headers are the same
-        if len(set(all_header_lines))!=1: 
-            print_if_verbose("These are the header lines: ", set(all_header_lines))
-            print_if_verbose("There are %i unique headers"%len(set(all_header_lines)))
-            raise ValueError("Not all headers are the same in the individual chromosomal vcfs. This may indicate a problem with parallelization of freebayes")
+            # run in parallel the freebayes generation for all the 
+            regions_vcfs = pool.starmap(run_freebayes_for_region, inputs_fn, chunksize=1)
 
-        # sort and remove duplicate entries
-        all_df = all_df.sort_values(by=["#CHROM", "POS", "REF", "ALT"]).drop_duplicates(subset=["#CHROM", "POS", "REF", "ALT"])
+            # close the pool
+            pool.close()
+            pool.terminate()
 
-        # write the file
-        open(freebayes_output_tmp, "w").write(all_header_lines[0] + all_df[vcf_header].to_csv(sep="\t", index=False, header=True))
+        # merge the vcfs of all regions
+        df_regions["vcf"] = regions_vcfs
+        write_merged_freebayes_region_vcfs(df_regions, freebayes_output_tmp)
 
         # remove tmp vcfs
         delete_folder(regions_vcfs_dir)
@@ -6707,11 +7539,98 @@ def get_is_matching_predicted_and_known_rows(rk, rp, equal_fields, approximate_f
 
     return  equal_fields_match and approximate_fields_match and regions_overlap
 
+def get_predictedSV_IDs_per_known_sortedIndex(df_known, df_predicted, equal_fields, approximate_fields, chromField_to_posFields, tol_bp=50, pct_overlap=0.75, predicted_IDfield="ID"):
+
+    """Takes a df_known and a df_predicted and returns a list (one element per row of df_known) with the set of predicted IDs that match each known SV, with the same criteria as get_is_matching_predicted_and_known_rows. The predicted SVs are grouped by the equal_fields (which include the chromosomes) and sorted by the first approximate field. The candidates of each known SV are found by binary search within tol_bp, and the other approximate fields and the pct_overlap are checked in a vectorized way only on these candidates."""
+
+    # if there are no predicted SVs, return empty sets
+    if len(df_predicted)==0: return [set() for I in range(len(df_known))]
+
+    # define the arrays of the predicted SVs
+    predicted_IDs = np.array(df_predicted[predicted_IDfield], dtype=object)
+    predicted_field_to_array = {f : np.array(df_predicted[f]) for f in set(approximate_fields).union(set(chromField_to_posFields))}
+    for posFields in chromField_to_posFields.values():
+        for f in posFields.values(): predicted_field_to_array[f] = np.array(df_predicted[f])
+
+    # map each combination of equal_fields to the predicted indices, sorted by the first approximate field
+    equalKey_to_Is = {}
+    for I, equal_key in enumerate(zip(*[df_predicted[f] for f in equal_fields])): equalKey_to_Is.setdefault(equal_key, []).append(I)
+
+    if len(equal_fields)==0: equalKey_to_Is = {() : list(range(len(df_predicted)))}
+
+    equalKey_to_sortedIndex = {}
+    for equal_key, Is in equalKey_to_Is.items():
+        Is = np.array(Is, dtype=int)
+
+        if len(approximate_fields)>0:
+            sorting_values = predicted_field_to_array[approximate_fields[0]][Is]
+            Is = Is[np.argsort(sorting_values, kind="mergesort")]
+            equalKey_to_sortedIndex[equal_key] = (predicted_field_to_array[approximate_fields[0]][Is], Is)
+
+        else: equalKey_to_sortedIndex[equal_key] = (None, Is)
+
+    # define the known fields needed
+    known_fields = list(equal_fields) + [f for f in predicted_field_to_array if f not in equal_fields]
+    if "POS" in df_known.keys(): known_fields += [f for f in ["POS", "START", "END"] if f not in known_fields]
+    known_field_to_array = {f : np.array(df_known[f]) for f in known_fields}
+
+    # go through each known SV
+    predictedSV_IDs_list = []
+    for Ik in range(len(df_known)):
+
+        # get the predicted SVs with the same equal_fields
+        equal_key = tuple([known_field_to_array[f][Ik] for f in equal_fields])
+        if equal_key not in equalKey_to_sortedIndex:
+            predictedSV_IDs_list.append(set())
+            continue
+
+        sorted_values, Is = equalKey_to_sortedIndex[equal_key]
+
+        # if the known is all 0s there is no match
+        if "POS" in known_field_to_array and all([known_field_to_array[f][Ik]==0 for f in ["POS", "START", "END"]]):
+            predictedSV_IDs_list.append(set())
+            continue
+
+        # binary search of the candidates within tol_bp of the first approximate field
+        if sorted_values is not None:
+            value_k = known_field_to_array[approximate_fields[0]][Ik]
+            Is = Is[np.searchsorted(sorted_values, value_k-tol_bp, side="left"):np.searchsorted(sorted_values, value_k+tol_bp, side="right")]
+
+        # keep the ones where all approximate fields are within tol_bp
+        for f in approximate_fields:
+            if len(Is)==0: break
+            Is = Is[np.abs(predicted_field_to_array[f][Is] - known_field_to_array[f][Ik])<=tol_bp]
+
+        # keep the ones where all the chromField_to_posFields overlap by more than pct_overlap
+        for chromField, posFields in chromField_to_posFields.items():
+            if len(Is)==0: break
+
+            start_k = known_field_to_array[posFields["start"]][Ik]
+            end_k = known_field_to_array[posFields["end"]][Ik]
+            len_k = end_k-start_k
+
+            start_p = predicted_field_to_array[posFields["start"]][Is]
+            end_p = predicted_field_to_array[posFields["end"]][Is]
+            len_p = end_p-start_p
+
+            # make sure that the end is after the start
+            if len_k<=0 or any(len_p<=0): raise ValueError("start is after end")
+
+            # get the fraction of overlap relative to the longest region
+            len_overlap = np.minimum(end_p, end_k) - np.maximum(start_p, start_k)
+            longest_region_len = np.maximum(len_p, len_k)
+
+            Is = Is[(predicted_field_to_array[chromField][Is]==known_field_to_array[chromField][Ik]) & ((len_overlap/longest_region_len)>=pct_overlap)]
+
+        predictedSV_IDs_list.append(set(predicted_IDs[Is]))
+
+    return predictedSV_IDs_list
+
 def get_SVbenchmark_dict(df_predicted, df_known, equal_fields=["Chr"], approximate_fields=["Start", "End"], chromField_to_posFields={}, tol_bp=50, pct_overlap=0.75):
 
     """Takes dfs for known and predicted SVs and returns a df with the benchmark. approximate_fields are fields that have to overlap at least by tolerance_bp. It returns a dict that maps each of the benchmark fields to the value. pct_overlap is the percentage of overlap between each of the features in approximate_fields.
 
-    chromField_to_posFields is a dict that maps each chromosome field to the start and end fields that need to be interrogated by pct_overlap"""
+    chromField_to_posFields is a dict that maps each chromosome field to the start and end fields that need to be interrogated by pct_overlap. The matching is done in-process with a sorted index of the predicted SVs (see get_predictedSV_IDs_per_known_sortedIndex), which gives the same matches as comparing each known and predicted SV with get_is_matching_predicted_and_known_rows."""
 
     # define the ID fields 
     if "Name" in df_known.keys(): known_IDfield = "Name"
@@ -6725,7 +7644,7 @@ def get_SVbenchmark_dict(df_predicted, df_known, equal_fields=["Chr"], approxima
     # get the predictedIDs as those that have the same equal_fields and overlap in all approximate_fields
     if len(df_predicted)>0: 
 
-        df_known["predictedSV_IDs"] = df_known.apply(lambda rk: set(df_predicted[df_predicted.apply(lambda rp: get_is_matching_predicted_and_known_rows(rk, rp, equal_fields, approximate_fields, chromField_to_posFields, tol_bp=tol_bp, pct_overlap=pct_overlap), axis=1)][predicted_IDfield]), axis=1)
+        df_known["predictedSV_IDs"] = get_predictedSV_IDs_per_known_sortedIndex(df_known, df_predicted, equal_fields, approximate_fields, chromField_to_posFields, tol_bp=tol_bp, pct_overlap=pct_overlap, predicted_IDfield=predicted_IDfield)
 
     else: df_known["predictedSV_IDs"] = [set()]*len(df_known)
 
@@ -6746,10 +7665,19 @@ def get_SVbenchmark_dict(df_predicted, df_known, equal_fields=["Chr"], approxima
     else: all_predicted_IDs = set()
 
     true_positives_knownIDs = set(df_known_matching[known_IDfield])
-    false_negatives_knownIDs = all_known_IDs.difference(true_positives_knownIDs)
     
     if len(df_known_matching)==0:  true_positives_predictedIDs = set()
     else: true_positives_predictedIDs = set.union(*df_known_matching.predictedSV_IDs)
+
+    # get dict
+    return get_SVbenchmark_dict_from_IDsets(all_known_IDs, all_predicted_IDs, true_positives_knownIDs, true_positives_predictedIDs)
+
+def get_SVbenchmark_dict_from_IDsets(all_known_IDs, all_predicted_IDs, true_positives_knownIDs, true_positives_predictedIDs):
+
+    """Takes the sets of known and predicted IDs, together with the ones that are true positives, and returns the benchmarking dict of get_SVbenchmark_dict."""
+
+    # define the false sets
+    false_negatives_knownIDs = all_known_IDs.difference(true_positives_knownIDs)
     false_positives_predictedIDs = all_predicted_IDs.difference(true_positives_predictedIDs)
 
     # calculate stats
@@ -6917,20 +7845,90 @@ def get_SVbenchmark_dict_fast(df_predicted, df_known, tmpdir, equal_fields=["Chr
     # get dict
     return {"TP":TP, "FP":FP, "FN":FN, "Fvalue":Fvalue, "nevents":nevents, "precision":precision, "recall":recall, "TP_predictedIDs":TP_predictedIDs, "true_positives_knownIDs":set_to_str(true_positives_knownIDs), "false_negatives_knownIDs":set_to_str(false_negatives_knownIDs), "true_positives_predictedIDs":set_to_str(true_positives_predictedIDs), "false_positives_predictedIDs":set_to_str(false_positives_predictedIDs)}
 
+def get_SVbenchmark_dicts_batch(predsvfile_list, df_known, equal_fields=["Chr"], approximate_fields=["Start", "End"], chromField_to_posFields={}, tol_bp=50, pct_overlap=0.75):
 
+    """Batch version of get_SVbenchmark_dict for several predicted SV sets (predsvfile_list, each a file, a df or None if there are no predictions) benchmarked against the same df_known. Each unique predicted SV (defined by the fields used for matching) is matched against the known SVs only once, and the benchmarking dict of each predicted set is derived from set algebra over the unique SVs that it contains. It returns a list of dicts, the same as running get_SVbenchmark_dict on each predicted set."""
 
+    # define the ID fields
+    if "Name" in df_known.keys(): known_IDfield = "Name"
+    else: known_IDfield = "ID"
 
-def get_represenative_filtersDict_for_filtersDict_list(filtersDict_list, type_filters="less_conservative"):
+    predicted_IDfield = "ID"
 
-    """Takes a lis, each position with a list of filters like passed to get_tupleBreakpoints_for_filters_GRIDSS and returns a representative dict, according to less_conservative"""
+    # if the known is empty, return
+    if len(df_known)==0: return [{"TP":0, "FP":0, "FN":0, "Fvalue":0.0, "nevents":0, "precision":0.0, "recall":0.0, "TP_predictedIDs":"", "true_positives_knownIDs":"", "false_negatives_knownIDs":"", "true_positives_predictedIDs":"", "false_positives_predictedIDs":""} for x in predsvfile_list]
 
-    # map a score for each dict
-    score_to_dict = {sum([g_filterName_to_filterValue_to_Number[fname][find_nearest(g_filterName_to_filtersList[fname], fvalue)] for fname, fvalue in filtersDict.items()]) : filtersDict for filtersDict in filtersDict_list}
+    # define the fields that define whether two predicted SVs match the same known SVs
+    matching_fields = []
+    for f in (list(equal_fields) + list(approximate_fields) + list(chromField_to_posFields) + [posF for posFields in chromField_to_posFields.values() for posF in posFields.values()]):
+        if f not in matching_fields: matching_fields.append(f)
 
-    # get the dict with the min or max score, depedning on the approach
-    type_filters_to_getPositionFun = {"less_conservative":min, "most_conservative":max}
+    # map each predicted SV to an unique SV, keeping the IDs of each predicted set
+    matchingKey_to_uniqueIdx = {}
+    unique_matching_keys = []
+    predictedIDs_and_uniqueIdxs_list = []
 
-    return score_to_dict[type_filters_to_getPositionFun[type_filters](score_to_dict.keys())]
+    for predsvfile in predsvfile_list:
+
+        # load the predicted df
+        if predsvfile is None: df_predicted = pd.DataFrame()
+        elif type(predsvfile)==str: df_predicted = pd.read_csv(predsvfile, sep="\t")
+        else: df_predicted = predsvfile
+
+        if len(df_predicted)==0:
+            predictedIDs_and_uniqueIdxs_list.append((np.array([], dtype=object), np.array([], dtype=int)))
+            continue
+
+        uniqueIdxs = []
+        for matching_key in zip(*[df_predicted[f] for f in matching_fields]):
+
+            if matching_key not in matchingKey_to_uniqueIdx:
+                matchingKey_to_uniqueIdx[matching_key] = len(unique_matching_keys)
+                unique_matching_keys.append(matching_key)
+
+            uniqueIdxs.append(matchingKey_to_uniqueIdx[matching_key])
+
+        predictedIDs_and_uniqueIdxs_list.append((np.array(df_predicted[predicted_IDfield], dtype=object), np.array(uniqueIdxs, dtype=int)))
+
+    # match the unique predicted SVs against the known ones
+    df_unique = pd.DataFrame(unique_matching_keys, columns=matching_fields)
+    df_unique["uniqueIdx"] = list(range(len(df_unique)))
+    uniqueIdxs_per_known = get_predictedSV_IDs_per_known_sortedIndex(df_known, df_unique, equal_fields, approximate_fields, chromField_to_posFields, tol_bp=tol_bp, pct_overlap=pct_overlap, predicted_IDfield="uniqueIdx")
+
+    if any([len(x)>1 for x in uniqueIdxs_per_known]): print_if_verbose("WARNING: There are some predictedIDs that match more than one variant")
+
+    # map each unique predicted SV to the known IDs that it matches
+    uniqueIdx_to_knownIDs = {}
+    for knownID, uniqueIdxs in zip(df_known[known_IDfield], uniqueIdxs_per_known):
+        for uniqueIdx in uniqueIdxs: uniqueIdx_to_knownIDs.setdefault(uniqueIdx, set()).add(knownID)
+
+    is_matching_unique = np.zeros(len(df_unique), dtype=bool)
+    is_matching_unique[list(uniqueIdx_to_knownIDs)] = True
+
+    # get the benchmarking of each predicted set
+    all_known_IDs = set(df_known[known_IDfield])
+    dict_benchmark_list = []
+    for predicted_IDs, uniqueIdxs in predictedIDs_and_uniqueIdxs_list:
+
+        is_matching = is_matching_unique[uniqueIdxs]
+        true_positives_predictedIDs = set(predicted_IDs[is_matching])
+        true_positives_knownIDs = set.union(set(), *[uniqueIdx_to_knownIDs[uniqueIdx] for uniqueIdx in set(uniqueIdxs[is_matching])])
+
+        dict_benchmark_list.append(get_SVbenchmark_dict_from_IDsets(all_known_IDs, set(predicted_IDs), true_positives_knownIDs, true_positives_predictedIDs))
+
+    return dict_benchmark_list
+
+def get_represenative_filtersDict_for_filtersDict_list(filtersDict_list, type_filters="less_conservative"):
+
+    """Takes a lis, each position with a list of filters like passed to get_tupleBreakpoints_for_filters_GRIDSS and returns a representative dict, according to less_conservative"""
+
+    # map a score for each dict
+    score_to_dict = {sum([g_filterName_to_filterValue_to_Number[fname][find_nearest(g_filterName_to_filtersList[fname], fvalue)] for fname, fvalue in filtersDict.items()]) : filtersDict for filtersDict in filtersDict_list}
+
+    # get the dict with the min or max score, depedning on the approach
+    type_filters_to_getPositionFun = {"less_conservative":min, "most_conservative":max}
+
+    return score_to_dict[type_filters_to_getPositionFun[type_filters](score_to_dict.keys())]
 
 def get_changing_fields_in_df_benchmark(df):
 
@@ -7713,6 +8711,7 @@ def clean_perSVade_outdir(outdir):
        # immediate files
        "aligned_reads.bam.sorted.CollectInsertSizeMetrics.out",
        "aligned_reads.bam.sorted.coverage_per_window.tab",
+       "aligned_reads.bam.sorted.per_base_coverage_store",
        "aligned_reads.bam.sorted.histogram_insertsizes.pdf",
        "aligned_reads.bam.sorted.tmp.MarkDups.bam.bai",
        "aligned_reads.bam.sorted.tmp.MarkDups.metrics",
@@ -8235,16 +9234,9 @@ def count_number_read_pairs(bamfile, replace=False, threads=4):
 
 
 
-def run_wgsim_pairedEnd_for_window(genome, chromosome, start, end, readPairs, read_length, outdir,  median_insert_size, median_insert_size_sd, replace, error_rate=0.02):
-
-    """Takes a region of a genome and generates a fasta file for it under outdir. Then it runs wgsim to simulate total_readPairs. It returns a tupple of the (read1, read2) in .gz . It assumes that the error rate is 0.02, which was benchmarked in https://bmcbioinformatics.biomedcentral.com/articles/10.1186/1471-2105-14-184.
-
-    This is run on haplotype mode (which means that all introduced vars are homozygous (although I am not introducing any vars))"""
-
-    # get the time
+def get_region_and_insert_size_for_window_read_simulation(genome, chromosome, start, end, read_length, median_insert_size, median_insert_size_sd, ID):
 
-    # define the ID
-    ID = "%s_%i_%i_readlen%i_nreads%i_insertsize%i+-%i_error%.3f"%(chromosome, start, end, read_length, readPairs, median_insert_size, median_insert_size_sd, error_rate)
+    """Takes a window of a genome where reads are to be simulated and returns a tuple (start, end, median_insert_size, median_insert_size_sd), where windows that are too short for the reads are extended and the insert size is reduced for short windows. ID is used to report errors."""
 
     # define region
     len_region = end - start
@@ -8255,7 +9247,7 @@ def run_wgsim_pairedEnd_for_window(genome, chromosome, start, end, readPairs, re
         print_if_verbose("WARNING: The length of the region is %i and the length of the reads is %i. Setting the length of the region to %i. We will try to set the region to the 5' of the chromosome, and to the 3' if not possible."%(len_region, read_length, min_length_region))
 
         # get the length of the chromosome
-        len_chr = [len(chrom) for chrom in SeqIO.parse(genome, "fasta") if chrom.id==chromosome][0]
+        len_chr = get_chrom_to_len_genome_store(genome)[chromosome]
 
         # define the region to extend
         length_to_extend = min_length_region - len_region
@@ -8273,10 +9265,6 @@ def run_wgsim_pairedEnd_for_window(genome, chromosome, start, end, readPairs, re
 
         else: raise ValueError("Region %s cannot be corrected according to read length, maybe because the chromosome is to short. Check that %s is ok"%(ID, chromosome))
 
-    # first get the region
-    region_fasta = "%s/%s.fasta"%(outdir, ID)
-    if file_is_empty(region_fasta) or replace is True: SeqIO.write([chrom[start:end] for chrom in SeqIO.parse(genome, "fasta") if chrom.id==chromosome], region_fasta, "fasta")
-
     # define the distance between ends of the reads, which depends on the length of the region
     if len_region<=(median_insert_size/2):
 
@@ -8284,6 +9272,26 @@ def run_wgsim_pairedEnd_for_window(genome, chromosome, start, end, readPairs, re
         median_insert_size = int(len_region/2)+1
         median_insert_size_sd = int(median_insert_size/10)+1
 
+    return (start, end, median_insert_size, median_insert_size_sd)
+
+def run_wgsim_pairedEnd_for_window(genome, chromosome, start, end, readPairs, read_length, outdir,  median_insert_size, median_insert_size_sd, replace, error_rate=0.02):
+
+    """Takes a region of a genome and generates a fasta file for it under outdir. Then it runs wgsim to simulate total_readPairs. It returns a tupple of the (read1, read2) in .gz . It assumes that the error rate is 0.02, which was benchmarked in https://bmcbioinformatics.biomedcentral.com/articles/10.1186/1471-2105-14-184.
+
+    This is run on haplotype mode (which means that all introduced vars are homozygous (although I am not introducing any vars))"""
+
+    # get the time
+
+    # define the ID
+    ID = "%s_%i_%i_readlen%i_nreads%i_insertsize%i+-%i_error%.3f"%(chromosome, start, end, read_length, readPairs, median_insert_size, median_insert_size_sd, error_rate)
+
+    # get the region and the insert size corrected for short windows
+    start, end, median_insert_size, median_insert_size_sd = get_region_and_insert_size_for_window_read_simulation(genome, chromosome, start, end, read_length, median_insert_size, median_insert_size_sd, ID)
+
+    # first get the region
+    region_fasta = "%s/%s.fasta"%(outdir, ID)
+    if file_is_empty(region_fasta) or replace is True: SeqIO.write([SeqRecord(Seq(fetch_genome_store(genome, chromosome, start, end)), id=chromosome, name="", description="")], region_fasta, "fasta")
+
     # now run wgsim
     fastq_1 = "%s/%s_read1.fq"%(outdir, ID); fastq_2 = "%s/%s_read2.fq"%(outdir, ID); 
     fastq_1_tmp = "%s.tmp"%fastq_1; fastq_2_tmp = "%s.tmp"%fastq_2; 
@@ -8436,6 +9444,173 @@ def run_wgsim_pairedEnd_per_windows_in_parallel(df_windows, genome, outdir, read
 
     return (allChunks_fastqgz_1, allChunks_fastqgz_2) 
 
+# map each ASCII character to the nucleotide codes used by wgsim (A,C,G,T -> 0-3, any other -> 4, which is N)
+g_wgsim_nt4_table = np.full(256, 4, dtype=np.uint8)
+for I_nt, nt in enumerate("ACGT"): g_wgsim_nt4_table[ord(nt)] = I_nt; g_wgsim_nt4_table[ord(nt.lower())] = I_nt
+g_wgsim_code_to_nt = np.frombuffer(b"ACGTN", dtype=np.uint8)
+
+def get_simulated_readPairs_wgsimModel(seq_codes, readPairs, read_length, median_insert_size, median_insert_size_sd, error_rate, random_state, max_fraction_N=0.05, max_readPairs_at_once=100000):
+
+    """Takes a sequence (as an array of wgsim nucleotide codes) and simulates readPairs with the model of wgsim in haplotype mode without mutations (-h -r 0.0 -R 0.0 -X 0.0). Insert sizes are normally distributed, the fragments are uniformly distributed along the sequence, each base has an error_rate probability of being changed to another base, and pairs with reads that have more than max_fraction_N Ns are resimulated. It yields tuples (reads1, reads2) of arrays with the codes of the reads (one row per read), simulating up to max_readPairs_at_once at a time."""
+
+    len_seq = len(seq_codes)
+
+    # wgsim skips sequences that are shorter than the insert size + 3 SD
+    if len_seq<(median_insert_size + 3*median_insert_size_sd) or len_seq<read_length:
+        print_if_verbose("WARNING: skipping read simulation of a sequence of %ibp, which is shorter than %i"%(len_seq, median_insert_size + 3*median_insert_size_sd))
+        return
+
+    idxs_read = np.arange(read_length)
+    max_failed_readPairs = 10*readPairs + 1000
+    n_generated_readPairs = 0
+    n_failed_readPairs = 0
+
+    while n_generated_readPairs<readPairs:
+
+        # define the number of pairs to simulate
+        n_readPairs = min([readPairs - n_generated_readPairs, max_readPairs_at_once])
+
+        # sample the fragment size and the start of each pair, resampling those that fall out of the sequence
+        fragment_sizes = np.zeros(n_readPairs, dtype=int)
+        starts = np.zeros(n_readPairs, dtype=int)
+        Is_to_sample = np.arange(n_readPairs)
+
+        while len(Is_to_sample)>0:
+
+            sampled_fragment_sizes = np.maximum(np.trunc(random_state.standard_normal(len(Is_to_sample))*median_insert_size_sd + median_insert_size + 0.5).astype(int), read_length)
+            sampled_starts = np.trunc((len_seq - sampled_fragment_sizes + 1)*random_state.random_sample(len(Is_to_sample))).astype(int)
+            is_valid = (sampled_starts>=0) & (sampled_starts<len_seq) & ((sampled_starts + sampled_fragment_sizes - 1)<len_seq)
+
+            fragment_sizes[Is_to_sample[is_valid]] = sampled_fragment_sizes[is_valid]
+            starts[Is_to_sample[is_valid]] = sampled_starts[is_valid]
+            Is_to_sample = Is_to_sample[~is_valid]
+
+        # get the forward read from the start and the reverse complement read from the end of the fragment
+        reads_fwd = seq_codes[starts[:,None] + idxs_read]
+        reads_rev = seq_codes[(starts + fragment_sizes - 1)[:,None] - idxs_read]
+        reads_rev = np.where(reads_rev<4, 3-reads_rev, 4).astype(np.uint8)
+
+        # add the sequencing errors
+        for reads in [reads_fwd, reads_rev]:
+            is_error = (reads<4) & (random_state.random_sample(reads.shape)<error_rate)
+            error_shifts = np.trunc(random_state.random_sample(reads.shape)*3.0 + 1).astype(np.uint8)
+            reads[is_error] = (reads[is_error] + error_shifts[is_error]) & 3
+
+        # discard pairs with too many Ns
+        is_valid = ((reads_fwd==4).sum(axis=1)/read_length<=max_fraction_N) & ((reads_rev==4).sum(axis=1)/read_length<=max_fraction_N)
+
+        # define which read goes to each file
+        is_flipped = (random_state.random_sample(n_readPairs)<0.5)[:,None]
+        reads1 = np.where(is_flipped, reads_rev, reads_fwd)[is_valid]
+        reads2 = np.where(is_flipped, reads_fwd, reads_rev)[is_valid]
+
+        n_generated_readPairs += len(reads1)
+        n_failed_readPairs += sum(~is_valid)
+        if len(reads1)>0: yield (reads1, reads2)
+
+        # stop for sequences with too many Ns
+        if n_failed_readPairs>max_failed_readPairs:
+            print_if_verbose("WARNING: Failed to produce a sequence with insufficient Ns. Only %i/%i read pairs were simulated"%(n_generated_readPairs, readPairs))
+            break
+
+def get_fastq_bytes_simulated_reads(reads, first_readID, quality_char):
+
+    """Takes an array of read codes (one row per read) as yielded by get_simulated_readPairs_wgsimModel and returns the bytes of a fastq with them, named read_<N> starting from first_readID, and with a constant quality_char."""
+
+    read_length = reads.shape[1]
+    seqs = g_wgsim_code_to_nt[reads].view("S%i"%read_length).ravel()
+    quality = quality_char.encode()*read_length
+
+    return b"".join([b"@read_%i\n%s\n+\n%s\n"%(readID, seq, quality) for readID, seq in zip(range(first_readID, first_readID+len(seqs)), seqs)])
+
+def write_simulated_readPairs_windows_wgsimModel(windows_tuples, genome, fastqgz_1, fastqgz_2, read_length, median_insert_size, median_insert_size_sd, error_rate):
+
+    """Takes a list of windows (chromosome, start, end, readPairs, first_readID, seed) and writes into the bgzipped fastqgz_1 and fastqgz_2 the paired reads simulated for each of them with get_simulated_readPairs_wgsimModel. The reads of each window are named starting from first_readID, and seed is used to generate them."""
+
+    # define the quality of the bases, as in wgsim
+    if error_rate==0.0: quality_char = "I"
+    else: quality_char = chr(int(-10.0*np.log10(error_rate) + 0.499) + 33)
+
+    fastqgz_1_tmp = "%s.tmp"%fastqgz_1
+    fastqgz_2_tmp = "%s.tmp"%fastqgz_2
+
+    with bgzf.BgzfWriter(fastqgz_1_tmp, "wb") as fd1, bgzf.BgzfWriter(fastqgz_2_tmp, "wb") as fd2:
+        for chromosome, start, end, readPairs, first_readID, seed in windows_tuples:
+
+            # define the ID
+            ID = "%s_%i_%i_readlen%i_nreads%i_insertsize%i+-%i_error%.3f"%(chromosome, start, end, read_length, readPairs, median_insert_size, median_insert_size_sd, error_rate)
+
+            # get the region and the insert size corrected for short windows
+            start_w, end_w, median_insert_size_w, median_insert_size_sd_w = get_region_and_insert_size_for_window_read_simulation(genome, chromosome, start, end, read_length, median_insert_size, median_insert_size_sd, ID)
+
+            # get the sequence
+            seq_codes = g_wgsim_nt4_table[np.frombuffer(fetch_genome_store(genome, chromosome, start_w, end_w).encode(), dtype=np.uint8)]
+
+            # simulate and write the reads
+            random_state = np.random.RandomState(seed)
+            readID = first_readID
+            for reads1, reads2 in get_simulated_readPairs_wgsimModel(seq_codes, readPairs, read_length, median_insert_size_w, median_insert_size_sd_w, error_rate, random_state):
+
+                fd1.write(get_fastq_bytes_simulated_reads(reads1, readID, quality_char))
+                fd2.write(get_fastq_bytes_simulated_reads(reads2, readID, quality_char))
+                readID += len(reads1)
+
+            if readID==first_readID: print_if_verbose("!!WARNING: No reads could be generated for region %s. It is likely too short or it has too many Ns."%ID)
+
+    os.rename(fastqgz_1_tmp, fastqgz_1); os.rename(fastqgz_2_tmp, fastqgz_2)
+
+def simulate_pairedEnd_reads_per_windows_wgsimModel(df_windows, genome, fastqgz_1, fastqgz_2, read_length, median_insert_size, median_insert_size_sd, replace=False, error_rate=0.02, threads=4, seed=None):
+
+    """Takes a dataframe with windows of ["chromosome", "start", "end", "readPairs"] and simulates, in one pass, the paired reads of all the windows into the bgzipped fastqgz_1 and fastqgz_2, with the same model and parameters as run_wgsim_pairedEnd_per_windows_in_parallel but without running wgsim for each window. The reads are named read_<N>, like after run_seqtk_rename. The windows are split into contiguous chunks that are simulated in parallel on threads and then concatenated. seed is used to generate the reads (each window is simulated with seed + its index), and it is defined from the time if None (like wgsim)."""
+
+    if any([file_is_empty(f) for f in [fastqgz_1, fastqgz_2]]) or replace is True:
+        print_if_verbose("simulating paired reads into %s and %s"%(fastqgz_1, fastqgz_2))
+        start_time = time.time()
+
+        # keep only windows with at more than 1 (pseudocount) read pair
+        df_windows = df_windows[["chromosome", "start", "end", "readPairs"]]
+        df_windows = df_windows[df_windows.readPairs>1]
+        readPairs = np.array(df_windows.readPairs).astype(int)
+
+        # define the seeds and the first read of each window
+        if seed is None: seed = int(time.time()) & 0x7fffffff
+        first_readIDs = np.cumsum(readPairs) - readPairs + 1
+        windows_tuples = [(chromosome, int(start), int(end), int(readPairs_w), int(first_readID), (seed + Iw)%(2**32)) for Iw, (chromosome, start, end, readPairs_w, first_readID) in enumerate(zip(df_windows.chromosome, df_windows.start, df_windows.end, readPairs, first_readIDs))]
+
+        # define chunks of windows with similar number of reads (at least one chunk)
+        nchunks = max([1, min([len(windows_tuples), threads*4])])
+        Is_chunk = np.searchsorted(np.linspace(0, sum(readPairs), nchunks+1)[1:-1], np.cumsum(readPairs) - readPairs, side="right")
+        chunks_windows_tuples = [[w for w, Ichunk in zip(windows_tuples, Is_chunk) if Ichunk==I] for I in range(nchunks)]
+
+        chunks_fastqgz_files = [("%s.chunk%i"%(fastqgz_1, I), "%s.chunk%i"%(fastqgz_2, I)) for I in range(nchunks)]
+        args = [(chunk_windows_tuples, genome, chunk_fastqgz_1, chunk_fastqgz_2, read_length, median_insert_size, median_insert_size_sd, error_rate) for chunk_windows_tuples, (chunk_fastqgz_1, chunk_fastqgz_2) in zip(chunks_windows_tuples, chunks_fastqgz_files)]
+
+        # simulate
+        print_if_verbose("simulating %i read pairs in %i windows, split in %i chunks, on %i threads"%(sum(readPairs), len(windows_tuples), nchunks, threads))
+        if threads==1: 
+            for x in args: write_simulated_readPairs_windows_wgsimModel(*x)
+
+        else:
+            with multiproc.Pool(threads) as pool:
+                pool.starmap(write_simulated_readPairs_windows_wgsimModel, args)
+                pool.close()
+                pool.terminate()
+
+        # concatenate the chunks (concatenated bgzip files are valid bgzip files)
+        for fastqgz, chunks_files in [(fastqgz_1, [x[0] for x in chunks_fastqgz_files]), (fastqgz_2, [x[1] for x in chunks_fastqgz_files])]:
+
+            fastqgz_tmp = "%s.tmp"%fastqgz
+            with open(fastqgz_tmp, "wb") as fd:
+                for chunk_file in chunks_files:
+                    with open(chunk_file, "rb") as fd_chunk: shutil.copyfileobj(fd_chunk, fd)
+                    remove_file(chunk_file)
+
+            os.rename(fastqgz_tmp, fastqgz)
+
+        print_if_verbose("--- simulating the reads took %s seconds ---"%(time.time() - start_time))
+
+    return (fastqgz_1, fastqgz_2)
+
 def run_seqtk_rename(origin_fastqgz, dest_fastqgz):
 
     """This function takes an origin and a dest fastq gz and runs seqtk to rename the reads"""
@@ -8469,133 +9644,108 @@ def simulate_readPairs_per_window(df_windows, genome, npairs, outdir, read_lengt
         all_fastqgz_1_correct_tmp = "%s/all_reads1.correct.tmp.fq.gz"%outdir
         all_fastqgz_2_correct_tmp = "%s/all_reads2.correct.tmp.fq.gz"%outdir
 
-        # get the raw reads from wgsim
-        if any([file_is_empty(f) for f in [all_fastqgz_1, all_fastqgz_2]]) or replace is True:
+        # delete previous folders and files
+        #delete_folder(outdir_whole_chromosomes); delete_folder(outdir_per_windows); remove_file(all_fastqgz_1); remove_file(all_fastqgz_2)
 
-            # delete previous folders and files
-            #delete_folder(outdir_whole_chromosomes); delete_folder(outdir_per_windows); remove_file(all_fastqgz_1); remove_file(all_fastqgz_2)
+        # add the chromosome lengths
+        chr_to_len = get_chrom_to_len_genome_store(genome)
+        df_windows["len_chromosome"] = df_windows.chromosome.apply(lambda x: chr_to_len[x])
 
-            # add the chromosome lengths
-            chr_to_len = {seq.id: len(seq.seq) for seq in SeqIO.parse(genome, "fasta")}
-            df_windows["len_chromosome"] = df_windows.chromosome.apply(lambda x: chr_to_len[x])
+        # assign the number of readpairs to each window
+        uniform_n_readPairs_per_base = npairs / sum(set(df_windows.len_chromosome))
+        df_windows["window_length"] = df_windows.end - df_windows.start
+        df_windows["total_readPairs"] = (df_windows.window_length*uniform_n_readPairs_per_base) * df_windows.predicted_relative_coverage
 
-            # assign the number of readpairs to each window
-            uniform_n_readPairs_per_base = npairs / sum(set(df_windows.len_chromosome))
-            df_windows["window_length"] = df_windows.end - df_windows.start
-            df_windows["total_readPairs"] = (df_windows.window_length*uniform_n_readPairs_per_base) * df_windows.predicted_relative_coverage
+        # generate a df_windows that have sliding windows, so that each window appears twice and covers the intersection of df_windows. each window will get half of the reads that are expected
+        df_windows_sliding = pd.DataFrame()
 
-            # generate a df_windows that have sliding windows, so that each window appears twice and covers the intersection of df_windows. each window will get half of the reads that are expected
-            df_windows_sliding = pd.DataFrame()
+        for chromosome in df_windows.chromosome.unique():
+            print_if_verbose("geting sliding window for %s"%chromosome)
 
-            for chromosome in df_windows.chromosome.unique():
-                print_if_verbose("geting sliding window for %s"%chromosome)
+            # get the df with a unique numeric index
+            df_c = df_windows[df_windows.chromosome==chromosome][["chromosome", "start", "end", "total_readPairs", "window_length"]].sort_values(by=["chromosome", "start"])
+            df_c.index = list(range(len(df_c)))
 
-                # get the df with a unique numeric index
-                df_c = df_windows[df_windows.chromosome==chromosome][["chromosome", "start", "end", "total_readPairs", "window_length"]].sort_values(by=["chromosome", "start"])
-                df_c.index = list(range(len(df_c)))
+            if len(df_c)>1:
 
-                if len(df_c)>1:
+                # this only applies when there is more than 1 window
 
-                    # this only applies when there is more than 1 window
+                ##### define df_c_halfs, which has non_overlapping windows ####
 
-                    ##### define df_c_halfs, which has non_overlapping windows ####
+                # get a df that has halfs of the windows, only from the first to the forelast ones --> this lacks the half of the first window and half of the last window
+                df_c_halfs = cp.deepcopy(df_c).iloc[0:-1][["chromosome", "start", "end", "window_length"]]
 
-                    # get a df that has halfs of the windows, only from the first to the forelast ones --> this lacks the half of the first window and half of the last window
-                    df_c_halfs = cp.deepcopy(df_c).iloc[0:-1][["chromosome", "start", "end", "window_length"]]
+                # define the starts
+                starts = list(df_c_halfs.apply(lambda r: r["start"] + int(r["window_length"]*0.5), axis=1)) # start at +half of the window
+                starts[0] = 0 # the first start is 0
 
-                    # define the starts
-                    starts = list(df_c_halfs.apply(lambda r: r["start"] + int(r["window_length"]*0.5), axis=1)) # start at +half of the window
-                    starts[0] = 0 # the first start is 0
+                # define the ends (half of the next window)
+                ends = [df_c_halfs.loc[I, "end"] + int(df_c.loc[I+1, "window_length"]*0.5) for I in df_c_halfs.index]
+                ends[-1] = df_c.iloc[-1].end
 
-                    # define the ends (half of the next window)
-                    ends = [df_c_halfs.loc[I, "end"] + int(df_c.loc[I+1, "window_length"]*0.5) for I in df_c_halfs.index]
-                    ends[-1] = df_c.iloc[-1].end
-
-                    # add to df
-                    df_c_halfs["start"] = starts; df_c_halfs["end"] = ends
-                    df_c_halfs["window_length"] = df_c_halfs.end - df_c_halfs.start
-
-                    #################################################################
-
-                    # add to df_halfs the expected coverage as a function of the overlapping windows 
-                    def get_reads_from_overlap_with_other_windows(r):
-
-                        """Takes a row and of the windows df and returns the reads as a function of the overlap with df_c"""
-
-                        # get the index of this window, which is -500 than df_c
-                        I = r.name
-
-                        # for the first window, take the first window and half of the second
-                        if I==0: return (df_c.loc[0].total_readPairs + df_c.loc[1].total_readPairs/2)
-
-                        # for the last window, get half of the forelast window and all the last one 
-                        if I==last_w: return (df_c.iloc[-2].total_readPairs/2 + df_c.iloc[-1].total_readPairs)
-
-                        # for the others, take half and half
-                        else: return (df_c.loc[I, "total_readPairs"]/2 + df_c.loc[I+1, "total_readPairs"]/2)
+                # add to df
+                df_c_halfs["start"] = starts; df_c_halfs["end"] = ends
+                df_c_halfs["window_length"] = df_c_halfs.end - df_c_halfs.start
 
-                    last_w = df_c_halfs.index[-1]
-                    df_c_halfs["total_readPairs"] = df_c_halfs[["start", "end"]].apply(get_reads_from_overlap_with_other_windows, axis=1)
-                    df_c_halfs = df_c_halfs[list(df_c.keys())]
+                #################################################################
 
-                    # get the concatenated df
-                    df_c_both = df_c_halfs.append(df_c, sort=True).sort_values(by=["chromosome", "start"])
+                # add to df_halfs the expected coverage as a function of the overlapping windows 
+                def get_reads_from_overlap_with_other_windows(r):
 
-                    # get half of the total_readPairs, as you have overlapping region
-                    df_c_both["total_readPairs"] = (df_c_both.total_readPairs/2).apply(int) + 1 # I also add a pseudocount
+                    """Takes a row and of the windows df and returns the reads as a function of the overlap with df_c"""
 
-                else: 
+                    # get the index of this window, which is -500 than df_c
+                    I = r.name
 
-                    # else all the reads go to this window
-                    df_c_both = df_c.sort_values(by=["chromosome", "start"])
-                    df_c_both["total_readPairs"] = df_c_both.total_readPairs.apply(int) + 1
+                    # for the first window, take the first window and half of the second
+                    if I==0: return (df_c.loc[0].total_readPairs + df_c.loc[1].total_readPairs/2)
 
-                # record the minimum 
-                min_read_pairs = min(df_c_both.total_readPairs)
-                df_c_both["min_readPairs"] = min_read_pairs
-                df_c_both["extra_readPairs"] = (df_c_both.total_readPairs - min_read_pairs) + 1 # also add a pseudocount to have non-empty regions
+                    # for the last window, get half of the forelast window and all the last one 
+                    if I==last_w: return (df_c.iloc[-2].total_readPairs/2 + df_c.iloc[-1].total_readPairs)
 
-                # append both dfs in a sorted manner
-                df_windows_sliding = df_windows_sliding.append(df_c_both, sort=True)
+                    # for the others, take half and half
+                    else: return (df_c.loc[I, "total_readPairs"]/2 + df_c.loc[I+1, "total_readPairs"]/2)
 
-            # get chr as index
-            df_windows_sliding = df_windows_sliding.set_index("chromosome", drop=False)
+                last_w = df_c_halfs.index[-1]
+                df_c_halfs["total_readPairs"] = df_c_halfs[["start", "end"]].apply(get_reads_from_overlap_with_other_windows, axis=1)
+                df_c_halfs = df_c_halfs[list(df_c.keys())]
 
-            # first simulate reads for the whole chromosome, so that we simulate the minimum number of reads for each chromosome. This is useful to have paired end reads that span the whole chromosome, not only regions
-            chrom_to_len = {s.id: len(s.seq) for s in SeqIO.parse(genome, "fasta")}
-            df_windows_chromosomes_minCov = pd.DataFrame({I : {"start": 0, "end": len_chr, "chromosome": chrom, "readPairs": sum(df_windows_sliding[df_windows_sliding.chromosome==chrom]["min_readPairs"])} for I, (chrom, len_chr) in enumerate(chrom_to_len.items())}).transpose()
-            wholeChr_fastqgz1, wholeChr_fastqgz2 = run_wgsim_pairedEnd_per_windows_in_parallel(df_windows_chromosomes_minCov, genome, outdir_whole_chromosomes, read_length, median_insert_size, median_insert_size_sd, replace=replace, threads=threads)
+                # get the concatenated df
+                df_c_both = df_c_halfs.append(df_c, sort=True).sort_values(by=["chromosome", "start"])
 
-            # now simulate the reads for the regions, only considering the extra_readPairs
-            df_windows_sliding["readPairs"] = df_windows_sliding.extra_readPairs        
-            perWindow_fastqgz1, perWindow_fastqgz2 = run_wgsim_pairedEnd_per_windows_in_parallel(df_windows_sliding, genome, outdir_per_windows, read_length, median_insert_size, median_insert_size_sd, replace=replace, threads=threads)
+                # get half of the total_readPairs, as you have overlapping region
+                df_c_both["total_readPairs"] = (df_c_both.total_readPairs/2).apply(int) + 1 # I also add a pseudocount
 
-            # now concatenate all the simulated reads
-            all_fastqgz_1_tmp = "%s.tmp"%all_fastqgz_1
-            all_fastqgz_2_tmp = "%s.tmp"%all_fastqgz_2
+            else: 
 
-            all_fastqgz_1_tmp_stderr = "%s.generating.stderr"%all_fastqgz_1_tmp
-            all_fastqgz_2_tmp_stderr = "%s.generating.stderr"%all_fastqgz_2_tmp
+                # else all the reads go to this window
+                df_c_both = df_c.sort_values(by=["chromosome", "start"])
+                df_c_both["total_readPairs"] = df_c_both.total_readPairs.apply(int) + 1
 
-            print_if_verbose("Integrating all in one. The stderrs are in %s and %s"%(all_fastqgz_1_tmp_stderr, all_fastqgz_2_tmp_stderr))
+            # record the minimum 
+            min_read_pairs = min(df_c_both.total_readPairs)
+            df_c_both["min_readPairs"] = min_read_pairs
+            df_c_both["extra_readPairs"] = (df_c_both.total_readPairs - min_read_pairs) + 1 # also add a pseudocount to have non-empty regions
 
-            run_cmd("cat %s %s > %s 2>%s"%(wholeChr_fastqgz1, perWindow_fastqgz1, all_fastqgz_1_tmp, all_fastqgz_1_tmp_stderr))
-            run_cmd("cat %s %s > %s 2>%s"%(wholeChr_fastqgz2, perWindow_fastqgz2, all_fastqgz_2_tmp, all_fastqgz_2_tmp_stderr))
+            # append both dfs in a sorted manner
+            df_windows_sliding = df_windows_sliding.append(df_c_both, sort=True)
 
-            remove_file(all_fastqgz_1_tmp_stderr)
-            remove_file(all_fastqgz_2_tmp_stderr)
+        # get chr as index
+        df_windows_sliding = df_windows_sliding.set_index("chromosome", drop=False)
 
-            # rename to keep
-            os.rename(all_fastqgz_1_tmp, all_fastqgz_1); os.rename(all_fastqgz_2_tmp, all_fastqgz_2)
+        # first simulate reads for the whole chromosome, so that we simulate the minimum number of reads for each chromosome. This is useful to have paired end reads that span the whole chromosome, not only regions
+        chrom_to_len = get_chrom_to_len_genome_store(genome)
+        df_windows_chromosomes_minCov = pd.DataFrame({I : {"start": 0, "end": len_chr, "chromosome": chrom, "readPairs": sum(df_windows_sliding[df_windows_sliding.chromosome==chrom]["min_readPairs"])} for I, (chrom, len_chr) in enumerate(chrom_to_len.items())}).transpose()
 
+        # then simulate the reads for the regions, only considering the extra_readPairs
+        df_windows_sliding["readPairs"] = df_windows_sliding.extra_readPairs        
 
-        # correct the names with seqtk rename
-        print_if_verbose("running seqtk to correct read names from wgsim")
-        run_seqtk_rename(all_fastqgz_1, all_fastqgz_1_correct_tmp)
-        run_seqtk_rename(all_fastqgz_2, all_fastqgz_2_correct_tmp)
+        # simulate all the reads in one pass, already with the correct names
+        df_windows_simulation = pd.concat([df_windows_chromosomes_minCov[["chromosome", "start", "end", "readPairs"]], df_windows_sliding[["chromosome", "start", "end", "readPairs"]]], sort=False)
+        simulate_pairedEnd_reads_per_windows_wgsimModel(df_windows_simulation, genome, all_fastqgz_1_correct_tmp, all_fastqgz_2_correct_tmp, read_length, median_insert_size, median_insert_size_sd, replace=True, threads=threads)
 
         for f in [all_fastqgz_1_correct_tmp, all_fastqgz_2_correct_tmp]:
-            if file_is_empty(f): raise ValueError("%s is empty. Something went wrong with wgsim"%f)
+            if file_is_empty(f): raise ValueError("%s is empty. Something went wrong with the simulation of reads"%f)
 
         # keep
         os.rename(all_fastqgz_1_correct_tmp, all_fastqgz_1_correct)
@@ -8651,139 +9801,480 @@ def simulate_and_align_PairedReads_perWindow(df_windows, genome_interest, refere
     return sim_sorted_bam
 
 
-def get_fractions_reads_for_ploidy(ploidy):
+def get_fractions_reads_for_ploidy(ploidy):
+
+    """Takes a ploidy and returns the fraction_var and fraction_ref."""
+
+    # define the fraction of reads that come from each genome
+    if ploidy in {"haploid", "diploid_homo"}:
+
+        fraction_var = 1.0
+        fraction_ref = 0.0
+
+    elif ploidy=="diploid_hetero":
+
+        fraction_var = 0.5
+        fraction_ref = 0.5 
+
+    else:
+
+        # These are specific combinations of genomes (polyploids or populations)
+        try:
+            typeGenome_to_ncopies = {x.split(":")[0] : int(x.split(":")[1]) for x in ploidy.split("_")}
+            typeGenome_to_fraction_reads = {type_genome: ncopies / sum(typeGenome_to_ncopies.values()) for type_genome, ncopies in typeGenome_to_ncopies.items()}
+
+        except: raise ValueError("ploidy %s is incorrect. The format is ref:2_var:1 , which would be one copy of variant genome for every two copies of reference genome"%ploidy)
+        
+        fraction_var = typeGenome_to_fraction_reads["var"]
+        fraction_ref = typeGenome_to_fraction_reads["ref"]
+
+    return fraction_var, fraction_ref
+
+
+
+def merge_2bams(bamA, bamB, merged, threads=4):
+
+    """Merges two bams"""
+    remove_file(merged)
+
+    merged_std = "%s.generating.std"%merged
+    print_if_verbose("merging %s and %s into %s. The std is in %s"%(bamA, bamB, merged, merged_std))
+    run_cmd("%s merge --threads %i %s %s %s > %s 2>&1"%(samtools, threads, merged, bamA, bamB, merged_std))
+    remove_file(merged_std)
+
+def sort_bam(bam, sorted_bam, threads=4):
+
+    """Sorts a bam file into sorted_bam"""
+
+    # remove the previously generated .tmp. file
+    for f in os.listdir(get_dir(sorted_bam)):
+        
+        if f.startswith("%s.tmp."%(get_file(sorted_bam))): remove_file("%s/%s"%(get_dir(sorted_bam), f))
+
+    sorting_std = "%s.generating.std"%sorted_bam
+    print_if_verbose("sorting bam. The std is in %s"%sorting_std)
+    run_cmd("%s sort --threads %i -o %s %s > %s 2>&1"%(samtools, threads, sorted_bam, bam, sorting_std))
+    remove_file(sorting_std)
+
+def index_bam(bam, threads=4):
+
+    """indexes bam and creates a .bai file"""
+
+    indexing_std = "%s.generating.std"%bam
+    print_if_verbose("indexing bam. The std is in %s"%indexing_std)
+    run_cmd("%s index -@ %i %s > %s 2>&1"%(samtools, threads, bam, indexing_std))
+    remove_file(indexing_std)
+
+
+def merge_2bams_sort_and_index(bamfileA, bamfileB, merged_bam, merged_sorted_bam, merged_sorted_bam_index, threads=4):
+
+    """Takes two bams and merges them. writes files under merged_bam_prefix"""
+
+    # first merge
+    merge_2bams(bamfileA, bamfileB, merged_bam, threads=threads)
+
+    # sort 
+    sort_bam(merged_bam, merged_sorted_bam, threads=threads)
+
+    # index
+    index_bam(merged_sorted_bam, threads=threads)
+
+    # remove the unsorted bam
+    remove_file(merged_bam)
+
+
+def get_merged_bamfile_for_ploidy(variant_bamfile, reference_bamfile, ploidy, replace=False, threads=4):
+
+    """This function takes two bam files, one that includes aligned reads for a reference genome and another that includes aligned reads for a variat genome. It subsamples each of the bamfiles so that there is a proportion of reads comming from each reference and variant, and the proportion is indicated by ploidy, which can be any of the strings in the default values of target_ploidies of run_GridssClove_optimising_parameters."""
+
+    print_if_verbose("merging %s and %s in ploidy %s"%(variant_bamfile, reference_bamfile, ploidy))
+
+    # initialize counter
+    start_time = time.time()
+
+    # haploid means only variant
+    if ploidy=="haploid": merged_sorted_bam = variant_bamfile
+
+    # in all the other cases, do some merging
+    else:
+
+        # define the expected files
+        merged_bam = "%s.%s.bam"%(variant_bamfile, ploidy)
+        merged_sorted_bam = "%s.sorted"%merged_bam
+        merged_sorted_bam_index = "%s.bai"%merged_sorted_bam
+
+        if any([file_is_empty(f) for f in [merged_sorted_bam, merged_sorted_bam_index]]) or replace is True:
+
+            # FIRST DEFINE TWO BAMFILES
+
+            # diploid homo is merging a subset of 50% of reads for each variant_bamfile
+            if ploidy=="diploid_homo":
+
+                # simulate 50% of reads for each the variant
+                bamfileA = downsample_bamfile_keeping_pairs(variant_bamfile, fraction_reads=0.5, replace=replace, threads=threads, name="varGenomeA")
+                bamfileB = downsample_bamfile_keeping_pairs(variant_bamfile, fraction_reads=0.5, replace=replace, threads=threads, name="varGenomeB")
+
+            # all the situations where you have a combination of reference and variant genomes
+            else:
+
+                # get the fractions of reads
+                fraction_var, fraction_ref = get_fractions_reads_for_ploidy(ploidy)
+
+                # simulate the reads for the giiven fraction
+                bamfileA = downsample_bamfile_keeping_pairs(variant_bamfile, fraction_reads=fraction_var, replace=replace, threads=threads, name="varGenome")
+                bamfileB = downsample_bamfile_keeping_pairs(reference_bamfile, fraction_reads=fraction_ref, replace=replace, threads=threads, name="refGenome")
+
+            # NOW MERGE, SORT and INDEX
+            merge_2bams_sort_and_index(bamfileA, bamfileB, merged_bam, merged_sorted_bam, merged_sorted_bam_index, threads=threads)
+
+            # FINALLY REMOVE THE SAMPLED BAMFILES
+            for f in [bamfileA, bamfileB]: remove_file(f)
+
+    # get the time the function took to run
+    print_if_verbose("--- merging took for ploidy %s reads took %s seconds ---"%(ploidy, time.time() - start_time))
+
+    return merged_sorted_bam
+
+def get_gridss_filtering_arrays(df_gridss_twoBreakEnds):
+
+    """Takes a df_gridss where each breakpoint has two breakends (such as the df_gridss_twoBreakEnds generated in write_breakpoints_for_parameter_combinations_and_get_filterIDtoBpoints_gridss) and returns a dict with the numpy arrays that are necessary to run get_tupleBreakpoints_for_filters_GRIDSS_bitmask. The breakpoints are sorted by ID, and each of them is mapped to the positions of its two breakends. The packed masks of each filter term are cached under 'filterTerm_to_packedMask'."""
+
+    # check that all breakpoints have two breakends
+    if set(Counter(df_gridss_twoBreakEnds["breakpointID"]).values())!={2}: raise ValueError("Not all breakpoints have 2 brekends")
+
+    # map each breakpoint to the positions of the breakends
+    breakpointIDs = np.array(df_gridss_twoBreakEnds.breakpointID.values, dtype=object)
+    sorting_idx = np.argsort(breakpointIDs, kind="mergesort")
+    sorted_breakpointIDs = breakpointIDs[sorting_idx][0::2]
+
+    # init dict
+    fa = {"sorted_breakpointIDs":sorted_breakpointIDs, "n_breakpoints":len(sorted_breakpointIDs), "bendIdxA":sorting_idx[0::2], "bendIdxB":sorting_idx[1::2], "filterTerm_to_packedMask":{}}
+
+    # add the numeric fields
+    for f in ["length_event", "QUAL", "DATA_VF", "real_AF", "allele_frequency", "allele_frequency_SmallEvent", "length_microHomology", "length_inexactHomology", "len_inserted_sequence", "DATA_SR", "DATA_RP"]: fa[f] = df_gridss_twoBreakEnds[f].values.astype(float)
+    fa["INFO_SB"] = df_gridss_twoBreakEnds.INFO_SB.apply(float).values
+
+    # add the boolean fields
+    for f in ["has_poly16GC", "overlaps_repeats"]: fa[f] = df_gridss_twoBreakEnds[f].values.astype(bool)
+    fa["is_DEL"] = (df_gridss_twoBreakEnds.INFO_SIMPLE_TYPE=="DEL").values
+    fa["is_INV"] = (df_gridss_twoBreakEnds.INFO_SIMPLE_TYPE=="INV").values
+    fa["is_DEL_or_DUP"] = (df_gridss_twoBreakEnds.INFO_SIMPLE_TYPE.isin({"DEL", "DUP"})).values
+
+    # add the string fields
+    fa["INFO_misc"] = list(df_gridss_twoBreakEnds.INFO_misc)
+    fa["FILTER_set"] = [set(f.split(";")) for f in df_gridss_twoBreakEnds.FILTER]
+
+    return fa
+
+def get_hashable_gridss_filter_value(filterName, filterValue):
+
+    """Takes a filter value of a gridss filters_dict and returns a hashable version of it, which is used as a key of the cached masks"""
+
+    if filterName in {"wrong_INFOtags", "wrong_FILTERtags"}: return tuple(sorted(set(filterValue)))
+    elif filterName=="range_filt_DEL_breakpoints": return tuple(filterValue)
+    else: return filterValue
+
+def get_breakendMask_gridss_filter_term(fa, filterTerm, filterValues):
+
+    """Takes the output of get_gridss_filtering_arrays and returns a boolean array with the breakends that pass one of the terms of get_gridssDF_filtered. filterValues are the values of the filters in g_gridssFilterTerm_to_filterNames[filterTerm], in the same order."""
+
+    # define whether the breakends are small DEL or DUP
+    if "max_to_be_considered_small_event" in g_gridssFilterTerm_to_filterNames[filterTerm]: is_small_DupDel = fa["is_DEL_or_DUP"] & (fa["length_event"]<=filterValues[-1])
+
+    # define the value of the (first) filter
+    val = filterValues[0]
+
+    # get each of the masks, as in get_gridssDF_filtered
+    if filterTerm=="min_size": mask = fa["length_event"]>=val
+    elif filterTerm=="min_QUAL": mask = fa["QUAL"]>=val
+    elif filterTerm=="min_Nfragments": mask = fa["DATA_VF"]>=val
+    elif filterTerm=="min_af": mask = fa["real_AF"]>=val
+    elif filterTerm=="min_af_EitherSmallOrLargeEvent": mask = (fa["allele_frequency"]>=val) | (fa["allele_frequency_SmallEvent"]>=val)
+    elif filterTerm=="wrong_INFOtags": 
+        wrong_INFOtags = set(val)
+        mask = np.array([x not in wrong_INFOtags for x in fa["INFO_misc"]], dtype=bool)
+
+    elif filterTerm=="wrong_FILTERtags": 
+        wrong_FILTERtags = set(val)
+        mask = np.array([len(x.intersection(wrong_FILTERtags))==0 for x in fa["FILTER_set"]], dtype=bool)
+
+    elif filterTerm=="maximum_strand_bias": mask = ((fa["INFO_SB"]<val) | np.isnan(fa["INFO_SB"])) | ~(is_small_DupDel)
+    elif filterTerm=="maximum_microhomology": mask = fa["length_microHomology"]<val
+    elif filterTerm=="maximum_lenght_inexactHomology": mask = (fa["length_inexactHomology"]<val) | is_small_DupDel
+    elif filterTerm=="range_filt_DEL_breakpoints": mask = ~(fa["is_DEL"] & (fa["length_inexactHomology"]>=6) & (fa["length_event"]>=val[0]) & (fa["length_event"]<=val[1]))
+    elif filterTerm=="min_length_inversions": mask = ~(fa["is_INV"] & (fa["length_event"]<val) & (fa["length_microHomology"]>=6))
+    elif filterTerm=="dif_between_insert_and_del": mask = ~(fa["is_DEL"] & (fa["length_event"]<=filterValues[-1]) & (fa["len_inserted_sequence"]>=(fa["length_event"]-val)))
+    elif filterTerm=="filter_polyGC": mask = ~(fa["has_poly16GC"]) if val else np.ones(len(fa["length_event"]), dtype=bool)
+    elif filterTerm=="filter_noSplitReads": mask = (~(fa["DATA_SR"]==0) | ~(is_small_DupDel)) if val else np.ones(len(fa["length_event"]), dtype=bool)
+    elif filterTerm=="filter_noReadPairs": mask = (~(fa["DATA_RP"]==0) | is_small_DupDel) if val else np.ones(len(fa["length_event"]), dtype=bool)
+    elif filterTerm=="filter_overlappingRepeats": mask = ~(fa["overlaps_repeats"]) if val else np.ones(len(fa["length_event"]), dtype=bool)
+    else: raise ValueError("%s is not a valid filter term"%filterTerm)
+
+    return mask
+
+def get_packedMask_gridss_filter_term(fa, filterTerm, filterValues):
+
+    """Takes the output of get_gridss_filtering_arrays and returns a packed (np.packbits) array of the breakpoints (sorted as in fa["sorted_breakpointIDs"]) where both breakends pass one term of the filters. The masks are cached in fa, so that each (filterTerm, filterValues) is only calculated once."""
+
+    # define the key
+    key = (filterTerm, tuple([get_hashable_gridss_filter_value(fname, fval) for fname, fval in zip(g_gridssFilterTerm_to_filterNames[filterTerm], filterValues)]))
+
+    if key not in fa["filterTerm_to_packedMask"]:
+
+        # get the mask of breakends and keep the breakpoints where both breakends passed
+        mask_breakends = get_breakendMask_gridss_filter_term(fa, filterTerm, key[1])
+        mask_breakpoints = mask_breakends[fa["bendIdxA"]] & mask_breakends[fa["bendIdxB"]]
+
+        # keep packed
+        fa["filterTerm_to_packedMask"][key] = np.packbits(mask_breakpoints)
+
+    return fa["filterTerm_to_packedMask"][key]
+
+def precompute_packedMasks_gridss_filters(fa, filterName_to_filtersList, wrong_INFOtags=("IMPRECISE",), min_size=50):
+
+    """Takes the output of get_gridss_filtering_arrays and a dict mapping each filter name to the list of tested values (like in write_breakpoints_for_parameter_combinations_and_get_filterIDtoBpoints_gridss). It calculates, once, the packed masks of all the filter terms for all the tested values."""
+
+    # add the filters that are always the same
+    filterName_to_filtersList = {**filterName_to_filtersList, "wrong_INFOtags":[wrong_INFOtags], "min_size":[min_size]}
+
+    # go through each term and each combination of the values
+    for filterTerm, filterNames in g_gridssFilterTerm_to_filterNames.items():
+        for filterValues in itertools.product(*[filterName_to_filtersList[fname] for fname in filterNames]): get_packedMask_gridss_filter_term(fa, filterTerm, filterValues)
+
+    print_if_verbose("There are %i precomputed masks of breakpoints for the filters"%(len(fa["filterTerm_to_packedMask"])))
+
+def get_packedMask_breakpoints_for_filters_GRIDSS_bitmask(fa, filters_dict):
+
+    """Takes the output of get_gridss_filtering_arrays and a filters_dict (like the one passed to get_tupleBreakpoints_for_filters_GRIDSS). It returns a packed array of the breakpoints that pass all the filters, calculated by AND-ing the masks of each filter term."""
+
+    # debug the fact that there is no min_af_EitherSmallOrLargeEvent
+    if "min_af_EitherSmallOrLargeEvent" not in filters_dict: filters_dict["min_af_EitherSmallOrLargeEvent"] = 0.0
+
+    # get the AND of all the terms
+    packed_mask = None
+    for filterTerm, filterNames in g_gridssFilterTerm_to_filterNames.items():
+
+        term_mask = get_packedMask_gridss_filter_term(fa, filterTerm, [filters_dict[fname] for fname in filterNames])
+        if packed_mask is None: packed_mask = term_mask.copy()
+        else: np.bitwise_and(packed_mask, term_mask, out=packed_mask)
+
+    return packed_mask
+
+def get_tupleBreakpoints_from_packedMask_GRIDSS(fa, packed_mask):
+
+    """Takes the output of get_gridss_filtering_arrays and a packed mask of breakpoints and returns the sorted tuple of breakpoint IDs (as in get_tupleBreakpoints_for_filters_GRIDSS)"""
+
+    mask = np.unpackbits(packed_mask)[0:fa["n_breakpoints"]].astype(bool)
+    return tuple(fa["sorted_breakpointIDs"][mask])
+
+def get_tupleBreakpoints_for_filters_GRIDSS_bitmask(fa, filters_dict, return_timing=False):
+
+    """Equivalent to get_tupleBreakpoints_for_filters_GRIDSS, but taking the output of get_gridss_filtering_arrays (fa), which makes it much faster."""
+
+    # initialize time
+    start_time = time.time()
+
+    # get the breakpoints
+    correct_breakpoints = get_tupleBreakpoints_from_packedMask_GRIDSS(fa, get_packedMask_breakpoints_for_filters_GRIDSS_bitmask(fa, filters_dict))
+
+    if return_timing: return  (time.time() - start_time)
+    else: return correct_breakpoints
+
+def save_gridss_filtering_arrays_to_npy_dir(fa, npy_dir):
+
+    """Takes the output of get_gridss_filtering_arrays and writes it into npy_dir, so that the workers of a multiprocessing pool can load it once as memory-mapped arrays (see init_worker_gridss_filtering_arrays). The numeric arrays and the precomputed packed masks are written as .npy files, and the other objects are pickled."""
+
+    # init the folder
+    delete_folder(npy_dir); make_folder(npy_dir)
+
+    # go through each field
+    other_objects = {}
+    for field, value in fa.items():
+
+        # the masks are saved as a 2D array, with the keys pickled
+        if field=="filterTerm_to_packedMask":
+
+            packedMasks_keys = list(value.keys())
+            if len(packedMasks_keys)>0: np.save("%s/packedMasks.npy"%npy_dir, np.vstack([value[k] for k in packedMasks_keys]))
+            other_objects["packedMasks_keys"] = packedMasks_keys
+
+        # numeric arrays
+        elif type(value)==np.ndarray and value.dtype!=object: np.save("%s/%s.npy"%(npy_dir, field), value)
+
+        # other objects
+        else: other_objects[field] = value
+
+    save_object(other_objects, "%s/other_objects.py"%npy_dir)
+
+def load_gridss_filtering_arrays_from_npy_dir(npy_dir):
+
+    """Loads the output of save_gridss_filtering_arrays_to_npy_dir, with the numeric arrays and masks memory-mapped."""
+
+    # load the pickled objects
+    fa = load_object("%s/other_objects.py"%npy_dir)
+    packedMasks_keys = fa.pop("packedMasks_keys")
+
+    # load the arrays
+    for file in os.listdir(npy_dir):
+        if file.endswith(".npy") and file!="packedMasks.npy": fa[file.split(".npy")[0]] = np.load("%s/%s"%(npy_dir, file), mmap_mode="r")
+
+    # load the masks, each of them as a row of the memory-mapped array
+    if len(packedMasks_keys)>0: 
+        packedMasks = np.load("%s/packedMasks.npy"%npy_dir, mmap_mode="r")
+        fa["filterTerm_to_packedMask"] = {key : packedMasks[I] for I, key in enumerate(packedMasks_keys)}
 
-    """Takes a ploidy and returns the fraction_var and fraction_ref."""
+    else: fa["filterTerm_to_packedMask"] = {}
 
-    # define the fraction of reads that come from each genome
-    if ploidy in {"haploid", "diploid_homo"}:
+    return fa
 
-        fraction_var = 1.0
-        fraction_ref = 0.0
+# the filtering arrays of the workers of the pools that run get_packedMasks_for_filtersDicts_GRIDSS
+g_worker_gridss_filtering_arrays = None
 
-    elif ploidy=="diploid_hetero":
+def init_worker_gridss_filtering_arrays(npy_dir):
 
-        fraction_var = 0.5
-        fraction_ref = 0.5 
+    """Initializer of the workers of the pools that run get_packedMasks_for_filtersDicts_GRIDSS. It loads the filtering arrays once per worker."""
 
-    else:
+    global g_worker_gridss_filtering_arrays
+    g_worker_gridss_filtering_arrays = load_gridss_filtering_arrays_from_npy_dir(npy_dir)
 
-        # These are specific combinations of genomes (polyploids or populations)
-        try:
-            typeGenome_to_ncopies = {x.split(":")[0] : int(x.split(":")[1]) for x in ploidy.split("_")}
-            typeGenome_to_fraction_reads = {type_genome: ncopies / sum(typeGenome_to_ncopies.values()) for type_genome, ncopies in typeGenome_to_ncopies.items()}
+def get_packedMasksBytes_for_filtersDicts_GRIDSS_worker(filters_dict_list):
 
-        except: raise ValueError("ploidy %s is incorrect. The format is ref:2_var:1 , which would be one copy of variant genome for every two copies of reference genome"%ploidy)
-        
-        fraction_var = typeGenome_to_fraction_reads["var"]
-        fraction_ref = typeGenome_to_fraction_reads["ref"]
+    """Takes a list of filter dicts and returns a list with the packed masks of breakpoints (as bytes) of each of them. This is run by the workers initialized with init_worker_gridss_filtering_arrays."""
 
-    return fraction_var, fraction_ref
+    return [get_packedMask_breakpoints_for_filters_GRIDSS_bitmask(g_worker_gridss_filtering_arrays, fd).tobytes() for fd in filters_dict_list]
 
+def get_packedMasksBytes_for_filtersDicts_GRIDSS(fa, filters_dict_list, npy_dir, threads=4):
 
+    """Takes the output of get_gridss_filtering_arrays and a list of filter dicts. It returns a list with the packed masks of breakpoints (as bytes) of each filter dict. If threads>1 the filtering arrays are written once to npy_dir, and the workers of the pool load them as memory-mapped arrays. Only the filter dicts are sent to each task."""
 
-def merge_2bams(bamA, bamB, merged, threads=4):
+    # run in the main process
+    if threads==1 or len(filters_dict_list)<=1: return [get_packedMask_breakpoints_for_filters_GRIDSS_bitmask(fa, fd).tobytes() for fd in filters_dict_list]
 
-    """Merges two bams"""
-    remove_file(merged)
+    # write the arrays
+    save_gridss_filtering_arrays_to_npy_dir(fa, npy_dir)
 
-    merged_std = "%s.generating.std"%merged
-    print_if_verbose("merging %s and %s into %s. The std is in %s"%(bamA, bamB, merged, merged_std))
-    run_cmd("%s merge --threads %i %s %s %s > %s 2>&1"%(samtools, threads, merged, bamA, bamB, merged_std))
-    remove_file(merged_std)
+    # define the chunks of filter dicts, so that there are ~10 chunks per thread
+    chunk_size = max(1, int(ceil(len(filters_dict_list)/(threads*10))))
+    filters_dict_chunks = list(chunks(filters_dict_list, chunk_size))
 
-def sort_bam(bam, sorted_bam, threads=4):
+    # run in a pool where each worker has the arrays
+    with multiproc.Pool(threads, initializer=init_worker_gridss_filtering_arrays, initargs=(npy_dir,)) as pool:
+        packedMasks_chunks = pool.map(get_packedMasksBytes_for_filtersDicts_GRIDSS_worker, filters_dict_chunks)
+        pool.close()
 
-    """Sorts a bam file into sorted_bam"""
+    # clean
+    delete_folder(npy_dir)
 
-    # remove the previously generated .tmp. file
-    for f in os.listdir(get_dir(sorted_bam)):
-        
-        if f.startswith("%s.tmp."%(get_file(sorted_bam))): remove_file("%s/%s"%(get_dir(sorted_bam), f))
+    return make_flat_listOflists(packedMasks_chunks)
 
-    sorting_std = "%s.generating.std"%sorted_bam
-    print_if_verbose("sorting bam. The std is in %s"%sorting_std)
-    run_cmd("%s sort --threads %i -o %s %s > %s 2>&1"%(samtools, threads, sorted_bam, bam, sorting_std))
-    remove_file(sorting_std)
+def get_bpointTuple_to_filterDicts_GRIDSS_treeSearch(fa, filterName_to_filtersList, constant_filters_dict):
 
-def index_bam(bam, threads=4):
+    """Takes the output of get_gridss_filtering_arrays, a dict mapping each filter name to the tested values and a dict with the filters that are always the same (wrong_INFOtags and min_size). It returns a dict that maps each tuple of breakpoints to the list of filter dicts that yield it, as the brute force search of write_breakpoints_for_parameter_combinations_and_get_filterIDtoBpoints_gridss.
 
-    """indexes bam and creates a .bai file"""
+    The product of filters is searched as a tree, where each level is one filter in g_gridss_sorted_filterNames_treeSearch. Each node keeps the mask of the breakpoints that pass the filter terms that are already defined, which is reused by the children. The subtrees where there are no breakpoints left are pruned. Subtrees with the same breakpoints (and the same values of the filters of the terms that are not yet applied) as an already searched subtree are not searched again, but the results of the previous one are reused. """
 
-    indexing_std = "%s.generating.std"%bam
-    print_if_verbose("indexing bam. The std is in %s"%indexing_std)
-    run_cmd("%s index -@ %i %s > %s 2>&1"%(samtools, threads, bam, indexing_std))
-    remove_file(indexing_std)
+    # define the sizes of the tree
+    n_levels = len(g_gridss_sorted_filterNames_treeSearch)
+    level_to_filtersList = [filterName_to_filtersList[fname] for fname in g_gridss_sorted_filterNames_treeSearch]
 
+    depth_to_nLeaves = [1]*(n_levels+1) # the number of leaves below a node of each depth
+    depth_to_nDescendants = [0]*(n_levels+1) # the number of nodes below a node of each depth
+    for depth in reversed(range(n_levels)): 
+        depth_to_nLeaves[depth] = depth_to_nLeaves[depth+1]*len(level_to_filtersList[depth])
+        depth_to_nDescendants[depth] = len(level_to_filtersList[depth])*(1 + depth_to_nDescendants[depth+1])
 
-def merge_2bams_sort_and_index(bamfileA, bamfileB, merged_bam, merged_sorted_bam, merged_sorted_bam_index, threads=4):
+    # map each filter term to the depth where all its filters are defined
+    filterName_to_depth = {**{fname : 0 for fname in constant_filters_dict}, **{fname : level+1 for level, fname in enumerate(g_gridss_sorted_filterNames_treeSearch)}}
+    filterTerm_to_depth = {filterTerm : max([filterName_to_depth[fname] for fname in filterNames]) for filterTerm, filterNames in g_gridssFilterTerm_to_filterNames.items()}
+    depth_to_filterTerms = {depth : [t for t, d in filterTerm_to_depth.items() if d==depth] for depth in range(n_levels+1)}
 
-    """Takes two bams and merges them. writes files under merged_bam_prefix"""
+    # for each depth, define the levels that are already defined but are part of filter terms that are applied below. These are necessary to define whether two subtrees are equivalent
+    depth_to_pendingLevels = {depth : sorted({filterName_to_depth[fname]-1 for t, d in filterTerm_to_depth.items() if d>depth for fname in g_gridssFilterTerm_to_filterNames[t] if 0<filterName_to_depth[fname]<=depth}) for depth in range(n_levels+1)}
 
-    # first merge
-    merge_2bams(bamfileA, bamfileB, merged_bam, threads=threads)
+    # define a function that adds to a mask the filter terms of one depth
+    def get_mask_adding_filterTerms(mask, depth, level_values):
 
-    # sort 
-    sort_bam(merged_bam, merged_sorted_bam, threads=threads)
+        filters_dict = {**constant_filters_dict, **dict(zip(g_gridss_sorted_filterNames_treeSearch, level_values))}
+        for filterTerm in depth_to_filterTerms[depth]: mask = mask & get_packedMask_gridss_filter_term(fa, filterTerm, [filters_dict[fname] for fname in g_gridssFilterTerm_to_filterNames[filterTerm]])
+        return mask
 
-    # index
-    index_bam(merged_sorted_bam, threads=threads)
+    # init the objects of the search
+    maskBytes_to_maskID = {} # map each unique mask to an ID
+    leaf_globalIdxs = [] # the position (in the brute force order) of each leaf with some breakpoints
+    leaf_maskIDs = [] # the maskID of each leaf
+    nodeKey_to_leavesRange = {} # map each searched subtree to (global idx of the first leaf, first and last position in leaf_globalIdxs)
+    search_stats = {"evaluated":0, "skipped":0}
 
-    # remove the unsorted bam
-    remove_file(merged_bam)
+    def get_maskID(mask): return maskBytes_to_maskID.setdefault(mask.tobytes(), len(maskBytes_to_maskID))
 
+    # define a recursive function that searches the children of a node
+    def search_children(depth, level_values, mask, global_idx):
 
-def get_merged_bamfile_for_ploidy(variant_bamfile, reference_bamfile, ploidy, replace=False, threads=4):
+        for Ival, filterValue in enumerate(level_to_filtersList[depth]):
 
-    """This function takes two bam files, one that includes aligned reads for a reference genome and another that includes aligned reads for a variat genome. It subsamples each of the bamfiles so that there is a proportion of reads comming from each reference and variant, and the proportion is indicated by ploidy, which can be any of the strings in the default values of target_ploidies of run_GridssClove_optimising_parameters."""
+            # get the mask of the child
+            child_depth = depth+1
+            child_level_values = level_values + [filterValue]
+            child_global_idx = global_idx + Ival*depth_to_nLeaves[child_depth]
+            child_mask = get_mask_adding_filterTerms(mask, child_depth, child_level_values)
+            search_stats["evaluated"] += 1
 
-    print_if_verbose("merging %s and %s in ploidy %s"%(variant_bamfile, reference_bamfile, ploidy))
+            # prune empty subtrees
+            if not child_mask.any(): 
+                search_stats["skipped"] += depth_to_nDescendants[child_depth]
+                continue
 
-    # initialize counter
-    start_time = time.time()
+            # keep the leaves
+            if child_depth==n_levels: 
+                leaf_globalIdxs.append(child_global_idx)
+                leaf_maskIDs.append(get_maskID(child_mask))
+                continue
 
-    # haploid means only variant
-    if ploidy=="haploid": merged_sorted_bam = variant_bamfile
+            # define the key of the subtree
+            child_key = (child_depth, get_maskID(child_mask), tuple([get_hashable_gridss_filter_value(g_gridss_sorted_filterNames_treeSearch[l], child_level_values[l]) for l in depth_to_pendingLevels[child_depth]]))
 
-    # in all the other cases, do some merging
-    else:
+            # if the subtree was already searched, copy the leaves of it
+            if child_key in nodeKey_to_leavesRange:
 
-        # define the expected files
-        merged_bam = "%s.%s.bam"%(variant_bamfile, ploidy)
-        merged_sorted_bam = "%s.sorted"%merged_bam
-        merged_sorted_bam_index = "%s.bai"%merged_sorted_bam
+                seen_global_idx, seen_start, seen_end = nodeKey_to_leavesRange[child_key]
+                for I in range(seen_start, seen_end): 
+                    leaf_globalIdxs.append(leaf_globalIdxs[I] - seen_global_idx + child_global_idx)
+                    leaf_maskIDs.append(leaf_maskIDs[I])
 
-        if any([file_is_empty(f) for f in [merged_sorted_bam, merged_sorted_bam_index]]) or replace is True:
+                search_stats["skipped"] += depth_to_nDescendants[child_depth]
 
-            # FIRST DEFINE TWO BAMFILES
+            # if not, search it
+            else:
 
-            # diploid homo is merging a subset of 50% of reads for each variant_bamfile
-            if ploidy=="diploid_homo":
+                start = len(leaf_globalIdxs)
+                search_children(child_depth, child_level_values, child_mask, child_global_idx)
+                nodeKey_to_leavesRange[child_key] = (child_global_idx, start, len(leaf_globalIdxs))
 
-                # simulate 50% of reads for each the variant
-                bamfileA = downsample_bamfile_keeping_pairs(variant_bamfile, fraction_reads=0.5, replace=replace, threads=threads, name="varGenomeA")
-                bamfileB = downsample_bamfile_keeping_pairs(variant_bamfile, fraction_reads=0.5, replace=replace, threads=threads, name="varGenomeB")
+    # run the search from the root
+    root_mask = get_mask_adding_filterTerms(np.packbits(np.ones(fa["n_breakpoints"], dtype=bool)), 0, [])
+    if root_mask.any(): search_children(0, [], root_mask, 0)
+    else: search_stats["skipped"] += depth_to_nDescendants[0]
 
-            # all the situations where you have a combination of reference and variant genomes
-            else:
+    print_if_verbose("The tree search of filters evaluated %i nodes and skipped %i nodes (%.2f%%)"%(search_stats["evaluated"], search_stats["skipped"], (search_stats["skipped"]/max(depth_to_nDescendants[0], 1))*100))
 
-                # get the fractions of reads
-                fraction_var, fraction_ref = get_fractions_reads_for_ploidy(ploidy)
+    # define a function that gets the filters dict from the global idx
+    def get_filters_dict_from_globalIdx(global_idx):
 
-                # simulate the reads for the giiven fraction
-                bamfileA = downsample_bamfile_keeping_pairs(variant_bamfile, fraction_reads=fraction_var, replace=replace, threads=threads, name="varGenome")
-                bamfileB = downsample_bamfile_keeping_pairs(reference_bamfile, fraction_reads=fraction_ref, replace=replace, threads=threads, name="refGenome")
+        filters_dict = dict(constant_filters_dict)
+        for level, fname in enumerate(g_gridss_sorted_filterNames_treeSearch): filters_dict[fname] = level_to_filtersList[level][(global_idx//depth_to_nLeaves[level+1]) % len(level_to_filtersList[level])]
+        return filters_dict
 
-            # NOW MERGE, SORT and INDEX
-            merge_2bams_sort_and_index(bamfileA, bamfileB, merged_bam, merged_sorted_bam, merged_sorted_bam_index, threads=threads)
+    # map each tuple of breakpoints to the filter dicts, in the order of the brute force search
+    maskID_to_maskBytes = dict(zip(maskBytes_to_maskID.values(), maskBytes_to_maskID.keys()))
+    maskID_to_bpointTuple = {}
+    bpointTuple_to_filterDicts = {}
 
-            # FINALLY REMOVE THE SAMPLED BAMFILES
-            for f in [bamfileA, bamfileB]: remove_file(f)
+    for global_idx, maskID in zip(leaf_globalIdxs, leaf_maskIDs):
 
-    # get the time the function took to run
-    print_if_verbose("--- merging took for ploidy %s reads took %s seconds ---"%(ploidy, time.time() - start_time))
+        if maskID not in maskID_to_bpointTuple: maskID_to_bpointTuple[maskID] = get_tupleBreakpoints_from_packedMask_GRIDSS(fa, np.frombuffer(maskID_to_maskBytes[maskID], dtype=np.uint8))
+        bpointTuple_to_filterDicts.setdefault(maskID_to_bpointTuple[maskID], []).append(get_filters_dict_from_globalIdx(global_idx))
 
-    return merged_sorted_bam
+    return bpointTuple_to_filterDicts
 
 def get_tupleBreakpoints_for_filters_GRIDSS(df_gridss, filters_dict, reference_genome, return_timing=False):
 
@@ -8804,16 +10295,16 @@ def get_tupleBreakpoints_for_filters_GRIDSS(df_gridss, filters_dict, reference_g
     if return_timing: return  (time.time() - start_time)
     else: return correct_breakpoints
 
-def keep_relevant_filters_lists_inparallel(filterName_to_filtersList, df_gridss, reference_genome, type_filtering="keeping_all_filters_that_change",  wrong_INFOtags=("IMPRECISE",), min_size=50, threads=4):
+def keep_relevant_filters_lists_inparallel(filterName_to_filtersList, fa, npy_dir, type_filtering="keeping_all_filters_that_change",  wrong_INFOtags=("IMPRECISE",), min_size=50, threads=4):
 
-    """Takes a dictionary that maps the filterName to the list of possible filters. It modifies each of the lists in filterName_to_filtersList in a way that only those values that yield a unique set of breakpoints when being applied in the context of a set breakpoints. The final set of filters taken are the less conservative of each. """
+    """Takes a dictionary that maps the filterName to the list of possible filters. It modifies each of the lists in filterName_to_filtersList in a way that only those values that yield a unique set of breakpoints when being applied in the context of a set breakpoints. The final set of filters taken are the less conservative of each. fa is the output of get_gridss_filtering_arrays, which is used to get the breakpoints with get_tupleBreakpoints_for_filters_GRIDSS_bitmask. npy_dir is a temporary folder to share fa with the workers of the pool (see get_packedMasksBytes_for_filtersDicts_GRIDSS)."""
 
     # define a set of filters that are very unconservative (they take all the breakpoints)
     unconservative_filterName_to_filter = {"min_Nfragments":-1, "min_af":-1, "wrong_FILTERtags":("",), "filter_polyGC":False, "filter_noSplitReads":False, "filter_noReadPairs":False, "maximum_strand_bias":1.1, "maximum_microhomology":1000000000000, "maximum_lenght_inexactHomology":1000000000000, "range_filt_DEL_breakpoints":(0,1), "min_length_inversions":-1, "dif_between_insert_and_del":0, "max_to_be_considered_small_event":1, "wrong_INFOtags":wrong_INFOtags, "min_size":min_size, "min_af_EitherSmallOrLargeEvent":-1, "min_QUAL":0, "filter_overlappingRepeats":False}
 
     # define an unconservative set of breakpoints
     #unconservative_breakpoints = tuple(sorted([bp for bp, N in Counter(df_gridss.breakpointID).items() if N==2]))
-    unconservative_breakpoints = get_tupleBreakpoints_for_filters_GRIDSS(df_gridss, unconservative_filterName_to_filter, reference_genome)
+    unconservative_breakpoints = get_tupleBreakpoints_for_filters_GRIDSS_bitmask(fa, unconservative_filterName_to_filter)
     print_if_verbose("There are %i bp in total with unconservative filtering"%len(unconservative_breakpoints))
 
     if len(unconservative_breakpoints)==0: raise ValueError("There are no breakpoints after unconservative filtering. Something is wrong with the unconservative filters")
@@ -8832,16 +10323,8 @@ def keep_relevant_filters_lists_inparallel(filterName_to_filtersList, df_gridss,
             filter_changing_list.append((filterName, filterVal))
             filters_dict_list.append(filters_dict)
     
-    # run in a map or a pool the obtention of tuples of breakpoints for each parameter combination
-    inputs_fn = [(df_gridss, fd, reference_genome) for fd in filters_dict_list]
-
-    # pool
-    with  multiproc.Pool(threads) as pool:
-        bp_tuples_list = pool.starmap(get_tupleBreakpoints_for_filters_GRIDSS, inputs_fn)
-        pool.close()
-
-    # map
-    #bp_tuples_list = list(map(lambda x: get_tupleBreakpoints_for_filters_GRIDSS(x[0], x[1], x[2]), inputs_fn))
+    # get the tuples of breakpoints for each parameter combination
+    bp_tuples_list = [get_tupleBreakpoints_from_packedMask_GRIDSS(fa, np.frombuffer(packed_mask, dtype=np.uint8)) for packed_mask in get_packedMasksBytes_for_filtersDicts_GRIDSS(fa, filters_dict_list, npy_dir, threads=threads)]
 
     # map the filter changing to the dict and the breakpoints
     filterChanging_to_filtersDict = dict(zip(filter_changing_list, filters_dict_list))
@@ -8904,11 +10387,18 @@ def write_bedpeANDfilterdicts_for_breakpoints(df_bedpe, breakpoints, filterDicts
 
 def write_breakpoints_for_parameter_combinations_and_get_filterIDtoBpoints_gridss(df_gridss, df_bedpe, outdir, reference_genome, range_filtering="theoretically_meaningful", expected_AF=1.0, replace=False, threads=4):
 
-    """Gets, for a range of filters defined byrange_filtering, a dictionary that maps a string defining all these filters to a df that has the filtered breakpoints (bedpe) . If range_filtering is large, we expect ~13 h to run on 48 cores for the Candida glabrata genome"""
+    """Gets, for a range of filters defined byrange_filtering, a dictionary that maps a string defining all these filters to a df that has the filtered breakpoints (bedpe). The breakpoints of each filter combination are obtained by AND-ing precomputed masks of breakpoints for each filter value (see get_tupleBreakpoints_for_filters_GRIDSS_bitmask)."""
 
     # define files that will be written at the end of this function
     filtersID_to_breakpoints_file  = "%s/filtersID_to_breakpoints_file.py"%outdir
 
+    # define the type of search of the filter combinations. If range_filtering ends with '_treeSearch' the combinations are searched as a tree (see get_bpointTuple_to_filterDicts_GRIDSS_treeSearch)
+    if range_filtering.endswith("_treeSearch"): 
+        type_search = "tree"
+        range_filtering = range_filtering[0:-len("_treeSearch")]
+
+    else: type_search = "bruteForce"
+
     print_if_verbose("getting lists of bedpe breakpoints")
 
     if any([file_is_empty(f) for f in [filtersID_to_breakpoints_file]]) or replace is True:
@@ -9090,57 +10580,74 @@ def write_breakpoints_for_parameter_combinations_and_get_filterIDtoBpoints_grids
         # map the filters through a dict
         filterName_to_filtersList = {"min_Nfragments":min_Nfragments_l, "min_af":min_af_l, "wrong_FILTERtags":wrong_FILTERtags_l, "filter_polyGC":filter_polyGC_l, "filter_noSplitReads":filter_noSplitReads_l, "filter_noReadPairs":filter_noReadPairs_l, "maximum_strand_bias":maximum_strand_bias_l, "maximum_microhomology":maximum_microhomology_l, "maximum_lenght_inexactHomology":maximum_lenght_inexactHomology_l, "range_filt_DEL_breakpoints":range_filt_DEL_breakpoints_l, "min_length_inversions":min_length_inversions_l, "dif_between_insert_and_del":dif_between_insert_and_del_l, "max_to_be_considered_small_event":max_to_be_considered_small_event_l, "min_af_EitherSmallOrLargeEvent":min_af_EitherSmallOrLargeEvent_l, "min_QUAL":min_QUAL_l, "filter_overlappingRepeats":filter_overlappingRepeats_l}
 
+        # get the arrays to filter the breakpoints with bitmasks, and precompute the masks of all the filter values
+        print_if_verbose("precomputing the masks of breakpoints for each filter")
+        fa = get_gridss_filtering_arrays(df_gridss_twoBreakEnds)
+        precompute_packedMasks_gridss_filters(fa, filterName_to_filtersList, wrong_INFOtags=wrong_INFOtags, min_size=min_size)
+
         # edit the filter list, to keep only those that, when applied, change the called breakpoints
-        keep_relevant_filters_lists_inparallel(filterName_to_filtersList, df_gridss_twoBreakEnds, reference_genome, type_filtering="keeping_filters_that_yield_uniqueBPs", wrong_INFOtags=wrong_INFOtags, min_size=min_size, threads=threads) # it can also be keeping_all_filters_that_change or keeping_filters_that_yield_uniqueBPs or none
-
-        # initialize objects to store the filtering
-        I = 0
-        filters_dict_list = []
-
-        # go through each range of filters
-        print_if_verbose("generating dictionaries of filters")
-        for min_Nfragments in min_Nfragments_l:
-          for min_af in min_af_l:
-            for min_af_EitherSmallOrLargeEvent in min_af_EitherSmallOrLargeEvent_l:
-                for wrong_FILTERtags in wrong_FILTERtags_l:
-                  for filter_polyGC in filter_polyGC_l:
-                    for filter_noSplitReads in filter_noSplitReads_l:
-                      for filter_noReadPairs in filter_noReadPairs_l:
-                        for maximum_strand_bias in maximum_strand_bias_l:
-                          for maximum_microhomology in maximum_microhomology_l:
-                            for maximum_lenght_inexactHomology in maximum_lenght_inexactHomology_l:
-                              for range_filt_DEL_breakpoints in range_filt_DEL_breakpoints_l:
-                                for min_length_inversions in min_length_inversions_l:
-                                  for dif_between_insert_and_del in dif_between_insert_and_del_l:
-                                    for max_to_be_considered_small_event in max_to_be_considered_small_event_l:
-                                        for min_QUAL in min_QUAL_l:
-                                            for filter_overlappingRepeats in filter_overlappingRepeats_l:
-
-                                                I+=1
-
-                                                # get the parameters_dict
-                                                filters_dict = dict(min_Nfragments=min_Nfragments, min_af=min_af, wrong_INFOtags=wrong_INFOtags, wrong_FILTERtags=wrong_FILTERtags, filter_polyGC=filter_polyGC, filter_noSplitReads=filter_noSplitReads, filter_noReadPairs=filter_noReadPairs, maximum_strand_bias=maximum_strand_bias, maximum_microhomology=maximum_microhomology, maximum_lenght_inexactHomology=maximum_lenght_inexactHomology, range_filt_DEL_breakpoints=range_filt_DEL_breakpoints, min_length_inversions=min_length_inversions, dif_between_insert_and_del=dif_between_insert_and_del, max_to_be_considered_small_event=max_to_be_considered_small_event, min_size=min_size, min_af_EitherSmallOrLargeEvent=min_af_EitherSmallOrLargeEvent, min_QUAL=min_QUAL, filter_overlappingRepeats=filter_overlappingRepeats)
-
-                                                # keep
-                                                filters_dict_list.append(filters_dict)
+        npy_dir_filtering_arrays = "%s/gridss_filtering_arrays_npy"%outdir
+        keep_relevant_filters_lists_inparallel(filterName_to_filtersList, fa, npy_dir_filtering_arrays, type_filtering="keeping_filters_that_yield_uniqueBPs", wrong_INFOtags=wrong_INFOtags, min_size=min_size, threads=threads) # it can also be keeping_all_filters_that_change or keeping_filters_that_yield_uniqueBPs or none
+
+        if type_search=="bruteForce":
+
+            # initialize objects to store the filtering
+            I = 0
+            filters_dict_list = []
+
+            # go through each range of filters
+            print_if_verbose("generating dictionaries of filters")
+            for min_Nfragments in min_Nfragments_l:
+              for min_af in min_af_l:
+                for min_af_EitherSmallOrLargeEvent in min_af_EitherSmallOrLargeEvent_l:
+                    for wrong_FILTERtags in wrong_FILTERtags_l:
+                      for filter_polyGC in filter_polyGC_l:
+                        for filter_noSplitReads in filter_noSplitReads_l:
+                          for filter_noReadPairs in filter_noReadPairs_l:
+                            for maximum_strand_bias in maximum_strand_bias_l:
+                              for maximum_microhomology in maximum_microhomology_l:
+                                for maximum_lenght_inexactHomology in maximum_lenght_inexactHomology_l:
+                                  for range_filt_DEL_breakpoints in range_filt_DEL_breakpoints_l:
+                                    for min_length_inversions in min_length_inversions_l:
+                                      for dif_between_insert_and_del in dif_between_insert_and_del_l:
+                                        for max_to_be_considered_small_event in max_to_be_considered_small_event_l:
+                                            for min_QUAL in min_QUAL_l:
+                                                for filter_overlappingRepeats in filter_overlappingRepeats_l:
+
+                                                    I+=1
+
+                                                    # get the parameters_dict
+                                                    filters_dict = dict(min_Nfragments=min_Nfragments, min_af=min_af, wrong_INFOtags=wrong_INFOtags, wrong_FILTERtags=wrong_FILTERtags, filter_polyGC=filter_polyGC, filter_noSplitReads=filter_noSplitReads, filter_noReadPairs=filter_noReadPairs, maximum_strand_bias=maximum_strand_bias, maximum_microhomology=maximum_microhomology, maximum_lenght_inexactHomology=maximum_lenght_inexactHomology, range_filt_DEL_breakpoints=range_filt_DEL_breakpoints, min_length_inversions=min_length_inversions, dif_between_insert_and_del=dif_between_insert_and_del, max_to_be_considered_small_event=max_to_be_considered_small_event, min_size=min_size, min_af_EitherSmallOrLargeEvent=min_af_EitherSmallOrLargeEvent, min_QUAL=min_QUAL, filter_overlappingRepeats=filter_overlappingRepeats)
+
+                                                    # keep
+                                                    filters_dict_list.append(filters_dict)
         
-        print_if_verbose("There are %i combinations of parameters"%I)
+            print_if_verbose("There are %i combinations of parameters"%I)
 
-        # first try for some combinations, which will give you the timing 
-        times = [get_tupleBreakpoints_for_filters_GRIDSS(df_gridss_twoBreakEnds, filters_dict, reference_genome, return_timing=True) for filters_dict in random.sample(filters_dict_list, min(10, len(filters_dict_list)))]
-        ncores = threads
-        print_if_verbose("Obtaining the list of tuples of breakpoints will take around %.2f minutes on %i cores"%(((np.mean(times)*I)/ncores)/60, ncores))
+            # first try for some combinations, which will give you the timing 
+            times = [get_tupleBreakpoints_for_filters_GRIDSS_bitmask(fa, filters_dict, return_timing=True) for filters_dict in random.sample(filters_dict_list, min(10, len(filters_dict_list)))]
+            print_if_verbose("Obtaining the list of tuples of breakpoints will take less than %.2f minutes on %i cores"%(((np.mean(times)*I)/threads)/60, threads))
 
+            # map each packed mask of breakpoints (as bytes) to the dicts of parameters that gave it. Only the unique masks are converted to tuples of breakpoints
+            packedMask_to_filterDicts = {}
+            for packed_mask, filterDict in zip(get_packedMasksBytes_for_filtersDicts_GRIDSS(fa, filters_dict_list, npy_dir_filtering_arrays, threads=threads), filters_dict_list): packedMask_to_filterDicts.setdefault(packed_mask, []).append(filterDict)
 
-        # obtain the list of tuples for each parameter combintaion
-        with  multiproc.Pool(threads) as pool:
-            bp_tuples_list = pool.starmap(get_tupleBreakpoints_for_filters_GRIDSS, [(df_gridss_twoBreakEnds, fd, reference_genome) for fd in filters_dict_list])
-            pool.close()
+            # map each tuple o bp to the dicts of parameters that gave it
+            bpointTuple_to_filterDicts = {}
+            for packed_mask, filterDicts in packedMask_to_filterDicts.items():
+
+                bpointTuple = get_tupleBreakpoints_from_packedMask_GRIDSS(fa, np.frombuffer(packed_mask, dtype=np.uint8))
+                if len(bpointTuple)>0: bpointTuple_to_filterDicts[bpointTuple] = filterDicts
+
+        elif type_search=="tree":
+
+            # get the breakpoints for each filter combination, pruning the subtrees of the filters that are already empty or that have been seen
+            I = int(np.prod([len(filterName_to_filtersList[f]) for f in g_gridss_sorted_filterNames_treeSearch]))
+            print_if_verbose("There are %i combinations of parameters"%I)
+            bpointTuple_to_filterDicts = get_bpointTuple_to_filterDicts_GRIDSS_treeSearch(fa, filterName_to_filtersList, {"wrong_INFOtags":wrong_INFOtags, "min_size":min_size})
+
+        else: raise ValueError("%s is not a valid type_search"%type_search)
 
-        # map each tuple o bp to the dicts of parameters that gave it
-        bpointTuple_to_filterDicts = {}
-        for bpointTuple, filterDict in zip(bp_tuples_list, filters_dict_list): 
-            if len(bpointTuple)>0: bpointTuple_to_filterDicts.setdefault(bpointTuple, []).append(filterDict)
         print_if_verbose("There are %i sets of breakpoints that can be created with %i combinations of parameters"%(len(bpointTuple_to_filterDicts), I))
 
         # map each tuple pf breakpoints to an ID that will be saved
@@ -9172,141 +10679,164 @@ def write_breakpoints_for_parameter_combinations_and_get_filterIDtoBpoints_grids
     # return the dataframe with all the parameter combinations and the filter
     return filtersID_to_breakpoints
 
-def benchmark_bedpe_with_knownSVs(bedpe, know_SV_dict, reference_genome, sorted_bam, median_coverage, replace=False, ID_benchmark="defaultID", delete_intermediate_files=True, threads=4, expected_AF=1.0):
+def get_benchmarking_inputs_bedpe_with_knownSVs(bedpe, reference_genome, sorted_bam, median_coverage, replace=False, threads=4, expected_AF=1.0):
 
-    """Takes the full path to a bedpe file and generates files, under the same directory, that indicate the benchmarking.
-    expected_AF is the allele frequency expected by the reads. It will determine which parameters are used."""
+    """Takes the full path to a bedpe file, runs clove on it and writes, under the same directory, the predicted SVs for each of the clove coverage filters that are benchmarked by benchmark_bedpe_with_knownSVs. It returns a list of tuples (svtype_to_predsvfile, svtypes_to_benchmark, clove_max_rel_coverage_to_consider_del, clove_min_rel_coverage_to_consider_dup), one for each set of predicted SVs to benchmark."""
 
     # write files under the bedpe outdir
     outdir = "/".join(bedpe.split("/")[0:-1])
-    bedpe_filename = bedpe.split("/")[-1]
 
-    # get the benchmark file
-    benchmark_df_filename = "%s/df_benchmarking_allParms.py"%outdir
-    #remove_file(benchmark_df_filename) # debug
+    # get the df clove
+    df_clove = get_df_clove_from_bedpe(sorted_bam, bedpe, reference_genome, median_coverage, replace=replace, threads=threads, return_df=True, validate_all_coverage_already_calculated=True) # running with validate_all_coverage_already_calculated because it is assumed that all the coverage for necessary windows was already calculated
 
-    if file_is_empty(benchmark_df_filename) or replace is True:
-        print_if_verbose("benchmarking %s..."%outdir)
+    # initialize the inputs
+    benchmarking_inputs = []
 
-        # get the df clove
-        df_clove = get_df_clove_from_bedpe(sorted_bam, bedpe, reference_genome, median_coverage, replace=replace, threads=threads, return_df=True, validate_all_coverage_already_calculated=True) # running with validate_all_coverage_already_calculated because it is assumed that all the coverage for necessary windows was already calculated
+    # define boundaries of the coverage parameters
+    max_max_rel_coverage_to_consider_del = 1.1 - expected_AF  
+    min_min_rel_coverage_to_consider_dup = 1 + expected_AF*0.6
 
-        # initialize benchmark_df
-        df_benchmark_all = pd.DataFrame()
+    ##### INSERTIONS, INVERSIONS and TRANSLOCATIONS ##########
+    
+    # get files in a way that it is similar to RSVSim, only for complex variants
+    svtypes_InsInvTra = {"insertions", "inversions", "translocations"}
+    fileprefix = "%s/insertionsANDinversionsANDtranslocations"%(outdir)
+    remaining_df_clove, svtype_to_predsvfile = write_clove_df_into_bedORbedpe_files_like_RSVSim(df_clove, fileprefix, reference_genome, sorted_bam, replace=replace, svtypes_to_consider=svtypes_InsInvTra)
+    svtype_to_predsvfile_InsInvTra = {svtype : svtype_to_predsvfile[svtype] for svtype in svtypes_InsInvTra if svtype in svtype_to_predsvfile}
 
-        # define boundaries of the coverage parameters
-        max_max_rel_coverage_to_consider_del = 1.1 - expected_AF  
-        min_min_rel_coverage_to_consider_dup = 1 + expected_AF*0.6
+    # keep
+    benchmarking_inputs.append((svtype_to_predsvfile_InsInvTra, svtypes_InsInvTra, max_max_rel_coverage_to_consider_del, min_min_rel_coverage_to_consider_dup))
+
+    ##########################################################
+
+    ##### deletions #################
+
+    # get df
+    df_DEL = df_clove[df_clove.SVTYPE=="DEL"]
+
+    # go through different deletion ranges that define true deletion
+    max_rel_coverage_to_consider_del_l = [0.0, 0.0001, 0.001, 0.01, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5, 0.6, 0.7, 0.9, 1.0]
+    max_rel_coverage_to_consider_del_l = [x for x in max_rel_coverage_to_consider_del_l if x<=max_max_rel_coverage_to_consider_del]
+
+    for max_rel_coverage_to_consider_del in max_rel_coverage_to_consider_del_l:
+
+        # count the maximum coverage for the deletion
+        maxDELcoverage = int(max_rel_coverage_to_consider_del*median_coverage)
+
+        # define ID
+        coveragefiltID = "maxDELcoverage%i"%(maxDELcoverage)
+
+        # add the filter 
+        if len(df_DEL)>0: df_DEL["coverage_FILTER"] = df_DEL.apply(lambda r: get_covfilter_cloveDF_row_according_to_SVTYPE(r, max_rel_coverage_to_consider_del=max_rel_coverage_to_consider_del, min_rel_coverage_to_consider_dup=0), axis=1)
+        else: df_DEL["coverage_FILTER"] = []
+
+        # get a dict svtype_to_svfile
+        fileprefix = "%s/%s"%(outdir, coveragefiltID)
+        remaining_df_clove, svtype_to_predsvfile = write_clove_df_into_bedORbedpe_files_like_RSVSim(df_DEL, fileprefix, reference_genome, sorted_bam, replace=replace, svtypes_to_consider={"deletions"})
 
-        ##### BENCHMARK INSERTIONS, INVERSIONS and TRANSLOCATIONS ##########
-        
-        # get files in a way that it is similar to RSVSim, only for complex variants
-        fileprefix = "%s/insertionsANDinversionsANDtranslocations"%(outdir)
-        remaining_df_clove, svtype_to_predsvfile = write_clove_df_into_bedORbedpe_files_like_RSVSim(df_clove, fileprefix, reference_genome, sorted_bam, replace=replace, svtypes_to_consider={"insertions", "inversions", "translocations"})
-        svtype_to_predsvfile_InsInvTra = {svtype : svtype_to_predsvfile[svtype] for svtype in {"insertions", "inversions", "translocations"} if svtype in svtype_to_predsvfile}
-        know_SV_dict_InsInvTra = {svtype : know_SV_dict[svtype] for svtype in {"insertions", "inversions", "translocations"} if svtype in know_SV_dict}
-
-        # benchmark (and write missing events with overlaps)
-        df_benchmark_InsInvTra = benchmark_processedSVs_against_knownSVs_inHouse(svtype_to_predsvfile_InsInvTra, know_SV_dict_InsInvTra, fileprefix, replace=replace, add_integrated_benchmarking=False) # this time you don't want the 'integrated thing'
-        
         # keep
-        df_benchmark_all = df_benchmark_all.append(df_benchmark_InsInvTra, sort=True)
+        benchmarking_inputs.append((svtype_to_predsvfile, {"deletions"}, max_rel_coverage_to_consider_del, min_min_rel_coverage_to_consider_dup))
 
-        # add fields that are necessary to compare with the TANDEL df
-        df_benchmark_all["clove_max_rel_coverage_to_consider_del"] = [max_max_rel_coverage_to_consider_del]*len(df_benchmark_all)
-        df_benchmark_all["clove_min_rel_coverage_to_consider_dup"] = [min_min_rel_coverage_to_consider_dup]*len(df_benchmark_all)
+    ################################
 
+    ##### tandem duplications ######
 
-        #########################################################################
+    # get df
+    df_TAN = df_clove[df_clove.SVTYPE=="TAN"]
+    
+    # go through different TAN ranges that define true TAN
+    min_rel_coverage_to_consider_dup_l = [0.0, 0.4, 0.5, 1.0, 1.5, 1.8, 2.0, 2.5, 3.5]
+    min_rel_coverage_to_consider_dup_l = [x for x in min_rel_coverage_to_consider_dup_l if x>=min_min_rel_coverage_to_consider_dup]
 
-        # initialize a benchmark df for tandel
-        df_benchmark_TANDEL = pd.DataFrame()
+    for min_rel_coverage_to_consider_dup in min_rel_coverage_to_consider_dup_l:
 
-        ##### deletions #################
+        # count the maximum coverage for the tan
+        minDUPcoverage = int(min_rel_coverage_to_consider_dup*median_coverage)
 
-        # get df
-        df_DEL = df_clove[df_clove.SVTYPE=="DEL"]
+        # define ID
+        coveragefiltID = "minDUPcoverage%i"%(minDUPcoverage)
 
-        # go through different deletion ranges that define true deletion
-        max_rel_coverage_to_consider_del_l = [0.0, 0.0001, 0.001, 0.01, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5, 0.6, 0.7, 0.9, 1.0]
-        max_rel_coverage_to_consider_del_l = [x for x in max_rel_coverage_to_consider_del_l if x<=max_max_rel_coverage_to_consider_del]
+        # add the filter 
+        if len(df_TAN)>0: df_TAN["coverage_FILTER"] = df_TAN.apply(lambda r: get_covfilter_cloveDF_row_according_to_SVTYPE(r, max_rel_coverage_to_consider_del=1000000, min_rel_coverage_to_consider_dup=min_rel_coverage_to_consider_dup), axis=1)
+        else: df_TAN["coverage_FILTER"] = []
 
-        for max_rel_coverage_to_consider_del in max_rel_coverage_to_consider_del_l:
+        # get a dict svtype_to_svfile
+        fileprefix = "%s/%s"%(outdir, coveragefiltID)
+        remaining_df_clove, svtype_to_predsvfile = write_clove_df_into_bedORbedpe_files_like_RSVSim(df_TAN, fileprefix, reference_genome, sorted_bam, replace=replace, svtypes_to_consider={"tandemDuplications"})
 
-            # count the maximum coverage for the deletion
-            maxDELcoverage = int(max_rel_coverage_to_consider_del*median_coverage)
+        # keep
+        benchmarking_inputs.append((svtype_to_predsvfile, {"tandemDuplications"}, max_max_rel_coverage_to_consider_del, min_rel_coverage_to_consider_dup))
 
-            # define ID
-            coveragefiltID = "maxDELcoverage%i"%(maxDELcoverage)
+    ################################
 
-            # add the filter 
-            if len(df_DEL)>0: df_DEL["coverage_FILTER"] = df_DEL.apply(lambda r: get_covfilter_cloveDF_row_according_to_SVTYPE(r, max_rel_coverage_to_consider_del=max_rel_coverage_to_consider_del, min_rel_coverage_to_consider_dup=0), axis=1)
-            else: df_DEL["coverage_FILTER"] = []
+    return benchmarking_inputs
 
-            # get a dict svtype_to_svfile
-            fileprefix = "%s/%s"%(outdir, coveragefiltID)
-            remaining_df_clove, svtype_to_predsvfile = write_clove_df_into_bedORbedpe_files_like_RSVSim(df_DEL, fileprefix, reference_genome, sorted_bam, replace=replace, svtypes_to_consider={"deletions"})
+def get_df_benchmark_all_bedpe_with_knownSVs(bedpe, benchmarking_inputs, df_benchmark_list, ID_benchmark):
 
-            # benchmark
-            know_SV_dict_DEL = {svtype : know_SV_dict[svtype] for svtype in {"deletions"} if svtype in know_SV_dict}
+    """Takes the benchmarking_inputs of get_benchmarking_inputs_bedpe_with_knownSVs and the df_benchmark of each of them (as returned by benchmark_processedSVs_against_knownSVs_inHouse) and returns the df with all the benchmarking of the bedpe."""
 
-            df_benchmark = benchmark_processedSVs_against_knownSVs_inHouse(svtype_to_predsvfile, know_SV_dict_DEL, fileprefix, replace=replace, add_integrated_benchmarking=False)
+    # initialize benchmark_df
+    df_benchmark_all = pd.DataFrame()
 
-            df_benchmark["clove_max_rel_coverage_to_consider_del"] = [max_rel_coverage_to_consider_del]*len(df_benchmark)
-            df_benchmark["clove_min_rel_coverage_to_consider_dup"] = [min_min_rel_coverage_to_consider_dup]*len(df_benchmark)
+    for (svtype_to_predsvfile, svtypes_to_benchmark, max_rel_coverage_to_consider_del, min_rel_coverage_to_consider_dup), df_benchmark in zip(benchmarking_inputs, df_benchmark_list):
 
-            # keep
-            df_benchmark_TANDEL = df_benchmark_TANDEL.append(df_benchmark, sort=True)
+        # add the coverage parameters
+        df_benchmark["clove_max_rel_coverage_to_consider_del"] = [max_rel_coverage_to_consider_del]*len(df_benchmark)
+        df_benchmark["clove_min_rel_coverage_to_consider_dup"] = [min_rel_coverage_to_consider_dup]*len(df_benchmark)
 
-        ################################
+        # keep
+        df_benchmark_all = df_benchmark_all.append(df_benchmark, sort=True)
 
-        ##### tandem duplications ######
+    # add the IDs
+    df_benchmark_all["benchmarkID"] = [ID_benchmark]*len(df_benchmark_all)
+    df_benchmark_all["bedpe"] = [bedpe]*len(df_benchmark_all) # I changed this line at some point because it was raising integers
 
-        # get df
-        df_TAN = df_clove[df_clove.SVTYPE=="TAN"]
-        
-        # go through different TAN ranges that define true TAN
-        min_rel_coverage_to_consider_dup_l = [0.0, 0.4, 0.5, 1.0, 1.5, 1.8, 2.0, 2.5, 3.5]
-        min_rel_coverage_to_consider_dup_l = [x for x in min_rel_coverage_to_consider_dup_l if x>=min_min_rel_coverage_to_consider_dup]
+    # add the parameters that yielded this dict
+    filters_dict = load_object("%s/less_conservative_filtersDict.py"%get_dir(bedpe))
+    df_benchmark_all["filters_dict"] = [filters_dict]*len(df_benchmark_all)
 
-        for min_rel_coverage_to_consider_dup in min_rel_coverage_to_consider_dup_l:
+    return df_benchmark_all
 
-            # count the maximum coverage for the tan
-            minDUPcoverage = int(min_rel_coverage_to_consider_dup*median_coverage)
+def delete_intermediate_files_benchmark_bedpe_with_knownSVs(bedpe):
 
-            # define ID
-            coveragefiltID = "minDUPcoverage%i"%(minDUPcoverage)
+    """Removes the intermediate files generated by benchmark_bedpe_with_knownSVs in the directory of bedpe"""
 
-            # add the filter 
-            if len(df_TAN)>0: df_TAN["coverage_FILTER"] = df_TAN.apply(lambda r: get_covfilter_cloveDF_row_according_to_SVTYPE(r, max_rel_coverage_to_consider_del=1000000, min_rel_coverage_to_consider_dup=min_rel_coverage_to_consider_dup), axis=1)
-            else: df_TAN["coverage_FILTER"] = []
+    outdir = "/".join(bedpe.split("/")[0:-1])
+    bedpe_filename = bedpe.split("/")[-1]
 
-            # get a dict svtype_to_svfile
-            fileprefix = "%s/%s"%(outdir, coveragefiltID)
-            remaining_df_clove, svtype_to_predsvfile = write_clove_df_into_bedORbedpe_files_like_RSVSim(df_TAN, fileprefix, reference_genome, sorted_bam, replace=replace, svtypes_to_consider={"tandemDuplications"})
+    filenames_to_keep = {bedpe_filename, "%s.clove.vcf.TANDEL.bed.coverage_provided_windows.tab"%bedpe_filename, "unbalanced_translocations_5with5_or_3with3.bed.coverage_provided_windows.tab", "%s.clove.vcf"%bedpe_filename, "uniform_filters_series.py", "variable_filters_df.py", "df_benchmarking_allParms.py", "less_conservative_filtersDict.py", "%s.df_clove.tab"%bedpe_filename}
 
-            # benchmark
-            know_SV_dict_TAN = {svtype : know_SV_dict[svtype] for svtype in {"tandemDuplications"} if svtype in know_SV_dict}
+    for file in os.listdir(outdir):
+        if file not in filenames_to_keep and "benchmark_analysis_" not in file: remove_file("%s/%s"%(outdir, file))
 
-            df_benchmark = benchmark_processedSVs_against_knownSVs_inHouse(svtype_to_predsvfile, know_SV_dict_TAN, fileprefix, replace=replace, add_integrated_benchmarking=False)
-            df_benchmark["clove_max_rel_coverage_to_consider_del"] = [max_max_rel_coverage_to_consider_del]*len(df_benchmark)
-            df_benchmark["clove_min_rel_coverage_to_consider_dup"] = [min_rel_coverage_to_consider_dup]*len(df_benchmark)
+def benchmark_bedpe_with_knownSVs(bedpe, know_SV_dict, reference_genome, sorted_bam, median_coverage, replace=False, ID_benchmark="defaultID", delete_intermediate_files=True, threads=4, expected_AF=1.0):
 
-            # keep
-            df_benchmark_TANDEL = df_benchmark_TANDEL.append(df_benchmark, sort=True)
+    """Takes the full path to a bedpe file and generates files, under the same directory, that indicate the benchmarking.
+    expected_AF is the allele frequency expected by the reads. It will determine which parameters are used."""
 
-        ################################
+    # write files under the bedpe outdir
+    outdir = "/".join(bedpe.split("/")[0:-1])
 
-        # keep
-        df_benchmark_all = df_benchmark_all.append(df_benchmark_TANDEL, sort=True)
+    # get the benchmark file
+    benchmark_df_filename = "%s/df_benchmarking_allParms.py"%outdir
+    #remove_file(benchmark_df_filename) # debug
+
+    if file_is_empty(benchmark_df_filename) or replace is True:
+        print_if_verbose("benchmarking %s..."%outdir)
+
+        # get the predicted SVs for each set of clove coverage filters
+        benchmarking_inputs = get_benchmarking_inputs_bedpe_with_knownSVs(bedpe, reference_genome, sorted_bam, median_coverage, replace=replace, threads=threads, expected_AF=expected_AF)
+
+        # benchmark each of them
+        df_benchmark_list = []
+        for svtype_to_predsvfile, svtypes_to_benchmark, max_rel_coverage_to_consider_del, min_rel_coverage_to_consider_dup in benchmarking_inputs:
 
-        # append both and return
-        df_benchmark_all["benchmarkID"] = [ID_benchmark]*len(df_benchmark_all)
-        df_benchmark_all["bedpe"] = [bedpe]*len(df_benchmark_all) # I changed this line at some point because it was raising integers
+            know_SV_dict_svtypes = {svtype : know_SV_dict[svtype] for svtype in svtypes_to_benchmark if svtype in know_SV_dict}
+            fileprefix = "%s/benchmarking_%s"%(outdir, "AND".join(sorted(svtypes_to_benchmark)))
+            df_benchmark_list.append(benchmark_processedSVs_against_knownSVs_inHouse(svtype_to_predsvfile, know_SV_dict_svtypes, fileprefix, replace=replace, add_integrated_benchmarking=False)) # you don't want the 'integrated thing'
 
-        # add the parameters that yielded this dict
-        filters_dict = load_object("%s/less_conservative_filtersDict.py"%outdir)
-        df_benchmark_all["filters_dict"] = [filters_dict]*len(df_benchmark_all)
+        # get the df with all the benchmarking
+        df_benchmark_all = get_df_benchmark_all_bedpe_with_knownSVs(bedpe, benchmarking_inputs, df_benchmark_list, ID_benchmark)
 
         # save in disk
         print_if_verbose("saving into %s"%benchmark_df_filename)
@@ -9315,15 +10845,91 @@ def benchmark_bedpe_with_knownSVs(bedpe, know_SV_dict, reference_genome, sorted_
     else: df_benchmark_all = load_object(benchmark_df_filename)
 
     # delete intermediate fields
-    if delete_intermediate_files is True:
+    if delete_intermediate_files is True: delete_intermediate_files_benchmark_bedpe_with_knownSVs(bedpe)
 
-        filenames_to_keep = {bedpe_filename, "%s.clove.vcf.TANDEL.bed.coverage_provided_windows.tab"%bedpe_filename, "unbalanced_translocations_5with5_or_3with3.bed.coverage_provided_windows.tab", "%s.clove.vcf"%bedpe_filename, "uniform_filters_series.py", "variable_filters_df.py", "df_benchmarking_allParms.py", "less_conservative_filtersDict.py", "%s.df_clove.tab"%bedpe_filename}
+    return df_benchmark_all
 
-        for file in os.listdir(outdir):
-            if file not in filenames_to_keep and "benchmark_analysis_" not in file: remove_file("%s/%s"%(outdir, file))
+def benchmark_bedpe_list_with_knownSVs_batch(bedpe_list, know_SV_dict, reference_genome, sorted_bam, median_coverage, replace=False, ID_benchmark_list=None, delete_intermediate_files=True, threads=4, expected_AF=1.0, run_in_parallel=True):
 
+    """Batch version of benchmark_bedpe_with_knownSVs for several bedpes (one for each set of gridss filters) benchmarked against the same know_SV_dict. The clove outputs of each bedpe are generated first (in parallel if run_in_parallel), and then all the predicted SVs of each svtype are benchmarked at once with get_SVbenchmark_dicts_batch, so that the known SVs are loaded and indexed once and each unique predicted SV is matched only once. Many filter sets share most of their SVs, so this is much faster than benchmarking each bedpe independently. It returns a list with the df_benchmark_all of each bedpe, the same as benchmark_bedpe_with_knownSVs."""
 
-    return df_benchmark_all
+    # define the IDs
+    if ID_benchmark_list is None: ID_benchmark_list = [bedpe.split("/")[-2] for bedpe in bedpe_list]
+
+    # define the bedpes that need to be benchmarked
+    benchmark_df_filenames = ["%s/df_benchmarking_allParms.py"%get_dir(bedpe) for bedpe in bedpe_list]
+    Is_to_benchmark = [I for I, benchmark_df_filename in enumerate(benchmark_df_filenames) if file_is_empty(benchmark_df_filename) or replace is True]
+
+    if len(Is_to_benchmark)>0:
+        print_if_verbose("benchmarking %i bedpes in batch..."%len(Is_to_benchmark))
+
+        # get the predicted SVs of each bedpe
+        inputs_fn = [(bedpe_list[I], reference_genome, sorted_bam, median_coverage, replace, 1, expected_AF) for I in Is_to_benchmark]
+
+        if run_in_parallel is True:
+
+            # redefine the threads so that each thread has at least 6Gb of RAM
+            available_RAM = get_availableGbRAM(get_dir(sorted_bam))
+            max_threads = max([1, int(available_RAM/6 - 1)]) 
+            parallel_threads = min([threads, max_threads])
+
+            print_if_verbose("getting clove outputs for each set of filters in parallel on %i threads"%parallel_threads)
+            with multiproc.Pool(parallel_threads) as pool:
+                benchmarking_inputs_list = pool.starmap(get_benchmarking_inputs_bedpe_with_knownSVs, inputs_fn)
+                pool.close()
+                pool.terminate()
+
+        else: benchmarking_inputs_list = [get_benchmarking_inputs_bedpe_with_knownSVs(x[0], x[1], x[2], x[3], replace=x[4], threads=threads, expected_AF=x[6]) for x in inputs_fn]
+
+        # define all the predicted sets of each svtype, as (Ibenchmark, Iinput, predsvfile)
+        svtype_to_predsvfile_tuples = {}
+        for Ibenchmark, benchmarking_inputs in enumerate(benchmarking_inputs_list):
+            for Iinput, (svtype_to_predsvfile, svtypes_to_benchmark, max_rel_coverage_to_consider_del, min_rel_coverage_to_consider_dup) in enumerate(benchmarking_inputs):
+                for svtype in svtypes_to_benchmark.intersection(set(know_SV_dict)):
+
+                    if svtype in svtype_to_predsvfile: predsvfile = svtype_to_predsvfile[svtype]
+                    else: predsvfile = None
+                    svtype_to_predsvfile_tuples.setdefault(svtype, []).append((Ibenchmark, Iinput, predsvfile))
+
+        # benchmark all the predicted sets of each svtype at once
+        benchmarkInputTuple_to_svtype_to_dict = {}
+        for svtype, predsvfile_tuples in svtype_to_predsvfile_tuples.items():
+            print_if_verbose("benchmarking %i sets of %s"%(len(predsvfile_tuples), svtype))
+
+            # load known df
+            if type(know_SV_dict[svtype])==str: df_known = pd.read_csv(know_SV_dict[svtype], sep="\t")
+            else: df_known = know_SV_dict[svtype]
+
+            # get the benchmarking dicts
+            fieldsDict = svtype_to_fieldsDict[svtype]
+            dict_benchmark_list = get_SVbenchmark_dicts_batch([x[2] for x in predsvfile_tuples], df_known, equal_fields=fieldsDict["equal_fields"], approximate_fields=fieldsDict["approximate_fields"], chromField_to_posFields=fieldsDict["chromField_to_posFields"])
+
+            for (Ibenchmark, Iinput, predsvfile), dict_benchmark_svtype in zip(predsvfile_tuples, dict_benchmark_list):
+                dict_benchmark_svtype["svtype"] = svtype
+                benchmarkInputTuple_to_svtype_to_dict.setdefault((Ibenchmark, Iinput), {})[svtype] = dict_benchmark_svtype
+
+        # get the df_benchmark_all for each bedpe, in the same way as benchmark_bedpe_with_knownSVs
+        for Ibenchmark, (I, benchmarking_inputs) in enumerate(zip(Is_to_benchmark, benchmarking_inputs_list)):
+
+            df_benchmark_list = []
+            for Iinput, (svtype_to_predsvfile, svtypes_to_benchmark, max_rel_coverage_to_consider_del, min_rel_coverage_to_consider_dup) in enumerate(benchmarking_inputs):
+
+                # get the benchmarking of the svtypes (in the same order as benchmark_processedSVs_against_knownSVs_inHouse)
+                svtype_to_dict = benchmarkInputTuple_to_svtype_to_dict.get((Ibenchmark, Iinput), {})
+                benchmark_dict = {svtype : svtype_to_dict[svtype] for svtype in set({svtype for svtype in svtypes_to_benchmark if svtype in know_SV_dict})}
+                df_benchmark_list.append(pd.DataFrame(benchmark_dict).transpose())
+
+            df_benchmark_all = get_df_benchmark_all_bedpe_with_knownSVs(bedpe_list[I], benchmarking_inputs, df_benchmark_list, ID_benchmark_list[I])
+            save_object(df_benchmark_all, benchmark_df_filenames[I])
+
+    # load the benchmarking dfs and delete intermediate files
+    df_benchmark_all_list = []
+    for bedpe, benchmark_df_filename in zip(bedpe_list, benchmark_df_filenames):
+
+        df_benchmark_all_list.append(load_object(benchmark_df_filename))
+        if delete_intermediate_files is True: delete_intermediate_files_benchmark_bedpe_with_knownSVs(bedpe)
+
+    return df_benchmark_all_list
 
 
 
@@ -9589,16 +11195,18 @@ def get_df_clove_from_bedpe(sorted_bam, bedpe, reference_genome, median_coverage
     else: return None
 
 
-def benchmark_GridssClove_for_knownSV(sample_bam, reference_genome, know_SV_dict, outdir, range_filtering="theoretically_meaningful", expected_AF=1.0, replace=False, threads=4, median_insert_size=500, median_insert_size_sd=50, mitochondrial_chromosome="mito_C_glabrata_CBS138", run_in_parallel=True):
+def benchmark_GridssClove_for_knownSV(sample_bam, reference_genome, know_SV_dict, outdir, range_filtering="theoretically_meaningful", expected_AF=1.0, replace=False, threads=4, median_insert_size=500, median_insert_size_sd=50, mitochondrial_chromosome="mito_C_glabrata_CBS138", run_in_parallel=True, batch_benchmarking=True):
 
     """Runs a benchmarking for several combinations of filters of a GridsssClove pipeline of a given bam file (sample_bam), writing files under outdir. The known SV are provided as a dictionary that maps each type of SV to a path where a table with the SVs are known .
 
-    range_filtering indicates which type of simulation will be performed, it can be "large", "medium", "small", "single" and correlates with the range of parameters to use.
+    range_filtering indicates which type of simulation will be performed, it can be "large", "medium", "small", "single" and correlates with the range of parameters to use. If it ends with "_treeSearch" the combinations of filters are searched as a tree (see get_bpointTuple_to_filterDicts_GRIDSS_treeSearch).
     expected_AF is the expected allele frequency, for a haploid it should be 1.0 
 
     median_insert_size is used to define small breakends to calculate their allele frequency
 
-    window_l is used to define the coverage for winows of regions"""
+    window_l is used to define the coverage for winows of regions
+
+    batch_benchmarking indicates whether to benchmark all the sets of filters at once against the known SVs (see benchmark_bedpe_list_with_knownSVs_batch), instead of each of them independently"""
 
 
     ###### DEFINE GENERAL THINGS
@@ -9689,7 +11297,11 @@ def benchmark_GridssClove_for_knownSV(sample_bam, reference_genome, know_SV_dict
             # define inputs of the benchmarking pipeline
             inputs_benchmarking_pipeline = [(bedpe, know_SV_dict, reference_genome, sample_bam, median_coverage, replace, bedpe.split("/")[-2], True, parallel_threads, expected_AF) for bedpe in paths_to_bedpe_breakpoints]
 
-            if run_in_parallel is True:
+            if batch_benchmarking is True:
+
+                all_benchmarking_dfs = benchmark_bedpe_list_with_knownSVs_batch(paths_to_bedpe_breakpoints, know_SV_dict, reference_genome, sample_bam, median_coverage, replace=replace, ID_benchmark_list=[bedpe.split("/")[-2] for bedpe in paths_to_bedpe_breakpoints], delete_intermediate_files=True, threads=threads, expected_AF=expected_AF, run_in_parallel=run_in_parallel)
+
+            elif run_in_parallel is True:
 
                 # initialize the list of benchmarking dfs
                 all_benchmarking_dfs = []
@@ -9718,7 +11330,7 @@ def benchmark_GridssClove_for_knownSV(sample_bam, reference_genome, know_SV_dict
                 all_benchmarking_dfs = list(map(lambda x: benchmark_bedpe_with_knownSVs(x[0], x[1], x[2], x[3], x[4], x[5], x[6], x[7], x[8], x[9]), inputs_benchmarking_pipeline))
 
             #### delete the bamfiles for the chromosomes, which are created in benchmark_bedpe_with_knownSVs ######
-            all_chromosome_IDs = set([s.id for s in SeqIO.parse(reference_genome, "fasta")])
+            all_chromosome_IDs = set(get_chrom_to_len_genome_store(reference_genome))
             outdir_bam = get_dir(sample_bam)
             name_bam = get_file(sample_bam)
             for chrom in all_chromosome_IDs: 
@@ -10558,7 +12170,7 @@ def get_best_parameters_for_GridssClove_run(sorted_bam, reference_genome, outdir
         df_repeats = get_tab_as_df_or_empty_df("%s.repeats.tab"%reference_genome)
 
         # redefine the reference genome
-        interesting_chromRecords = [seq for seq in SeqIO.parse(reference_genome, "fasta") if seq.id in simulation_chromosomes_set]
+        interesting_chromRecords = get_seqRecords_genome_store(reference_genome, chromosomes=simulation_chromosomes_set)
         if len(interesting_chromRecords)!=len(simulation_chromosomes_set): raise ValueError("not all chroms are in reference genome")
 
         reference_genome = "%s.subsetChromsForSimulation.fasta"%reference_genome
@@ -11268,7 +12880,7 @@ def link_files_from_other_perSVade_outdirs_reads_and_alignment(outdir, other_per
 
 def get_multifasta_genome_split_into_windows(reference_genome, window_size, replace, max_query_windows):
 
-    """Splits a genome into windows of window_size"""
+    """Splits a genome into windows of window_size. The sequences are written directly from the genome store, without building SeqRecords"""
 
     windows_multifasta = "%s.windows_%ibp_max%iWindows.fasta"%(reference_genome, window_size, max_query_windows)
     if file_is_empty(windows_multifasta) or replace is True:
@@ -11276,98 +12888,136 @@ def get_multifasta_genome_split_into_windows(reference_genome, window_size, repl
 
         # load genome
         chr_to_len = get_chr_to_len(reference_genome)
-        chr_to_seq = {seq.id : seq for seq in SeqIO.parse(reference_genome, "fasta")}
-
-        # index it
-        index_genome(reference_genome, replace=replace)
 
-        # make windows of the genome
-        windows_file = "%s.windows%ibp.bed"%(reference_genome, window_size)
-        windows_file_stderr = "%s.generating.stderr"%windows_file
-        run_cmd("%s makewindows -g %s.fai -w %i > %s 2>%s"%(bedtools, reference_genome, window_size, windows_file, windows_file_stderr)) # debug
-        df_windows = pd.read_csv(windows_file, sep="\t", header=-1, names=["chromosome", "start", "end"])
+        # make windows of the genome (like bedtools makewindows)
+        df_windows = pd.concat([pd.DataFrame({"chromosome":chrom, "start":np.arange(0, len_chrom, window_size)}) for chrom, len_chrom in chr_to_len.items()])
+        df_windows["end"] = np.minimum(df_windows.start + window_size, df_windows.chromosome.map(chr_to_len))
 
         # keep only max_query_windows (randomly, and then sorting them)
         df_windows = df_windows.sample(frac=1).iloc[0:max_query_windows].sort_values(by=["chromosome", "start", "end"])
 
-        # clean
-        for f in [windows_file, windows_file_stderr]: remove_file(f)
+        # write the multifasta, keeping the windows that have no Ns
+        print_if_verbose("writing windows with no Ns")
+        windows_multifasta_tmp = "%s.tmp"%windows_multifasta
+        n_windows_written = 0
+        with open(windows_multifasta_tmp, "w") as fd:
+            for chrom, start, end in df_windows[["chromosome", "start", "end"]].values:
 
-        # generate the multifasta
-        all_records = [SeqRecord(chr_to_seq[r.chromosome][r.start:r.end].seq, id="%s||%i||%i"%(r.chromosome, r.start, r.end), name="", description="") for I,r in df_windows.iterrows()]
-        len_all_records = len(all_records)
+                seq = fetch_genome_store(reference_genome, chrom, start, end)
+                if "N" in seq: continue
 
-        # keep the records that have no Ns
-        print_if_verbose("removing records with Ns")
-        all_records = [r for r in all_records if "N" not in r.seq]
-        print_if_verbose("There are %i/%i query regions with no Ns, kept for the analysis"%(len(all_records), len_all_records))
+                fd.write(">%s||%i||%i\n%s\n"%(chrom, start, end, seq))
+                n_windows_written += 1
 
-        windows_multifasta_tmp = "%s.tmp"%windows_multifasta
-        SeqIO.write(all_records, windows_multifasta_tmp, "fasta")
+        print_if_verbose("There are %i/%i query regions with no Ns, kept for the analysis"%(n_windows_written, len(df_windows)))
         os.rename(windows_multifasta_tmp, windows_multifasta)
 
     return windows_multifasta
-        
-def blastn_query_against_subject(query_fasta, database_multifasta, blast_outfile, outdir, threads, replace, max_eval=1e-5):
 
-    """This function blastn's query_multifasta against database_multifasta writing the blast_outfile as tab"""
+def split_multifasta_into_shards(multifasta, outdir, n_shards):
 
-    # define the outfields
-    out_fields = ["qseqid", "qlen", "sseqid", "slen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "score", "length", "pident", "nident", "qcovs"]
+    """Writes the records of multifasta into up to n_shards fastas under outdir (with a similar number of records each, keeping the order), and returns the list of shards. The records are copied as text, without parsing the sequences. Each shard is named after its records (shard_<first record>-<last record + 1>.fasta, 0-based), so that the names of the shards of a multifasta are stable"""
 
-    if file_is_empty(blast_outfile) or replace is True:
-        print_if_verbose("generating %s"%blast_outfile)
+    # get the start byte of each record
+    record_starts = []
+    with open(multifasta, "rb") as f:
+        pos = 0
+        for line in f:
+            if line.startswith(b">"): record_starts.append(pos)
+            pos += len(line)
+
+    record_starts.append(pos)
+    n_records = len(record_starts) - 1
+    if n_records==0: raise ValueError("There are no records in %s"%multifasta)
 
-        # put the query under outdir 
-        query = "%s/query.fasta"%outdir
-        soft_link_files(query_fasta, query)
+    # define the first record of each shard
+    n_shards = max([1, min([n_shards, n_records])])
+    shard_first_records = np.unique(np.linspace(0, n_records, n_shards+1).astype(int))
 
-        # init a list of blast_outfile_chrom
-        list_blast_outfile_chrom = []
+    # write the shards
+    list_shards = []
+    with open(multifasta, "rb") as f:
+        for Is, (first_record, last_record) in enumerate(zip(shard_first_records[:-1], shard_first_records[1:])):
 
-        # parallelize on chromosomes
-        for chrom in SeqIO.parse(database_multifasta, "fasta"):
-            print_if_verbose("getting blastn for chrom %s"%(chrom.id))
+            shard = "%s/shard_%i-%i.fasta"%(outdir, first_record, last_record)
+            f.seek(record_starts[first_record])
+            with open(shard, "wb") as fd: fd.write(f.read(record_starts[last_record]-record_starts[first_record]))
+            list_shards.append(shard)
 
-            # define the outdir for this chrom
-            blast_outfile_chrom = "%s.%s.out"%(blast_outfile, chrom.id)
-            list_blast_outfile_chrom.append(blast_outfile_chrom)
+    return list_shards
 
-            if file_is_empty(blast_outfile_chrom) or replace is True:
+def run_blastn_one_query_shard(query_shard, blast_db, blast_outfile_shard, max_eval, out_fields, threads):
 
-                # define outdir of this chrom
-                outdir_chrom = "%s/%s"%(outdir, chrom.id)
-                delete_folder(outdir_chrom); make_folder(outdir_chrom)
+    """Runs blastn of query_shard against blast_db (made with makeblastdb), writing blast_outfile_shard as tab (without header). It is skipped if blast_outfile_shard exists, so that interrupted runs are resumed."""
 
-                # generate the fasta for this chrom
-                database_chrom = "%s/database.fasta"%outdir_chrom
-                SeqIO.write([chrom], database_chrom, "fasta")
+    if file_is_empty(blast_outfile_shard):
 
-                # make blast db
-                makeblastdb_out = "%s.generating.std"%database_chrom
-                run_cmd("%s -in %s -dbtype nucl > %s"%(makeblastdb, database_chrom, makeblastdb_out), env=EnvName_RepeatMasker)
+        blast_outfile_shard_tmp = "%s.tmp"%blast_outfile_shard
+        blast_std = "%s.generating.std"%blast_outfile_shard
 
-                # run blast
-                blast_outfile_chrom_tmp = "%s.tmp"%blast_outfile_chrom
-                blast_std = "%s.generating.std"%blast_outfile_chrom
+        run_cmd('%s -query %s -out %s -evalue %.10f -db %s -num_threads %i -outfmt "6 %s" > %s 2>&1 '%(blastn, query_shard, blast_outfile_shard_tmp, max_eval, blast_db, threads, " ".join(out_fields), blast_std), env=EnvName_RepeatMasker)
 
-                print_if_verbose("running blastn. The std is in %s"%blast_std)
-                run_cmd('%s -query %s -out %s -evalue %.10f -db %s -num_threads %i -outfmt "6 %s" > %s 2>&1 '%(blastn, query, blast_outfile_chrom_tmp, max_eval, database_chrom, threads, " ".join(out_fields), blast_std), env=EnvName_RepeatMasker)
+        remove_file(blast_std)
+        os.rename(blast_outfile_shard_tmp, blast_outfile_shard)
 
-                # clean
-                remove_file(blast_std)
-                remove_file(makeblastdb_out)
-                delete_folder(outdir_chrom)
-                os.rename(blast_outfile_chrom_tmp, blast_outfile_chrom)
+    return blast_outfile_shard
 
+def blastn_query_against_subject(query_fasta, database_multifasta, blast_outfile, outdir, threads, replace, max_eval=1e-5):
+
+    """This function blastn's query_multifasta against database_multifasta writing the blast_outfile as tab. The blast database is built once for the whole database_multifasta, and the query is split into shards that are blasted in parallel (one thread each)."""
+
+    # define the outfields
+    out_fields = ["qseqid", "qlen", "sseqid", "slen", "qstart", "qend", "sstart", "send", "evalue", "bitscore", "score", "length", "pident", "nident", "qcovs"]
+
+    if file_is_empty(blast_outfile) or replace is True:
+        print_if_verbose("generating %s"%blast_outfile)
 
-        # get a df
-        print_if_verbose("generating df_blast")
-        df_blast = pd.concat([pd.read_csv(blast_outfile_chrom, sep="\t", header=-1, names=out_fields) for blast_outfile_chrom in list_blast_outfile_chrom])
+        # make the blast db once, under outdir
+        outdir_db = "%s/database"%outdir
+        blast_db = "%s/database.fasta"%outdir_db
+        if replace is True: delete_folder(outdir_db)
+        make_folder(outdir_db)
+        soft_link_files(database_multifasta, blast_db)
+
+        makeblastdb_finished_file = "%s.makeblastdb_finished.txt"%blast_db
+        if file_is_empty(makeblastdb_finished_file):
+            print_if_verbose("running makeblastdb")
+
+            makeblastdb_out = "%s.generating.std"%blast_db
+            run_cmd("%s -in %s -dbtype nucl > %s"%(makeblastdb, blast_db, makeblastdb_out), env=EnvName_RepeatMasker)
+            remove_file(makeblastdb_out)
+            open(makeblastdb_finished_file, "w").write("makeblastdb finished\n")
+
+        # split the query into one shard per thread. The blastn outputs of finished shards are kept (unless replace is True or the query or max_eval changed), so that interrupted runs are resumed
+        outdir_shards = "%s/query_shards"%outdir
+        shards_info_file = "%s/shards_info.py"%outdir_shards
+        shards_info = {"query_fasta":get_fullpath(query_fasta), "query_fasta_stat":(os.path.getmtime(query_fasta), os.path.getsize(query_fasta)), "max_eval":max_eval}
+
+        if replace is True or file_is_empty(shards_info_file) or load_object(shards_info_file)!=shards_info:
+            delete_folder(outdir_shards); make_folder(outdir_shards)
+            save_object(shards_info, shards_info_file)
+
+        list_query_shards = split_multifasta_into_shards(query_fasta, outdir_shards, threads)
+
+        # run blastn on each shard
+        print_if_verbose("running blastn on %i query shards with %i threads"%(len(list_query_shards), threads))
+        inputs_fn = [(query_shard, blast_db, "%s.out"%query_shard, max_eval, out_fields, 1) for query_shard in list_query_shards]
+        with multiproc.Pool(min([threads, len(inputs_fn)])) as pool:
+            list_blast_outfile_shards = pool.starmap(run_blastn_one_query_shard, inputs_fn, chunksize=1)
+            pool.close()
+            pool.terminate()
 
-        # get the blast_outfile
+        # stream the shards into the blast_outfile
+        print_if_verbose("merging the blastn outputs")
         blast_outfile_tmp = "%s.tmp"%blast_outfile
-        df_blast.to_csv(blast_outfile_tmp, sep="\t", header=True, index=False)
+        with open(blast_outfile_tmp, "w") as fd:
+            fd.write("\t".join(out_fields) + "\n")
+            for blast_outfile_shard in list_blast_outfile_shards:
+                with open(blast_outfile_shard, "r") as f: shutil.copyfileobj(f, fd)
+
+        # clean
+        delete_folder(outdir_shards)
+        delete_folder(outdir_db)
         os.rename(blast_outfile_tmp, blast_outfile)
 
     # load into df and return 
@@ -11398,18 +13048,19 @@ def get_blastn_regions_genome_against_itself(reference_genome, max_eval, query_w
 
         # filter so that you don't keep the same region
         blast_df["sstart_0based"] = blast_df.sstart - 1
-        blast_df["subject_like_qseqid"] = blast_df.sseqid + "||" + blast_df.sstart_0based.apply(str) + "||" + blast_df.send.apply(str)
+        blast_df["subject_like_qseqid"] = blast_df.sseqid + "||" + blast_df.sstart_0based.astype(str) + "||" + blast_df.send.astype(str)
 
         blast_df = blast_df[(blast_df.qseqid!=blast_df.subject_like_qseqid)]
 
         # add the distance between hits and some fields
-        blast_df["query_chromosome"] = blast_df.qseqid.apply(lambda x: x.split("||")[0])
-        blast_df["query_start"] = blast_df.qseqid.apply(lambda x: x.split("||")[1]).apply(int)
-        blast_df["query_end"] = blast_df.qseqid.apply(lambda x: x.split("||")[2]).apply(int)
+        qseqid_fields = blast_df.qseqid.str.rsplit("||", n=2, expand=True)
+        blast_df["query_chromosome"] = qseqid_fields[0]
+        blast_df["query_start"] = qseqid_fields[1].astype(int)
+        blast_df["query_end"] = qseqid_fields[2].astype(int)
 
         blast_df["subject_chromosome"] = blast_df.sseqid
-        blast_df["query_center"] = blast_df.query_start + ((blast_df.query_end-blast_df.query_start)/2).apply(int)
-        blast_df["subject_center"] = blast_df.sstart + ((blast_df.send-blast_df.sstart)/2).apply(int)
+        blast_df["query_center"] = blast_df.query_start + ((blast_df.query_end-blast_df.query_start)/2).astype(int)
+        blast_df["subject_center"] = blast_df.sstart + ((blast_df.send-blast_df.sstart)/2).astype(int)
 
         # clean
         delete_folder(tmpdir)
@@ -11428,21 +13079,17 @@ def get_bedpe_breakpoints_around_homologousRegions(blastn_file, bedpe_breakpoint
     if file_is_empty(bedpe_breakpoints) or replace is True:
         print_if_verbose("generating %s"%bedpe_breakpoints)
 
-        # get the blast df
+        # get the blast df, only with the used fields
         print_if_verbose("loading blast file")
-        blast_df = get_tab_as_df_or_empty_df(blastn_file)
+        important_fields = ["query_chromosome", "subject_chromosome", "query_center", "subject_center", "evalue", "qcovs"]
+        if file_is_empty(blastn_file): blast_df = pd.DataFrame(columns=important_fields)
+        else: blast_df = pd.read_csv(blastn_file, sep="\t", usecols=important_fields, dtype={"query_chromosome":str, "subject_chromosome":str})
         if len(blast_df)==0: raise ValueError("There are no blast hits in %s. Maybe this means that there are no homology regions in your genome."%blastn_file)
         
-        # add the distance between hits
-        print_if_verbose("getting distance between hits same chrom")
-        blast_df_sameChrom = blast_df[(blast_df.query_chromosome==blast_df.subject_chromosome)]
-        blast_df_sameChrom["distance_btw_hits"] = (blast_df_sameChrom.query_center-blast_df_sameChrom.subject_center).apply(abs)
-
-        print_if_verbose("getting distance between hits different chrom")
-        blast_df_difChrom = blast_df[(blast_df.query_chromosome!=blast_df.subject_chromosome)]
-        blast_df_difChrom["distance_btw_hits"] = (min_sv_size*1000)
-
-        blast_df = blast_df_sameChrom.append(blast_df_difChrom)
+        # add the distance between hits (hits in different chromosomes are always far enough)
+        print_if_verbose("getting distance between hits")
+        is_same_chrom = (blast_df.query_chromosome==blast_df.subject_chromosome).values
+        blast_df["distance_btw_hits"] = np.where(is_same_chrom, (blast_df.query_center-blast_df.subject_center).abs(), (min_sv_size*1000))
 
         # filter according to evalue, qcovs and size
         print_if_verbose("filtering")
@@ -11450,43 +13097,22 @@ def get_bedpe_breakpoints_around_homologousRegions(blastn_file, bedpe_breakpoint
         print_if_verbose("There are %i regions with homology after filtering"%len(blast_df))
 
         # sort by being in the same chromosome and then eval. This is to ensure that interchromosomal breakpoints are taken first
-        isSameChrom_to_number = {True:0, False:1}
-        blast_df["is_same_chromosomeNumber"] = (blast_df.query_chromosome==blast_df.subject_chromosome).apply(lambda x: isSameChrom_to_number[x])
+        blast_df["is_same_chromosomeNumber"] = (blast_df.query_chromosome!=blast_df.subject_chromosome).astype(int)
         blast_df = blast_df.sort_values(by=["is_same_chromosomeNumber", "evalue"])
 
-        # add the ID
-        blast_df["ID"] = ["blastnHit_%i"%I for I in range(len(blast_df))]
-
         # add the orientation
-        blast_df["correct_bedpe_order"] = ((blast_df.query_chromosome==blast_df.subject_chromosome) & (blast_df.query_center<blast_df.subject_center)) | (blast_df.query_chromosome<blast_df.subject_chromosome)
+        correct_bedpe_order = (((blast_df.query_chromosome==blast_df.subject_chromosome) & (blast_df.query_center<blast_df.subject_center)) | (blast_df.query_chromosome<blast_df.subject_chromosome)).values
 
         print_if_verbose("getting the bedpe df")
 
-        # generate one breakpoint for each of the overlapping regions
-        def get_bedpe_series_for_blast_df_r(r):
-
-            # in the right orientation
-            if r.correct_bedpe_order is True:
-
-                dict_bedpe = {"chrom1":r.query_chromosome, "start1":r.query_center-1, "end1":r.query_center, "chrom2":r.subject_chromosome, "start2": r.subject_center-1, "end2":r.subject_center}
-
-            # in the reverse orientation
-            else:
-
-                dict_bedpe = {"chrom1":r.subject_chromosome, "start1":r.subject_center-1, "end1":r.subject_center, "chrom2":r.query_chromosome, "start2": r.query_center-1, "end2":r.query_center}
-
-
-            # add general things
-            strands = ["+", "-"]
-            dict_bedpe["ID"] = r.ID
-            dict_bedpe["score"] = 100.0
-            dict_bedpe["strand1"] = random.choice(strands)
-            dict_bedpe["strand2"] = random.choice(strands)
-
-            return pd.Series(dict_bedpe)
+        # generate one breakpoint for each of the overlapping regions, in the right orientation
+        chrom1 = np.where(correct_bedpe_order, blast_df.query_chromosome, blast_df.subject_chromosome)
+        center1 = np.where(correct_bedpe_order, blast_df.query_center, blast_df.subject_center)
+        chrom2 = np.where(correct_bedpe_order, blast_df.subject_chromosome, blast_df.query_chromosome)
+        center2 = np.where(correct_bedpe_order, blast_df.subject_center, blast_df.query_center)
 
-        important_fields = ["query_chromosome", "subject_chromosome", "query_center", "subject_center", "ID", "correct_bedpe_order"]
-        bedpe_df = blast_df[important_fields].apply(get_bedpe_series_for_blast_df_r, axis=1)
+        strands = np.array(["+", "-"])
+        bedpe_df = pd.DataFrame({"chrom1":chrom1, "start1":center1-1, "end1":center1, "chrom2":chrom2, "start2":center2-1, "end2":center2, "ID":["blastnHit_%i"%I for I in range(len(blast_df))], "score":100.0, "strand1":np.random.choice(strands, len(blast_df)), "strand2":np.random.choice(strands, len(blast_df))})
 
         # write
         bedpe_breakpoints_tmp = "%s.tmp"%bedpe_breakpoints
@@ -11993,10 +13619,13 @@ def generate_final_file_report(final_file, start_time_GeneralProcessing, end_tim
     open(final_file, "w").write("\n".join(lines))
 
 
-def generate_final_file_report_one_module(final_file, start_time, end_time):
+def generate_final_file_report_one_module(final_file, start_time, end_time, stage=None, requested_threads=None, start_cpu_time=None):
 
-    """Writes the seconds taht it took to finish the pipeline"""
+    """Writes the seconds taht it took to finish the pipeline. If stage is provided it also records the used threads (see record_threads_used_stage) in the dir of final_file, which needs the start_cpu_time of the stage (from get_cpu_time_self_and_children)"""
 
+    if stage is not None: 
+        if start_cpu_time is None: raise ValueError("start_cpu_time should be provided to record the threads of %s"%stage)
+        record_threads_used_stage(get_dir(final_file), stage, requested_threads, start_time, end_time, start_cpu_time)
     open(final_file, "w").write("perSVade finished in %s seconds"%(end_time-start_time))
 
 
@@ -14191,58 +15820,71 @@ def get_df_windows(ref_genome, wsize):
     return df_windows
 
 
-def get_mappability_per_pos_one_chunk(Ic, nchunks, fields_mappability, mappability_file_chunk, chunk_windows, chromosome):
+def get_mappability_RLE_one_chromosome(map_bed_chrom, len_chrom):
 
-    """gets the mappability for one chunk """
+    """Takes the bed with the mappability of one chromosome (the genmap output) and returns the run-length-encoded mappability, as a tuple of arrays (starts, ends, scores) that cover all the positions of the chromosome. Positions that are not in the bed have a mappability of 0.0, and adjacent runs with the same score are merged."""
 
-    # generate the mappability file
-    if file_is_empty(mappability_file_chunk):
-        print_if_verbose("Generatting map per pos file for chunk %i/%i"%(Ic+1, nchunks))
+    # load df
+    if file_is_empty(map_bed_chrom): df_map = pd.DataFrame(columns=["chromosome", "start", "end", "strand", "map_idx"])
+    else: df_map = pd.read_csv(map_bed_chrom, sep="\t", header=None, names=["chromosome", "start", "end", "strand", "map_idx"]).sort_values(by="start") # strand 
 
-        # load df
-        df_map = pd.read_csv(chunk_windows, sep="\t", header=None, names=["chromosome", "start", "end", "strand", "map_idx"]) # strand 
+    # checks
+    if not all(df_map.strand=="-"): raise ValueError("strand should be always -")
 
-        # checks
-        if not all(df_map.strand=="-"): raise ValueError("strand should be always -")
+    starts = df_map.start.values.astype(np.int64)
+    ends = df_map.end.values.astype(np.int64)
+    scores = df_map.map_idx.values.astype(float)
 
-        # define a list with the positions and the scores for that window
-        df_map["positions_list"] = df_map[["start", "end"]].apply(lambda r: list(range(r["start"], r["end"])), axis=1)
-        df_map["length_range"] = df_map.positions_list.apply(len)
-        df_map["map_idx_list"] = df_map[["length_range", "map_idx"]].apply(lambda r: [r["map_idx"]]*int(r["length_range"]), axis=1)
+    if any(starts>=ends) or any(starts[1:]<ends[:-1]) or any(starts<0) or any(ends>len_chrom): raise ValueError("The intervals of %s should be sorted, non-overlapping and within the chromosome"%map_bed_chrom)
 
-        # initialize a dictionary that will store chromosome, position and mappability_score as lists
-        expanded_data_dict = {"position":[], "unique_map_score":[]}
+    # add the regions with 0.0 mappability
+    gap_starts = np.append(0, ends)
+    gap_ends = np.append(starts, len_chrom)
+    idx_gaps = gap_ends>gap_starts
 
-        # go through each row of the dataframe and append the lists
-        for positions_list, map_idx_list in df_map[["positions_list", "map_idx_list"]].values:
-            expanded_data_dict["position"] += positions_list
-            expanded_data_dict["unique_map_score"] += map_idx_list
+    starts = np.append(starts, gap_starts[idx_gaps])
+    ends = np.append(ends, gap_ends[idx_gaps])
+    scores = np.append(scores, np.zeros(sum(idx_gaps)))
 
-        df_long = pd.DataFrame(expanded_data_dict).sort_values(by=["position"])
+    sorted_idx = np.argsort(starts)
+    starts, ends, scores = starts[sorted_idx], ends[sorted_idx], scores[sorted_idx]
 
-        # checks
-        len_region = df_map.end.iloc[-1] - df_map.start.iloc[0]
-        if df_map.start.iloc[0] != df_long.position.iloc[0]: raise ValueError("start should match")
-        if df_map.end.iloc[-1] != (df_long.position.iloc[-1]+1): raise ValueError("end should match")
-        if len(df_long)!=len_region: raise ValueError("len is not as expected")
-        if len(df_long)!=len(df_long["position"].unique()): raise ValueError("positions should be unique")
+    # merge adjacent runs with the same score
+    is_new_run = np.append(True, scores[1:]!=scores[:-1])
+    run_idx = np.nonzero(is_new_run)[0]
+    starts, ends, scores = starts[run_idx], np.append(ends[run_idx[1:]-1], ends[-1]), scores[run_idx]
 
-        # add chromosome
-        df_long["chromosome"] = str(df_map.chromosome.iloc[0]).split()[0]
+    # checks
+    if sum(ends-starts)!=len_chrom: raise ValueError("The mappability of %s should cover all the chromosome"%map_bed_chrom)
 
-        # add whether it is uniquely mappable
-        df_long["is_uniquely_mappable"] = (df_long.unique_map_score>=1.0).apply(int)
+    return starts, ends, scores
 
-        # save
-        mappability_file_chunk_tmp = "%s.tmp"%mappability_file_chunk
-        df_long[fields_mappability].to_csv(mappability_file_chunk_tmp, sep="\t", header=False, index=False)
+def get_median_mappability_windows_RLE(starts, ends, scores, window_starts, window_ends):
 
-        # clean objects
-        del df_long
-        del df_map
+    """Takes the run-length-encoded mappability of one chromosome (see get_mappability_RLE_one_chromosome) and the starts and ends (0-based, half-open) of some windows. It returns an array with the median mappability of the positions of each window (NaN for windows without positions). As in bedmap --median, the median of an even number of positions is the mean of the two central values."""
 
-        # keep
-        os.rename(mappability_file_chunk_tmp, mappability_file_chunk)
+    # get the runs that overlap each window
+    first_run = np.searchsorted(ends, window_starts, side="right")
+    last_run = np.searchsorted(starts, window_ends, side="left")
+
+    medians = np.full(len(window_starts), np.nan)
+    for I, (wstart, wend, Ifirst, Ilast) in enumerate(zip(window_starts, window_ends, first_run, last_run)):
+        if Ilast<=Ifirst: continue
+
+        # get the number of positions of each score in the window
+        run_scores = scores[Ifirst:Ilast]
+        run_lengths = np.minimum(ends[Ifirst:Ilast], wend) - np.maximum(starts[Ifirst:Ilast], wstart)
+
+        sorted_idx = np.argsort(run_scores, kind="mergesort")
+        run_scores = run_scores[sorted_idx]
+        cum_lengths = np.cumsum(run_lengths[sorted_idx])
+        npositions = cum_lengths[-1]
+        if npositions<=0: continue
+
+        # get the central values
+        medians[I] = (run_scores[np.searchsorted(cum_lengths, (npositions-1)//2, side="right")] + run_scores[np.searchsorted(cum_lengths, npositions//2, side="right")])/2
+
+    return medians
 
 def get_nlines_file_no_writing(file_name):
 
@@ -14263,14 +15905,14 @@ def check_correct_filename_dots(f, expected_chunks):
 
 def generate_genome_mappability_file(genome, replace=False, threads=4):
 
-    """Takes a genome in fasta and generates a file indicating the mappability of each position of the genome.
-    This writes a file (output) that contains, for each position (i) in the genome, the value of 1/ (number of 30-mers equal to the one that starts in i, allowing 2 missmatches). If it is 1 it is a uniquely mapped position """
+    """Takes a genome in fasta and generates a file with the run-length-encoded mappability of each chromosome (a dict mapping each chromosome to the (starts, ends, scores) arrays, see get_mappability_RLE_one_chromosome).
+    The mappability of each position (i) in the genome is the value of 1/ (number of 30-mers equal to the one that starts in i, allowing 2 missmatches). If it is 1 it is a uniquely mapped position """
 
     # if already generated, return it
-    map_outfile_long = "%s.mappability_per_position.bed"%genome # should have chromosome      position        unique_map_score        is_uniquely_mappable
-    if not file_is_empty(map_outfile_long): 
-        print_if_verbose("mappability per position file already generated.")
-        return map_outfile_long
+    map_outfile_RLE = "%s.mappability_RLE.py"%genome
+    if not file_is_empty(map_outfile_RLE): 
+        print_if_verbose("mappability file already generated.")
+        return map_outfile_RLE
 
     # first create the index
     genome_dir = "/".join(genome.split("/")[0:-1])
@@ -14288,149 +15930,58 @@ def generate_genome_mappability_file(genome, replace=False, threads=4):
         run_cmd("%s index -F %s -I %s -v > %s 2>&1"%(genmap, genome, idx_folder, genmap_std_file))
 
     # define the final file
-    if file_is_empty(map_outfile_long):
-        print_if_verbose("Getting the mappability per position...")
-
-        # create tmp dirwhere to save intermediate files
-        tmpdir = "%s/mappability_per_window_files"%genome_dir
-        make_folder(tmpdir)
+    print_if_verbose("Getting the mappability per chromosome...")
 
-        # create a dir where to save the per-chrom foles
-        per_chrom_map_files = "%s.mappability_per_position_per_chromosome"%genome
-        make_folder(per_chrom_map_files)
-
-        # get a df with windows of the genome of 0.1Mb
-        index_genome(genome)
-        df_windows = get_df_windows(genome, 1000000)
-        df_windows["chromosome"] = df_windows.chromosome.apply(str)
-        df_windows = df_windows.sort_values(by=["chromosome", "start", "end"])
-
-        # get chrom to len
-        chrom_to_len = get_chr_to_len(genome)
-
-        # init the map_outfile_long (tmp version)
-        map_outfile_long_tmp = "%s.tmp"%map_outfile_long
-        fields_mappability = ["chromosome", "position", "unique_map_score", "is_uniquely_mappable"]
-        remove_file(map_outfile_long_tmp)
-        open(map_outfile_long_tmp, "w").write("\t".join(fields_mappability)+"\n")
+    # create tmp dirwhere to save intermediate files
+    tmpdir = "%s/mappability_per_window_files"%genome_dir
+    make_folder(tmpdir)
 
-        # go through each chromosome
-        for chrom in sorted(set(df_windows.chromosome)):
-            print_if_verbose("Getting mappability per position for %s..."%chrom)
+    # create a dir where to save the per-chrom foles
+    per_chrom_map_files = "%s.mappability_RLE_per_chromosome"%genome
+    make_folder(per_chrom_map_files)
 
-            # define the file for the chrom and generate
-            map_outfile_long_chrom = "%s/mappability_chrom_%s.bed"%(per_chrom_map_files, chrom)
-            if file_is_empty(map_outfile_long_chrom):
+    # get chrom to len
+    index_genome(genome)
+    chrom_to_len = get_chr_to_len(genome)
 
-                # get df
-                df_windows_chrom = df_windows[df_windows.chromosome==chrom].copy()
-
-                # get the mappability per windows file for whole chrom
-                bed_region = "%s/bed_region_%s.bed"%(tmpdir, chrom)
-                pd.DataFrame({"chromosome":[chrom], "start":[df_windows_chrom.start.iloc[0]], "end":[df_windows_chrom.end.iloc[-1]]}).to_csv(bed_region, sep="\t", header=False, index=False)
-
-                # get the mappability per windows file
-                map_outfile_chrom = "%s/map_per_window_%s.bed"%(tmpdir, chrom)
-                genmap_std_file = "%s.map_running.std"%map_outfile_chrom
-
-                if file_is_empty(map_outfile_chrom):
-                    map_outfile_chrom_tmp = "%s.tmp.bed"%map_outfile_chrom
-                    remove_file(map_outfile_chrom_tmp)
-                    run_cmd("%s map -E 2 -K 30 -I %s -O %s -b --threads %i -v --selection %s > %s 2>&1"%(genmap, idx_folder, ".bed".join(map_outfile_chrom_tmp.split(".bed")[0:-1]), threads, bed_region, genmap_std_file))
-                    os.rename(map_outfile_chrom_tmp, map_outfile_chrom)
-
-                # add regions with 0.0 mappability
-                print_if_verbose("getting bed with 0 mappability")
-                map_outfile_chrom_0_map = "%s.0map.bed"%map_outfile_chrom
-                if file_is_empty(map_outfile_chrom_0_map):
-                    map_outfile_chrom_0_map_tmp = "%s.tmp"%map_outfile_chrom_0_map
-                    run_cmd("""%s subtract -a %s -b %s | awk -v OFS='\\t' '{print $1, $2, $3, "-", "0.0"}' > %s"""%(bedtools, bed_region, map_outfile_chrom, map_outfile_chrom_0_map_tmp))
-                    os.rename(map_outfile_chrom_0_map_tmp, map_outfile_chrom_0_map)
-
-                # generate the merged file of both
-                print_if_verbose("get merged bed")
-                map_outfile_chrom_merged = "%s.merged.bed"%map_outfile_chrom
-                if file_is_empty(map_outfile_chrom_merged):
-                    map_outfile_chrom_merged_tmp = "%s.tmp"%map_outfile_chrom_merged
-                    run_cmd("cat %s %s | sort -k1,1 -k2,2n -k3,3n > %s"%(map_outfile_chrom_0_map, map_outfile_chrom, map_outfile_chrom_merged_tmp))
-                    os.rename(map_outfile_chrom_merged_tmp, map_outfile_chrom_merged)
-
-                # split file in chunks
-                print_if_verbose("getting chunks...")
-                chunk_size = 10000
-                tmpdir_chrom = "%s/chrom_%s_csize_%i"%(tmpdir, chrom, chunk_size)
-                make_folder(tmpdir_chrom)
-
-                chunks_dir = "%s/chunks_windows"%tmpdir_chrom
-                if not os.path.isdir(chunks_dir):
-
-                    # log chunks
-                    nlines_merged_bed = get_nlines_file_no_writing(map_outfile_chrom_merged)
-                    nchunks = len(list(chunks(list(range(int(nlines_merged_bed))), chunk_size)))
-
-                    # split reads
-                    chunks_dir_tmp = "%s_tmp"%chunks_dir
-                    delete_folder(chunks_dir_tmp); make_folder(chunks_dir_tmp)
-                    for suffix_len in range(3, 100):
-                        if (24**suffix_len) > nchunks: break
-                    run_cmd("split -a %i -l %i %s %s/chunk."%(suffix_len, chunk_size, map_outfile_chrom_merged, chunks_dir_tmp))
+    # go through each chromosome
+    chrom_to_mappabilityRLE = {}
+    for chrom in sorted(chrom_to_len.keys()):
+        print_if_verbose("Getting mappability for %s..."%chrom)
 
-                    # keep
-                    for f in os.listdir(chunks_dir_tmp): check_correct_filename_dots(f, 2)
-                    os.rename(chunks_dir_tmp, chunks_dir)
-
-                # for each chunk, get the mappability per position in parallel
-                print("getting map per pos in parallel...")
-                chunks_dir_map = "%s/mappability_per_pos"%tmpdir_chrom; make_folder(chunks_dir_map)
-                nchunks = len(os.listdir(chunks_dir))
-                inputs_fn = []
-                for Ic, chunk_name in enumerate(sorted(os.listdir(chunks_dir))):
-                    mappability_file_chunk = "%s/%s_map_per_pos.bed"%(chunks_dir_map, chunk_name)
-                    inputs_fn.append((Ic, nchunks, fields_mappability, mappability_file_chunk, "%s/%s"%(chunks_dir, chunk_name), chrom))
+        # define the file for the chrom and generate
+        map_outfile_RLE_chrom = "%s/mappability_chrom_%s.py"%(per_chrom_map_files, chrom)
+        if file_is_empty(map_outfile_RLE_chrom):
 
-                with multiproc.Pool(threads) as pool:
-                    pool.starmap(get_mappability_per_pos_one_chunk, inputs_fn, chunksize=1) 
-                    pool.close()
-                    pool.terminate()
+            # get the mappability per windows file for whole chrom
+            bed_region = "%s/bed_region_%s.bed"%(tmpdir, chrom)
+            pd.DataFrame({"chromosome":[chrom], "start":[0], "end":[chrom_to_len[chrom]]}).to_csv(bed_region, sep="\t", header=False, index=False)
 
-                # create map_outfile_long_chrom
-                print_if_verbose("appending files for chrom %s..."%chrom)
-                map_outfile_long_chrom_tmp = "%s.tmp"%map_outfile_long_chrom
-                remove_file(map_outfile_long_chrom_tmp)
-                open(map_outfile_long_chrom_tmp, "w").write("\t".join(fields_mappability)+"\n")
-                run_cmd("cat %s/* | sort -k2,2n >> %s"%(chunks_dir_map, map_outfile_long_chrom_tmp))
+            # get the mappability per windows file
+            map_outfile_chrom = "%s/map_per_window_%s.bed"%(tmpdir, chrom)
+            genmap_std_file = "%s.map_running.std"%map_outfile_chrom
 
-                # checks
-                print_if_verbose("checking file...")
-                expected_chrom_len = df_windows_chrom.end.iloc[-1] - df_windows_chrom.start.iloc[0]
-                nlines_chrom = get_int_output_bash_command("wc -l %s"%map_outfile_long_chrom_tmp)
-                if expected_chrom_len!=(nlines_chrom-1): raise ValueError("# lines are not correct")
-                if get_int_output_bash_command("tail -n +2 %s | head -1 | cut -f2"%map_outfile_long_chrom_tmp) != 0: raise ValueError("pos1 should be 0")
-                if get_int_output_bash_command("tail -n1 %s | cut -f2"%map_outfile_long_chrom_tmp) != expected_chrom_len-1: raise ValueError("end should be chrom len")
-                if get_int_output_bash_command("cut -f2 %s | sort | uniq | wc -l"%map_outfile_long_chrom_tmp) != (expected_chrom_len+1): raise ValueError("there should be one pos per line")
-
-                # clean
-                for f in [bed_region, tmpdir_chrom, genmap_std_file, map_outfile_chrom_0_map, map_outfile_chrom_merged, map_outfile_chrom]:
-                    delete_file_or_folder(f)
+            if file_is_empty(map_outfile_chrom):
+                map_outfile_chrom_tmp = "%s.tmp.bed"%map_outfile_chrom
+                remove_file(map_outfile_chrom_tmp)
+                run_cmd("%s map -E 2 -K 30 -I %s -O %s -b --threads %i -v --selection %s > %s 2>&1"%(genmap, idx_folder, ".bed".join(map_outfile_chrom_tmp.split(".bed")[0:-1]), threads, bed_region, genmap_std_file))
+                os.rename(map_outfile_chrom_tmp, map_outfile_chrom)
 
-                # keep
-                print_if_verbose("cleaning....")
-                os.rename(map_outfile_long_chrom_tmp, map_outfile_long_chrom)
+            # get the run-length-encoded mappability
+            save_object(get_mappability_RLE_one_chromosome(map_outfile_chrom, chrom_to_len[chrom]), map_outfile_RLE_chrom)
 
-            # append to the complete file
-            print_if_verbose("appending to genome file...")
-            run_cmd_simple("tail -n +2 %s >> %s"%(map_outfile_long_chrom, map_outfile_long_tmp))
+            # clean
+            for f in [bed_region, genmap_std_file, map_outfile_chrom]: delete_file_or_folder(f)
 
-        # check and save
-        nlines_all = get_nlines_file_no_writing(map_outfile_long_tmp)
-        if (nlines_all-1)!=sum(chrom_to_len.values()):
-            raise ValueError("file has %i lines, and genome len is %i"%(nlines_all-1, sum(chrom_to_len.values())))
+        # keep
+        chrom_to_mappabilityRLE[chrom] = load_object(map_outfile_RLE_chrom)
 
-        # save and keep
-        delete_folder(tmpdir)
-        os.rename(map_outfile_long_tmp, map_outfile_long)
+    # save and keep
+    save_object(chrom_to_mappabilityRLE, map_outfile_RLE)
+    delete_folder(tmpdir)
+    delete_folder(per_chrom_map_files)
 
-    return map_outfile_long
+    return map_outfile_RLE
 
 def get_df_with_GCcontent(df_windows, genome, gcontent_outfile, replace=False):
 
@@ -14438,7 +15989,7 @@ def get_df_with_GCcontent(df_windows, genome, gcontent_outfile, replace=False):
 
     print_if_verbose("Getting GC content")
 
-    if file_is_empty(gcontent_outfile) or replace is True:
+    if columnar_file_is_empty(gcontent_outfile) or replace is True:
 
         # define the initial index
         initial_index = list(df_windows.index)
@@ -14477,10 +16028,10 @@ def get_df_with_GCcontent(df_windows, genome, gcontent_outfile, replace=False):
         # at the end save the df windows
         df_windows.index = initial_index
         df_windows = df_windows[initial_cols + ["GCcontent"]]
-        save_object(df_windows, gcontent_outfile)
+        save_df_columnar_file(df_windows, gcontent_outfile)
 
     # load
-    df_windows = load_object(gcontent_outfile)
+    df_windows = get_df_columnar_file(gcontent_outfile)
 
     return df_windows
 
@@ -14500,29 +16051,20 @@ def get_df_windows_with_median_mappability(df_windows, reference_genome, mappabi
         df_windows = df_windows.sort_values(by=["chromosome", "start", "end"])
         print_if_verbose("getting mappability for %i new windows"%len(df_windows))
 
-        # get the mappability per position into map_df
-        mappability_per_position_file = generate_genome_mappability_file(reference_genome, replace=replace, threads=threads)
-
-        # transform into a bed with 1-based 
-        print_if_verbose("Generating bed with 1-based coordinates...")
-        mappability_bed = "%s.mappability.bed"%mappability_outfile
-        run_cmd("""awk -v OFS='\\t' 'NR > 1 {print $1, $2, $2+1, NR-2, $3}' %s > %s"""%(mappability_per_position_file, mappability_bed))
+        # get the run-length-encoded mappability
+        chrom_to_mappabilityRLE = load_object(generate_genome_mappability_file(reference_genome, replace=replace, threads=threads))
 
-        # generate the bed with the windows
-        target_windows_bed = "%s.target_windows.bed"%mappability_outfile
-        df_windows["IDwindow"] = list(range(0, len(df_windows)))
-        df_windows[["chromosome", "start", "end", "IDwindow"]].to_csv(target_windows_bed, sep="\t", header=None, index=False)
+        # get the median mappability of the windows of each chromosome
+        print_if_verbose("getting median mappability of each window")
+        chromosomes = df_windows.chromosome.apply(str).values
+        median_mappability = np.full(len(df_windows), np.nan)
+        for chrom in set(chromosomes).intersection(set(chrom_to_mappabilityRLE)):
 
-        # run bedmap to get a file where each line corresponds to the regions to which each target_windows_bed
-        bedmap_outfile = "%s.bedmap.target_windows_overlappingMappability.txt"%mappability_outfile
-        bedmap_stderr = "%s.stderr"%bedmap_outfile
-
-        print_if_verbose("running bedmap. The stderr is in %s"%bedmap_stderr)
-        run_cmd("%s --fraction-map 1.0 --median --delim '\t' %s %s > %s 2>%s"%(bedmap, target_windows_bed, mappability_bed, bedmap_outfile, bedmap_stderr))
+            idx_chrom = np.nonzero(chromosomes==chrom)[0]
+            starts, ends, scores = chrom_to_mappabilityRLE[chrom]
+            median_mappability[idx_chrom] = get_median_mappability_windows_RLE(starts, ends, scores, df_windows.start.values[idx_chrom], df_windows.end.values[idx_chrom])
 
-        # load bedmap df into df
-        df_windows["median_mappability"] = open(bedmap_outfile, "r").readlines()
-        df_windows["median_mappability"] = df_windows.median_mappability.apply(float)
+        df_windows["median_mappability"] = median_mappability
 
         # debug
         if any(pd.isna(df_windows.median_mappability)) or any(df_windows.median_mappability>1): 
@@ -14532,9 +16074,6 @@ def get_df_windows_with_median_mappability(df_windows, reference_genome, mappabi
 
             raise ValueError("Something went went wrong with the mappability calculation")
 
-        # remove files
-        for f in [mappability_bed, target_windows_bed, bedmap_outfile, bedmap_stderr]: remove_file(f)
-
         # at the end save the df windows
         df_windows.index = initial_index
         df_windows = df_windows[initial_cols + ["median_mappability"]]
@@ -14648,6 +16187,15 @@ def get_value_to_color(values, palette="mako", n=100, type_color="rgb", center=N
 
     return value_to_color, palette_dict
 
+def get_unique_x_mean_y(x, y):
+
+    """Takes an x and a y array and returns the sorted unique x values and the mean y for each of them"""
+
+    xfit, inverse_idx = np.unique(np.array(x, dtype=float), return_inverse=True)
+    yfit = np.bincount(inverse_idx, weights=np.array(y, dtype=float)) / np.bincount(inverse_idx)
+
+    return xfit, yfit
+
 def get_lowess_fit_y(x, y, xtarget, frac, iterations, fill_value_interpolation):
 
     """This function takes an x and a y. It returns the prediction on the targetx.
@@ -14655,9 +16203,7 @@ def get_lowess_fit_y(x, y, xtarget, frac, iterations, fill_value_interpolation):
     fill_value_interpolation should be a tuple of the returned if x<min("""
 
     # get unique x and ys
-    x_to_y_unique = pd.DataFrame({"x":x, "y":y}).groupby("x").apply(lambda df_x: np.mean(df_x.y)).sort_index()
-    xfit = np.array(x_to_y_unique.index, dtype=float)
-    yfit = np.array(x_to_y_unique.values, dtype=float)
+    xfit, yfit = get_unique_x_mean_y(x, y)
 
     # get the loess fit
     lowess_results = cylowess.lowess(endog=yfit, exog=xfit, frac=frac, it=iterations)
@@ -14682,75 +16228,66 @@ def get_lowess_fit_y(x, y, xtarget, frac, iterations, fill_value_interpolation):
 
     return ypredicted_on_xtarget
 
+def get_LOWESS_CV_folds(x, y, kfold, min_test_points_CV):
 
-def get_LOWESS_benchmarking_series_CV(kfold, frac, it, df, xfield, yfield, min_test_points_CV, outdir):
+    """Takes the x and y arrays (sorted by x and y) and returns a list with the data of each of the kfold cross-validation folds, as (xfit, yfit, xtest, ytest). xfit and yfit are the unique train x and their mean y, and xtest and ytest are the test points that are within the train x range. It returns None if any fold has less than min_test_points_CV test points."""
 
-    """This function takes a df with xfield and yfield. It runs kfold cross validation and returns a series with the accuracies """
+    folds = []
+    kfold_object = KFold(n_splits=kfold, random_state=1, shuffle=True)
+    for numeric_train_index, numeric_test_index in kfold_object.split(x):
 
-    # define all the indices
-    all_idx = set(df.index)
+        # if there are not enough data points, break
+        if len(numeric_test_index)<min_test_points_CV: return None
 
-    # init rsquares
-    rsquares_cv = []
+        # get the train and test values, sorted as in x and y
+        numeric_train_index = np.sort(numeric_train_index)
+        numeric_test_index = np.sort(numeric_test_index)
+        xtrain = x[numeric_train_index]
+        xtest = x[numeric_test_index]
+        ytest = y[numeric_test_index]
 
-    # this will only work if the unique df is long enough
-    if len(df)>kfold and (frac*len(df))>=3: 
+        idx_correct_test = (xtest>xtrain[0]) & (xtest<xtrain[-1])
 
-        # iterate through 10-fold chross validation 
-        kfold_object = KFold(n_splits=kfold, random_state=1, shuffle=True)
-        for numeric_train_index, numeric_test_index in kfold_object.split(df.index):
+        # if there are not enough points, skip
+        if sum(idx_correct_test)<min_test_points_CV: return None
 
-            print_if_verbose("processing data")
+        # keep
+        xfit, yfit = get_unique_x_mean_y(xtrain, y[numeric_train_index])
+        folds.append((xfit, yfit, xtest[idx_correct_test], ytest[idx_correct_test]))
 
-            # get the idx test as the index of df
-            test_idx = set(df.iloc[numeric_test_index].index)
-            train_idx = all_idx.difference(test_idx)
+    return folds
 
-            # if there are not enough data points, break
-            if len(test_idx)<min_test_points_CV: break
+def get_LOWESS_benchmarking_series_CV(kfold, frac, it, folds, ndata, min_r2_first_fold=0.0):
 
-            # get dfs
-            df_train = df.loc[train_idx].sort_values(by=[xfield, yfield])
-            df_test = df.loc[test_idx].sort_values(by=[xfield, yfield])
-           
-            # get train alues
-            xtrain = df_train[xfield].values
-            ytrain = df_train[yfield].values
+    """This function takes the cross validation folds of some data (of ndata points) from get_LOWESS_CV_folds and returns a series with the accuracies of fitting LOWESS with frac and it. The cross-validation stops (and the parameters are discarded) if one fold fails, or if the first fold has an rsquare below min_r2_first_fold."""
 
-            # get the test values
-            xtest = df_test[xfield].values
-            ytest = df_test[yfield].values
+    # init rsquares
+    rsquares_cv = []
 
-            idx_correct_test = (xtest>min(xtrain)) & (xtest<max(xtrain))
-            xtest = xtest[idx_correct_test]
-            ytest = ytest[idx_correct_test]
+    # this will only work if the unique df is long enough
+    if folds is not None and ndata>kfold and (frac*ndata)>=3: 
 
-            # if there are not enough points, skip
-            if sum(idx_correct_test)<min_test_points_CV: break
+        # iterate through the folds
+        for Ifold, (xfit, yfit, xtest, ytest) in enumerate(folds):
 
-            # get the lowess fit on the test data
-            print_if_verbose("running loess")
-            fill_value_interpolation = None
-            ytest_predicted = get_lowess_fit_y(xtrain, ytrain, xtest, frac, it, fill_value_interpolation)
+            # get the lowess fit on the test data, which are always within the range of xfit
+            lowess_y = cylowess.lowess(endog=yfit, exog=xfit, frac=frac, it=it)[:,1]
 
             # if there are NaNs, break the cross-validation
-            if any(pd.isna(ytest_predicted)): break
+            if any(pd.isna(lowess_y)): break
+            ytest_predicted = np.interp(xtest, xfit, lowess_y)
 
             # if there are any 0 predicted values, break the cross-validation
             if any(ytest_predicted<=0): break
 
-            # debug
-            if len(ytest_predicted)!=len(ytest): raise ValueError("xtest and ytest are not the same")
-            if any(pd.isna(ytest_predicted)): raise ValueError("There can't be NaNs")
-
             # calculate the rsquare, making sure it is a float
             rsquare = r2_score(ytest, ytest_predicted)
 
             # debug
             if pd.isna(rsquare): raise ValueError("The rsquare can't be nan")
 
-            # break trying if there is a 0 rsquare
-            if rsquare<=0: break 
+            # break trying if there is a 0 rsquare, or the first fold is already below the min
+            if rsquare<=0 or (Ifold==0 and rsquare<min_r2_first_fold): break 
 
             # keep
             rsquares_cv.append(rsquare)
@@ -14820,16 +16357,23 @@ def get_y_corrected_by_x_LOWESS_crossValidation(df, xfield, yfield, outdir, thre
             # debug
             if any(pd.isna(df_fitting[xfield])) or any(pd.isna(df_fitting[yfield])): raise ValueError("There are NaNs")
 
+            # get the data of the cross-validation folds once for all the parameters
+            if len(df_fitting)>kfold: folds = get_LOWESS_CV_folds(df_fitting[xfield].values, df_fitting[yfield].values, kfold, min_test_points_CV)
+            else: folds = None
+
             # define the inputs of the benchmarking function
-            inputs_fn = make_flat_listOflists([[(kfold, frac, it, df_fitting, xfield, yfield, min_test_points_CV, outdir) for frac in all_fractions] for it in all_its])
+            inputs_fn = make_flat_listOflists([[(kfold, frac, it, folds, len(df_fitting), min_r2) for frac in all_fractions] for it in all_its])
 
             # get a list of the benchmarking series in parallel
-            with multiproc.Pool(threads) as pool:
+            if folds is None or threads==1: list_benchmarking_series = list(itertools.starmap(get_LOWESS_benchmarking_series_CV, inputs_fn))
 
-                list_benchmarking_series = pool.starmap(get_LOWESS_benchmarking_series_CV, inputs_fn) 
-                
-                pool.close()
-                pool.terminate()
+            else:
+                with multiproc.Pool(min(threads, len(inputs_fn))) as pool:
+
+                    list_benchmarking_series = pool.starmap(get_LOWESS_benchmarking_series_CV, inputs_fn, chunksize=1) 
+                    
+                    pool.close()
+                    pool.terminate()
 
             # get as df
             df_benchmarking = pd.DataFrame(list_benchmarking_series)
@@ -15556,7 +17100,7 @@ def run_CNV_calling(sorted_bam, reference_genome, outdir, threads, replace, mito
         df_coverage = df_coverage.sort_values(by=["chromosome", "start", "end"])
 
         # add the fraction of N bases
-        chrom_to_seq = {seq.id : str(seq.seq).upper() for seq in SeqIO.parse(reference_genome, "fasta")}
+        chrom_to_seq = get_chrom_to_seq_genome_store(reference_genome, upper=True)
         df_coverage["width"] = (df_coverage.end - df_coverage.start).apply(int)
         df_coverage["chromosome"] = df_coverage.chromosome.apply(str)
         df_coverage["fraction_N_bases"] = df_coverage.apply(run_fraction_Nbases_window_genome, chrom_to_seq=chrom_to_seq, axis=1)
@@ -17068,9 +18612,9 @@ def get_vep_df_for_vcf_df(vcf_df, outdir, reference_genome, gff_with_biotype, mi
 
     return df_vep
 
-def run_vep_parallel(vcf, reference_genome, gff_with_biotype, mitochondrial_chromosome, mitochondrial_code, gDNA_code, threads=4, replace=False):
+def run_vep_parallel(vcf, reference_genome, gff_with_biotype, mitochondrial_chromosome, mitochondrial_code, gDNA_code, threads=4, replace=False, threads_outdir=None):
 
-    """This function runs vep in parallel and returns an annotated_vcf"""
+    """This function runs vep in parallel and returns an annotated_vcf. If threads_outdir (the outdir of the module) is provided, the used threads are recorded there (see record_threads_used_stage)"""
 
     # define an output file for VEP
     output_vcf = "%s_annotated.tab"%vcf; output_vcf_tmp = "%s.tmp"%output_vcf
@@ -17135,13 +18679,16 @@ def run_vep_parallel(vcf, reference_genome, gff_with_biotype, mitochondrial_chro
         # get the inputs of the function
         inputs_fn = [(c, outdir_intermediate_files, reference_genome, gff_with_biotype, mitochondrial_chromosome, mitochondrial_code, gDNA_code, replace) for c in chunks_vcf_df]
 
-        # run in parallel
+        # run in parallel, recording the used threads
+        start_time = time.time(); start_cpu_time = get_cpu_time_self_and_children()
         with multiproc.Pool(threads) as pool:
             list_vep_dfs = pool.starmap(get_vep_df_for_vcf_df, inputs_fn) 
                 
             pool.close()
             pool.terminate()
 
+        if threads_outdir is not None: record_threads_used_stage(threads_outdir, "run_vep_parallel", threads, start_time, time.time(), start_cpu_time)
+
         # run one after the other, this is to test
         #list_vep_dfs = list(map(lambda x: get_vep_df_for_vcf_df(x[0], x[1], x[2], x[3], x[4], x[5], x[6], x[7]), inputs_fn))
 
@@ -18163,54 +19710,73 @@ def check_that_df_index_is_unique(df):
 
 
 
-def get_list_clusters_from_dict(key_to_setVals, integrate_keyAndValues=True):
+def get_list_clusters_from_groups(groups):
 
-    """Takes a dictionary mapping strings to strings and returns a list of sets, each of them having uniquely clusters of connected data"""
+    """Takes an iterable of groups (iterables of hashable items, like the IDs that overlap each region in a bedmap output) where all the items of each group are connected. It returns a list of sets with the connected components (clusters), in the order in which their first item appears. Items are mapped to integer IDs and clustered with a disjoint-set forest (union by size and path compression), so that it runs in near-linear time."""
 
-    # initialize a list_clusters
-    list_clusters = []
+    # init the disjoint sets, where each item is an integer
+    item_to_I = {}
+    all_items = []
+    parent = []
+    size = []
 
-    # initialize a list of mapped regions
-    print_if_verbose("get_list_clusters_from_dict, copying elements")
-    if integrate_keyAndValues is True: list_partial_clusters = [cp.deepcopy({key}.union(setVals)) for key, setVals in key_to_setVals.items()]
-    else: list_partial_clusters = list(map(cp.deepcopy, key_to_setVals.values()))
-
-    # go through each element in dict
-    print_if_verbose("get_list_clusters_from_dict, refining clusters")
-    for all_items in list_partial_clusters:
-
-        # if there is any overlap with any of the clusters, add it there
-        cluster_found = False
-        for cluster in list_clusters:
-            if len(cluster.intersection(all_items))>0: 
-                cluster.update(all_items)
-                cluster_found = True
-                break
+    def get_root(I):
 
-        # else initialize with all elements of this cluster
-        if cluster_found is False: list_clusters.append(all_items)
+        # find the root
+        root = I
+        while parent[root]!=root: root = parent[root]
 
-    # make sure that all clusters are nonoverlapping with each other
-    """
-    for I in range(len(list_clusters)):
-        for J in range(I+1, len(list_clusters)):
+        # compress the path
+        while parent[I]!=root: parent[I], I = root, parent[I]
 
-            if I==J: raise ValueError("We don't want to compare the same I and J")
+        return root
 
-            # define clusters
-            clusterI = list_clusters[I]
-            clusterJ = list_clusters[J]
+    # connect the items of each group
+    for group in groups:
 
-            if len(clusterI.intersection(clusterJ))!=0: 
-                pass
-                #print(I, clusterI, "\n", J, clusterJ)
-                #raise ValueError("There are some overlapping clusters")
-                #print("There are some overlapping clusters")
-    """
+        root_group = None
+        for item in group:
+
+            # add new items
+            if item not in item_to_I: 
+                item_to_I[item] = len(all_items)
+                all_items.append(item)
+                parent.append(item_to_I[item])
+                size.append(1)
+
+            # join to the group
+            root_item = get_root(item_to_I[item])
+            if root_group is None: root_group = root_item
+
+            elif root_item!=root_group:
+                if size[root_item]>size[root_group]: root_item, root_group = root_group, root_item
+                parent[root_item] = root_group
+                size[root_group] += size[root_item]
 
+    # get the clusters
+    root_to_cluster = {}
+    list_clusters = []
+    for I, item in enumerate(all_items):
+
+        root = get_root(I)
+        if root not in root_to_cluster: 
+            root_to_cluster[root] = set()
+            list_clusters.append(root_to_cluster[root])
+
+        root_to_cluster[root].add(item)
 
     return list_clusters
 
+def get_list_clusters_from_dict(key_to_setVals, integrate_keyAndValues=True):
+
+    """Takes a dictionary mapping strings to strings and returns a list of sets, each of them having uniquely clusters of connected data (see get_list_clusters_from_groups). If integrate_keyAndValues is True each key is connected to its values, otherwise only the values are connected among them."""
+
+    print_if_verbose("get_list_clusters_from_dict, clustering %i elements"%len(key_to_setVals))
+    if integrate_keyAndValues is True: groups = (itertools.chain([key], setVals) for key, setVals in key_to_setVals.items())
+    else: groups = key_to_setVals.values()
+
+    return get_list_clusters_from_groups(groups)
+
 def get_bestID_from_df_CNV_cluster(clustered_nuericIDs, df_CNV):
 
     """This function takes a df_CNV and the clusteredIDs. It returns the best clusterID"""
@@ -18251,16 +19817,9 @@ def get_list_clusters_overlapping_df_CNV(outdir, df_CNV, pct_overlap, threads):
 
     remove_file(bedmap_stderr)
 
-    # load as df, which already has the same order as df_CNV
-    df_bedmap = pd.read_csv(bedmap_outfile, sep="\t", header=None, names=["overlapping_IDs"])
-    df_bedmap["overlapping_IDs_set"] = df_bedmap.overlapping_IDs.apply(str).apply(lambda x: {int(y) for y in x.split(";")})
-
-    # define
-    ID_to_overlappingIDs = dict(df_bedmap["overlapping_IDs_set"])
-
-    # get the list of clusters
+    # get the list of clusters from the bedmap output, where each line (which has the same order as df_CNV) has the overlapping IDs
     print_if_verbose("getting lists of clusters")
-    list_clusters = get_list_clusters_from_dict(ID_to_overlappingIDs)
+    list_clusters = get_list_clusters_from_groups((itertools.chain([I], map(int, line.rstrip("\n").split(";"))) for I, line in enumerate(open(bedmap_outfile, "r"))))
 
     # check
     all_IDs = set(df_CNV.numericID)
@@ -19355,6 +20914,13 @@ def get_tab_as_df_or_empty_df(file):
     else: return pd.read_csv(file, sep="\t")
 
 
+def get_fields_tab_file(file):
+
+    """Returns the fields of the header of a tab file, or an empty list if the file is empty (as get_tab_as_df_or_empty_df)"""
+
+    if file_is_empty(file): return []
+    else: return list(pd.read_csv(file, sep="\t", nrows=0).keys())
+
 def get_tab_as_df_or_empty_df_with_index(file):
 
     """Gets df from file or empty df"""
@@ -19364,6 +20930,157 @@ def get_tab_as_df_or_empty_df_with_index(file):
     if nlines==0: return pd.DataFrame()
     else: return pd.read_csv(file, sep="\t", index_col=0)
 
+# the operations that can be used in the filters of get_df_from_columnar
+g_columnar_filter_operation_to_fn = {"==":lambda s, v: s==v, "!=":lambda s, v: s!=v, "<":lambda s, v: s<v, "<=":lambda s, v: s<=v, ">":lambda s, v: s>v, ">=":lambda s, v: s>=v, "in":lambda s, v: s.isin(v), "not in":lambda s, v: ~s.isin(v)}
+
+def save_df_as_columnar(df, columnar_dir, source_file_stat=None):
+
+    """Saves df into columnar_dir, with one file per column, so that it can be loaded with get_df_from_columnar (only some columns and rows). Numeric, boolean and datetime columns are .npy files (which are loaded through mmap), categorical columns are the .npy codes and the rest (i.e. strings or lists) are pickled. columns_info.py has the columns, their storage and the index. source_file_stat is the (mtime, size) of the file from which the df was migrated (see get_df_columnar_file)."""
+
+    if len(set(df.columns))!=len(df.columns): raise ValueError("The columns of the df should be unique to save it as columnar")
+
+    # write into a tmp dir (unique for the process, several processes may migrate the same file)
+    columnar_dir_tmp = "%s.%i.tmp"%(columnar_dir, os.getpid())
+    delete_folder(columnar_dir_tmp); make_folder(columnar_dir_tmp)
+
+    # save each column
+    columns_storage = []
+    for Ic, col in enumerate(df.columns):
+        series = df[col]
+
+        if pd.api.types.is_categorical_dtype(series.dtype):
+            np.save("%s/column_%i.npy"%(columnar_dir_tmp, Ic), series.cat.codes.values)
+            columns_storage.append(("category", (series.cat.categories, series.cat.ordered)))
+
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM": 
+            np.save("%s/column_%i.npy"%(columnar_dir_tmp, Ic), series.values)
+            columns_storage.append(("npy", None))
+
+        else: 
+            save_object(series.values, "%s/column_%i.py"%(columnar_dir_tmp, Ic))
+            columns_storage.append(("pickle", None))
+
+    # save the index if it is not 0, 1, ..., n-1 (keeping its name)
+    if type(df.index)==pd.RangeIndex and df.index.equals(pd.RangeIndex(len(df))): index = None
+    else: index = df.index
+
+    columns_info = {"columns":list(df.columns), "columns_storage":columns_storage, "nrows":len(df), "index":index, "index_name":df.index.name, "source_file_stat":source_file_stat}
+    save_object(columns_info, "%s/columns_info.py"%columnar_dir_tmp)
+
+    # replace the previous dir
+    delete_folder(columnar_dir)
+    os.rename(columnar_dir_tmp, columnar_dir)
+
+def get_column_from_columnar(columnar_dir, columns_info, Ic, rows_bool=None):
+
+    """Returns the values of column Ic of columnar_dir (saved with save_df_as_columnar), only for rows_bool (a boolean array) if provided"""
+
+    storage, storage_info = columns_info["columns_storage"][Ic]
+
+    if storage in {"npy", "category"}: 
+        values = np.load("%s/column_%i.npy"%(columnar_dir, Ic), mmap_mode=("r" if columns_info["nrows"]>0 else None))
+        values = np.array(values) if rows_bool is None else values[rows_bool]
+
+        if storage=="category": values = pd.Categorical.from_codes(values, categories=storage_info[0], ordered=storage_info[1])
+
+    else:
+        values = load_object("%s/column_%i.py"%(columnar_dir, Ic))
+        if rows_bool is not None: values = values[rows_bool]
+
+    return values
+
+def get_df_from_columnar(columnar_dir, fields="all", filters=[]):
+
+    """Loads a df saved with save_df_as_columnar. fields is a list of the columns to load (or "all"). filters is a list of (field, operation, value) tuples (operation can be ==, !=, <, <=, >, >=, in or not in), and only the rows that pass all of them are loaded. The filter fields are loaded first, so that the other fields are only read for the passing rows."""
+
+    columns_info = load_object("%s/columns_info.py"%columnar_dir)
+    column_to_Ic = {col : Ic for Ic, col in enumerate(columns_info["columns"])}
+
+    # define the fields
+    if fields=="all": fields = columns_info["columns"]
+    missing_fields = [f for f in (list(fields) + [x[0] for x in filters]) if f not in column_to_Ic]
+    if len(missing_fields)>0: raise ValueError("The fields %s are not in %s"%(missing_fields, columnar_dir))
+
+    # get the rows that pass the filters
+
+    if len(filters)==0: rows_bool = None
+    else:
+        rows_bool = np.ones(columns_info["nrows"], dtype=bool)
+        for field, operation, value in filters: 
+            if operation not in g_columnar_filter_operation_to_fn: raise ValueError("Invalid filter operation %s"%operation)
+            rows_bool &= np.asarray(g_columnar_filter_operation_to_fn[operation](pd.Series(get_column_from_columnar(columnar_dir, columns_info, column_to_Ic[field])), value), dtype=bool)
+
+    # get the index
+    if columns_info["index"] is None: index = pd.RangeIndex(columns_info["nrows"], name=columns_info.get("index_name", None))
+    else: index = columns_info["index"]
+    if rows_bool is not None: index = index[rows_bool]
+
+    # get the df
+    df = pd.DataFrame(OrderedDict([(field, get_column_from_columnar(columnar_dir, columns_info, column_to_Ic[field], rows_bool=rows_bool)) for field in fields]), index=index, columns=fields)
+
+    return df
+
+def columnar_file_is_empty(file):
+
+    """Returns whether there is no df in file, neither as a columnar store (<file>.columnar, see save_df_columnar_file) nor as a pickle or tab file"""
+
+    return file_is_empty(file) and file_is_empty("%s.columnar/columns_info.py"%file)
+
+def save_df_columnar_file(df, file):
+
+    """Saves df as the columnar store of file (<file>.columnar), which is read with get_df_columnar_file. Any previous pickle or tab file is removed"""
+
+    save_df_as_columnar(df, "%s.columnar"%file)
+    remove_file(file)
+
+def get_df_columnar_file(file, fields="all", filters=[], persist=True):
+
+    """Loads the df of file with get_df_from_columnar (only some fields and rows, see get_df_from_columnar). The df is stored in <file>.columnar (see save_df_columnar_file). If file is a pickled df (ending with .py) or a tab file without a columnar store (or with one that is older than file), it is migrated into <file>.columnar on first read. If the store can't be written (i.e. a read-only dir) the df is loaded from file. If persist is False (for files in dirs that are not owned by the step, i.e. the outdirs of other samples) nothing is written, and files without an up-to-date store are loaded in memory (only the fields of a tab file)."""
+
+    columnar_dir = "%s.columnar"%file
+
+    # migrate file if needed
+    if os.path.isfile(file):
+
+        source_file_stat = (os.path.getmtime(file), os.path.getsize(file))
+        if file_is_empty("%s/columns_info.py"%columnar_dir) or load_object("%s/columns_info.py"%columnar_dir)["source_file_stat"]!=source_file_stat:
+
+            # load without writing
+            if persist is False:
+
+                if file.endswith(".py"): df = load_object(file)
+                elif fields=="all": df = get_tab_as_df_or_empty_df(file)
+                elif file_is_empty(file): df = pd.DataFrame(columns=list(OrderedDict.fromkeys(list(fields) + [x[0] for x in filters])))
+                else: df = pd.read_csv(file, sep="\t", usecols=list(OrderedDict.fromkeys(list(fields) + [x[0] for x in filters])))
+
+                return get_df_from_columnar_in_memory(df, fields=fields, filters=filters)
+
+            print_if_verbose("migrating %s into a columnar store"%file)
+
+            if file.endswith(".py"): df = load_object(file)
+            else: df = get_tab_as_df_or_empty_df(file)
+            if type(df)!=pd.DataFrame: raise ValueError("%s should be a pickled DataFrame"%file)
+
+            try: save_df_as_columnar(df, columnar_dir, source_file_stat=source_file_stat)
+            except OSError: 
+                print_if_verbose("WARNING: %s could not be written. Loading from %s"%(columnar_dir, file))
+                return get_df_from_columnar_in_memory(df, fields=fields, filters=filters)
+
+    elif file_is_empty("%s/columns_info.py"%columnar_dir): raise ValueError("There is no %s or %s"%(file, columnar_dir))
+
+    return get_df_from_columnar(columnar_dir, fields=fields, filters=filters)
+
+def get_df_from_columnar_in_memory(df, fields="all", filters=[]):
+
+    """Like get_df_from_columnar, but from a df already in memory"""
+
+    for field, operation, value in filters: 
+        if operation not in g_columnar_filter_operation_to_fn: raise ValueError("Invalid filter operation %s"%operation)
+        df = df[g_columnar_filter_operation_to_fn[operation](df[field], value)]
+
+    if fields=="all": return df
+    else: return df[list(fields)]
+
 def get_END_vcf_df_r_NaN_to_1(r):
 
     """Takes a row of a vcf df that has END and POS. If the END is NaN, it set's it to POS+1"""
@@ -19534,6 +21251,30 @@ def get_small_variant_calling_withCNstate(varcall_file, df_CNV_coverage, replace
 #######################################################################################
 
 
+def benchmark_loading_single_sample_VCF(path, n_iterations=3):
+
+    """Takes a vcf with a single sample (i.e. the output of gridss) and compares the running time of get_df_single_sample_VCF_literalEval (the previous way to load it) and get_df_single_sample_VCF_typed (the one used by load_single_sample_VCF). It checks that both yield the same df and returns a series with the median running times (in seconds) of each of them."""
+
+    # get the timings
+    function_to_times = {}
+    function_to_df = {}
+    for function in [get_df_single_sample_VCF_literalEval, get_df_single_sample_VCF_typed]:
+        for I in range(n_iterations):
+
+            start_time = time.time()
+            function_to_df[function.__name__] = function(path)
+            function_to_times.setdefault(function.__name__, []).append(time.time() - start_time)
+
+    # check that both dfs are the same
+    pd.testing.assert_frame_equal(function_to_df["get_df_single_sample_VCF_literalEval"], function_to_df["get_df_single_sample_VCF_typed"])
+
+    # get the median times
+    timings = pd.Series({f : np.median(times) for f, times in function_to_times.items()})
+    print_if_verbose("Loading %s (%i records) took %.2fs with get_df_single_sample_VCF_literalEval and %.2fs with get_df_single_sample_VCF_typed (%.2fx faster)"%(path, len(function_to_df["get_df_single_sample_VCF_typed"]), timings["get_df_single_sample_VCF_literalEval"], timings["get_df_single_sample_VCF_typed"], timings["get_df_single_sample_VCF_literalEval"]/timings["get_df_single_sample_VCF_typed"]))
+
+    return timings
+
+
 def run_jobarray_file_Nord3(jobs_filename, name, time="12:00:00", queue="bsc_ls", threads_per_job=4, RAM_per_thread=1800, max_njobs_to_run=1000):
 
     """Runs jobs_filename in Nord3"""
@@ -19925,7 +21666,80 @@ def get_integrated_variants_into_one_df(df, file_prefix, replace=False, remove_f
 
     return small_vars, small_vars_annot, SV_CNV, SV_CNV_annot
 
-def run_perSVade_severalSamples(paths_df, cwd, common_args, threads=4, sampleID_to_parentIDs={}, samples_to_run=set(), repeat=False, job_array_mode="job_array", ploidy=1, get_integrated_dfs=True, repeat_job_running=False):
+# the fields of the ledger of run_cmds_local_scheduler
+g_run_ledger_fields = ["name", "status", "date", "threads", "RAM_Gb", "running_time_s", "log_file"]
+
+def write_line_run_ledger(ledger_file, fields_dict):
+
+    """Appends a line with fields_dict (with the fields of g_run_ledger_fields) to the ledger_file of run_cmds_local_scheduler, writing the header if it does not exist"""
+
+    if file_is_empty(ledger_file): open(ledger_file, "w").write("\t".join(g_run_ledger_fields) + "\n")
+    open(ledger_file, "a").write("\t".join([str(fields_dict[f]) for f in g_run_ledger_fields]) + "\n")
+
+def run_cmds_local_scheduler(jobs_df, total_threads, total_RAM_Gb, ledger_file, env=EnvName, check_interval=5):
+
+    """Runs the cmds of jobs_df locally, several at a time. jobs_df has the fields name, cmd, threads, RAM_Gb and log_file (where the std of the cmd is written). The jobs are started in the order of jobs_df, each one as soon as its threads and RAM fit in what is left of total_threads and total_RAM_Gb (jobs that need more than the total are run alone). Each start and end of a job is appended to ledger_file (see write_line_run_ledger). It raises an error at the end if any job failed."""
+
+    # get the environment
+    environ = get_environ_conda_env(env)
+
+    # init
+    pending_jobs = list(jobs_df.index)
+    name_to_running = {} # maps each name to (process, start_time, threads, RAM_Gb)
+    failed_jobs = []
+    n_finished = 0
+    used_threads = 0
+    used_RAM_Gb = 0.0
+
+    try:
+        while len(pending_jobs)>0 or len(name_to_running)>0:
+
+            # start the jobs that fit
+            for I in list(pending_jobs):
+                r = jobs_df.loc[I]
+
+                job_threads = min([r.threads, total_threads])
+                job_RAM_Gb = min([r.RAM_Gb, total_RAM_Gb])
+                if (used_threads+job_threads)>total_threads or (used_RAM_Gb+job_RAM_Gb)>total_RAM_Gb: continue
+
+                if log_file_all_cmds is not None: open(log_file_all_cmds, "a").write("environment: %s; cmd: %s\n"%(env, r.cmd))
+                process = subprocess.Popen(r.cmd, shell=True, executable=g_bash_executable, env=environ, stdout=open(r.log_file, "w"), stderr=subprocess.STDOUT)
+                name_to_running[r["name"]] = (process, time.time(), job_threads, job_RAM_Gb, r.log_file)
+
+                used_threads += job_threads
+                used_RAM_Gb += job_RAM_Gb
+                pending_jobs.remove(I)
+
+                write_line_run_ledger(ledger_file, {"name":r["name"], "status":"started", "date":get_date_and_time_for_print(), "threads":job_threads, "RAM_Gb":job_RAM_Gb, "running_time_s":0.0, "log_file":r.log_file})
+                print_if_verbose("started %s (%i threads, %.2f Gb RAM). There are %i running, %i pending and %i finished jobs"%(r["name"], job_threads, job_RAM_Gb, len(name_to_running), len(pending_jobs), n_finished))
+
+            # wait and check the finished jobs
+            time.sleep(check_interval)
+            for name, (process, start_time, job_threads, job_RAM_Gb, log_file) in list(name_to_running.items()):
+
+                out_stat = process.poll()
+                if out_stat is None: continue
+
+                del name_to_running[name]
+                used_threads -= job_threads
+                used_RAM_Gb -= job_RAM_Gb
+                n_finished += 1
+
+                if out_stat==0: status = "finished"
+                else: 
+                    status = "failed"
+                    failed_jobs.append(name)
+
+                write_line_run_ledger(ledger_file, {"name":name, "status":status, "date":get_date_and_time_for_print(), "threads":job_threads, "RAM_Gb":job_RAM_Gb, "running_time_s":"%.1f"%(time.time()-start_time), "log_file":log_file})
+                print_if_verbose("%s %s in %.1f seconds. There are %i running, %i pending and %i finished jobs"%(name, status, time.time()-start_time, len(name_to_running), len(pending_jobs), n_finished))
+
+    # kill the running jobs if something went wrong (i.e. an interruption)
+    finally:
+        for name, (process, start_time, job_threads, job_RAM_Gb, log_file) in name_to_running.items(): process.kill()
+
+    if len(failed_jobs)>0: raise ValueError("The jobs %s failed. You can check their std in %s. The finished ones won't be repeated if you rerun."%(", ".join(failed_jobs), ", ".join(jobs_df.set_index("name").loc[failed_jobs, "log_file"])))
+
+def run_perSVade_severalSamples(paths_df, cwd, common_args, threads=4, sampleID_to_parentIDs={}, samples_to_run=set(), repeat=False, job_array_mode="job_array", ploidy=1, get_integrated_dfs=True, repeat_job_running=False, RAM_per_job_Gb=None):
 
  
     """
@@ -19935,7 +21749,7 @@ def run_perSVade_severalSamples(paths_df, cwd, common_args, threads=4, sampleID_
     - repeat is a boolean that indicates whether to repeat all the steps of this function
     - threads are the number of cores per task allocated. In mn, you can use 48 cores per node. It has not been tested whether more cores can be used per task
     - samples_to_run is a set of samples for which we want to run all the pipeline
-    - job_array_mode can be 'job_array' or 'local'. If local each job will be run after the other
+    - job_array_mode can be 'job_array' or 'local'. If local the jobs are run in this node, several at a time (see run_cmds_local_scheduler), as many as fit in the available threads and RAM. Each job takes threads and RAM_per_job_Gb (by default, the RAM proportional to threads). The starts and ends of each sample are written into <cwd>/perSVade_severalSamples_ledger.tab, and the std into <cwd>/perSVade_severalSamples_logs/<sampleID>.std (so that it is kept if the run removes its outdir). Finished samples are not repeated.
     - sampleID_to_parentIDs is a dictionary that maps each sampleID to the parent sampleIDs (a set), in a way that there will be a col called parentIDs_with_var, which is a string of ||-joined parent IDs where the variant is also found
     - common_args is a string with all the perSVade args except the reads. The arguments added will be -o, -f1, -f2
     - max_ncores_queue is the total number of cores that will be assigned to the job.
@@ -19957,6 +21771,8 @@ def run_perSVade_severalSamples(paths_df, cwd, common_args, threads=4, sampleID_
 
     # get the info of all the reads and samples
     all_cmds = []
+    all_cmds_sampleIDs = []
+    already_finished_sampleIDs = []
 
     for sampleID in samples_to_run:
 
@@ -19985,16 +21801,34 @@ def run_perSVade_severalSamples(paths_df, cwd, common_args, threads=4, sampleID_
         cmd = "%s -f1 %s -f2 %s -o %s --ploidy %i %s"%(perSVade_py, reads1, reads2, outdir, ploidy, common_args)
 
         # add cmd if necessary
-        if any([file_is_empty(x) for x in success_files]) or repeat is True: all_cmds.append(cmd)
+        if any([file_is_empty(x) for x in success_files]) or repeat is True: 
+            all_cmds.append(cmd)
+            all_cmds_sampleIDs.append(sampleID)
+
+        else: already_finished_sampleIDs.append(sampleID)
 
     # submit to cluster or return True
     if len(all_cmds)>0:
 
         if job_array_mode=="local":
 
-            for Icmd, cmd in enumerate(all_cmds):
-                print_if_verbose("running cmd %i/%i"%(Icmd+1, len(all_cmds)))
-                run_cmd(cmd)
+            # define the resources
+            total_threads = get_available_threads(cwd)
+            total_RAM_Gb = get_availableGbRAM(cwd)
+            if RAM_per_job_Gb is None: RAM_per_job_Gb = total_RAM_Gb*(min([threads, total_threads])/total_threads)
+
+            # each perSVade run should use only its RAM. --fraction_available_mem is applied to the memory available in the whole node (not to the budget of total_RAM_Gb)
+            if "--fraction_available_mem" not in common_args: all_cmds = ["%s --fraction_available_mem %.3f"%(cmd, min([1.0, RAM_per_job_Gb/get_node_availableGbRAM()])) for cmd in all_cmds]
+
+            # record the samples that were already finished
+            ledger_file = "%s/perSVade_severalSamples_ledger.tab"%cwd
+            logs_dir = "%s/perSVade_severalSamples_logs"%cwd; make_folder(logs_dir)
+            for sampleID in already_finished_sampleIDs: write_line_run_ledger(ledger_file, {"name":sampleID, "status":"already_finished", "date":get_date_and_time_for_print(), "threads":0, "RAM_Gb":0.0, "running_time_s":0.0, "log_file":""})
+
+            # run
+            print_if_verbose("running %i jobs locally, with %i threads and %.2f Gb of RAM"%(len(all_cmds), total_threads, total_RAM_Gb))
+            jobs_df = pd.DataFrame({"name":all_cmds_sampleIDs, "cmd":all_cmds, "threads":threads, "RAM_Gb":RAM_per_job_Gb, "log_file":["%s/%s.std"%(logs_dir, sampleID) for sampleID in all_cmds_sampleIDs]})
+            run_cmds_local_scheduler(jobs_df, total_threads, total_RAM_Gb, ledger_file)
 
         elif job_array_mode=="job_array":
 
@@ -20288,126 +22122,177 @@ def get_SV_CNV_df_with_common_variantID_acrossSamples(SV_CNV, outdir, pct_overla
 
     return SV_CNV
 
-def load_gff3_intoDF(gff_path, replace=False):
+def get_gff_attributes_as_dicts(annotations):
 
-    """ Takes the path to a gff and loads it into a df"""
+    """Takes an iterable of the attributes field of a gff and returns a list of dicts, with the key-value pairs of each attribute (the first value if there are repeated keys)"""
 
-    gff_df_file = "%s.df.tab"%gff_path
+    list_dicts = []
+    for an in annotations:
+        an_dict = {}
+        for a in str(an).split(";"):
+            key_val = a.split("=", 1)
+            if key_val[0]!="" and key_val[0] not in an_dict: an_dict[key_val[0]] = key_val[-1] if len(key_val)==2 else ""
 
-    if file_is_empty(gff_df_file) or replace is True:
+        list_dicts.append(an_dict)
 
-        # define the number of rows to skip
-        gff_lines = "%s.gff_lines.gff"%gff_path
-        run_cmd("egrep -v '^#' %s > %s"%(gff_path, gff_lines))
+    return list_dicts
 
-        # define the gff fields
-        gff_fields = ["chromosome", "source", "feature", "start", "end", "blank1", "strand", "blank2", "annotation"]
+def get_upmost_parents_gff(IDs, parents, ANNOTATION_IDs):
 
-        # load
-        #print("loading gff")
-        gff = pd.read_csv(gff_lines, header=None, names=gff_fields, sep="\t")
+    """Takes the unique IDs, the Parent and the ANNOTATION_ID of each feature of a gff. It returns a list with the upmost parent of each feature (the one with no Parent). Parents that are split (several features with the same ANNOTATION_ID) are resolved to the first of them. Each feature is visited once, by following the ID->parent map until reaching a feature which already has an upmost parent."""
 
-        # set all possible annotations
-        all_annotations = set.union(*[set([x.split("=")[0] for x in an.split(";")]) for an in gff.annotation])
+    # map each Parent to the ID of the feature
+    all_unique_IDs = set(IDs)
+    split_parent_to_ID = {}
+    for ID, annotation_ID in zip(IDs, ANNOTATION_IDs): 
+        if annotation_ID not in split_parent_to_ID: split_parent_to_ID[annotation_ID] = ID
 
-        def list_to_str(list_x):
+    ID_to_parentID = {}
+    for ID, parent in zip(IDs, parents):
+        if parent=="": ID_to_parentID[ID] = None
+        elif parent in all_unique_IDs: ID_to_parentID[ID] = parent
+        elif parent in split_parent_to_ID: ID_to_parentID[ID] = split_parent_to_ID[parent]
+        else: raise ValueError("%s is not a valid Parent ID"%parent)
 
-            if list_x==[]: return ""
-            else: return list_x[0]
-        
-        for anno in all_annotations:
+    # resolve the upmost parents
+    ID_to_upmost_parent = {}
+    for ID in IDs:
 
-            # define the field 
-            anno_field = "ANNOTATION_%s"%anno
+        # go up until a resolved feature or a root
+        path = []
+        current_ID = ID
+        while current_ID not in ID_to_upmost_parent:
 
-            # add the normalQ annotation field
-            gff[anno_field] = gff.annotation.apply(lambda x: list_to_str([a.split(anno)[1].lstrip("=") for a in x.split(";") if anno in a]))
+            if ID_to_parentID[current_ID] is None: 
+                ID_to_upmost_parent[current_ID] = current_ID
+                break
 
-            # add the Dbxref sepparated
-            if anno=="Dbxref": 
+            path.append(current_ID)
+            if len(path)>len(IDs): raise ValueError("There is a cycle of Parents in the gff, involving %s"%ID)
+            current_ID = ID_to_parentID[current_ID]
 
-                # get all the dbxref fields
-                all_Dbxrefs = set.union(*[set([x.split(":")[0] for x in dbxref.split(",")]) for dbxref in gff[anno_field]]).difference({""})
+        # set the upmost parent for the path
+        for path_ID in path: ID_to_upmost_parent[path_ID] = ID_to_upmost_parent[current_ID]
 
-                # go through each dbxref field and add it to the df
-                for dbxref in all_Dbxrefs: 
+    return [ID_to_upmost_parent[ID] for ID in IDs]
 
-                    gff["%s_%s"%(anno_field, dbxref)] = gff[anno_field].apply(lambda x: list_to_str([d.split(dbxref)[1].lstrip(":") for d in x.split(",") if dbxref in d]))
+def get_gff_df_with_upmost_parents(gff_path):
 
-        # get the ID
-        gff["ID"] = gff.ANNOTATION_ID
-        gff["Parent"] = gff.ANNOTATION_Parent
+    """Takes the path to a gff and returns it as a df. It has one ANNOTATION_<key> field for each attribute (and ANNOTATION_Dbxref_<db> for each Dbxref), the unique ID of each feature, the upmost_parent (which should be the gene) and the upmost_parent_feature."""
 
-        # change the ID so that all of the features are unique, add numbers for non-unique IDs
-        gff["duplicated_ID"] = gff.duplicated(subset="ID", keep=False) # marks all the duplicated IDs with a True
-        gff["numeric_idx"] = list(range(0, len(gff)))
+    # load the gff lines
+    gff_lines = "%s.gff_lines.gff"%gff_path
+    run_cmd("egrep -v '^#' %s > %s"%(gff_path, gff_lines))
 
-        def getuniqueIDs_gff(row):
+    gff_fields = ["chromosome", "source", "feature", "start", "end", "blank1", "strand", "blank2", "annotation"]
+    gff = pd.read_csv(gff_lines, header=None, names=gff_fields, sep="\t")
+    remove_file(gff_lines)
 
-            """Takes a row and changes the IDs if they are not unique"""
-            if row["duplicated_ID"] is False: return row["ID"]
-            else: return "%s-%i"%(row["ID"], row["numeric_idx"])
+    # add the annotations, parsing each attributes field once
+    annotation_dicts = get_gff_attributes_as_dicts(gff.annotation)
+    all_annotations = sorted(set.union(set(), *[set(d.keys()) for d in annotation_dicts]).union({"ID", "Parent"}))
 
-        gff["ID"] = gff.apply(getuniqueIDs_gff, axis=1)
+    for anno in all_annotations:
 
-        # check that it is correct
-        if len(gff)!=len(set(gff["ID"])): raise ValueError("IDs are not unique in the gff")
+        anno_field = "ANNOTATION_%s"%anno
+        gff[anno_field] = [d.get(anno, "") for d in annotation_dicts]
 
-        # set the id as index
-        gff = gff.set_index("ID", drop=False)
+        # add the Dbxref sepparated
+        if anno=="Dbxref":
 
-        # define all the IDs
-        all_unique_IDs = set(gff.index)
+            dbxref_dicts = []
+            for dbxref in gff[anno_field]:
+                dbxref_dict = {}
+                for d in dbxref.split(","):
+                    key_val = d.split(":", 1)
+                    if key_val[0]!="" and key_val[0] not in dbxref_dict: dbxref_dict[key_val[0]] = key_val[-1] if len(key_val)==2 else ""
 
-        # add the upmost_parent (which should be the geneID)
-        #print("getting upmost parent")
-        def get_utmost_parent(row, gff_df):
+                dbxref_dicts.append(dbxref_dict)
 
-            """Takes a row and the gff_df and returns the highest parent. The index has to be the ID of the GFF"""
+            for dbxref in sorted(set.union(set(), *[set(d.keys()) for d in dbxref_dicts])): gff["%s_%s"%(anno_field, dbxref)] = [d.get(dbxref, "") for d in dbxref_dicts]
 
-            # when you have found the parent it has no parent, so the ID is the upmost_parent
-            if row["Parent"]=="": return row["ID"]
+    # get the ID, adding numbers for non-unique IDs
+    gff["ID"] = gff.ANNOTATION_ID
+    gff["Parent"] = gff.ANNOTATION_Parent
+    gff["duplicated_ID"] = gff.duplicated(subset="ANNOTATION_ID", keep=False) # marks all the duplicated IDs with a True
+    gff["numeric_idx"] = list(range(0, len(gff)))
+    gff["ID"] = np.where(gff.duplicated_ID, gff.ANNOTATION_ID + "-" + gff.numeric_idx.apply(str), gff.ANNOTATION_ID)
 
-            # else you go to the parent
-            else: 
+    if len(gff)!=len(set(gff["ID"])): raise ValueError("IDs are not unique in the gff")
 
-                # define the ID of the parent
-                if row["Parent"] in all_unique_IDs: parentID = row["Parent"] # normal
+    # add the upmost_parent (which should be the geneID)
+    gff["upmost_parent"] = get_upmost_parents_gff(list(gff.ID), list(gff.Parent), list(gff.ANNOTATION_ID))
 
-                elif sum(gff_df.ANNOTATION_ID==row["Parent"])>1: # split parents, take the first one
-                    parentID = gff_df[gff_df.ANNOTATION_ID==row["Parent"]].ID.iloc[0]
+    # add the type of upmost_parent
+    df_upmost_parents = gff[gff.ID==gff.upmost_parent]
+    if len(df_upmost_parents)!=len(set(df_upmost_parents.ID)): raise ValueError("upmost parents are not unique")
+    upmost_parent_to_feature = dict(zip(df_upmost_parents.upmost_parent, df_upmost_parents.feature))
+    gff["upmost_parent_feature"] = gff.upmost_parent.map(upmost_parent_to_feature)
 
-                else: 
-                    print(gff_df, row)
-                    print(gff_df[gff_df.Parent==row["Parent"]])
-                    raise ValueError("%s is not a valid Parent ID"%(row["Parent"])) # errors
+    # get the types as if the df was read from a tab file (i.e. empty annotations as NaN)
+    gff_tab = StringIO()
+    gff.to_csv(gff_tab, sep="\t", index=False, header=True)
+    gff_tab.seek(0)
+    gff = pd.read_csv(gff_tab, sep="\t")
+
+    return gff
 
-                # get the upmost parent from the parent
-                return get_utmost_parent(gff_df.loc[parentID], gff_df)
+def get_gff_store_dir(gff_path): return "%s.gff_store"%gff_path
 
-        gff["upmost_parent"] = gff.apply(lambda row: get_utmost_parent(row, gff), axis=1)
-        gff = gff.set_index("upmost_parent", drop=False)
+def save_gff_store(gff_path):
 
-        # add the type of upmost_parent
-        df_upmost_parents = gff[gff.ID==gff.upmost_parent]
+    """Parses gff_path (with get_gff_df_with_upmost_parents) into <gff_path>.gff_store. The store has one columnar store (see save_df_as_columnar) per chromosome, with the features sorted by start. gff_store_info.py has the chromosomes, the columns and the (mtime, size) of the gff."""
 
-        # check that the upmost_parents are unique
-        if len(df_upmost_parents)!=len(set(df_upmost_parents.ID)): raise ValueError("upmost parents are not unique")
+    print_if_verbose("building the gff store of %s"%gff_path)
+    source_file_stat = (os.path.getmtime(gff_path), os.path.getsize(gff_path))
+    gff = get_gff_df_with_upmost_parents(gff_path)
 
-        # map each upmost_parent to the feature
-        upmost_parent_to_feature = dict(df_upmost_parents.set_index("upmost_parent")["feature"])
+    # write into a tmp dir (unique for the process, several processes may build the same store)
+    gff_store_dir = get_gff_store_dir(gff_path)
+    gff_store_dir_tmp = "%s.%i.tmp"%(gff_store_dir, os.getpid())
+    delete_folder(gff_store_dir_tmp); make_folder(gff_store_dir_tmp)
 
-        # add the upmost_parent_feature to gff df
-        gff["upmost_parent_feature"] = gff.upmost_parent.apply(lambda x: upmost_parent_to_feature[x])
+    # save each chromosome
+    chromosomes = list(pd.unique(gff.chromosome))
+    for Ichrom, chrom in enumerate(chromosomes):
 
-        # write df
-        gff_df_file_tmp = "%s.tmp"%gff_df_file
-        gff.to_csv(gff_df_file_tmp, sep="\t", index=False, header=True)
-        os.rename(gff_df_file_tmp, gff_df_file)
+        gff_chrom = gff[gff.chromosome==chrom].sort_values(by=["start", "end", "numeric_idx"]).reset_index(drop=True)
+        save_df_as_columnar(gff_chrom, "%s/chromosome_%i"%(gff_store_dir_tmp, Ichrom))
 
+    gff_store_info = {"chromosome_to_Ichrom":{str(chrom) : Ichrom for Ichrom, chrom in enumerate(chromosomes)}, "columns":list(gff.columns), "nrows":len(gff), "source_file_stat":source_file_stat}
+    save_object(gff_store_info, "%s/gff_store_info.py"%gff_store_dir_tmp)
 
-    # load
-    gff = pd.read_csv(gff_df_file, sep="\t")
+    # replace the previous store
+    delete_folder(gff_store_dir)
+    os.rename(gff_store_dir_tmp, gff_store_dir)
+
+    # remove the legacy tab file
+    remove_file("%s.df.tab"%gff_path)
+
+def get_gff_store_info(gff_path, replace=False):
+
+    """Returns the info of the gff store of gff_path (see save_gff_store), building it if it does not exist, if it is older than the gff or if replace is True"""
+
+    gff_store_info_file = "%s/gff_store_info.py"%get_gff_store_dir(gff_path)
+    source_file_stat = (os.path.getmtime(gff_path), os.path.getsize(gff_path))
+
+    if replace is True or file_is_empty(gff_store_info_file) or load_object(gff_store_info_file)["source_file_stat"]!=source_file_stat: save_gff_store(gff_path)
+
+    return load_object(gff_store_info_file)
+
+def load_gff3_intoDF(gff_path, replace=False, fields="all", filters=[]):
+
+    """ Takes the path to a gff and loads it into a df (in the order of the gff), from the gff store (see save_gff_store). fields and filters are as in get_df_from_columnar, so that only some columns and rows are loaded."""
+
+    gff_store_info = get_gff_store_info(gff_path, replace=replace)
+    gff_store_dir = get_gff_store_dir(gff_path)
+    if fields=="all": fields = gff_store_info["columns"]
+
+    # load each chromosome, with the numeric_idx to sort
+    fields_load = list(fields) + (["numeric_idx"] if "numeric_idx" not in fields else [])
+    if gff_store_info["nrows"]==0: return pd.DataFrame(columns=fields)
+    gff = pd.concat([get_df_from_columnar("%s/chromosome_%i"%(gff_store_dir, Ichrom), fields=fields_load, filters=filters) for Ichrom in sorted(gff_store_info["chromosome_to_Ichrom"].values())], sort=False)
+    gff = gff.sort_values(by="numeric_idx").reset_index(drop=True)[list(fields)]
 
     return gff
 
@@ -20581,7 +22466,7 @@ def get_overlapping_df_bedpe_multiple_samples(df_bedpe_all, outdir, tol_bp, pct_
     df_overlapping_BPs_file = "%s/df_bedpe_all_with_overlapping_BPs.py"%outdir
     initial_fields = list(df_bedpe_all.keys())
 
-    if file_is_empty(df_overlapping_BPs_file) or replace is True:
+    if columnar_file_is_empty(df_overlapping_BPs_file) or replace is True:
 
         print("getting overlapping breakpoints")
 
@@ -20705,10 +22590,10 @@ def get_overlapping_df_bedpe_multiple_samples(df_bedpe_all, outdir, tol_bp, pct_
         df_bedpe_all["overlapping_bpoints_final"] = df_bedpe_all.apply(get_overlapping_bpoints, axis=1)
 
         # save
-        save_object(df_bedpe_all[initial_fields + ["overlapping_bpoints_final"]], df_overlapping_BPs_file)
+        save_df_columnar_file(df_bedpe_all[initial_fields + ["overlapping_bpoints_final"]], df_overlapping_BPs_file)
 
     # load bepe with adds
-    df_bedpe_all_withAdds = load_object(df_overlapping_BPs_file)
+    df_bedpe_all_withAdds = get_df_columnar_file(df_overlapping_BPs_file)
 
     return df_bedpe_all_withAdds
 
@@ -20919,29 +22804,53 @@ def get_tab_as_df_and_add_sampleID(sampleID, file, fields="all"):
     """returns the variant calling df as a df"""
     print("getting small vars for sample %s"%sampleID)
 
-    # get df
-    df = get_tab_as_df_or_empty_df(file)
-    if fields!="all": df = df[fields]
+    # get df, only with the fields (missing fields are NaN). Empty files yield an empty df
+    if fields=="all": 
+        if file_is_empty(file): df = pd.DataFrame()
+        else: df = get_df_columnar_file(file, persist=False)
+
+    else:
+        existing_fields = set(get_fields_tab_file(file))
+        if len(existing_fields)==0: df = pd.DataFrame(index=pd.RangeIndex(0))
+        else: df = get_df_columnar_file(file, fields=[f for f in fields if f in existing_fields], persist=False)
+        for f in fields: 
+            if f not in existing_fields: df[f] = np.nan
+        df = df[fields]
+
     df["sampleID"] = str(sampleID)
 
     return df
 
-def integrate_call_small_variants_several_samples(sample_to_outdir, filename, threads, ploidy, fields_small_variants="all"):
+def write_stacked_tab_files_with_sampleID(sampleID_and_file_list, outfile, threads, fields="all"):
 
-    """Generates a call set that includes all the stacked results of call_small_variants into filename"""
+    """Writes into outfile the stacked tab files of several samples (sampleID_and_file_list is a list of (sampleID, file)), adding the field sampleID. The files are loaded in parallel, in batches of a few samples, and appended to outfile in the order of sampleID_and_file_list, so that the memory does not grow with the number of samples. If fields is "all" they are all the fields found in the files."""
 
-    if file_is_empty(filename):
-        print("running integrate_call_small_variants_several_samples")
+    # define the fields
+    if fields=="all": fields = list(OrderedDict.fromkeys([f for sampleID, file in sampleID_and_file_list for f in get_fields_tab_file(file) if f!="sampleID"]))
+
+    # write each batch of samples
+    outfile_tmp = "%s.tmp"%outfile
+    with open(outfile_tmp, "w") as fd:
+        fd.write("\t".join(fields + ["sampleID"]) + "\n")
 
-        # integrate in parallel
         with multiproc.Pool(threads) as pool:
-            small_vars_df = pd.concat(pool.starmap(get_tab_as_df_and_add_sampleID, [(s, "%s/variant_calling_ploidy%i.tab"%(o, ploidy), fields_small_variants) for s, o in sample_to_outdir.items()])) 
+            for batch_sampleID_and_file in chunks(sampleID_and_file_list, threads*4):
+                for df in pool.starmap(get_tab_as_df_and_add_sampleID, [(sampleID, file, fields) for sampleID, file in batch_sampleID_and_file]): df.to_csv(fd, sep="\t", index=False, header=False)
+
             pool.close()
             pool.terminate()
 
-        # save
-        print("saving")
-        save_df_as_tab(small_vars_df, filename)
+    os.rename(outfile_tmp, outfile)
+
+def integrate_call_small_variants_several_samples(sample_to_outdir, filename, threads, ploidy, fields_small_variants="all"):
+
+    """Generates a call set that includes all the stacked results of call_small_variants into filename"""
+
+    if file_is_empty(filename):
+        print("running integrate_call_small_variants_several_samples")
+
+        # integrate in parallel, streaming into filename
+        write_stacked_tab_files_with_sampleID([(s, "%s/variant_calling_ploidy%i.tab"%(o, ploidy)) for s, o in sample_to_outdir.items()], filename, threads, fields=fields_small_variants)
 
 def integrate_get_cov_genes_several_samples(sample_to_outdir, filename, threads):
 
@@ -20950,15 +22859,8 @@ def integrate_get_cov_genes_several_samples(sample_to_outdir, filename, threads)
     if file_is_empty(filename):
         print("running integrate_get_cov_genes_several_samples")
 
-        # integrate in parallel
-        with multiproc.Pool(threads) as pool:
-            coverage_df = pd.concat(pool.starmap(get_tab_as_df_and_add_sampleID, [(s, "%s/genes_and_regions_coverage.tab"%o) for s, o in sample_to_outdir.items()])) 
-            pool.close()
-            pool.terminate()
-
-        # save
-        print("saving")
-        save_df_as_tab(coverage_df, filename)
+        # integrate in parallel, streaming into filename
+        write_stacked_tab_files_with_sampleID([(s, "%s/genes_and_regions_coverage.tab"%o) for s, o in sample_to_outdir.items()], filename, threads)
 
 def integrate_annotate_vars_several_samples(sample_to_outdir, filename, threads, gff):
 
@@ -20969,7 +22871,7 @@ def integrate_annotate_vars_several_samples(sample_to_outdir, filename, threads,
 
         # integrate in parallel
         with multiproc.Pool(threads) as pool:
-            annot_df = pd.concat(pool.starmap(get_tab_as_df_or_empty_df, [("%s/annotated_variants.tab"%o,) for o in sample_to_outdir.values()])).drop_duplicates()
+            annot_df = pd.concat(pool.starmap(get_df_columnar_file, [("%s/annotated_variants.tab"%o, "all", [], False) for o in sample_to_outdir.values()])).drop_duplicates()
             pool.close()
             pool.terminate()
 
@@ -21108,8 +23010,8 @@ def get_integrated_SV_CNV_smallVars_df_from_run_perSVade_severalSamples(paths_df
         # add whether the SV is protein alterring
         if SV_CNV_called is True:
 
-            gff_df = load_gff3_intoDF(gff, replace=False)
-            all_protein_coding_genes = set(gff_df[gff_df.feature.isin({"CDS", "mRNA"})].upmost_parent)
+            gff_df = load_gff3_intoDF(gff, replace=False, fields=["upmost_parent"], filters=[("feature", "in", {"CDS", "mRNA"})])
+            all_protein_coding_genes = set(gff_df.upmost_parent)
             SV_CNV_annot["is_protein_coding_gene"] = SV_CNV_annot.Gene.isin(all_protein_coding_genes)
             SV_CNV_annot["is_transcript_disrupting"] = SV_CNV_annot.Consequence.apply(get_is_transcript_disrupting_consequence_SV)
 
@@ -21309,27 +23211,34 @@ def get_integrated_SV_CNV_smallVars_df_from_run_perSVade_severalSamples(paths_df
 
     #############################################
 
+def get_partition_name_chromosome(chromosome):
+
+    """Returns a name for the partition of chromosome that can be used as a filename"""
+
+    return "chromosome_%s"%(hashlib.md5(str(chromosome).encode()).hexdigest())
+
 def get_s_small_vars_df_and_s_small_var_annot(Is, perSVade_outdir, sampleID, target_ploidy, fields_varCall, fields_varAnnot, tmpdir):
 
-    """This function takes a perSVade outdir and re-writes the varcall file with no headers into tmpdir"""
+    """This function takes a perSVade outdir and re-writes the varcall file with no headers into tmpdir, partitioned by chromosome (into <tmpdir>/partitions/<partition name>/<sampleID>_ploidy<target_ploidy>.tab). It returns the chromosomes of the sample (sorted as in the varcall file) and the annotation file with no headers."""
 
     print("ploidy %i, %i: %s"%(target_ploidy, Is+1, sampleID))
 
-    # variants
-    small_vars_file = "%s/small_vars_%s_ploidy%i.tab"%(tmpdir, sampleID, target_ploidy)
-    if file_is_empty(small_vars_file):
+    # variants, partitioned by chromosome
+    small_vars_chromosomes_file = "%s/small_vars_chromosomes_%s_ploidy%i.py"%(tmpdir, sampleID, target_ploidy)
+    if file_is_empty(small_vars_chromosomes_file):
 
-        # get the variant calling
-        s_small_vars_df = pd.read_csv("%s/smallVars_CNV_output/variant_calling_ploidy%i.tab"%(perSVade_outdir, target_ploidy), sep="\t")
+        # get the variant calling, only with the interesting fields
+        small_vars_file = "%s/smallVars_CNV_output/variant_calling_ploidy%i.tab"%(perSVade_outdir, target_ploidy)
+        existing_fields = set(get_fields_tab_file(small_vars_file))
+        fields_load = [f for f in fields_varCall if f in existing_fields] + [f for f in ["#CHROM"] if f not in fields_varCall]
+        if len(existing_fields)==0: s_small_vars_df = pd.DataFrame(columns=fields_load)
+        else: s_small_vars_df = get_df_columnar_file(small_vars_file, fields=fields_load, persist=False)
 
         # add extra fields
-        missing_fields = set(fields_varCall).difference(set(s_small_vars_df.keys()))
+        missing_fields = set(fields_varCall).difference(existing_fields)
         if len(missing_fields)>0: print("WARNING: There are some missing fields (%s) in %s"%(missing_fields, sampleID))
         for field in missing_fields: s_small_vars_df[field] = np.nan
 
-        # keep interesting fields 
-        s_small_vars_df = s_small_vars_df[fields_varCall]
-
         # add fields
         s_small_vars_df["sampleID"] = sampleID
         s_small_vars_df["calling_ploidy"] = target_ploidy
@@ -21337,24 +23246,75 @@ def get_s_small_vars_df_and_s_small_var_annot(Is, perSVade_outdir, sampleID, tar
         # redeinfe
         fields_varCall = (fields_varCall + ["sampleID", "calling_ploidy"])
 
-        # save
-        small_vars_file_tmp = "%s.tmp"%small_vars_file
-        s_small_vars_df[fields_varCall].to_csv(small_vars_file_tmp, sep="\t", index=False, header=False)
-        os.rename(small_vars_file_tmp, small_vars_file)
+        # save each chromosome
+        chromosomes = []
+        for chromosome, s_small_vars_df_chrom in s_small_vars_df.groupby("#CHROM", sort=False):
+
+            partition_dir = "%s/partitions/%s"%(tmpdir, get_partition_name_chromosome(chromosome))
+            make_folder(partition_dir)
+
+            partition_file = "%s/%s_ploidy%i.tab"%(partition_dir, sampleID, target_ploidy)
+            partition_file_tmp = "%s.tmp"%partition_file
+            s_small_vars_df_chrom[fields_varCall].to_csv(partition_file_tmp, sep="\t", index=False, header=False)
+            os.rename(partition_file_tmp, partition_file)
+
+            chromosomes.append(chromosome)
+
+        save_object(chromosomes, small_vars_chromosomes_file)
 
     # var annotation
     small_vars_annot_file = "%s/small_vars_annot_%s_ploidy%i.tab"%(tmpdir, sampleID, target_ploidy)
     if file_is_empty(small_vars_annot_file):
 
         # get the annotation of the variants
-        small_var_annot_s = pd.read_csv("%s/smallVars_CNV_output/variant_annotation_ploidy%i.tab"%(perSVade_outdir, target_ploidy), sep="\t")
+        small_var_annot_file_s = "%s/smallVars_CNV_output/variant_annotation_ploidy%i.tab"%(perSVade_outdir, target_ploidy)
+        if file_is_empty(small_var_annot_file_s): small_var_annot_s = pd.DataFrame(columns=fields_varAnnot)
+        else: small_var_annot_s = get_df_columnar_file(small_var_annot_file_s, fields=fields_varAnnot, persist=False)
 
         # write
         small_vars_annot_file_tmp = "%s.tmp"%small_vars_annot_file
         small_var_annot_s[fields_varAnnot].to_csv(small_vars_annot_file_tmp, sep="\t", index=False, header=False)
         os.rename(small_vars_annot_file_tmp, small_vars_annot_file)
 
-    return (small_vars_file, small_vars_annot_file)
+    return (load_object(small_vars_chromosomes_file), small_vars_annot_file)
+
+def get_integrated_small_vars_one_partition(partition_files, fields_varCall, add_overlapping_samples, check_relative_CN, outfile):
+
+    """Takes the small vars files of one partition (one chromosome) of get_integrated_small_vars_df_severalSamples (with no header and fields_varCall) and writes them into outfile (with no header). If add_overlapping_samples is True it adds the field other_samples_with_variant_called, with the sorted samples (other than the one of the row) that have each variant. The variants are indexed by hashing (pd.factorize), and the samples of each variant are obtained by a group-by. Only the variant and the sampleID are loaded, and the rows are written from the text of partition_files. It returns an array with the unique variants of the partition."""
+
+    # load the variants and samples of the partition
+    usecols = ["#Uploaded_variation", "sampleID"] + (["relative_CN"] if check_relative_CN is True else [])
+    df = pd.concat([pd.read_csv(f, sep="\t", header=None, names=fields_varCall, usecols=usecols, dtype={"sampleID":str, "#Uploaded_variation":str}) for f in partition_files], ignore_index=True)
+
+    # check that the relative_CN is there
+    if check_relative_CN is True and any(pd.isna(df.relative_CN)): raise ValueError("there can't be NaNs in small_vars_df")
+
+    # index the variants
+    variant_codes, unique_variants = pd.factorize(df["#Uploaded_variation"])
+
+    # get the other samples of each row, from the sorted samples of each variant
+    if add_overlapping_samples is True:
+
+        df_pairs = pd.DataFrame({"variant_code":variant_codes, "sampleID":df.sampleID.values}).drop_duplicates().sort_values(by=["variant_code", "sampleID"])
+        variant_code_to_samples = df_pairs.groupby("variant_code").sampleID.apply(list).values
+        other_samples_with_variant_called = [",".join([s for s in variant_code_to_samples[code] if s!=sampleID]) for code, sampleID in zip(variant_codes, df.sampleID.values)]
+
+    # write the rows
+    outfile_tmp = "%s.tmp"%outfile
+    with open(outfile_tmp, "w") as fd:
+
+        Ir = 0
+        for f in partition_files:
+            for line in open(f, "r"):
+
+                if add_overlapping_samples is True: fd.write("%s\t%s\n"%(line.rstrip("\n"), other_samples_with_variant_called[Ir]))
+                else: fd.write(line)
+                Ir += 1
+
+    if Ir!=len(df): raise ValueError("The lines of %s do not match the loaded rows"%partition_files)
+    os.rename(outfile_tmp, outfile)
+
+    return unique_variants.values
 
 def load_varcall_df_and_print_sampleID(varcall_file, sample_idx, len_all_samples):
 
@@ -21433,20 +23393,8 @@ def get_integrated_small_vars_df_severalSamples(paths_df, outdir, ploidy, gff, r
     if file_is_empty(coverage_df_file) or replace is True:
         print("getting per gene coverage df") # This took <10 Gb of RAM for 645 C. albincans samples
 
-        # init df
-        coverage_df = pd.DataFrame()
-
-        for Is, (sampleID, perSVade_outdir) in enumerate(paths_df[["sampleID", "perSVade_outdir"]].values):
-            print("%i/%i: %s"%(Is+1, len(paths_df), sampleID))
-
-            # add the coverage
-            s_coverage_df = pd.read_csv("%s/smallVars_CNV_output/CNV_results/genes_and_regions_coverage.tab"%(perSVade_outdir), sep="\t")
-            s_coverage_df["sampleID"] = sampleID
-            coverage_df = coverage_df.append(s_coverage_df)
-
-        # save and del the object
-        save_df_as_tab(coverage_df, coverage_df_file)
-        del coverage_df
+        # stream the coverage of each sample
+        write_stacked_tab_files_with_sampleID([(sampleID, "%s/smallVars_CNV_output/CNV_results/genes_and_regions_coverage.tab"%(perSVade_outdir)) for sampleID, perSVade_outdir in paths_df[["sampleID", "perSVade_outdir"]].values], coverage_df_file, threads)
 
     ##################################################
 
@@ -21459,39 +23407,30 @@ def get_integrated_small_vars_df_severalSamples(paths_df, outdir, ploidy, gff, r
     if file_is_empty(small_vars_df_file) or file_is_empty(small_var_annot_file) or replace is True:
         print_if_verbose("getting small variant calls")
 
-        # init dfs
-        small_vars_df = pd.DataFrame()
-        small_var_annot = pd.DataFrame()
-
         # define a tmpdir
         tmpdir = "%s/tmp"%outdir; make_folder(tmpdir)
 
         ######## GET INDIVIDUAL VARCALL FILES WITH DESIRED FIELDS #####
 
-        # This took <10 Gb of RAM for 645 C. albincans samples
+        # the varcall files are written partitioned by chromosome
 
         # define the interesting ploidies
         if run_ploidy2_ifHaploid is True: interesting_ploidies = [1, 2]
         else: interesting_ploidies = [ploidy]
 
-        # load the first df to get the fields_varCall
-        first_perSVade_outdir = paths_df.perSVade_outdir.iloc[0]
-        first_small_vars_df = get_tab_as_df_or_empty_df("%s/smallVars_CNV_output/variant_calling_ploidy%i.tab"%(first_perSVade_outdir, ploidy))
-        first_small_vars_annot = get_tab_as_df_or_empty_df("%s/smallVars_CNV_output/variant_annotation_ploidy%i.tab"%(first_perSVade_outdir, ploidy))
-
-        # define the fields_varCall and fields_varAnnot
-        if fields_varCall=="all": fields_varCall = list(first_small_vars_df.keys())
-        if fields_varAnnot=="all": fields_varAnnot = list(first_small_vars_annot.keys())
+        # get the fields_varCall and fields_varAnnot from the first sample with a non-empty file
+        if fields_varCall=="all": fields_varCall = next((fs for fs in (get_fields_tab_file("%s/smallVars_CNV_output/variant_calling_ploidy%i.tab"%(o, ploidy)) for o in paths_df.perSVade_outdir) if len(fs)>0), [])
+        if fields_varAnnot=="all": fields_varAnnot = next((fs for fs in (get_fields_tab_file("%s/smallVars_CNV_output/variant_annotation_ploidy%i.tab"%(o, ploidy)) for o in paths_df.perSVade_outdir) if len(fs)>0), [])
 
         # make sure that "#Uploaded_variation" is in annot
         if "#Uploaded_variation" not in fields_varAnnot: raise ValueError("#Uploaded_variation shold be in fields_varAnnot")
 
         # define a list of inputs to parallelize
-        inputs_fn = [(Is, perSVade_outdir, sampleID, target_ploidy, fields_varCall, fields_varAnnot, tmpdir) for Is, (sampleID, perSVade_outdir) in enumerate(paths_df[["sampleID", "perSVade_outdir"]].values) for target_ploidy in interesting_ploidies]
+        inputs_fn_samples = [(Is, perSVade_outdir, sampleID, target_ploidy, fields_varCall, fields_varAnnot, tmpdir) for Is, (sampleID, perSVade_outdir) in enumerate(paths_df[["sampleID", "perSVade_outdir"]].values) for target_ploidy in interesting_ploidies]
 
         # get files in parallel
         with multiproc.Pool(threads) as pool:
-            list_small_vars_files = pool.starmap(get_s_small_vars_df_and_s_small_var_annot, inputs_fn) 
+            list_small_vars_files = pool.starmap(get_s_small_vars_df_and_s_small_var_annot, inputs_fn_samples) 
                 
             pool.close()
             pool.terminate()
@@ -21507,11 +23446,10 @@ def get_integrated_small_vars_df_severalSamples(paths_df, outdir, ploidy, gff, r
 
             # get the concatenated annot files without header
             df_annotation_all_file = "%s.all_vars.tab"%small_var_annot_file
-            run_cmd("cat '%s' > '%s'"%(annot_files[0], df_annotation_all_file))
-
-            for If, f in enumerate(annot_files[1:]):
-                print_if_verbose("appending df %i/%i"%(If, len(annot_files)-1))
-                run_cmd("cat '%s' >> '%s'"%(f, df_annotation_all_file))
+            with open(df_annotation_all_file, "w") as fd:
+                for If, f in enumerate(annot_files):
+                    print_if_verbose("appending df %i/%i"%(If+1, len(annot_files)))
+                    with open(f, "r") as fd_annot: shutil.copyfileobj(fd_annot, fd)
 
             # get a uniquely sorted df
             print("sorting and removing duplicates")
@@ -21520,7 +23458,8 @@ def get_integrated_small_vars_df_severalSamples(paths_df, outdir, ploidy, gff, r
 
             # get df 
             print("loading df_annotation_unique_file")
-            df_annotation_unique = pd.read_csv(df_annotation_unique_file, sep="\t", names=fields_varAnnot)
+            if file_is_empty(df_annotation_unique_file): df_annotation_unique = pd.DataFrame(columns=fields_varAnnot)
+            else: df_annotation_unique = pd.read_csv(df_annotation_unique_file, sep="\t", names=fields_varAnnot)
 
             # drop duplicates
             print_if_verbose("dropping duplicates")
@@ -21540,71 +23479,47 @@ def get_integrated_small_vars_df_severalSamples(paths_df, outdir, ploidy, gff, r
 
         ####### INTEGRATE AND ADD OVERLAPPING VARS #######
 
-        # integrate the the varinat calling files with cat
-        print("concatenating small variant calling files into %s"%small_vars_df_file)
+        # define the chromosomes, sorted as they appear in the samples
+        chromosomes = list(OrderedDict.fromkeys([chrom for sample_chromosomes, annot_file in list_small_vars_files for chrom in sample_chromosomes]))
 
-        # init file
+        # define the files of each partition, sorted as the samples
         fields_varCall = (fields_varCall + ["sampleID", "calling_ploidy"])
-        small_vars_df_file_tmp = "%s.tmp"%small_vars_df_file
-        run_cmd("echo '%s' > %s"%("\t".join(fields_varCall), small_vars_df_file_tmp))
+        partitions_dir = "%s/partitions"%tmpdir
+        inputs_fn = []
+        for chrom in chromosomes:
 
-        # append each of the varcall files
-        varcall_files = [x[0] for x in list_small_vars_files]
-        for Iv, file in enumerate(varcall_files):
-            print("adding file %i/%i"%(Iv+1, len(varcall_files)))
-            run_cmd("cat %s >> %s"%(file, small_vars_df_file_tmp))
+            partition_dir = "%s/%s"%(partitions_dir, get_partition_name_chromosome(chrom))
+            partition_files = ["%s/%s_ploidy%i.tab"%(partition_dir, x[2], x[3]) for x in inputs_fn_samples]
+            inputs_fn.append(([f for f in partition_files if os.path.isfile(f)], fields_varCall, add_overlapping_samples, run_ploidy2_ifHaploid, "%s/integrated_small_vars.tab"%partition_dir))
 
-        # quality control before saving:
-        print("quality control before saving")
+        # integrate each chromosome in parallel (and add the samples that share variants if add_overlapping_samples, only the called ones)
+        print("integrating small variant calling files of %i chromosomes"%len(chromosomes))
+        with multiproc.Pool(threads) as pool:
+            list_unique_variants = pool.starmap(get_integrated_small_vars_one_partition, inputs_fn, chunksize=1)
+                
+            pool.close()
+            pool.terminate()
 
-        # load df
-        small_vars_df = get_tab_as_df_or_empty_df(small_vars_df_file_tmp)
+        # write the integrated files of each chromosome into small_vars_df_file
+        print("concatenating small variant calling files into %s"%small_vars_df_file)
+        if add_overlapping_samples is True: fields_varCall = (fields_varCall + ["other_samples_with_variant_called"])
+
+        small_vars_df_file_tmp = "%s.tmp"%small_vars_df_file
+        with open(small_vars_df_file_tmp, "w") as fd:
+            fd.write("\t".join(fields_varCall) + "\n")
+            for x in inputs_fn: 
+                with open(x[-1], "r") as fd_partition: shutil.copyfileobj(fd_partition, fd)
 
-        # set the sample to be str
-        small_vars_df["sampleID"] = small_vars_df["sampleID"].apply(str)
-        
         # check that all the variants have an annotation
-        all_vars = set(small_vars_df["#Uploaded_variation"])
         print("checking if there are unannotated vars")
-
-        vars_with_annotation = set(get_tab_as_df_or_empty_df(small_var_annot_file)["#Uploaded_variation"])
+        all_vars = set(itertools.chain.from_iterable(list_unique_variants))
+        vars_with_annotation = set(pd.read_csv(small_var_annot_file, sep="\t", usecols=["#Uploaded_variation"])["#Uploaded_variation"])
         vars_with_no_annotation = all_vars.difference(vars_with_annotation)
         if len(vars_with_no_annotation):
             print("WARNING: There are %i/%i vars with no annotation:"%(len(vars_with_no_annotation), len(all_vars)))
             for v in vars_with_no_annotation: 
                 if "*" not in v: print(v)
 
-        # check that the relative_CN is there
-        if run_ploidy2_ifHaploid is True:
-            if any(pd.isna(small_vars_df.relative_CN)): raise ValueError("there can't be NaNs in small_vars_df")
-
-        #### ADD THE SAMPLES THAT SHARE VARIANTS ####
-
-        # add the overlap with other samples (comma-sepparated) (only the called ones)
-        if add_overlapping_samples is True:
-
-            # map each sample to a set with the called variants
-            def get_set_variants_from_df_s(df_s): return set(df_s["#Uploaded_variation"])
-            sampleID_to_calledVariants = small_vars_df.groupby("sampleID").apply(get_set_variants_from_df_s)
-
-            # init the field of other samples
-            small_vars_df["other_samples_with_variant_called"] = ""
-
-            # map each sample that is mapping 
-            for sampleID, variants in sampleID_to_calledVariants.items():
-                bool_to_text = {True: ","+sampleID, False:""}
-                small_vars_df["other_samples_with_variant_called"] += small_vars_df["#Uploaded_variation"].isin(variants).map(bool_to_text)
-
-            # get the final set of samples
-            def get_set_other_samples_withVar(r): return set(r["other_samples_with_variant_called"].split(",")).difference({"", r["sampleID"]})
-            def convert_list_to_string(x): return ",".join(x)
-            small_vars_df["other_samples_with_variant_called"] = small_vars_df.apply(get_set_other_samples_withVar, axis=1).apply(sorted).apply(convert_list_to_string)
-
-            # overwrite small_vars_df_file_tmp
-            save_df_as_tab(small_vars_df, small_vars_df_file_tmp)
-
-        #############################################
-
         ##################################################
 
         # clean intermediate files
@@ -21613,7 +23528,6 @@ def get_integrated_small_vars_df_severalSamples(paths_df, outdir, ploidy, gff, r
         # write dfs
         print("writing")
         os.rename(small_vars_df_file_tmp, small_vars_df_file)
-        del small_vars_df
 
     #############################################
 
@@ -21943,8 +23857,8 @@ def get_integrated_SV_CNV_df_severalSamples(paths_df, outdir, gff, reference_gen
         SV_CNV_annot = get_annotation_df_with_Gene_as_upmost_parent_in_gff(SV_CNV_annot, gff)
 
         # add the gff
-        gff_df = load_gff3_intoDF(gff, replace=False)
-        all_protein_coding_genes = set(gff_df[gff_df.feature.isin({"CDS", "mRNA"})].upmost_parent)
+        gff_df = load_gff3_intoDF(gff, replace=False, fields=["upmost_parent"], filters=[("feature", "in", {"CDS", "mRNA"})])
+        all_protein_coding_genes = set(gff_df.upmost_parent)
         SV_CNV_annot["is_protein_coding_gene"] = SV_CNV_annot.Gene.isin(all_protein_coding_genes)
         SV_CNV_annot["is_transcript_disrupting"] = SV_CNV_annot.Consequence.apply(get_is_transcript_disrupting_consequence_SV)
 
@@ -22852,7 +24766,7 @@ def get_bcftools_mpileup_output_one_chrom(ref, mpileup_output_chrom, sorted_bam,
 
         # get fasta for chrom
         ref_chrom = "%s.reference.fasta"%mpileup_output_chrom
-        chroms_list = [c for c in SeqIO.parse(ref, "fasta") if c.id==chrom]
+        chroms_list = get_seqRecords_genome_store(ref, chromosomes={chrom})
         if len(chroms_list)!=1: raise ValueError("there should be only one chrom")
         SeqIO.write(chroms_list, ref_chrom, "fasta")
 
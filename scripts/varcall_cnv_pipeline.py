@@ -10,6 +10,7 @@ import copy as cp
 import pickle
 import string
 import shutil 
+import time
 from Bio import SeqIO
 import random
 import sys
@@ -122,6 +123,11 @@ else: raise ValueError("The value provided in --minAF_smallVars is incorrect")
 
 
 print("running small vars and CNV pipeline into %s"%opt.outdir)
+start_time = time.time(); start_cpu_time = fun.get_cpu_time_self_and_children()
+
+# check the available threads (probed once for outdir)
+real_available_threads = fun.get_available_threads(opt.outdir)
+if opt.threads>real_available_threads: print("WARNING: There are %i available threads, and you required %i."%(real_available_threads, opt.threads))
 
 # check that the environment is correct
 fun.run_cmd("echo 'This is a check of the environment in which the pipeline is running'; which bedtools")
@@ -429,7 +435,7 @@ else:
     if fun.file_is_empty(variantAnnotation_table) or opt.replace is True:
 
         # run vep in parallel
-        annotated_vcf = fun.run_vep_parallel(merged_vcf_all, opt.ref, gff_with_biotype, opt.mitochondrial_chromosome, opt.mitochondrial_code, opt.gDNA_code, threads=opt.threads, replace=opt.replace)
+        annotated_vcf = fun.run_vep_parallel(merged_vcf_all, opt.ref, gff_with_biotype, opt.mitochondrial_chromosome, opt.mitochondrial_code, opt.gDNA_code, threads=opt.threads, replace=opt.replace, threads_outdir=opt.outdir)
 
         # get into df
         df_vep = pd.read_csv(annotated_vcf, sep="\t")
@@ -479,3 +485,5 @@ print("VarCall Finished")
 # at the end remove all the non-essential files
 if opt.remove_smallVarsCNV_nonEssentialFiles is True: fun.remove_smallVarsCNV_nonEssentialFiles(opt.outdir, opt.ploidy)
 
+# record the used threads
+fun.record_threads_used_stage(opt.outdir, "varcall_cnv_pipeline", opt.threads, start_time, time.time(), start_cpu_time)